@@ -16,6 +16,7 @@ goog.provide('p3rf.perfkit.explorer.components.container.ContainerToolbarDirecti
 goog.require('p3rf.perfkit.explorer.components.container.ContainerService');
 goog.require('p3rf.perfkit.explorer.components.dashboard.DashboardService');
 goog.require('p3rf.perfkit.explorer.components.explorer.sidebar.SidebarTabService');
+goog.require('p3rf.perfkit.explorer.components.widget.query.QueryResultDataService');
 
 
 goog.scope(function() {
@@ -29,7 +30,8 @@ goog.scope(function() {
    * @ngInject
    */
   explorer.components.container.ContainerToolbarDirective = function(
-      arrayUtilService, containerService, dashboardService) {
+      arrayUtilService, containerService, dashboardService,
+      queryResultDataService) {
     return {
       restrict: 'E',
       scope: {},
@@ -51,6 +53,11 @@ goog.scope(function() {
             return;
           }
 
+          let container = this.dashboardSvc.selectedContainer;
+          for (let widget of container.model.container.children) {
+            queryResultDataService.cancelResults(widget);
+          }
+
           this.containerSvc.remove()
         }
       }],
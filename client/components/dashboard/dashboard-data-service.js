@@ -259,21 +259,29 @@ DashboardDataService.prototype.editOwner = function(
 
 
 /**
- * Returns a list of dashboards.
+ * Returns a page of the list of dashboards.
+ *
+ * The server lists dashboards a page at a time.  The response has the
+ * dashboards of the page as 'data', and the 'cursor' of the next page, or
+ * null if it is the last page.
  *
  * @param {?boolean=} opt_mine If true, limits the list to items owned by the
  *     current user.  This setting is not useful is opt_owner is specified.
  * @param {?string=} opt_owner If provided, limits the list to dashboards owned
  *     by the provided email address.
+ * @param {?string=} opt_cursor If provided, the cursor returned with the
+ *     previous page.  Otherwise the first page is returned.
  *
  * @return {!angular.$q.Promise}
  */
-DashboardDataService.prototype.list = function(opt_mine, opt_owner) {
+DashboardDataService.prototype.list = function(
+    opt_mine, opt_owner, opt_cursor) {
   let deferred = this.q_.defer();
 
   let queryData = {
     'owner': opt_owner || null,
-    'mine': opt_mine || null
+    'mine': opt_mine || null,
+    'cursor': opt_cursor || null
   };
   let promise = this.post('/dashboard/list', queryData, null);
 
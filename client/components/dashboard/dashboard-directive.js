@@ -22,6 +22,7 @@ goog.provide('p3rf.perfkit.explorer.components.dashboard.DashboardDirective');
 
 goog.require('p3rf.perfkit.explorer.components.container.ContainerWidgetConfig');
 goog.require('p3rf.perfkit.explorer.components.dashboard.DashboardService');
+goog.require('p3rf.perfkit.explorer.components.widget.query.QueryResultDataService');
 goog.require('p3rf.perfkit.explorer.models.ChartType');
 goog.require('p3rf.perfkit.explorer.models.WidgetConfig');
 
@@ -50,9 +51,9 @@ explorer.components.dashboard.DashboardDirective = function() {
     templateUrl: '/static/components/dashboard/dashboard-directive.html',
     controller: [
         '$scope', 'explorerService', 'explorerStateService', 'dashboardService', 'containerService',
-        'sidebarTabService', 'widgetFactoryService', 'widgetService',
+        'sidebarTabService', 'widgetFactoryService', 'widgetService', 'queryResultDataService',
         function($scope, explorerService, explorerStateService, dashboardService, containerService,
-            sidebarTabService, widgetFactoryService, widgetService) {
+            sidebarTabService, widgetFactoryService, widgetService, queryResultDataService) {
       /** @export */
       $scope.containerSvc = containerService;
 
@@ -117,6 +118,7 @@ explorer.components.dashboard.DashboardDirective = function() {
           return;
         }
 
+        queryResultDataService.cancelResults(widget);
         dashboardService.removeWidget(widget, container);
       }
 
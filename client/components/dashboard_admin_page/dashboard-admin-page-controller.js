@@ -251,6 +251,15 @@ DashboardAdminPageCtrl.prototype.listDashboards = function() {
 };
 
 
+/**
+ * Adds the next page of dashboards to the grid.
+ * @export
+ */
+DashboardAdminPageCtrl.prototype.listMoreDashboards = function() {
+  this.scope_.pageService.listMoreDashboards();
+};
+
+
 /**
  * Removes selection and all items from the grid.
  * @export
@@ -44,6 +44,12 @@ explorer.components.dashboard_admin_page.DashboardAdminPageService = function(
    */
   this.dashboards = [];
 
+  /**
+   * The cursor of the next page of dashboards, or null if all are listed.
+   * @export {?string}
+   */
+  this.cursor = null;
+
   /** @export {Array.<!string>} */
   this.errors = [];
 
@@ -73,20 +79,48 @@ const DashboardAdminPageService = explorer.components.dashboard_admin_page.Dashb
 
 /**
  * Retrieves a list of dashboards
+ *
+ * Only the first page is requested, so it can be shown without waiting for
+ * the others.  Later pages are added by listMoreDashboards().
  * @export
  */
 DashboardAdminPageService.prototype.listDashboards = function() {
   this.selection && this.selection.clearSelectedRows();
 
+  this.listDashboardPage_(null);
+};
+
+
+/**
+ * Adds the next page of dashboards to the list, if there is one.
+ * @export
+ */
+DashboardAdminPageService.prototype.listMoreDashboards = function() {
+  if (this.cursor && !this.isLoading) {
+    this.listDashboardPage_(this.cursor);
+  }
+};
+
+
+/**
+ * Adds a page of dashboards to the list.
+ * @param {?string} cursor The cursor of the page, or null for the first one,
+ *     which replaces the list.
+ * @private
+ */
+DashboardAdminPageService.prototype.listDashboardPage_ = function(cursor) {
   let promise = this.dashboardDataService_.list(
-      this.model.mine, this.model.owner);
+      this.model.mine, this.model.owner, cursor);
   this.isLoading = true;
 
   promise.then(angular.bind(this, function(response) {
     this.isLoading = false;
-    this.dashboards = [];
+    if (!cursor) {
+      this.dashboards = [];
+    }
+    this.cursor = response['cursor'] || null;
     goog.array.forEach(
-        response['data'], angular.bind(this, function(dashboardJson) {
+        response['data'] || [], angular.bind(this, function(dashboardJson) {
           this.addDashboard(dashboardJson);
         }));
   }));
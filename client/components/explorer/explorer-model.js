@@ -39,6 +39,12 @@ explorer.components.explorer.ExplorerModel = function() {
   /** @export {!Array.<(DashboardInstance|DashboardModel)>} */
   this.dashboards = [];
 
+  /**
+   * The cursor of the next page of dashboards, or null if all are listed.
+   * @export {?string}
+   */
+  this.dashboardsCursor = null;
+
   /** @export {?boolean} */
   this.readOnly = null;
 
@@ -228,16 +228,41 @@ ExplorerService.prototype.newDashboard = function(
 
 /**
  * Retrieves a list of dashboards
+ *
+ * Only the first page is requested, so it can be shown without waiting for
+ * the others.  Later pages are added by listMoreDashboards().
  * @export
  */
 ExplorerService.prototype.listDashboards = function() {
-  let promise = this.dashboardDataService_.list(true);
+  goog.array.clear(this.model.dashboards);
+  this.model.dashboardsCursor = null;
+
+  this.listDashboardPage_(null);
+};
+
+
+/**
+ * Adds the next page of dashboards to the list, if there is one.
+ * @export
+ */
+ExplorerService.prototype.listMoreDashboards = function() {
+  if (this.model.dashboardsCursor && !this.dashboardsLoading) {
+    this.listDashboardPage_(this.model.dashboardsCursor);
+  }
+};
+
+
+/**
+ * Adds a page of dashboards to the list.
+ * @param {?string} cursor The cursor of the page, or null for the first one.
+ * @private
+ */
+ExplorerService.prototype.listDashboardPage_ = function(cursor) {
+  let promise = this.dashboardDataService_.list(true, null, cursor);
   this.dashboardsLoading = true;
 
   promise.then(angular.bind(this, function(response) {
     this.dashboardsLoading = false;
-    this.model.dashboards.slice(
-        0, this.model.dashboards.length);
 
     if (response['data']) {
       goog.array.forEach(
@@ -248,8 +273,9 @@ ExplorerService.prototype.listDashboards = function() {
 
             this.model.dashboards.push(dashboard);
           }, this));
+      this.model.dashboardsCursor = response['cursor'] || null;
     } else {
-      this.dashboardsLoading = false;
+      this.model.dashboardsCursor = null;
       this.errors.push('listDashboards() failed: No data returned.');
     }
   }));
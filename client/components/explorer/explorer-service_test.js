@@ -92,6 +92,40 @@ describe('explorerService', function() {
         }
     );
 
+    it('should show the first page before requesting the next one.',
+        function() {
+          expect(svc.model.dashboards.length).toEqual(0);
+
+          httpBackend.expectPOST('/dashboard/list?mine=true').respond({
+            'data': [{'title': 'foo', 'id': '1'}],
+            'cursor': 'page2'
+          });
+
+          svc.listDashboards();
+          httpBackend.flush();
+
+          expect(svc.model.dashboards.length).toEqual(1);
+          expect(svc.model.dashboardsCursor).toEqual('page2');
+          httpBackend.verifyNoOutstandingRequest();
+
+          httpBackend.expectPOST('/dashboard/list?cursor=page2&mine=true')
+              .respond({
+                'data': [{'title': 'bar', 'id': '2'}],
+                'cursor': null
+              });
+
+          svc.listMoreDashboards();
+          httpBackend.flush();
+
+          expect(svc.model.dashboards.length).toEqual(2);
+          expect(svc.model.dashboardsCursor).toBeNull();
+
+          // There are no more pages to request.
+          svc.listMoreDashboards();
+          httpBackend.verifyNoOutstandingRequest();
+        }
+    );
+
     it('should empty the list when no dashboards are returned.',
         function() {
           expect(svc.model.dashboards.length).toEqual(0);
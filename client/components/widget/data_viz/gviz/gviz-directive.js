@@ -18,6 +18,7 @@
  * in a declarative and data-driven way. When the configuration or the
  * data change, the chart is updated. When the datasource status changes to
  * TOFETCH, the datasource query is executed and new data are fetched.
+ * Paged datasources show buttons to fetch the previous and next pages.
  *
  * Usage:
  *   <bound-chart widget-config="widgetConfig"/>
@@ -33,6 +34,7 @@ goog.provide('p3rf.perfkit.explorer.components.widget.data_viz.gviz.gvizChart');
 goog.require('p3rf.perfkit.explorer.components.error.ErrorService');
 goog.require('p3rf.perfkit.explorer.components.error.ErrorTypes');
 goog.require('p3rf.perfkit.explorer.components.util.WorkQueueService');
+goog.require('p3rf.perfkit.explorer.components.explorer.ExplorerStateService');
 goog.require('p3rf.perfkit.explorer.components.widget.data_viz.gviz.column_style.ColumnStyleService');
 goog.require('p3rf.perfkit.explorer.components.widget.data_viz.gviz.ChartWrapperService');
 goog.require('p3rf.perfkit.explorer.components.widget.data_viz.gviz.GvizEvents');
@@ -56,6 +58,7 @@ const CurrentTimestampOptimizer = explorer.ext.bigquery.CurrentTimestampOptimize
 const DataViewService = explorer.components.widget.query.DataViewService;
 const ErrorService = explorer.components.error.ErrorService;
 const ErrorTypes = explorer.components.error.ErrorTypes;
+const ExplorerStateService = explorer.components.explorer.ExplorerStateService;
 const QueryResultDataService = (
     explorer.components.widget.query.QueryResultDataService);
 const ResultsDataStatus = explorer.models.ResultsDataStatus;
@@ -75,13 +78,14 @@ const CHART_EXTRA_HEIGHT_PX = 16;
  * @param {QueryResultDataService} queryResultDataService
  * @param {*} gvizEvents
  * @param {DataViewService} dataViewService
+ * @param {ExplorerStateService} explorerStateService
  * @return {Object} Directive definition object.
  * @ngInject
  */
 explorer.components.widget.data_viz.gviz.gvizChart = function(
     $timeout, $location, $animate, chartWrapperService, queryResultDataService,
     queryBuilderService, gvizEvents, dataViewService, dashboardService,
-    errorService, columnStyleService) {
+    errorService, columnStyleService, explorerStateService) {
   return {
     restrict: 'E',
     scope: {
@@ -120,6 +124,59 @@ explorer.components.widget.data_viz.gviz.gvizChart = function(
                ChartType.TABLE;
       };
 
+      // The offset of the page requested with the pager.  Other fetches, such
+      // as for a changed query, start from the first page.
+      let nextPageOffset = 0;
+
+      /**
+       * Returns the page of rows shown, or null if the results aren't paged.
+       * @return {?{offset: number, limit: number, totalRows: number}}
+       */
+      let getPage = function() {
+        return scope.widgetConfig.state().datasource.page;
+      };
+
+      /**
+       * Fetches the page of rows starting at an offset.
+       * @param {number} offset
+       */
+      let showPage = function(offset) {
+        nextPageOffset = Math.max(offset, 0);
+        scope.widgetConfig.state().datasource.status =
+            ResultsDataStatus.TOFETCH;
+      };
+
+      scope.hasPreviousPage = function() {
+        let page = getPage();
+        return Boolean(page) && page.offset > 0;
+      };
+
+      scope.hasNextPage = function() {
+        let page = getPage();
+        return Boolean(page) && page.offset + page.limit < page.totalRows;
+      };
+
+      scope.showPreviousPage = function() {
+        let page = getPage();
+        showPage(page.offset - page.limit);
+      };
+
+      scope.showNextPage = function() {
+        let page = getPage();
+        showPage(page.offset + page.limit);
+      };
+
+      /** @return {string} The range of rows shown, such as '1-100 of 250'. */
+      scope.getPageLabel = function() {
+        let page = getPage();
+        if (!page) {
+          return '';
+        }
+        let lastRow = Math.min(page.offset + page.limit, page.totalRows);
+        return (Math.min(page.offset + 1, lastRow) + '-' + lastRow + ' of ' +
+                page.totalRows);
+      };
+
       let canScroll = function() {
         return scope.widgetConfig.model.chart.chartType ===
                ChartType.TABLE;
@@ -258,6 +315,9 @@ explorer.components.widget.data_viz.gviz.gvizChart = function(
           let optimizer = new CurrentTimestampOptimizer();
           optimizer.apply(dashboardService.current.model, scope.widgetConfig.model);
 
+          scope.widgetConfig.state().datasource.page_offset = nextPageOffset;
+          nextPageOffset = 0;
+
           let promise = queryResultDataService.
               fetchResults(scope.widgetConfig);
 
@@ -421,6 +481,15 @@ explorer.components.widget.data_viz.gviz.gvizChart = function(
           }
       );
 
+      // Other views of a widget, like the maximized one, are destroyed while
+      // the widget is still shown, so only removed widgets are cancelled.
+      scope.$on('$destroy', function() {
+        let widget = scope.widgetConfig;
+        if (explorerStateService.widgets.all[widget.model.id] !== widget) {
+          queryResultDataService.cancelResults(widget);
+        }
+      });
+
       checkForErrors();
       fetchData();
     }
@@ -111,7 +111,8 @@ describe('gvizDirective', function() {
 
       queryResultDataServiceMock = {
         fetchResults: jasmine.createSpy().
-            and.returnValue(fetchResultsDeferred.promise)
+            and.returnValue(fetchResultsDeferred.promise),
+        cancelResults: jasmine.createSpy()
       };
       return queryResultDataServiceMock;
     };
@@ -366,6 +367,42 @@ describe('gvizDirective', function() {
     );
   });
 
+  describe('pager', function() {
+
+    it('should fetch the next page of a paged datasource.', function() {
+      setupData();
+      var component = setupComponent().component;
+      var scope = component.isolateScope();
+
+      state().datasource.status = ResultsDataStatus.TOFETCH;
+      fetchResultsDeferred.resolve(new GvizDataTable());
+      rootScope.$apply();
+      timeout.flush();
+      expect(state().datasource.page_offset).toEqual(0);
+
+      state().datasource.page = {'offset': 0, 'limit': 100, 'totalRows': 250};
+      expect(scope.hasPreviousPage()).toBe(false);
+      expect(scope.hasNextPage()).toBe(true);
+      expect(scope.getPageLabel()).toEqual('1-100 of 250');
+
+      var fetchCount = queryResultDataServiceMock.fetchResults.calls.count();
+      scope.showNextPage();
+      rootScope.$apply();
+
+      expect(state().datasource.page_offset).toEqual(100);
+      expect(queryResultDataServiceMock.fetchResults.calls.count()).toEqual(
+          fetchCount + 1);
+    });
+
+    it('should be hidden when the datasource is not paged.', function() {
+      setupData(true);
+      var component = setupComponent().component;
+      var pager = component[0].getElementsByClassName('pk-chart-pager')[0];
+
+      expect(angular.element(pager).hasClass('ng-hide')).toBe(true);
+    });
+  });
+
   describe('chartWrapper', function() {
 
     it('should be attached to the chart div.',
@@ -552,4 +589,26 @@ describe('gvizDirective', function() {
       expect(chartWrapperMock.draw.calls.count()).toEqual(2);
     });
   });
+
+  describe('when destroyed', function() {
+
+    it('should cancel the results of a removed widget.', inject(
+        function(explorerStateService) {
+          var component = setupComponent().component;
+          delete explorerStateService.widgets.all[model.id];
+
+          component.isolateScope().$destroy();
+
+          expect(queryResultDataServiceMock.cancelResults).
+              toHaveBeenCalledWith(rootScope.widgetConfig);
+        }));
+
+    it('should not cancel the results of a widget still shown.', function() {
+      var component = setupComponent().component;
+
+      component.isolateScope().$destroy();
+
+      expect(queryResultDataServiceMock.cancelResults).not.toHaveBeenCalled();
+    });
+  });
 });
@@ -18,6 +18,15 @@
  * handler p3rf.perfkit.explorer.data). It accepts a QueryConfig
  * object (provided by the QueryEditorService), and maintains a collection of
  * result sets (as google.visualization.DataTable's).
+ *
+ * The widgets of a saved dashboard first try the results of /data/dashboard,
+ * which runs the saved query of every widget concurrently on the server.
+ * Widgets whose query changed since the dashboard was saved, or whose query
+ * failed there, are fetched through /data/sql.
+ *
+ * Table widgets with a datasource page_size request a page of rows at a time
+ * (see getPage_).  Paged results are not cached here, since the server reads
+ * each page from its own cache of the full result.
  * @author joemu@google.com (Joe Allan Muharsky)
  */
 
@@ -30,11 +39,13 @@ goog.require('p3rf.perfkit.explorer.components.error.ErrorService');
 goog.require('p3rf.perfkit.explorer.components.explorer.ExplorerService');
 goog.require('p3rf.perfkit.explorer.components.explorer.ExplorerStateService');
 goog.require('p3rf.perfkit.explorer.components.util.WorkQueueService');
+goog.require('p3rf.perfkit.explorer.models.ChartType');
 goog.require('p3rf.perfkit.explorer.models.WidgetConfig');
 
 
 goog.scope(function() {
 const explorer = p3rf.perfkit.explorer;
+const ChartType = explorer.models.ChartType;
 const ConfigService = explorer.components.config.ConfigService;
 const ErrorTypes = explorer.components.error.ErrorTypes;
 const ErrorService = explorer.components.error.ErrorService;
@@ -47,6 +58,25 @@ const WidgetConfig = explorer.models.WidgetConfig;
 const ERR_FETCH = ''
 const ERR_UNEXPECTED = 'The HTTP response returned no details.';
 
+/**
+ * Requests TIMESTAMP values as milliseconds since the epoch, which are
+ * cheaper to serialize and parse than ISO strings.
+ * @const {string}
+ */
+const TIMESTAMP_MODE = 'epoch_ms';
+
+/**
+ * The state reported by the server for a query job that has not completed.
+ * @const {string}
+ */
+const JOB_STATE_RUNNING = 'RUNNING';
+
+/**
+ * The state reported by the server for a query job that was cancelled.
+ * @const {string}
+ */
+const JOB_STATE_CANCELLED = 'CANCELLED';
+
 /**
  * See module docstring for more information about purpose and usage.
  *
@@ -59,13 +89,15 @@ const ERR_UNEXPECTED = 'The HTTP response returned no details.';
  * @param {!angular.$filter} $filter
  * @param {angular.$cacheFactory} $cacheFactory
  * @param {!angular.$q} $q
+ * @param {!angular.Scope} $rootScope
  * @param {function(new:google.visualization.DataTable, ...)} GvizDataTable
  * @constructor
  * @ngInject
  */
 explorer.components.widget.query.QueryResultDataService = function(
     explorerService, explorerStateService, errorService, configService,
-    workQueueService, $http, $filter, $cacheFactory, $q, GvizDataTable) {
+    workQueueService, $http, $filter, $cacheFactory, $q, $rootScope,
+    GvizDataTable) {
   /**
    * @type {!angular.$http}
    * @private
@@ -114,6 +146,33 @@ explorer.components.widget.query.QueryResultDataService = function(
    */
   this.workQueue_ = workQueueService;
   this.workQueue_.setMaxParallelQueries(configService.max_parallel_queries);
+
+  /**
+   * The number of queries requested, used to build request ids.
+   * @private {number}
+   */
+  this.requestCount_ = 0;
+
+  /**
+   * The widgets with a request in progress, by widget id.
+   * @private {!Object.<string, !WidgetConfig>}
+   */
+  this.pendingWidgets_ = {};
+
+  /**
+   * The request for the results of the saved dashboard's widgets, if any.
+   * The widget results are removed once used.
+   * @private {?{id: string, promise: !angular.$q.Promise.<!Object>}}
+   */
+  this.dashboardResults_ = null;
+
+  // The results of the previous dashboard are no longer wanted.
+  $rootScope.$on('$stateChangeStart',
+      (event, toState, toParams, fromState, fromParams) => {
+    if (toParams.dashboard != fromParams.dashboard) {
+      this.cancelAllResults();
+    }
+  });
 };
 const QueryResultDataService = (
     explorer.components.widget.query.QueryResultDataService);
@@ -152,7 +211,8 @@ QueryResultDataService.prototype.getColumnIndexesOfType_ = function(
 
 
 /**
- * Loops over the data and converts string dates to Date objects.
+ * Loops over the data and converts string or epoch millisecond dates to Date
+ * objects.  Null values are left as null.
  *
  * @param {DataTableJson} data
  * @private
@@ -163,15 +223,180 @@ QueryResultDataService.prototype.parseDates_ = function(data) {
   if (columnIndexes.length > 0) {
     angular.forEach(data.rows, function(row) {
       angular.forEach(columnIndexes, function(columnIndex) {
-        let dateString = row.c[columnIndex].v;
-        let date = new Date(dateString);
-        row.c[columnIndex].v = date;
+        let dateValue = row.c[columnIndex].v;
+        if (goog.isDefAndNotNull(dateValue)) {
+          row.c[columnIndex].v = new Date(dateValue);
+        }
       });
     });
   }
 };
 
 
+/**
+ * Polls /data/job until a query job submitted to /data/sql is complete.
+ *
+ * The server waits for the job before replying, so the next request is
+ * issued immediately.  Responses without a running job are returned as-is.
+ * If the request was cancelled, polling stops and the job is cancelled by
+ * id, since it may have started after the cancel request was handled.
+ *
+ * @param {!angular.$http.Response} response
+ * @param {function(): boolean} isCurrent Returns false once the request was
+ *     cancelled or replaced.
+ * @param {?{offset: number, limit: number}=} opt_page The page of rows to
+ *     return, if the request is paged.
+ * @return {!angular.$q.Promise.<!angular.$http.Response>|!angular.$http.Response}
+ * @private
+ */
+QueryResultDataService.prototype.waitForJob_ = function(
+    response, isCurrent, opt_page) {
+  let job = response.data.job;
+
+  if (!goog.isDefAndNotNull(job) || job.state !== JOB_STATE_RUNNING) {
+    return response;
+  }
+
+  if (!isCurrent()) {
+    return this.http_.post(
+        '/data/cancel', null, {'params': {'id': job.id}}).then(
+            () => ({'data': {'job': {'id': job.id,
+                                     'state': JOB_STATE_CANCELLED}}}));
+  }
+
+  let params = angular.extend({'id': job.id}, opt_page);
+  return this.http_.get('/data/job', {'params': params}).then(
+      jobResponse => this.waitForJob_(jobResponse, isCurrent, opt_page));
+};
+
+
+/**
+ * Returns the page of rows to request for a widget, or null for all rows.
+ *
+ * Only Table charts with a datasource page_size are paged.  The page starts
+ * at the widget's datasource state page_offset.
+ *
+ * @param {WidgetConfig} widget
+ * @return {?{offset: number, limit: number}}
+ * @private
+ */
+QueryResultDataService.prototype.getPage_ = function(widget) {
+  let pageSize = widget.model.datasource.page_size;
+
+  if (!pageSize || !widget.model.chart ||
+      widget.model.chart.chartType !== ChartType.TABLE) {
+    return null;
+  }
+
+  return {'offset': widget.state().datasource.page_offset || 0,
+          'limit': pageSize};
+};
+
+
+/**
+ * Cancels the query job running for a widget's latest request, if any.
+ *
+ * The server cancels the previous job of a widget when a new query is
+ * requested, so this is only needed when the results are no longer wanted:
+ * when the widget is removed, or the dashboard is navigated away from.
+ *
+ * @param {WidgetConfig} widget
+ * @return {?angular.$q.Promise.<!angular.$http.Response>}
+ */
+QueryResultDataService.prototype.cancelResults = function(widget) {
+  let requestId = widget.state().datasource.request_id;
+
+  if (!goog.isDefAndNotNull(requestId)) {
+    return null;
+  }
+
+  widget.state().datasource.request_id = null;
+  delete this.pendingWidgets_[widget.model.id];
+  return this.http_.post(
+      '/data/cancel', null, {'params': {'request_id': requestId}});
+};
+
+
+/**
+ * Cancels the query jobs of every widget with a request in progress.
+ *
+ * @return {!Array.<!angular.$q.Promise.<!angular.$http.Response>>}
+ */
+QueryResultDataService.prototype.cancelAllResults = function() {
+  let promises = [];
+
+  for (let widgetId of Object.keys(this.pendingWidgets_)) {
+    let promise = this.cancelResults(this.pendingWidgets_[widgetId]);
+    if (promise) {
+      promises.push(promise);
+    }
+  }
+
+  return promises;
+};
+
+
+/**
+ * Marks a widget's request as complete, unless a newer one replaced it.
+ *
+ * @param {WidgetConfig} widget
+ * @param {string} requestId
+ * @private
+ */
+QueryResultDataService.prototype.completeRequest_ = function(
+    widget, requestId) {
+  if (widget.state().datasource.request_id === requestId) {
+    widget.state().datasource.request_id = null;
+    delete this.pendingWidgets_[widget.model.id];
+  }
+};
+
+
+/**
+ * Returns the /data/dashboard result of a widget of the saved dashboard.
+ *
+ * The results of every widget are requested together, the first time a
+ * widget of the dashboard is fetched.  Each result is used at most once, and
+ * only if the widget still has the saved query.
+ *
+ * @param {WidgetConfig} widget
+ * @return {?angular.$q.Promise.<?{data: *}>} Resolves to the response of the
+ *     widget, or null if it should be fetched from /data/sql.  Null if the
+ *     dashboard isn't saved.
+ * @private
+ */
+QueryResultDataService.prototype.fetchDashboardResult_ = function(widget) {
+  let dashboardId = this.explorerStateService_.selectedDashboard.model.id;
+
+  if (!goog.isDefAndNotNull(dashboardId)) {
+    return null;
+  }
+
+  if (!this.dashboardResults_ || this.dashboardResults_.id !== dashboardId) {
+    let params = {'id': dashboardId, 'timestamp_mode': TIMESTAMP_MODE};
+    this.dashboardResults_ = {
+      id: dashboardId,
+      promise: this.http_.get('/data/dashboard', {'params': params}).then(
+          response => response.data.widgets || {},
+          () => ({}))};
+  }
+
+  let datasource = widget.model.datasource;
+  let query = datasource.query_exec || datasource.query;
+
+  return this.dashboardResults_.promise.then(widgets => {
+    let result = widgets[widget.model.id];
+    delete widgets[widget.model.id];
+
+    if (!goog.isDefAndNotNull(result) ||
+        goog.isDefAndNotNull(result.error) || result.query !== query) {
+      return null;
+    }
+    return {'data': result};
+  });
+};
+
+
 /**
  * Adds roles to DataTable columns based on a set of rules.
  *
@@ -211,25 +436,64 @@ QueryResultDataService.prototype.applyRoles = function(data) {
 QueryResultDataService.prototype.fetchResults = function(widget) {
   let datasource = widget.model.datasource;
   let deferred = this.q_.defer();
+  let page = this.getPage_(widget);
   let cacheKey = angular.toJson(datasource);
-  let cachedDataTable = this.cache_.get(cacheKey);
+  let cachedDataTable = page ? null : this.cache_.get(cacheKey);
   let isSelected = widget.state().selected;
 
   if (cachedDataTable) {
     deferred.resolve(cachedDataTable);
   } else {
-    let endpoint = '/data/sql';
+    let requestId = widget.model.id + '-' + (++this.requestCount_);
+    widget.state().datasource.request_id = requestId;
+    this.pendingWidgets_[widget.model.id] = widget;
 
     let postData = {
       'dashboard_id': this.explorerStateService_.selectedDashboard.model.id,
       'id': widget.model.id,
-      'datasource': datasource};
-    let promise = this.workQueue_.enqueue(
-        () => this.http_.post(endpoint, postData),
-        isSelected);
+      'datasource': datasource,
+      'timestamp_mode': TIMESTAMP_MODE,
+      'async': true,
+      'request_id': requestId};
+    angular.extend(postData, page);
+    let isCurrent = () => widget.state().datasource.request_id === requestId;
+    let fetchQuery = () => this.workQueue_.enqueue(() => {
+      // Requests cancelled or replaced while queued are never sent.
+      if (!isCurrent()) {
+        return this.q_.when(
+            {'data': {'job': {'state': JOB_STATE_CANCELLED}}});
+      }
+      return this.http_.post('/data/sql', postData).then(
+          response => this.waitForJob_(response, isCurrent, page));
+    }, isSelected);
+
+    let promise;
+    let dashboardResult = page ? null : this.fetchDashboardResult_(widget);
+    if (dashboardResult) {
+      let resultDeferred = this.q_.defer();
+      promise = resultDeferred.promise;
+
+      dashboardResult.then(response => {
+        if (response && isCurrent()) {
+          resultDeferred.resolve(response);
+        } else {
+          fetchQuery().then(resultDeferred.resolve, resultDeferred.reject,
+                            resultDeferred.notify);
+        }
+      });
+    } else {
+      promise = fetchQuery();
+    }
 
+    let complete = () => this.completeRequest_(widget, requestId);
+    promise.then(complete, complete);
     promise.then(angular.bind(this, function(response) {
-      if (goog.isDefAndNotNull(response.data.error)) {
+      let job = response.data.job;
+
+      if (goog.isDefAndNotNull(job) && job.state === JOB_STATE_CANCELLED) {
+        // A newer query replaced this one, so there is nothing to report.
+        deferred.reject(response.data);
+      } else if (goog.isDefAndNotNull(response.data.error)) {
         if (goog.string.isEmptySafe(response.data.error)) {
           response.data.error = ERR_UNEXPECTED;
         }
@@ -251,6 +515,7 @@ QueryResultDataService.prototype.fetchResults = function(widget) {
         widget.state().datasource.row_count = rows;
         widget.state().datasource.query_size = size;
         widget.state().datasource.query_time = time;
+        widget.state().datasource.page = response.data.page || null;
 
         if (this.explorerService_.model.logStatistics) {
           let clauses = [];
@@ -273,7 +538,9 @@ QueryResultDataService.prototype.fetchResults = function(widget) {
 
         let dataTable = new this.GvizDataTable_(data);
 
-        this.cache_.put(cacheKey, dataTable);
+        if (!page) {
+          this.cache_.put(cacheKey, dataTable);
+        }
         deferred.resolve(dataTable);
       }
     }));
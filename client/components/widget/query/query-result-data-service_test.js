@@ -24,7 +24,7 @@ goog.require('p3rf.perfkit.explorer.models.ChartWidgetConfig');
 
 
 describe('queryResultDataService', function() {
-  var svc, rootScope;
+  var svc, rootScope, errorSvc, explorerStateSvc;
   var httpBackend, endpoint, mockData;
   var ChartWidgetConfig = p3rf.perfkit.explorer.models.ChartWidgetConfig;
 
@@ -40,8 +40,11 @@ describe('queryResultDataService', function() {
   }));
 
   beforeEach(inject(function(
-      explorerService, queryResultDataService, widgetFactoryService, $rootScope) {
+      explorerService, explorerStateService, queryResultDataService,
+      widgetFactoryService, errorService, $rootScope) {
     svc = queryResultDataService;
+    errorSvc = errorService;
+    explorerStateSvc = explorerStateService;
     widgetFactorySvc = widgetFactoryService;
     rootScope = $rootScope;
 
@@ -115,6 +118,16 @@ describe('queryResultDataService', function() {
       expect(data.rows[1].c[0].f).toEqual('Custom text');
       expect(data.rows[1].c[1].v).toEqual(0);
     });
+
+    it('should parse epoch milliseconds and keep nulls.', function() {
+      data.rows[0].c[0].v = 1362271684000;
+      data.rows[1].c[0].v = null;
+
+      svc.parseDates_(data);
+
+      expect(data.rows[0].c[0].v).toEqual(new Date(1362271684000));
+      expect(data.rows[1].c[0].v).toBeNull();
+    });
   });
 
   describe('fetchResults', function() {
@@ -134,7 +147,10 @@ describe('queryResultDataService', function() {
           var params = {
               'dashboard_id': null,
               'id': widget.model.id,
-              'datasource': widget.model.datasource
+              'datasource': widget.model.datasource,
+              'timestamp_mode': 'epoch_ms',
+              'async': true,
+              'request_id': widget.model.id + '-1'
           };
           httpBackend.expectPOST(query, params).respond(mockResponse);
 
@@ -160,7 +176,10 @@ describe('queryResultDataService', function() {
           var params = {
               'dashboard_id': null,
               'id': widget.model.id,
-              'datasource': widget.model.datasource
+              'datasource': widget.model.datasource,
+              'timestamp_mode': 'epoch_ms',
+              'async': true,
+              'request_id': widget.model.id + '-1'
           };
           httpBackend.expectPOST(query, params).respond(mockData);
 
@@ -185,7 +204,10 @@ describe('queryResultDataService', function() {
           var params = {
               'dashboard_id': null,
               'id': widget.model.id,
-              'datasource': widget.model.datasource
+              'datasource': widget.model.datasource,
+              'timestamp_mode': 'epoch_ms',
+              'async': true,
+              'request_id': widget.model.id + '-1'
           };
           httpBackend.expectPOST(query, params).respond(mockData);
 
@@ -218,7 +240,10 @@ describe('queryResultDataService', function() {
       var params = {
           'dashboard_id': null,
           'id': widget.model.id,
-          'datasource': widget.model.datasource
+          'datasource': widget.model.datasource,
+          'timestamp_mode': 'epoch_ms',
+          'async': true,
+          'request_id': widget.model.id + '-1'
       };
       httpBackend.expectPOST(query, params).respond(mockData);
 
@@ -230,5 +255,239 @@ describe('queryResultDataService', function() {
       expect(widget.state().datasource.query_time).toEqual(123);
       expect(widget.state().datasource.row_count).toEqual(3);
     });
+
+    it('should poll for the results of a running job', function() {
+      var dataTable = null;
+      var widget = new ChartWidgetConfig(widgetFactorySvc);
+      widget.model.datasource.query = 'fakeQuery3';
+
+      var params = {
+          'dashboard_id': null,
+          'id': widget.model.id,
+          'datasource': widget.model.datasource,
+          'timestamp_mode': 'epoch_ms',
+          'async': true,
+          'request_id': widget.model.id + '-1'
+      };
+      var runningJob = {'job': {'id': 'job1', 'state': 'RUNNING'}};
+
+      httpBackend.expectPOST(endpoint, params).respond(runningJob);
+      httpBackend.expectGET('/data/job?id=job1').respond(runningJob);
+      httpBackend.expectGET('/data/job?id=job1').respond(mockData);
+
+      svc.fetchResults(widget).then(function(data) {
+        dataTable = data;
+      });
+      httpBackend.flush();
+
+      expect(dataTable).not.toBeNull();
+      expect(widget.state().datasource.row_count).toEqual(3);
+      expect(widget.state().datasource.request_id).toBeNull();
+    });
+
+    it('should reject a cancelled job without an error', function() {
+      var rejected = null;
+      var widget = new ChartWidgetConfig(widgetFactorySvc);
+      widget.model.datasource.query = 'fakeQuery4';
+
+      var cancelledJob = {'job': {'id': 'job1', 'state': 'CANCELLED'}};
+      httpBackend.expectPOST(endpoint).respond(cancelledJob);
+
+      svc.fetchResults(widget).catch(function(data) {
+        rejected = data;
+      });
+      httpBackend.flush();
+
+      expect(rejected).toEqual(cancelledJob);
+      expect(errorSvc.errors.length).toEqual(0);
+    });
+
+    it('should request a page of rows for a paged table', function() {
+      var widget = new ChartWidgetConfig(widgetFactorySvc);
+      widget.model.chart.chartType = 'Table';
+      widget.model.datasource.query = 'fakeQuery11';
+      widget.model.datasource.page_size = 100;
+      widget.state().datasource.page_offset = 200;
+
+      var page = {'offset': 200, 'limit': 100, 'totalRows': 250};
+      var runningJob = {'job': {'id': 'job1', 'state': 'RUNNING'}};
+      httpBackend.expectPOST(endpoint, function(data) {
+        data = angular.fromJson(data);
+        return data.offset === 200 && data.limit === 100;
+      }).respond(runningJob);
+      httpBackend.expectGET('/data/job?id=job1&limit=100&offset=200').respond(
+          angular.extend({'page': page}, mockData));
+
+      svc.fetchResults(widget);
+      httpBackend.flush();
+
+      expect(widget.state().datasource.page).toEqual(page);
+
+      // Pages are not cached, so the next fetch requests the page again.
+      httpBackend.expectPOST(endpoint).respond(
+          angular.extend({'page': page}, mockData));
+      svc.fetchResults(widget);
+      httpBackend.flush();
+    });
+
+    describe('for a saved dashboard', function() {
+      var dashboardEndpoint = (
+          '/data/dashboard?id=dashboard1&timestamp_mode=epoch_ms');
+
+      beforeEach(function() {
+        explorerStateSvc.selectedDashboard.model.id = 'dashboard1';
+      });
+
+      it('should use the results of the dashboard', function() {
+        var dataTable = null;
+        var widget = new ChartWidgetConfig(widgetFactorySvc);
+        widget.model.datasource.query = 'fakeQuery8';
+
+        var widgets = {};
+        widgets[widget.model.id] = angular.extend(
+            {'query': 'fakeQuery8'}, mockData);
+        httpBackend.expectGET(dashboardEndpoint).respond({'widgets': widgets});
+
+        svc.fetchResults(widget).then(function(data) {
+          dataTable = data;
+        });
+        httpBackend.flush();
+
+        expect(dataTable).not.toBeNull();
+        expect(widget.state().datasource.row_count).toEqual(3);
+        expect(widget.state().datasource.request_id).toBeNull();
+      });
+
+      it('should query widgets whose query changed since it was saved',
+          function() {
+            var dataTable = null;
+            var widget = new ChartWidgetConfig(widgetFactorySvc);
+            widget.model.datasource.query = 'fakeQuery9';
+
+            var widgets = {};
+            widgets[widget.model.id] = angular.extend(
+                {'query': 'savedQuery'}, mockData);
+            httpBackend.expectGET(dashboardEndpoint).respond(
+                {'widgets': widgets});
+            httpBackend.expectPOST(endpoint).respond(mockData);
+
+            svc.fetchResults(widget).then(function(data) {
+              dataTable = data;
+            });
+            httpBackend.flush();
+
+            expect(dataTable).not.toBeNull();
+          });
+
+      it('should query widgets that failed in the dashboard', function() {
+        var dataTable = null;
+        var widget = new ChartWidgetConfig(widgetFactorySvc);
+        widget.model.datasource.query = 'fakeQuery10';
+
+        var widgets = {};
+        widgets[widget.model.id] = {'error': 'Query failed.'};
+        httpBackend.expectGET(dashboardEndpoint).respond({'widgets': widgets});
+        httpBackend.expectPOST(endpoint).respond(mockData);
+
+        svc.fetchResults(widget).then(function(data) {
+          dataTable = data;
+        });
+        httpBackend.flush();
+
+        expect(dataTable).not.toBeNull();
+        expect(errorSvc.errors.length).toEqual(0);
+      });
+    });
+  });
+
+  describe('cancelResults', function() {
+
+    it('should cancel the latest request of a widget', function() {
+      var widget = new ChartWidgetConfig(widgetFactorySvc);
+      widget.state().datasource.request_id = 'widget1-1';
+
+      httpBackend.expectPOST('/data/cancel?request_id=widget1-1').respond(
+          {'job': {'id': 'job1', 'state': 'CANCELLED'}});
+
+      svc.cancelResults(widget);
+      httpBackend.flush();
+
+      expect(widget.state().datasource.request_id).toBeNull();
+    });
+
+    it('should do nothing without a request', function() {
+      var widget = new ChartWidgetConfig(widgetFactorySvc);
+
+      expect(svc.cancelResults(widget)).toBeNull();
+    });
+
+    it('should cancel pending requests when the dashboard changes',
+        function() {
+          var rejected = null;
+          var widget = new ChartWidgetConfig(widgetFactorySvc);
+          widget.model.datasource.query = 'fakeQuery5';
+
+          var cancelledJob = {'job': {'id': 'job1', 'state': 'CANCELLED'}};
+
+          httpBackend.expectPOST(endpoint).respond(
+              {'job': {'id': 'job1', 'state': 'RUNNING'}});
+          httpBackend.expectGET('/data/job?id=job1').respond(cancelledJob);
+
+          svc.fetchResults(widget).catch(function(data) {
+            rejected = data;
+          });
+          httpBackend.flush(1);
+
+          httpBackend.expectPOST(
+              '/data/cancel?request_id=' + widget.model.id + '-1').respond(
+                  cancelledJob);
+
+          rootScope.$broadcast('$stateChangeStart',
+              {'name': 'explorer-dashboard-edit'}, {'dashboard': '2'},
+              {'name': 'explorer-dashboard-edit'}, {'dashboard': '1'});
+          httpBackend.flush();
+
+          expect(rejected).toEqual(cancelledJob);
+          expect(widget.state().datasource.request_id).toBeNull();
+          expect(errorSvc.errors.length).toEqual(0);
+        });
+
+    it('should cancel a job that started after its request was cancelled',
+        function() {
+          var rejected = null;
+          var widget = new ChartWidgetConfig(widgetFactorySvc);
+          widget.model.datasource.query = 'fakeQuery6';
+
+          httpBackend.expectPOST(endpoint).respond(
+              {'job': {'id': 'job1', 'state': 'RUNNING'}});
+          httpBackend.expectPOST(
+              '/data/cancel?request_id=' + widget.model.id + '-1').respond(
+                  {'job': null});
+          httpBackend.expectPOST('/data/cancel?id=job1').respond(
+              {'job': {'id': 'job1', 'state': 'CANCELLED'}});
+
+          svc.fetchResults(widget).catch(function(data) {
+            rejected = data;
+          });
+          svc.cancelResults(widget);
+          httpBackend.flush();
+
+          expect(rejected.job.state).toEqual('CANCELLED');
+          expect(errorSvc.errors.length).toEqual(0);
+        });
+
+    it('should not cancel requests when the dashboard is unchanged',
+        function() {
+          var widget = new ChartWidgetConfig(widgetFactorySvc);
+          widget.model.datasource.query = 'fakeQuery7';
+
+          svc.fetchResults(widget);
+          rootScope.$broadcast('$stateChangeStart',
+              {'name': 'explorer-dashboard-edit'}, {'dashboard': '1'},
+              {'name': 'explorer-dashboard-edit'}, {'dashboard': '1'});
+
+          expect(widget.state().datasource.request_id).toEqual(
+              widget.model.id + '-1');
+        });
   });
 });
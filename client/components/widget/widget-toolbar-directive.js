@@ -17,6 +17,7 @@ goog.require('p3rf.perfkit.explorer.components.dashboard.DashboardService');
 goog.require('p3rf.perfkit.explorer.components.explorer.ExplorerService');
 goog.require('p3rf.perfkit.explorer.components.explorer.sidebar.SidebarTabService');
 goog.require('p3rf.perfkit.explorer.components.widget.WidgetService');
+goog.require('p3rf.perfkit.explorer.components.widget.query.QueryResultDataService');
 
 
 goog.scope(function() {
@@ -32,7 +33,8 @@ goog.scope(function() {
    * @ngInject
    */
   explorer.components.widget.WidgetToolbarDirective = function(
-      dashboardService, explorerService, widgetService, explorerStateService) {
+      dashboardService, explorerService, widgetService, explorerStateService,
+      queryResultDataService) {
     return {
       restrict: 'E',
       scope: {
@@ -112,6 +114,7 @@ goog.scope(function() {
             return;
           }
 
+          queryResultDataService.cancelResults(target);
           this.dashboardSvc.removeWidget(target, this.dashboardSvc.selectedContainer);
         };
 
@@ -434,6 +434,10 @@ mocks.addMocks = function(appModule) {
       ];
     });
 
+    // Mock requests targeting GET /data/dashboard.  Without results, each
+    // widget queries /data/sql.
+    $httpBackend.whenGET(/^\/data\/dashboard/).respond({widgets: {}});
+
     let ids = 128;
     // Mock requests targeting POST /dashboard/create
     $httpBackend.whenPOST('/dashboard/create').respond(
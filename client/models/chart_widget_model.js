@@ -189,6 +189,20 @@ explorer.models.DatasourceState = function() {
    */
   this.query_size = null;
 
+  /**
+   * The offset of the first row to request, for paged datasources.
+   * @type {number}
+   * @export
+   */
+  this.page_offset = 0;
+
+  /**
+   * The page of rows returned by the server, for paged datasources.
+   * @type {?{offset: number, limit: number, totalRows: number}}
+   * @export
+   */
+  this.page = null;
+
   /**
    * @type {!Array.<string>}
    * @export
@@ -294,6 +308,14 @@ explorer.models.DatasourceModel = function() {
    */
   this.queryError = null;
 
+  /**
+   * If set, Table charts request this many rows at a time from the server,
+   * rather than all of the rows of the query.
+   * @type {?number}
+   * @export
+   */
+  this.page_size = null;
+
   /**
    * @type {!DataViewModel}
    * @export
@@ -0,0 +1,433 @@
+"""Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Admission control for queries issued on behalf of users.
+
+Queries are admitted when:
+  * the user's token bucket and the project's token bucket each have a token,
+    which limits the rate that one user or project can start queries, and
+  * fewer than max_concurrent queries are running on the instance.
+
+Requests that can't be admitted right away wait in a fair queue: when a slot
+or token becomes available, it goes to the oldest request of the user that
+was admitted least recently, so one user refreshing a large dashboard can't
+starve everyone else.  Requests that wait longer than queue_timeout raise
+AdmissionError.
+
+    controller = admission_control.GetController(
+        max_concurrent=10, user_rate=1.0, user_burst=20)
+    with controller.Admit(user_key, project_id):
+      client.QueryResultSet(query)
+
+A query that is still running as a job when its request ends keeps its slot
+with HoldJob(job_id), until ReleaseJob(job_id) is called when the job is
+seen to finish or is cancelled.  The job may be polled or cancelled on
+another instance, so ReleaseJob() also records the release in memcache.
+When the slots are full, the controller frees the held jobs released on
+other instances, at most every JOB_CHECK_INTERVAL.  Held slots are freed
+after JOB_HOLD_TIMEOUT regardless, in case a job is never polled again.
+
+The limits are kept in memory, so they apply per instance.
+"""
+
+__author__ = 'joemu@google.com (Joe Allan Muharsky)'
+
+import collections
+import contextlib
+import logging
+import threading
+import time
+
+from google.appengine.api import memcache
+
+
+# Token buckets that have been full (idle) for this many seconds are discarded.
+IDLE_BUCKET_TIMEOUT = 600
+# Held job slots are freed after this many seconds, if not released.
+JOB_HOLD_TIMEOUT = 1800
+# When the slots are full, the jobs released on other instances are read from
+# memcache at most once per this many seconds.
+JOB_CHECK_INTERVAL = 5
+RELEASED_JOB_PREFIX = 'admission_control:released_job:'
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+class Error(Exception):
+  pass
+
+
+class AdmissionError(Error):
+  """Raised when a request waits too long to be admitted.
+
+  Attributes:
+    retry_after: The number of seconds the caller should wait before trying
+        again.
+  """
+
+  def __init__(self, message, retry_after):
+    super(AdmissionError, self).__init__(message)
+    self.retry_after = retry_after
+
+
+class TokenBucket(object):
+  """Allows an average of rate events per second, and bursts of capacity."""
+
+  def __init__(self, rate, capacity, now=None):
+    """Initializes a full bucket.
+
+    Args:
+      rate: The number of tokens added per second.
+      capacity: The maximum number of tokens in the bucket.
+      now: The current time, for tests.
+    """
+    self.rate = rate
+    self.capacity = max(capacity, 1)
+    self.tokens = float(self.capacity)
+    self.updated = now if now is not None else time.time()
+    self.last_taken = self.updated
+
+  def Refill(self, now):
+    """Adds the tokens accumulated since the last refill."""
+    self.tokens = min(self.capacity,
+                      self.tokens + (now - self.updated) * self.rate)
+    self.updated = now
+
+  def HasToken(self, now):
+    self.Refill(now)
+    return self.tokens >= 1
+
+  def Take(self, now):
+    """Removes a token.  Call HasToken() first."""
+    self.Refill(now)
+    self.tokens -= 1
+    self.last_taken = now
+
+  def GetWaitTime(self, now):
+    """Returns the number of seconds until the bucket has a token."""
+    self.Refill(now)
+    if self.tokens >= 1:
+      return 0
+    return (1 - self.tokens) / self.rate
+
+  def IsIdle(self, now):
+    """Returns True if the bucket is full and unused for IDLE_BUCKET_TIMEOUT."""
+    self.Refill(now)
+    return (self.tokens >= self.capacity and
+            now - self.last_taken > IDLE_BUCKET_TIMEOUT)
+
+
+class _Request(object):
+  """A request waiting for admission."""
+
+  __slots__ = ('user_key', 'project_id', 'admitted')
+
+  def __init__(self, user_key, project_id):
+    self.user_key = user_key
+    self.project_id = project_id
+    self.admitted = False
+
+
+class AdmissionController(object):
+  """Admits queries within per-user, per-project and concurrency limits."""
+
+  def __init__(self, max_concurrent=0, user_rate=0, user_burst=1,
+               project_rate=0, project_burst=1, queue_timeout=0):
+    """Initializes the controller.
+
+    Args:
+      max_concurrent: The maximum number of admitted requests at once.  Zero
+          disables the limit.
+      user_rate: The number of requests per second allowed for each user,
+          on average.  Zero disables the limit.
+      user_burst: The number of requests a user can make at once.
+      project_rate: The number of requests per second allowed for each
+          project, on average.  Zero disables the limit.
+      project_burst: The number of requests a project can make at once.
+      queue_timeout: The number of seconds a request waits to be admitted
+          before AdmissionError is raised.
+    """
+    self.max_concurrent = max_concurrent
+    self.user_rate = user_rate
+    self.user_burst = user_burst
+    self.project_rate = project_rate
+    self.project_burst = project_burst
+    self.queue_timeout = queue_timeout
+
+    self.running = 0
+    self._condition = threading.Condition()
+    # The expiration time of each held job slot, by job id.
+    self._held_jobs = {}
+    self._last_checked = 0
+    # Waiting requests by user, ordered from the least recently admitted.
+    self._queues = collections.OrderedDict()
+    self._user_buckets = {}
+    self._project_buckets = {}
+    self._last_pruned = time.time()
+
+  def GetSettings(self):
+    """Returns the limits the controller was created with."""
+    return (self.max_concurrent, self.user_rate, self.user_burst,
+            self.project_rate, self.project_burst, self.queue_timeout)
+
+  @contextlib.contextmanager
+  def Admit(self, user_key, project_id):
+    """Waits for admission, and holds a slot for the duration of the block.
+
+    Args:
+      user_key: Identifies the user making the request.
+      project_id: The project the query runs in.
+
+    Raises:
+      AdmissionError: If the request is not admitted within queue_timeout.
+    """
+    self.Acquire(user_key, project_id)
+    try:
+      yield
+    finally:
+      self.Release()
+
+  def Acquire(self, user_key, project_id):
+    """Waits for admission.  Release() must be called when done.
+
+    See Admit() for the arguments and errors.
+    """
+    request = _Request(user_key, project_id)
+    deadline = time.time() + self.queue_timeout
+
+    with self._condition:
+      self._queues.setdefault(user_key, collections.deque()).append(request)
+
+      while True:
+        now = time.time()
+        wait_time = self._Dispatch(now)
+
+        if request.admitted:
+          return
+
+        remaining = deadline - now
+        if remaining <= 0:
+          self._Remove(request)
+          retry_after = max(1, int(round(wait_time or 1)))
+          logging.warning('Query for %s in project %s was not admitted after '
+                          '%ss.', user_key, project_id, self.queue_timeout)
+          raise AdmissionError(
+              'Too many queries are running.  Try again in %d seconds.' %
+              retry_after, retry_after)
+
+        self._condition.wait(min(remaining, wait_time or remaining))
+
+  def Release(self):
+    """Frees the slot of an admitted request."""
+    with self._condition:
+      self.running -= 1
+      self._Dispatch(time.time())
+
+  def HoldJob(self, job_id, now=None):
+    """Takes a slot for a running job, until ReleaseJob() is called.
+
+    Call this from within the admitted block that started the job, so the
+    job is counted against max_concurrent while it runs.  The slot is freed
+    after JOB_HOLD_TIMEOUT if the job is never released.
+
+    Args:
+      job_id: The id of the running job.
+      now: The current time, for tests.
+    """
+    now = now if now is not None else time.time()
+
+    with self._condition:
+      if job_id not in self._held_jobs:
+        self.running += 1
+      self._held_jobs[job_id] = now + JOB_HOLD_TIMEOUT
+
+  def ReleaseJob(self, job_id):
+    """Frees the slot of a held job.  Jobs that aren't held are ignored."""
+    with self._condition:
+      if self._held_jobs.pop(job_id, None) is not None:
+        self.running -= 1
+        self._Dispatch(time.time())
+
+  def GetHeldJobs(self):
+    """Returns the ids of the jobs holding a slot."""
+    with self._condition:
+      return set(self._held_jobs)
+
+  def _Dispatch(self, now):
+    """Admits waiting requests, in fair order, while the limits allow.
+
+    Returns:
+      The number of seconds until a token or an expired job slot is
+      available for the next waiting request, or None if no request is
+      waiting for either.
+    """
+    admitted = False
+    wait_time = None
+
+    self._ExpireHeldJobs(now)
+    if self._queues and self._IsFull():
+      self._FreeReleasedJobs(now)
+
+    while self._queues and not self._IsFull():
+      candidate = None
+
+      for user_key, queue in self._queues.iteritems():
+        request = queue[0]
+        request_wait = self._GetTokenWaitTime(request, now)
+
+        if not request_wait:
+          candidate = request
+          break
+
+        if wait_time is None or request_wait < wait_time:
+          wait_time = request_wait
+
+      if not candidate:
+        break
+
+      self._TakeTokens(candidate, now)
+      self._Remove(candidate)
+      # The user goes to the back of the line for their next request.
+      if candidate.user_key in self._queues:
+        self._queues[candidate.user_key] = self._queues.pop(
+            candidate.user_key)
+
+      candidate.admitted = True
+      self.running += 1
+      admitted = True
+      wait_time = None
+
+    if admitted:
+      self._condition.notify_all()
+
+    if self._queues and self._IsFull() and self._held_jobs:
+      expire_wait = min(min(self._held_jobs.itervalues()),
+                        self._last_checked + JOB_CHECK_INTERVAL) - now
+      if wait_time is None or expire_wait < wait_time:
+        wait_time = expire_wait
+
+    self._PruneBuckets(now)
+    return wait_time
+
+  def _ExpireHeldJobs(self, now):
+    for job_id, expiration in self._held_jobs.items():
+      if expiration <= now:
+        logging.warning('Freeing the slot of job %s, which was not released '
+                        'within %ss.', job_id, JOB_HOLD_TIMEOUT)
+        del self._held_jobs[job_id]
+        self.running -= 1
+
+  def _FreeReleasedJobs(self, now):
+    """Frees the held jobs that were released on any instance."""
+    if not self._held_jobs or now - self._last_checked < JOB_CHECK_INTERVAL:
+      return
+
+    self._last_checked = now
+    released = memcache.get_multi(list(self._held_jobs),
+                                  key_prefix=RELEASED_JOB_PREFIX)
+    for job_id in released:
+      if self._held_jobs.pop(job_id, None) is not None:
+        self.running -= 1
+
+  def _IsFull(self):
+    return self.max_concurrent > 0 and self.running >= self.max_concurrent
+
+  def _Remove(self, request):
+    queue = self._queues[request.user_key]
+    queue.remove(request)
+    if not queue:
+      del self._queues[request.user_key]
+
+  def _GetBuckets(self, request, now):
+    """Returns the token buckets that limit a request."""
+    buckets = []
+
+    if self.user_rate > 0:
+      if request.user_key not in self._user_buckets:
+        self._user_buckets[request.user_key] = TokenBucket(
+            self.user_rate, self.user_burst, now)
+      buckets.append(self._user_buckets[request.user_key])
+
+    if self.project_rate > 0:
+      if request.project_id not in self._project_buckets:
+        self._project_buckets[request.project_id] = TokenBucket(
+            self.project_rate, self.project_burst, now)
+      buckets.append(self._project_buckets[request.project_id])
+
+    return buckets
+
+  def _GetTokenWaitTime(self, request, now):
+    """Returns the seconds until every bucket of a request has a token."""
+    return max([bucket.GetWaitTime(now)
+                for bucket in self._GetBuckets(request, now)] or [0])
+
+  def _TakeTokens(self, request, now):
+    for bucket in self._GetBuckets(request, now):
+      bucket.Take(now)
+
+  def _PruneBuckets(self, now):
+    """Discards idle token buckets, at most once per IDLE_BUCKET_TIMEOUT."""
+    if now - self._last_pruned < IDLE_BUCKET_TIMEOUT:
+      return
+
+    self._last_pruned = now
+    for buckets in (self._user_buckets, self._project_buckets):
+      for key, bucket in buckets.items():
+        if bucket.IsIdle(now):
+          del buckets[key]
+
+
+def GetController(max_concurrent=0, user_rate=0, user_burst=1,
+                  project_rate=0, project_burst=1, queue_timeout=0):
+  """Returns the instance's AdmissionController, with the limits provided.
+
+  The controller is shared by all requests on the instance.  If the limits
+  change, a new controller replaces it; requests admitted by the previous
+  controller are not counted by the new one.  See AdmissionController for a
+  description of the arguments.
+  """
+  global _controller
+
+  settings = (max_concurrent, user_rate, user_burst, project_rate,
+              project_burst, queue_timeout)
+
+  with _controller_lock:
+    if _controller is None or _controller.GetSettings() != settings:
+      _controller = AdmissionController(*settings)
+
+    return _controller
+
+
+def ReleaseJob(job_id):
+  """Frees the slot held by a job, on this instance or any other.
+
+  The slot is freed right away if this instance's controller holds it.
+  Otherwise the instance that holds it frees it once its slots are full.
+  """
+  memcache.set(RELEASED_JOB_PREFIX + job_id, True, time=JOB_HOLD_TIMEOUT)
+
+  with _controller_lock:
+    controller = _controller
+
+  if controller:
+    controller.ReleaseJob(job_id)
+
+
+def ResetController():
+  """Discards the instance's controller, so its state is not shared."""
+  global _controller
+
+  with _controller_lock:
+    _controller = None
@@ -0,0 +1,211 @@
+"""Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Tests for the admission_control module."""
+
+__author__ = 'joemu@google.com (Joe Allan Muharsky)'
+
+import collections
+import threading
+import time
+import unittest
+
+from google.appengine.ext import testbed
+
+from perfkit.common import admission_control
+
+
+class TokenBucketTest(unittest.TestCase):
+
+  def testBurstAndRefill(self):
+    bucket = admission_control.TokenBucket(rate=0.5, capacity=2, now=100)
+
+    bucket.Take(100)
+    bucket.Take(100)
+
+    self.assertFalse(bucket.HasToken(100))
+    self.assertEqual(2, bucket.GetWaitTime(100))
+    self.assertEqual(1, bucket.GetWaitTime(101))
+    self.assertTrue(bucket.HasToken(102))
+
+    # Tokens don't accumulate beyond the capacity.
+    bucket.Refill(1000)
+    self.assertEqual(2, bucket.tokens)
+
+  def testIsIdle(self):
+    bucket = admission_control.TokenBucket(rate=1, capacity=1, now=100)
+    bucket.Take(100)
+
+    self.assertFalse(bucket.IsIdle(101))
+    self.assertTrue(
+        bucket.IsIdle(101 + admission_control.IDLE_BUCKET_TIMEOUT))
+
+
+class AdmissionControllerTest(unittest.TestCase):
+
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_memcache_stub()
+
+  def tearDown(self):
+    admission_control.ResetController()
+    self.testbed.deactivate()
+
+  def testConcurrencyLimit(self):
+    controller = admission_control.AdmissionController(max_concurrent=2)
+
+    controller.Acquire('user1', 'project1')
+    controller.Acquire('user2', 'project1')
+    self.assertEqual(2, controller.running)
+
+    self.assertRaises(admission_control.AdmissionError,
+                      controller.Acquire, 'user3', 'project1')
+
+    controller.Release()
+    with controller.Admit('user3', 'project1'):
+      self.assertEqual(2, controller.running)
+    self.assertEqual(1, controller.running)
+
+  def testUserRateLimit(self):
+    controller = admission_control.AdmissionController(
+        user_rate=0.1, user_burst=2)
+
+    controller.Acquire('user1', 'project1')
+    controller.Acquire('user1', 'project1')
+
+    try:
+      controller.Acquire('user1', 'project1')
+      self.fail('AdmissionError was not raised.')
+    except admission_control.AdmissionError as err:
+      self.assertEqual(10, err.retry_after)
+
+    # Other users have their own bucket.
+    controller.Acquire('user2', 'project1')
+
+  def testProjectRateLimit(self):
+    controller = admission_control.AdmissionController(
+        project_rate=1, project_burst=1)
+
+    controller.Acquire('user1', 'project1')
+
+    self.assertRaises(admission_control.AdmissionError,
+                      controller.Acquire, 'user2', 'project1')
+    controller.Acquire('user2', 'project2')
+
+  def testQueueWaitsForRelease(self):
+    controller = admission_control.AdmissionController(
+        max_concurrent=1, queue_timeout=5)
+    controller.Acquire('user1', 'project1')
+
+    admitted = threading.Event()
+
+    def AcquireAndSignal():
+      controller.Acquire('user2', 'project1')
+      admitted.set()
+
+    thread = threading.Thread(target=AcquireAndSignal)
+    thread.start()
+
+    self.assertFalse(admitted.wait(0.05))
+    controller.Release()
+    thread.join(5)
+
+    self.assertTrue(admitted.is_set())
+    self.assertEqual(1, controller.running)
+
+  def testHeldJobKeepsSlot(self):
+    controller = admission_control.AdmissionController(max_concurrent=1)
+
+    with controller.Admit('user1', 'project1'):
+      controller.HoldJob('job1')
+    self.assertEqual(1, controller.running)
+    self.assertEqual(set(['job1']), controller.GetHeldJobs())
+
+    self.assertRaises(admission_control.AdmissionError,
+                      controller.Acquire, 'user2', 'project1')
+
+    controller.ReleaseJob('unknown')
+    controller.ReleaseJob('job1')
+    controller.ReleaseJob('job1')
+    self.assertEqual(0, controller.running)
+
+    with controller.Admit('user2', 'project1'):
+      self.assertEqual(1, controller.running)
+
+  def testHeldJobExpires(self):
+    controller = admission_control.AdmissionController(max_concurrent=1)
+    controller.HoldJob(
+        'job1', now=time.time() - admission_control.JOB_HOLD_TIMEOUT)
+
+    with controller.Admit('user1', 'project1'):
+      self.assertEqual(1, controller.running)
+    self.assertEqual(set(), controller.GetHeldJobs())
+
+  def testReleaseJob(self):
+    admission_control.ReleaseJob('job1')
+
+    controller = admission_control.GetController(max_concurrent=1)
+    controller.HoldJob('job1')
+    admission_control.ReleaseJob('job1')
+
+    self.assertEqual(0, controller.running)
+
+  def testJobReleasedOnAnotherInstance(self):
+    controller = admission_control.AdmissionController(max_concurrent=1)
+    controller.HoldJob('job1')
+
+    # Another instance's controller doesn't hold the job.
+    admission_control.GetController(max_concurrent=1)
+    admission_control.ReleaseJob('job1')
+    self.assertEqual(set(['job1']), controller.GetHeldJobs())
+
+    with controller.Admit('user1', 'project1'):
+      self.assertEqual(1, controller.running)
+    self.assertEqual(set(), controller.GetHeldJobs())
+    self.assertEqual(0, controller.running)
+
+  def testFairOrder(self):
+    controller = admission_control.AdmissionController(max_concurrent=1)
+    controller.running = 1
+
+    # user1 has two requests waiting, queued before user2's request.
+    requests = [admission_control._Request('user1', 'project1'),
+                admission_control._Request('user1', 'project1'),
+                admission_control._Request('user2', 'project1')]
+    for request in requests:
+      controller._queues.setdefault(
+          request.user_key, collections.deque()).append(request)
+
+    order = []
+    for _ in requests:
+      controller.running -= 1
+      with controller._condition:
+        controller._Dispatch(0)
+      order.extend(index for index, request in enumerate(requests)
+                   if request.admitted and index not in order)
+
+    # user2 is served before user1's second request.
+    self.assertEqual([0, 2, 1], order)
+
+  def testGetController(self):
+    controller = admission_control.GetController(max_concurrent=5)
+
+    self.assertIs(controller, admission_control.GetController(max_concurrent=5))
+    self.assertIsNot(controller,
+                     admission_control.GetController(max_concurrent=6))
+
+
+if __name__ == '__main__':
+  unittest.main()
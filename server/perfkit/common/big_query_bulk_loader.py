@@ -0,0 +1,319 @@
+"""Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Loads many result files into BigQuery with parallel load jobs.
+
+BigQueryClient.LoadData() runs one load job and waits for it before the next
+one can start.  BulkLoader instead:
+  1. Shards the files into load jobs of up to max_bytes_per_job bytes.
+  2. Starts every job before waiting on any of them, so BigQuery runs them
+     in parallel.
+  3. Polls all of the running jobs together, backing off from
+     min_poll_interval to max_poll_interval while none of them finish.
+  4. Restarts failed jobs (up to max_tries), and reports the outcome of each
+     file.
+
+Job ids are built with BigQueryClient.BuildJobIdString() from the files of
+the job, the import round and the try, so running the same load again adopts
+the jobs that were already started rather than loading the files twice.
+
+    loader = big_query_bulk_loader.BulkLoader(client)
+    report = loader.Load({'gs://bucket/results-0001.json': 1048576, ...})
+    for uri in report.failed:
+      logging.error('%s: %s', uri, report.files[uri]['error'])
+"""
+
+__author__ = 'joemu@google.com (Joe Allan Muharsky)'
+
+import collections
+import logging
+import time
+
+from apiclient.errors import HttpError
+
+from perfkit.common import big_query_client
+
+
+# BigQuery accepts up to 10,000 source uris per load job.
+MAX_FILES_PER_JOB = 10000
+DEFAULT_MAX_BYTES_PER_JOB = 1024 * 1024 * 1024
+DEFAULT_MAX_TRIES = 3
+
+MIN_POLL_INTERVAL = 1  # In seconds
+MAX_POLL_INTERVAL = 30  # In seconds
+POLL_BACKOFF = 2
+
+
+class FileStates(object):
+  """The states of a file in a LoadReport."""
+  LOADED = 'loaded'
+  FAILED = 'failed'
+  PENDING = 'pending'
+
+
+class Error(Exception):
+  pass
+
+
+class LoadJob(object):
+  """A load job for a shard of the files.
+
+  Attributes:
+    uris: The sorted list of uris loaded by the job.
+    num_bytes: The total size of the files, in bytes.
+    tries: The number of times the job has been started.
+    job_id: The id of the current try of the job.
+    state: A FileStates value.
+    error: The error message of the last failed try.
+  """
+
+  def __init__(self, uris, num_bytes):
+    self.uris = sorted(uris)
+    self.num_bytes = num_bytes
+    self.tries = 0
+    self.job_id = None
+    self.state = FileStates.PENDING
+    self.error = None
+
+
+class LoadReport(object):
+  """The outcome of a bulk load.
+
+  Attributes:
+    files: An OrderedDict of uri to a dict describing the load of the file,
+        in the following format:
+          {'state': 'loaded', 'job_id': 'load_job_0_0_...', 'tries': 1,
+           'error': None}
+    jobs: The list of LoadJobs that the files were sharded into.
+  """
+
+  def __init__(self, jobs):
+    self.jobs = jobs
+    self.files = collections.OrderedDict()
+
+    for job in jobs:
+      for uri in job.uris:
+        self.files[uri] = {'state': job.state, 'job_id': job.job_id,
+                           'tries': job.tries, 'error': job.error}
+
+  def _GetFiles(self, state):
+    return [uri for uri, status in self.files.iteritems()
+            if status['state'] == state]
+
+  @property
+  def loaded(self):
+    return self._GetFiles(FileStates.LOADED)
+
+  @property
+  def failed(self):
+    return self._GetFiles(FileStates.FAILED)
+
+  @property
+  def pending(self):
+    return self._GetFiles(FileStates.PENDING)
+
+  @property
+  def success(self):
+    return len(self.loaded) == len(self.files)
+
+  def ToDict(self):
+    return {'files': self.files,
+            'loaded': len(self.loaded),
+            'failed': len(self.failed),
+            'pending': len(self.pending)}
+
+
+def ShardFiles(files, max_bytes_per_job=DEFAULT_MAX_BYTES_PER_JOB,
+               max_files_per_job=MAX_FILES_PER_JOB):
+  """Groups files into load jobs of up to max_bytes_per_job bytes.
+
+  Files are sorted by uri before they are grouped, so the same files always
+  produce the same jobs (and job ids).  A file larger than max_bytes_per_job
+  gets a job of its own.
+
+  Args:
+    files: A dict of uri to the size of the file in bytes, or a list of
+        (uri, size) tuples.
+    max_bytes_per_job: The maximum number of bytes loaded by a job.
+    max_files_per_job: The maximum number of files loaded by a job.
+
+  Returns:
+    A list of LoadJobs.
+  """
+  if isinstance(files, dict):
+    files = files.items()
+
+  jobs = []
+  uris = []
+  num_bytes = 0
+
+  for uri, size in sorted(files):
+    if uris and (num_bytes + size > max_bytes_per_job or
+                 len(uris) >= max_files_per_job):
+      jobs.append(LoadJob(uris, num_bytes))
+      uris = []
+      num_bytes = 0
+
+    uris.append(uri)
+    num_bytes += size
+
+  if uris:
+    jobs.append(LoadJob(uris, num_bytes))
+
+  return jobs
+
+
+class BulkLoader(object):
+  """Loads files into a BigQuery table with parallel load jobs."""
+
+  def __init__(self, client, max_bytes_per_job=DEFAULT_MAX_BYTES_PER_JOB,
+               max_tries=DEFAULT_MAX_TRIES, import_round=0,
+               min_poll_interval=MIN_POLL_INTERVAL,
+               max_poll_interval=MAX_POLL_INTERVAL, timeout=None,
+               sleep=time.sleep, clock=time.time):
+    """Initializes the loader.
+
+    Args:
+      client: A BigQueryClient.
+      max_bytes_per_job: The maximum number of bytes loaded by a job.
+      max_tries: The number of times a failed job is started before its files
+          are reported as failed.
+      import_round: Increment this to reload files that were already loaded
+          in a previous round, since their job ids would otherwise be reused.
+      min_poll_interval: The seconds to wait between the first polls.
+      max_poll_interval: The maximum seconds to wait between polls.
+      timeout: If provided, Load() returns after this many seconds and
+          reports the files of running jobs as pending.
+      sleep: The function used to wait between polls, for tests.
+      clock: The function that returns the current time, for tests.
+    """
+    self.client = client
+    self.max_bytes_per_job = max_bytes_per_job
+    self.max_tries = max_tries
+    self.import_round = import_round
+    self.min_poll_interval = min_poll_interval
+    self.max_poll_interval = max_poll_interval
+    self.timeout = timeout
+    self._sleep = sleep
+    self._clock = clock
+
+  def Load(self, files, **load_args):
+    """Loads files, and waits for every job to finish.
+
+    Args:
+      files: A dict of uri to the size of the file in bytes, or a list of
+          (uri, size) tuples.
+      **load_args: Passed to BigQueryClient.LoadDataAsync(), such as
+          destination_table or source_format.
+
+    Returns:
+      A LoadReport.
+    """
+    jobs = ShardFiles(files, self.max_bytes_per_job)
+    logging.info('Loading %d files with %d jobs.',
+                 sum(len(job.uris) for job in jobs), len(jobs))
+
+    deadline = None
+    if self.timeout is not None:
+      deadline = self._clock() + self.timeout
+
+    for job in jobs:
+      self._StartJob(job, load_args)
+
+    interval = self.min_poll_interval
+    running = self._GetRunningJobs(jobs)
+
+    while running:
+      if deadline is not None and self._clock() >= deadline:
+        logging.warning('Timed out waiting for %d load jobs.', len(running))
+        break
+
+      self._sleep(interval)
+
+      finished = False
+      for job in running:
+        if self._PollJob(job, load_args):
+          finished = True
+
+      # Poll again soon after a job finishes, since others are likely close.
+      if finished:
+        interval = self.min_poll_interval
+      else:
+        interval = min(interval * POLL_BACKOFF, self.max_poll_interval)
+
+      running = self._GetRunningJobs(jobs)
+
+    report = LoadReport(jobs)
+    logging.info('Loaded %d files, %d failed, %d pending.',
+                 len(report.loaded), len(report.failed), len(report.pending))
+    return report
+
+  def _GetRunningJobs(self, jobs):
+    return [job for job in jobs
+            if job.state == FileStates.PENDING and job.job_id]
+
+  def _StartJob(self, job, load_args):
+    """Starts the next try of a job.
+
+    If a job with the same id already exists (from an earlier run of the same
+    load), it is polled rather than started again.
+    """
+    job.job_id = big_query_client.BigQueryClient.BuildJobIdString(
+        job.uris, self.import_round, job.tries)
+    job.tries += 1
+
+    try:
+      self.client.LoadDataAsync(job.uris, job_id=job.job_id, **load_args)
+    except big_query_client.BigQueryImportError as err:
+      if (err.bq_error_message and
+          big_query_client.BqErrorMsgs.ALREADY_EXISTS in
+          err.bq_error_message):
+        logging.info('Load job %s already exists.', job.job_id)
+        return
+
+      self._FailJob(job, str(err), load_args)
+
+  def _PollJob(self, job, load_args):
+    """Checks the status of a running job.
+
+    Returns:
+      True if the job finished (successfully or not).
+    """
+    try:
+      reply = self.client.GetJobByID(job.job_id)
+    except HttpError as err:
+      logging.warning('Checking load job %s failed: %s', job.job_id, err)
+      return False
+
+    status = reply['status']
+    if status['state'] != big_query_client.BqStates.DONE:
+      return False
+
+    if 'errorResult' in status:
+      self._FailJob(job, status['errorResult']['message'], load_args)
+    else:
+      job.state = FileStates.LOADED
+      job.error = None
+
+    return True
+
+  def _FailJob(self, job, error, load_args):
+    """Records a failed try of a job, and starts the next try if allowed."""
+    logging.warning('Load job %s failed: %s', job.job_id, error)
+    job.error = error
+
+    if job.tries < self.max_tries:
+      self._StartJob(job, load_args)
+    else:
+      job.state = FileStates.FAILED
@@ -0,0 +1,167 @@
+"""Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Unit tests for the BigQuery bulk loader."""
+
+__author__ = 'joemu@google.com (Joe Allan Muharsky)'
+
+import unittest
+
+import mock
+
+from perfkit.common import big_query_bulk_loader as bulk_loader
+from perfkit.common import big_query_client
+
+
+FILES = {'gs://bucket/a.json': 40,
+         'gs://bucket/b.json': 40,
+         'gs://bucket/c.json': 40,
+         'gs://bucket/d.json': 200}
+
+
+class FakeJobs(object):
+  """Load jobs that finish after a number of polls, for a mock client."""
+
+  def __init__(self, polls_to_finish=1):
+    self.polls_to_finish = polls_to_finish
+    self.started = []
+    self.polls = {}
+    self.errors = {}
+
+  def LoadDataAsync(self, source_uris, job_id=None, **unused_load_args):
+    if job_id in self.polls:
+      raise big_query_client.BigQueryImportError(
+          'Importing failed', 'Already Exists: Job %s' % job_id)
+
+    self.started.append((job_id, list(source_uris)))
+    self.polls[job_id] = 0
+    return job_id
+
+  def GetJobByID(self, job_id):
+    self.polls[job_id] += 1
+    if self.polls[job_id] < self.polls_to_finish:
+      return {'status': {'state': 'RUNNING'}}
+
+    status = {'state': 'DONE'}
+    if job_id in self.errors:
+      status['errorResult'] = {'message': self.errors[job_id]}
+    return {'status': status}
+
+
+class BulkLoaderTest(unittest.TestCase):
+
+  def setUp(self):
+    self.jobs = FakeJobs()
+    self.client = mock.Mock()
+    self.client.LoadDataAsync.side_effect = self.jobs.LoadDataAsync
+    self.client.GetJobByID.side_effect = self.jobs.GetJobByID
+    self.sleeps = []
+
+  def _GetLoader(self, **kwargs):
+    return bulk_loader.BulkLoader(self.client, max_bytes_per_job=100,
+                                  sleep=self.sleeps.append, **kwargs)
+
+  def _GetJobId(self, uris, import_try, import_round=0):
+    return big_query_client.BigQueryClient.BuildJobIdString(
+        sorted(uris), import_round, import_try)
+
+  def testShardFiles(self):
+    jobs = bulk_loader.ShardFiles(FILES, max_bytes_per_job=100)
+
+    self.assertEqual(
+        [['gs://bucket/a.json', 'gs://bucket/b.json'],
+         ['gs://bucket/c.json'],
+         ['gs://bucket/d.json']],
+        [job.uris for job in jobs])
+    self.assertEqual([80, 40, 200], [job.num_bytes for job in jobs])
+
+    jobs = bulk_loader.ShardFiles(FILES, max_files_per_job=3)
+    self.assertEqual([3, 1], [len(job.uris) for job in jobs])
+
+  def testLoadStartsJobsBeforePolling(self):
+    self.jobs.polls_to_finish = 3
+    report = self._GetLoader().Load(FILES, destination_table='results')
+
+    self.assertTrue(report.success)
+    self.assertEqual(4, len(report.loaded))
+    self.assertEqual(3, len(self.jobs.started))
+
+    calls = [call[0] for call in self.client.method_calls]
+    self.assertEqual(['LoadDataAsync'] * 3, calls[:3])
+    self.assertEqual(['GetJobByID'] * 9, calls[3:])
+    uris = ['gs://bucket/c.json']
+    self.client.LoadDataAsync.assert_any_call(
+        uris, job_id=self._GetJobId(uris, 0), destination_table='results')
+
+    # Polls back off until a job finishes.
+    self.assertEqual([1, 2, 4], self.sleeps)
+
+  def testLoadRetriesFailedJobs(self):
+    failed_id = self._GetJobId(['gs://bucket/c.json'], 0)
+    self.jobs.errors[failed_id] = 'Backend error.'
+
+    report = self._GetLoader().Load(FILES)
+
+    self.assertTrue(report.success)
+    self.assertEqual(
+        {'state': 'loaded',
+         'job_id': self._GetJobId(['gs://bucket/c.json'], 1),
+         'tries': 2, 'error': None},
+        report.files['gs://bucket/c.json'])
+
+  def testLoadReportsFailedFiles(self):
+    uris = ['gs://bucket/a.json', 'gs://bucket/b.json']
+    for import_try in range(2):
+      self.jobs.errors[self._GetJobId(uris, import_try)] = 'Bad JSON.'
+
+    report = self._GetLoader(max_tries=2).Load(FILES)
+
+    self.assertFalse(report.success)
+    self.assertEqual(uris, report.failed)
+    self.assertEqual(['gs://bucket/c.json', 'gs://bucket/d.json'],
+                     report.loaded)
+    self.assertEqual('Bad JSON.', report.files['gs://bucket/a.json']['error'])
+    self.assertEqual({'files': report.files, 'loaded': 2, 'failed': 2,
+                      'pending': 0}, report.ToDict())
+
+  def testLoadAdoptsExistingJobs(self):
+    self._GetLoader().Load(FILES)
+    self.assertEqual(3, len(self.jobs.started))
+
+    report = self._GetLoader().Load(FILES)
+    self.assertTrue(report.success)
+    self.assertEqual(3, len(self.jobs.started))
+
+    self._GetLoader(import_round=1).Load(FILES)
+    self.assertEqual(6, len(self.jobs.started))
+
+  def testLoadTimeout(self):
+    self.jobs.polls_to_finish = 100
+    now = [0]
+
+    def Sleep(seconds):
+      now[0] += seconds
+
+    loader = bulk_loader.BulkLoader(self.client, max_bytes_per_job=100,
+                                    timeout=10, sleep=Sleep,
+                                    clock=lambda: now[0])
+    report = loader.Load(FILES)
+
+    self.assertEqual(4, len(report.pending))
+    self.assertEqual([], report.failed)
+    self.assertEqual(15, now[0])
+
+
+if __name__ == '__main__':
+  unittest.main()
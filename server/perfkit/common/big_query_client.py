@@ -36,10 +36,13 @@ import uuid
 from apiclient.discovery import build_from_document
 from apiclient.errors import HttpError
 
+from perfkit.common import big_query_result_sampler as result_sampler
+from perfkit.common import big_query_result_set as result_set_lib
 from perfkit.common import big_query_result_util as result_util
 from perfkit.common import credentials_lib
 from perfkit.common import data_source_config as config
 from perfkit.common import http_util
+from perfkit.common import timing_util
 
 
 DISCOVERY_FILE = 'config/big_query_v2_rest.json'
@@ -60,7 +63,7 @@ SLEEP_BETWEEN_POLLS = 5  # In seconds
 
 # A seed value used for doing random sampling.  We want to use a consistent
 # seed so refreshing a graph doesn't change the graph.
-RANDOM_SAMPLE_SEED = 0.8591313996314685
+RANDOM_SAMPLE_SEED = result_sampler.RANDOM_SAMPLE_SEED
 
 
 class BqStates(object):
@@ -226,14 +229,15 @@ class BigQueryClient(object):
     Returns:
       The results of the request.
     """
-    for _ in xrange(num_tries - 1):
-      try:
-        return request.execute()
-      except HttpError as e:
-        if e.resp['status'] not in self.RETRYABLE_ERRORS:
-          raise
+    with timing_util.Span('bigquery'):
+      for _ in xrange(num_tries - 1):
+        try:
+          return request.execute()
+        except HttpError as e:
+          if e.resp['status'] not in self.RETRYABLE_ERRORS:
+            raise
 
-    return request.execute()
+      return request.execute()
 
   def LoadData(self, source_uris, job_id=None,
                source_format='NEWLINE_DELIMITED_JSON',
@@ -570,11 +574,27 @@ class BigQueryClient(object):
         raise err
 
   def Query(self, query, timeout=None, max_results_per_page=None,
-            cache_duration=None):
+            cache_duration=None, sampler=None, timestamp_mode=None):
     """Issues a query to Big Query and returns the response.
 
     Note that multiple pages of data will be loaded returned as a single data
-    set.
+    set.  See QueryResultSet for a description of the arguments.
+
+    Returns:
+      The query results.  See big query's docs for the results format:
+      http://goto.google.com/big_query_query_results
+    """
+    return self.QueryResultSet(
+        query, timeout=timeout, max_results_per_page=max_results_per_page,
+        cache_duration=cache_duration, sampler=sampler,
+        timestamp_mode=timestamp_mode).ToReply()
+
+  def QueryResultSet(self, query, timeout=None, max_results_per_page=None,
+                     cache_duration=None, sampler=None, timestamp_mode=None):
+    """Issues a query to Big Query and returns the results as a ResultSet.
+
+    Each page of rows is converted to typed, column-oriented values as it is
+    fetched, so the full result is never held in the BigQuery JSON format.
 
     Args:
       query: The query to issue.
@@ -587,10 +607,17 @@ class BigQueryClient(object):
           Note this functionality is not available in the base client, but
           rather from subclasses (such as GaeBigQueryClient) that
           have caching implementations.
+      sampler: If provided, a big_query_result_sampler.ResultSampler that
+          receives each page of rows as it is fetched.  Only the sampled rows
+          are kept, and paging stops once the sampler is complete.  totalRows
+          in the reply will reflect the number of sampled rows.
+      timestamp_mode: One of big_query_result_util.TimestampModes.All(),
+          which determines how TIMESTAMP values are returned.  Defaults to ISO
+          strings.
 
     Returns:
-      The query results.  See big query's docs for the results format:
-      http://goto.google.com/big_query_query_results
+      A big_query_result_set.ResultSet.  Its metadata holds the other entries
+      of the query reply, such as totalRows and jobReference.
     """
     try:
       timeout_ms = (timeout or DEFAULT_QUERY_TIMEOUT) * 1000
@@ -607,35 +634,301 @@ class BigQueryClient(object):
       if 'jobReference' not in query_reply:
         logging.error('big_query_client.Query() failed: invalid JSON.\n'
                       'Query Reply:\n%s\n', query_reply)
-        return query_reply
+        return result_set_lib.ResultSet.FromReply(query_reply)
 
-      job_reference = query_reply['jobReference']
+      return self._ReadResultSet(query_reply, timeout_ms, sampler,
+                                 timestamp_mode)
+    except HttpError as err:
+      msg = http_util.GetHttpErrorResponse(err)
+      logging.error(msg)
+      logging.error(query)
 
-      if 'rows' in query_reply:
-        rows = query_reply['rows']
-      else:
-        rows = []
+      raise BigQueryError(msg, query)
+
+  def InsertQueryJob(self, query):
+    """Starts a query job without waiting for it to complete.
+
+    The results can be retrieved with GetQueryJobResultSet() once the job is
+    done.
+
+    Args:
+      query: The query to issue.
+
+    Returns:
+      The jobReference of the new job, including the jobId.
+    """
+    try:
+      body = {'configuration': {'query': {'query': query}}}
+      logging.info('Inserting BigQuery job for project %s, query:\n\n%s',
+                   self.project_id, query)
+      request = self.service.jobs().insert(projectId=self.project_id,
+                                           body=body)
+      reply = self._ExecuteRequestWithRetries(request)
+
+      return reply['jobReference']
+    except HttpError as err:
+      msg = http_util.GetHttpErrorResponse(err)
+      logging.error(msg)
+      logging.error(query)
+
+      raise BigQueryError(msg, query)
+
+  def CancelJob(self, job_id, project_id=None):
+    """Requests that a job be cancelled.
+
+    Cancellation is asynchronous; BigQuery stops the job shortly after the
+    request, and jobs that are already done are not affected.
+
+    Args:
+      job_id: The id of the job to cancel.
+      project_id: The project that owns the job.  Defaults to the client's
+          project.
+
+    Returns:
+      The state of the job (see BqStates) at the time of the request.
+
+    Raises:
+      BigQueryError: If the job cannot be found, or the request failed.
+    """
+    try:
+      logging.info('Cancelling BigQuery job %s.', job_id)
+      request = self.service.jobs().cancel(
+          projectId=project_id or self.project_id, jobId=job_id)
+      reply = self._ExecuteRequestWithRetries(request)
+
+      return reply.get('job', {}).get('status', {}).get('state')
+    except HttpError as err:
+      msg = http_util.GetHttpErrorResponse(err)
+      logging.error(msg)
 
-      while('rows' in query_reply and
-            len(rows) < int(query_reply['totalRows'])):
+      raise BigQueryError(msg)
+
+  def GetCachedResultSet(self, query, timestamp_mode=None, sampler=None):
+    """Returns the cached results of a query, or None if not cached.
+
+    The base client doesn't have a cache, so this always returns None.
+    """
+    return None
+
+  def GetCachedResultSets(self, queries, timestamp_mode=None):
+    """Returns a dict of cached results, keyed by query.
+
+    The base client doesn't have a cache, so this always returns {}.
+    """
+    return {}
+
+  def GetQueryJobResultSet(self, job_id, timeout=None, timestamp_mode=None,
+                           query=None, cache_duration=None, sampler=None):
+    """Returns the results of a query job, or None if it is still running.
+
+    Args:
+      job_id: The id of a job started by InsertQueryJob().
+      timeout: The length of time (in seconds) to wait for the job to
+          complete before returning None.  Defaults to not waiting.
+      timestamp_mode: One of big_query_result_util.TimestampModes.All(),
+          which determines how TIMESTAMP values are returned.
+      query: The query issued by the job.  Used by subclasses (such as
+          GaeBigQueryClient) to cache the results for later queries.
+      cache_duration: The number of seconds that the results should be
+          cached.  Not used by the base client.
+      sampler: See QueryResultSet.  It is only used once the job is complete.
+
+    Returns:
+      A big_query_result_set.ResultSet, or None if the job is not complete.
+
+    Raises:
+      BigQueryError: If the job failed, or cannot be found.
+    """
+    try:
+      timeout_ms = (timeout or 0) * 1000
+      query_reply = self._ExecuteRequestWithRetries(
+          self.service.jobs().getQueryResults(
+              projectId=self.project_id,
+              jobId=job_id,
+              timeoutMs=timeout_ms))
+
+      if not query_reply.get('jobComplete'):
+        return None
+
+      return self._ReadResultSet(query_reply, timeout_ms, sampler=sampler,
+                                 timestamp_mode=timestamp_mode)
+    except HttpError as err:
+      msg = http_util.GetHttpErrorResponse(err)
+      logging.error(msg)
+
+      raise BigQueryError(msg)
+
+  def QueryResultPage(self, query, start_index, max_results, timeout=None,
+                      timestamp_mode=None, cache_duration=None):
+    """Issues a query, and returns one page of the results.
+
+    Args:
+      query: The query to issue.
+      start_index: The index of the first row to return.
+      max_results: The maximum number of rows to return.
+      timeout: The length of time (in seconds) to wait for the query to
+          complete.
+      timestamp_mode: One of big_query_result_util.TimestampModes.All(),
+          which determines how TIMESTAMP values are returned.
+      cache_duration: The number of seconds that the query should be
+          retained.  Not used by the base client.
+
+    Returns:
+      A big_query_result_set.ResultSet with the rows of the page, or None if
+      the query did not complete within the timeout.  Its metadata holds the
+      totalRows of the full result, and the jobReference of the query, which
+      can be used to read other pages with GetQueryJobPage().
+    """
+    try:
+      timeout_ms = (timeout or DEFAULT_QUERY_TIMEOUT) * 1000
+      # Rows are only useful in the query reply for the first page.
+      query_data = {'query': query, 'timeoutMs': timeout_ms,
+                    'maxResults': 1 if start_index else max_results}
+      logging.info('Executing BigQuery for project %s, query:\n\n%s',
+                   self.project_id, query_data)
+      query_reply = self._ExecuteRequestWithRetries(
+          self.service.jobs().query(projectId=self.project_id,
+                                    body=query_data))
+
+      if 'jobReference' not in query_reply:
+        logging.error('big_query_client.Query() failed: invalid JSON.\n'
+                      'Query Reply:\n%s\n', query_reply)
+        return result_set_lib.ResultSet.FromReply(query_reply)
+
+      rows = query_reply.get('rows') or []
+      if (start_index or not query_reply.get('jobComplete') or
+          len(rows) < min(max_results, int(query_reply['totalRows']))):
+        return self.GetQueryJobPage(
+            query_reply['jobReference']['jobId'], start_index, max_results,
+            timeout=timeout, timestamp_mode=timestamp_mode)
+
+      result = result_set_lib.ResultSet.FromReply(query_reply,
+                                                  include_rows=False)
+      result.AddReplyRows(rows, timestamp_mode)
+      return result
+    except HttpError as err:
+      msg = http_util.GetHttpErrorResponse(err)
+      logging.error(msg)
+      logging.error(query)
+
+      raise BigQueryError(msg, query)
+
+  def GetQueryJobPage(self, job_id, start_index, max_results, timeout=None,
+                      timestamp_mode=None):
+    """Returns one page of the results of a query job.
+
+    The results of completed jobs are retained by BigQuery for about a day,
+    so pages can be read without re-running the query.
+
+    Args:
+      job_id: The id of the query job.
+      start_index: The index of the first row to return.
+      max_results: The maximum number of rows to return.
+      timeout: The length of time (in seconds) to wait for the job to
+          complete.
+      timestamp_mode: One of big_query_result_util.TimestampModes.All(),
+          which determines how TIMESTAMP values are returned.
+
+    Returns:
+      A big_query_result_set.ResultSet with the rows of the page, or None if
+      the job is not complete.  Its metadata holds the totalRows of the full
+      result.
+
+    Raises:
+      BigQueryError: If the job failed, or cannot be found.
+    """
+    try:
+      timeout_ms = (timeout or DEFAULT_QUERY_TIMEOUT) * 1000
+      job_collection = self.service.jobs()
+      result = None
+      rows_fetched = 0
+
+      # A page may be returned in several replies if its rows are large.
+      while result is None or rows_fetched < max_results:
         query_reply = self._ExecuteRequestWithRetries(
             job_collection.getQueryResults(
                 projectId=self.project_id,
-                jobId=job_reference['jobId'],
+                jobId=job_id,
                 timeoutMs=timeout_ms,
-                startIndex=len(rows)))
-        if 'rows' in query_reply:
-          rows += query_reply['rows']
+                startIndex=start_index + rows_fetched,
+                maxResults=max_results - rows_fetched))
+
+        if not query_reply.get('jobComplete'):
+          return None
+
+        rows = query_reply.get('rows') or []
+        if result is None:
+          result = result_set_lib.ResultSet.FromReply(query_reply,
+                                                      include_rows=False)
+        with timing_util.Span('typing'):
+          result.AddReplyRows(rows, timestamp_mode)
+        rows_fetched += len(rows)
+
+        if (not rows or
+            start_index + rows_fetched >= int(query_reply['totalRows'])):
+          break
 
-      query_reply['rows'] = rows
-      result_util.ReplyFormatter.ConvertValuesToTypedData(query_reply)
-      return query_reply
+      return result
     except HttpError as err:
       msg = http_util.GetHttpErrorResponse(err)
       logging.error(msg)
-      logging.error(query)
 
-      raise BigQueryError(msg, query)
+      raise BigQueryError(msg)
+
+  def _ReadResultSet(self, query_reply, timeout_ms, sampler=None,
+                     timestamp_mode=None):
+    """Reads all pages of a completed query into a ResultSet.
+
+    Args:
+      query_reply: The first reply for the job, from jobs.query or
+          jobs.getQueryResults.
+      timeout_ms: The timeout for each additional page request.
+      sampler: See QueryResultSet.
+      timestamp_mode: See QueryResultSet.
+
+    Returns:
+      A big_query_result_set.ResultSet.
+    """
+    job_collection = self.service.jobs()
+    job_reference = query_reply['jobReference']
+    result = result_set_lib.ResultSet.FromReply(query_reply,
+                                                include_rows=False)
+
+    rows = query_reply.get('rows') or []
+    rows_fetched = len(rows)
+
+    if sampler:
+      sampler.Begin(query_reply.get('totalRows', 0))
+      sampler.AddRows(rows)
+    else:
+      with timing_util.Span('typing'):
+        result.AddReplyRows(rows, timestamp_mode)
+
+    while('rows' in query_reply and
+          rows_fetched < int(query_reply['totalRows']) and
+          not (sampler and sampler.IsComplete())):
+      query_reply = self._ExecuteRequestWithRetries(
+          job_collection.getQueryResults(
+              projectId=self.project_id,
+              jobId=job_reference['jobId'],
+              timeoutMs=timeout_ms,
+              startIndex=rows_fetched))
+      if 'rows' in query_reply:
+        rows_fetched += len(query_reply['rows'])
+        if sampler:
+          sampler.AddRows(query_reply['rows'])
+        else:
+          with timing_util.Span('typing'):
+            result.AddReplyRows(query_reply['rows'], timestamp_mode)
+
+    if sampler:
+      with timing_util.Span('typing'):
+        result.AddReplyRows(sampler.GetRows(), timestamp_mode)
+      query_reply['totalRows'] = result.num_rows
+
+    result.metadata = result_set_lib.GetReplyMetadata(query_reply)
+    result.Compact()
+    return result
 
   def CopyTable(self,
                 source_table,
@@ -153,6 +153,20 @@ class BigQueryClientTest(unittest.TestCase):
                      {u'f': [{u'v': 3}, {u'v': u'c'}, {u'v': u'#'}]}]
     self.assertEquals(expected_rows, rows)
 
+  @pytest.mark.integration
+  def testQueryResultPage(self):
+    query = ('SELECT number, letter, symbol '
+             'FROM unit_test_data.query_test '
+             'WHERE number <> 1 '
+             'ORDER BY number')
+    first_page = self.client.QueryResultPage(query, 0, 1)
+    second_page = self.client.GetQueryJobPage(
+        first_page.metadata['jobReference']['jobId'], 1, 1)
+
+    self.assertEquals([(2, u'b', u'@')], list(first_page.IterRows()))
+    self.assertEquals([(3, u'c', u'#')], list(second_page.IterRows()))
+    self.assertEquals('2', second_page.metadata['totalRows'])
+
   @pytest.mark.integration
   def testCopyTable(self):
     table_name = self.AddTempTableRef()
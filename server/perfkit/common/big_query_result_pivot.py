@@ -12,7 +12,7 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 
-Transforms BigQuery data with a single-row/column pivot.
+Transforms BigQuery data with a row/column pivot.
 
 A Pivot transformation lets you take a standard, tabular result set and
 produce a column for each unique value in a specified field.  Pivots are
@@ -42,14 +42,40 @@ date     small     medium     large
 Jan 1    25        35         45
 Feb 1    27        35         52
 
-Note the following restrictions:
-* For efficiency, the result set must be reduced to a single value per row/
-    column.  A TooManyValuesError will be raised if more than one is found.
+Each of the row, column and value settings can also be a list of field names:
+  Rows: Each distinct combination of the row fields appears as a row, with
+      one leading column per row field.
+  Columns: Each distinct combination of the column fields appears as a
+      column, named by joining the values with KEY_SEPARATOR.  A '|' or '\\'
+      in a joined value is escaped with a '\\', so names can't collide.
+  Values: When more than one value field is provided, a column is added for
+      each value field and column key, named 'value|colkey'.  Columns are
+      ordered by value field, then by column key.
+
+For example, row='date', column='size', value=['cost', 'weight'] produces:
+
+date     cost|small  cost|medium  ...  weight|small  weight|medium  ...
+
+By default, the result set must be reduced to a single value per row/column,
+and a DuplicateValueError will be raised if more than one is found.  If an
+aggregation is specified (see Aggregations), duplicate values are combined
+instead.
+
+The pivot runs in two passes over the reply: the first collects the distinct
+row and column values and preallocates a dense row for each, and the second
+fills in the values.  Cells with no matching data have a value of None.
 """
 
 
+import itertools
 import logging
 
+from perfkit.common import big_query_result_set as result_set_lib
+
+
+KEY_SEPARATOR = '|'
+KEY_ESCAPE = '\\'
+
 
 class Error(Exception):
   pass
@@ -59,133 +85,288 @@ class DuplicateValueError(Error):
   pass
 
 
+class Aggregations(object):
+  """Enumerates the supported aggregations for duplicate row/column values.
+
+  None values are ignored by every aggregation other than LAST.
+  """
+
+  SUM = 'sum'
+  AVG = 'avg'
+  MIN = 'min'
+  MAX = 'max'
+  COUNT = 'count'
+  LAST = 'last'
+
+  @classmethod
+  def All(cls):
+    """Returns all known aggregations."""
+    return [cls.SUM, cls.AVG, cls.MIN, cls.MAX, cls.COUNT, cls.LAST]
+
+  @classmethod
+  def GetResultType(cls, aggregation, value_type):
+    """Returns the BigQuery type of an aggregated value.
+
+    Args:
+      aggregation: The aggregation being applied, or None.
+      value_type: The BigQuery type of the values being aggregated.
+
+    Returns:
+      The BigQuery type name for the aggregated column.
+    """
+    if aggregation == cls.COUNT:
+      return 'INTEGER'
+    elif aggregation == cls.AVG:
+      return 'FLOAT'
+    else:
+      return value_type
+
+
 class BigQueryPivotTransformer(object):
   """Transforms a BigQuery reply by pivoting it."""
 
-  def __init__(self, reply, rows_name, columns_name, values_name):
+  def __init__(self, reply, rows_name, columns_name, values_name,
+               aggregation=None):
     """Initializes a new transformer.  See module docstring for a description.
 
     Args:
-      reply: The BigQuery reply object.  A row in the result will appear for
-          each row in the reply.
+      reply: The BigQuery reply object, or a big_query_result_set.ResultSet.
+          A row in the result will appear for each row in the reply.
       rows_name: The column name that will appear as the first column of the
-          Pivot.  The information in this column is copied as-is.
+          Pivot.  The information in this column is copied as-is.  A list of
+          column names can be provided for a composite row key.
       columns_name: Each unique value in this column name will appear as a
-          column in the target.
+          column in the target.  A list of column names can be provided for a
+          composite column key.
       values_name: Each value in this column name will appear in the matching
-          column/row.
+          column/row.  A list of column names can be provided to pivot
+          several values at once.
+      aggregation: One of Aggregations.All(), used to combine values that
+          share a row/column.  If not provided, duplicates raise an error.
+
+    Raises:
+      ValueError: Raised if the aggregation is not supported.
     """
+    if aggregation and aggregation not in Aggregations.All():
+      raise ValueError(
+          'Pivot aggregation "%s" is not supported.' % aggregation)
+
     self.reply = reply
     self.rows_name = rows_name
     self.columns_name = columns_name
     self.values_name = values_name
+    self.rows_names = _GetNameList(rows_name)
+    self.columns_names = _GetNameList(columns_name)
+    self.values_names = _GetNameList(values_name)
+    self.aggregation = aggregation or None
 
     self.transformed_schema = None
     self.transformed_rows = None
+    self.transformed_result = None
 
     self.Initialize()
 
   def Initialize(self):
     self.transformed_schema = {'fields': []}
     self.transformed_rows = []
+    self.transformed_result = None
 
   def Transform(self, modify_reply=True, initialize_first=True):
     """Transforms a BigQuery reply with a pivot.
 
-    Note that the pivot is "ragged", in that rows will only contain values up
-    until the "last" column with data.  This format is acceptable for GViz, and
-    the data will load as though all "missing" columns existed with a value of
-    None.
-
     Args:
-      modify_reply: If True, the 'rows' and 'schema' attributes will be
-          modified by this method.  Otherwise, they are still accessible after
-          Transform() by self.transformed_schema and self.transformed_rows.
+      modify_reply: If True, the 'rows' and 'schema' attributes (or for a
+          ResultSet, the fields and columns) will be modified by this method.
+          Otherwise, they are still accessible after Transform() by
+          self.transformed_schema and self.transformed_result.  For a reply
+          dict, self.transformed_rows also holds the rows in the BigQuery
+          format.
       initialize_first: If True, transformed_schema and _rows will be erased
           before processing begins.
 
     Raises:
-      ValueError: Raised if a column value matches the row name.
+      ValueError: Raised if a pivot field cannot be found.
       DuplicateValueError: Raised if a value already exists for a provided
-          row/column.
+          row/column, and no aggregation was specified.
     """
     if initialize_first:
       self.Initialize()
 
-    rows_field = self.GetColumn(self.reply['schema'], self.rows_name)
-    columns_field = self.GetColumn(self.reply['schema'], self.columns_name)
-    values_field = self.GetColumn(self.reply['schema'], self.values_name)
+    if isinstance(self.reply, result_set_lib.ResultSet):
+      result_set = self.reply
+    else:
+      result_set = result_set_lib.ResultSet.FromReply(self.reply)
+
+    schema = {'fields': result_set.fields}
+    fields = result_set.fields
+    columns = result_set.columns
 
+    rows_fields = [self.GetColumn(schema, name) for name in self.rows_names]
+    columns_fields = [self.GetColumn(schema, name)
+                      for name in self.columns_names]
+    values_fields = [self.GetColumn(schema, name)
+                     for name in self.values_names]
+
+    row_key_column = _GetKeyColumn(
+        columns, [fields.index(field) for field in rows_fields])
+    column_key_column = _GetKeyColumn(
+        columns, [fields.index(field) for field in columns_fields])
+    values_columns = [columns[fields.index(field)] for field in values_fields]
+
+    # First pass: collect the distinct row and column keys, in order.
     row_headers = {}
-    row_count = 0
+    row_keys = []
     column_headers = {}
-    column_count = 0
-
-    source_rows_field_index = self.reply['schema']['fields'].index(
-        rows_field)
-    source_columns_field_index = self.reply['schema']['fields'].index(
-        columns_field)
-    source_values_field_index = self.reply['schema']['fields'].index(
-        values_field)
-
-    self.AddPivotField(
-        field_name=rows_field['name'],
-        field_type=rows_field['type'],
-        field_mode=rows_field['mode'])
-
-    for data_row in self.reply['rows']:
-      row_name = data_row['f'][source_rows_field_index]['v']
-      column_name = data_row['f'][source_columns_field_index]['v']
-      value = data_row['f'][source_values_field_index]['v']
-
-      # Find or create the row entry matching the current value.
-      if row_name in row_headers:
-        row_index = row_headers[row_name]
-        row = self.transformed_rows[row_index]
-      else:
-        row = {'f': [{'v': row_name}]}
-        self.transformed_rows.append(row)
-        row_index = row_count
-        row_headers[row_name] = row_count
-        row_count += 1
-
-      # Find or create the column entry matching the current value.
-      if column_name in column_headers:
-        column_index = column_headers[column_name]
-      else:
+    column_keys = []
+
+    for row_key, column_key in itertools.izip(row_key_column,
+                                              column_key_column):
+      if row_key not in row_headers:
+        row_headers[row_key] = len(row_keys)
+        row_keys.append(row_key)
+
+      if column_key not in column_headers:
+        column_headers[column_key] = len(column_keys)
+        column_keys.append(column_key)
+
+    for rows_field in rows_fields:
+      self.AddPivotField(
+          field_name=rows_field['name'],
+          field_type=rows_field['type'],
+          field_mode=rows_field['mode'])
+
+    column_names = [_GetColumnName(column_key, len(columns_fields))
+                    for column_key in column_keys]
+    for values_field in values_fields:
+      value_type = Aggregations.GetResultType(
+          self.aggregation, values_field['type'])
+
+      for column_key, column_name in zip(column_keys, column_names):
+        if len(values_fields) > 1:
+          if len(columns_fields) == 1:
+            column_key = (column_key,)
+          column_name = _JoinKey((values_field['name'],) + column_key)
+
         self.AddPivotField(
             field_name=column_name,
-            field_type=values_field['type'],
+            field_type=value_type,
             field_mode='NULLABLE')
-        column_index = column_count + 1
-        column_headers[column_name] = column_index
-        column_count += 1
-
-      # If a 'column' value is the same as the 'row' heading, raise an error.
-      if column_index == 0:
-        raise ValueError(
-            'Column value \'%s\' is the same as the row heading name.'
-            % column_name)
-
-      # If there aren't enough values in the current row, add empty values.
-      while column_index > (len(self.transformed_rows[row_index]['f']) - 1):
-        self.transformed_rows[row_index]['f'].append({'v': None})
-
-      # If the target cell already has a value, throw an error.
-      if self.transformed_rows[row_index]['f'][column_index]['v']:
+
+    # Second pass: fill a dense, preallocated grid of values for each value
+    # field.  Cells are shared by position, so counts tracks duplicates for
+    # all value fields.
+    column_count = len(column_keys)
+    cell_count = len(row_keys) * column_count
+    values_grids = [[None] * cell_count for _ in values_fields]
+    counts_grids = [[0] * cell_count if self.aggregation else None
+                    for _ in values_fields]
+    filled = [False] * cell_count
+
+    for row_index, (row_key, column_key) in enumerate(
+        itertools.izip(row_key_column, column_key_column)):
+      cell_index = (row_headers[row_key] * column_count +
+                    column_headers[column_key])
+
+      if filled[cell_index] and not self.aggregation:
         msg = (
             'Pivot failed: value already exists at row "%s", col "%s". '
             'Pivots require data to be pre-aggregated; each row/col combination '
-            'can only appear once.' % (row_name, column_name))
+            'can only appear once.' % (row_key, column_key))
         logging.error(msg)
         raise DuplicateValueError(msg)
+      filled[cell_index] = True
+
+      for value_index, values_column in enumerate(values_columns):
+        value = values_column[row_index]
+
+        if self.aggregation:
+          self._AggregateValue(values_grids[value_index],
+                               counts_grids[value_index], cell_index, value)
+        else:
+          values_grids[value_index][cell_index] = value
+
+    for value_index in xrange(len(values_grids)):
+      values_grids[value_index] = self._FinalizeValues(
+          values_grids[value_index], counts_grids[value_index])
+
+    # The grids are row-major, so each output column is a strided slice.
+    if len(rows_fields) == 1:
+      transformed_columns = [row_keys]
+    else:
+      transformed_columns = [list(values) for values in zip(*row_keys)] or [
+          [] for _ in rows_fields]
+
+    for values in values_grids:
+      for column_index in xrange(column_count):
+        transformed_columns.append(values[column_index::column_count])
+
+    self.transformed_result = result_set_lib.ResultSet(
+        fields=self.transformed_schema['fields'],
+        columns=transformed_columns,
+        metadata=result_set.metadata)
+
+    if isinstance(self.reply, result_set_lib.ResultSet):
+      if modify_reply:
+        self.reply.fields = self.transformed_result.fields
+        self.reply.columns = self.transformed_result.columns
+    else:
+      self.transformed_rows = self.transformed_result.GetReplyRows()
+
+      if modify_reply:
+        self.reply['schema'] = self.transformed_schema
+        self.reply['rows'] = self.transformed_rows
+
+  def _FinalizeValues(self, values, counts):
+    """Returns the final cell values once all values have been aggregated.
+
+    Args:
+      values: The flat list of cell values.
+      counts: The flat list of non-null value counts for each cell.
+
+    Returns:
+      The flat list of cell values.
+    """
+    if self.aggregation == Aggregations.AVG:
+      for cell_index in xrange(len(values)):
+        if counts[cell_index]:
+          values[cell_index] = float(values[cell_index]) / counts[cell_index]
+    elif self.aggregation == Aggregations.COUNT:
+      return counts
+
+    return values
+
+  def _AggregateValue(self, values, counts, cell_index, value):
+    """Combines a value into the specified cell using self.aggregation.
+
+    For AVG, values holds the running sum until Transform() divides it.  For
+    COUNT, counts holds the result.
+
+    Args:
+      values: The flat list of cell values.
+      counts: The flat list of non-null value counts for each cell.
+      cell_index: The position of the cell in values and counts.
+      value: The value to combine.
+    """
+    if self.aggregation == Aggregations.LAST:
+      values[cell_index] = value
+      counts[cell_index] = 1
+      return
+
+    if value is None:
+      return
+
+    current = values[cell_index]
 
-      # Set the value of the target cell.
-      self.transformed_rows[row_index]['f'][column_index]['v'] = value
+    if not counts[cell_index]:
+      values[cell_index] = value
+    elif self.aggregation in (Aggregations.SUM, Aggregations.AVG):
+      values[cell_index] = current + value
+    elif self.aggregation == Aggregations.MIN:
+      values[cell_index] = min(current, value)
+    elif self.aggregation == Aggregations.MAX:
+      values[cell_index] = max(current, value)
 
-    if modify_reply:
-      self.reply['schema'] = self.transformed_schema
-      self.reply['rows'] = self.transformed_rows
+    counts[cell_index] += 1
 
   def GetColumn(self, schema, field_name):
     """Returns a BQ column reference from transformed_schema.
@@ -228,3 +409,44 @@ class BigQueryPivotTransformer(object):
     self.transformed_schema['fields'].append(field)
 
     return field
+
+
+def _GetNameList(names):
+  """Returns names as a list, wrapping a single name if necessary."""
+  if isinstance(names, (list, tuple)):
+    return list(names)
+  return [names]
+
+
+def _GetKeyColumn(columns, indexes):
+  """Returns the (possibly composite) key of each row.
+
+  Single-field keys are returned as the bare column so that the common case
+  avoids building a tuple per row.
+
+  Args:
+    columns: The list of columns of the result set.
+    indexes: A list of field positions that make up the key.
+
+  Returns:
+    A sequence with the key for each row.
+  """
+  if len(indexes) == 1:
+    return columns[indexes[0]]
+
+  return zip(*[columns[index] for index in indexes])
+
+
+def _GetColumnName(column_key, field_count):
+  """Returns the output column name for a (possibly composite) column key."""
+  if field_count == 1:
+    return column_key
+
+  return _JoinKey(column_key)
+
+
+def _JoinKey(values):
+  """Joins key values with KEY_SEPARATOR, escaping it within the values."""
+  return KEY_SEPARATOR.join(
+      [unicode(value).replace(KEY_ESCAPE, KEY_ESCAPE * 2).replace(
+          KEY_SEPARATOR, KEY_ESCAPE + KEY_SEPARATOR) for value in values])
@@ -18,6 +18,7 @@ Tests for big_query_result_pivot.
 import unittest
 
 import big_query_result_pivot
+from perfkit.common import big_query_result_set
 
 
 class BigQueryResultPivotTest(unittest.TestCase):
@@ -93,6 +94,201 @@ class BigQueryResultPivotTest(unittest.TestCase):
     self.assertListEqual(
         pivot.transformed_rows, expected_rows)
 
+  def _GetDuplicateReply(self):
+    return {
+        'schema': {'fields': [
+            {'name': 'date', 'type': 'STRING', 'mode': 'REQUIRED'},
+            {'name': 'size', 'type': 'STRING', 'mode': 'REQUIRED'},
+            {'name': 'cost', 'type': 'INTEGER', 'mode': 'NULLABLE'}
+        ]},
+        'rows': [
+            {'f': [{'v': 'Jan 1'}, {'v': 'small'}, {'v': 25}]},
+            {'f': [{'v': 'Jan 1'}, {'v': 'small'}, {'v': 35}]},
+            {'f': [{'v': 'Jan 1'}, {'v': 'large'}, {'v': None}]},
+            {'f': [{'v': 'Feb 1'}, {'v': 'large'}, {'v': 52}]},
+        ]
+    }
+
+  def testTransformWithDuplicateZeroValues(self):
+    reply = {
+        'schema': {'fields': [
+            {'name': 'date', 'type': 'STRING', 'mode': 'REQUIRED'},
+            {'name': 'size', 'type': 'STRING', 'mode': 'REQUIRED'},
+            {'name': 'cost', 'type': 'INTEGER', 'mode': 'REQUIRED'}
+        ]},
+        'rows': [
+            {'f': [{'v': 'Jan 1'}, {'v': 'small'}, {'v': 0}]},
+            {'f': [{'v': 'Jan 1'}, {'v': 'small'}, {'v': 25}]},
+        ]
+    }
+
+    pivot = big_query_result_pivot.BigQueryPivotTransformer(
+        reply=reply, rows_name='date', columns_name='size', values_name='cost')
+    self.assertRaises(big_query_result_pivot.DuplicateValueError,
+                      pivot.Transform)
+
+  def testTransformDenseRows(self):
+    reply = self._GetDuplicateReply()
+    reply['rows'] = [reply['rows'][0], reply['rows'][3]]
+
+    pivot = big_query_result_pivot.BigQueryPivotTransformer(
+        reply=reply, rows_name='date', columns_name='size', values_name='cost')
+    pivot.Transform()
+
+    self.assertListEqual(
+        [{'f': [{'v': 'Jan 1'}, {'v': 25}, {'v': None}]},
+         {'f': [{'v': 'Feb 1'}, {'v': None}, {'v': 52}]}],
+        reply['rows'])
+
+  def testTransformUnsupportedAggregation(self):
+    self.assertRaises(
+        ValueError, big_query_result_pivot.BigQueryPivotTransformer,
+        reply=self._GetDuplicateReply(), rows_name='date',
+        columns_name='size', values_name='cost', aggregation='median')
+
+  def testTransformWithAggregations(self):
+    expected_values = {
+        'sum': ([60, None], [None, 52], 'INTEGER'),
+        'avg': ([30.0, None], [None, 52.0], 'FLOAT'),
+        'min': ([25, None], [None, 52], 'INTEGER'),
+        'max': ([35, None], [None, 52], 'INTEGER'),
+        'count': ([2, 0], [0, 1], 'INTEGER'),
+        'last': ([35, None], [None, 52], 'INTEGER'),
+    }
+
+    for aggregation, expected in expected_values.iteritems():
+      reply = self._GetDuplicateReply()
+      pivot = big_query_result_pivot.BigQueryPivotTransformer(
+          reply=reply, rows_name='date', columns_name='size',
+          values_name='cost', aggregation=aggregation)
+      pivot.Transform()
+
+      actual_values = [[cell['v'] for cell in row['f'][1:]]
+                       for row in reply['rows']]
+      self.assertListEqual([expected[0], expected[1]], actual_values,
+                           aggregation)
+      self.assertEqual(expected[2], reply['schema']['fields'][1]['type'])
+
+  def _GetCompositeReply(self):
+    return {
+        'schema': {'fields': [
+            {'name': 'machine', 'type': 'STRING', 'mode': 'NULLABLE'},
+            {'name': 'zone', 'type': 'STRING', 'mode': 'NULLABLE'},
+            {'name': 'metric', 'type': 'STRING', 'mode': 'NULLABLE'},
+            {'name': 'avg', 'type': 'FLOAT', 'mode': 'NULLABLE'},
+            {'name': 'p99', 'type': 'FLOAT', 'mode': 'NULLABLE'}
+        ]},
+        'rows': [
+            {'f': [{'v': 'n1-4'}, {'v': 'us'}, {'v': 'cpu'}, {'v': 1.0},
+                   {'v': 2.0}]},
+            {'f': [{'v': 'n1-4'}, {'v': 'eu'}, {'v': 'cpu'}, {'v': 3.0},
+                   {'v': 4.0}]},
+            {'f': [{'v': 'n1-8'}, {'v': 'us'}, {'v': 'cpu'}, {'v': 5.0},
+                   {'v': 6.0}]},
+        ]
+    }
+
+  def testTransformCompositeRowsAndColumns(self):
+    reply = self._GetCompositeReply()
+
+    pivot = big_query_result_pivot.BigQueryPivotTransformer(
+        reply=reply, rows_name=['machine', 'metric'], columns_name=['zone'],
+        values_name='avg')
+    pivot.Transform()
+
+    self.assertListEqual(
+        ['machine', 'metric', 'us', 'eu'],
+        [field['name'] for field in reply['schema']['fields']])
+    self.assertListEqual(
+        [{'f': [{'v': 'n1-4'}, {'v': 'cpu'}, {'v': 1.0}, {'v': 3.0}]},
+         {'f': [{'v': 'n1-8'}, {'v': 'cpu'}, {'v': 5.0}, {'v': None}]}],
+        reply['rows'])
+
+  def testTransformCompositeColumns(self):
+    reply = self._GetCompositeReply()
+
+    pivot = big_query_result_pivot.BigQueryPivotTransformer(
+        reply=reply, rows_name='machine', columns_name=['zone', 'metric'],
+        values_name='p99')
+    pivot.Transform()
+
+    self.assertListEqual(
+        ['machine', 'us|cpu', 'eu|cpu'],
+        [field['name'] for field in reply['schema']['fields']])
+    self.assertListEqual(
+        [{'f': [{'v': 'n1-4'}, {'v': 2.0}, {'v': 4.0}]},
+         {'f': [{'v': 'n1-8'}, {'v': 6.0}, {'v': None}]}],
+        reply['rows'])
+
+  def testTransformCompositeColumnsEscapesSeparator(self):
+    reply = self._GetCompositeReply()
+    reply['rows'] = [
+        {'f': [{'v': 'n1-4'}, {'v': 'us|cpu'}, {'v': 'x'}, {'v': 1.0},
+               {'v': 2.0}]},
+        {'f': [{'v': 'n1-4'}, {'v': 'us'}, {'v': 'cpu|x'}, {'v': 3.0},
+               {'v': 4.0}]},
+        {'f': [{'v': 'n1-4'}, {'v': 'us\\'}, {'v': 'cpu'}, {'v': 5.0},
+               {'v': 6.0}]},
+    ]
+
+    pivot = big_query_result_pivot.BigQueryPivotTransformer(
+        reply=reply, rows_name='machine', columns_name=['zone', 'metric'],
+        values_name=['avg', 'p99'])
+    pivot.Transform()
+
+    self.assertListEqual(
+        ['machine', 'avg|us\\|cpu|x', 'avg|us|cpu\\|x', 'avg|us\\\\|cpu',
+         'p99|us\\|cpu|x', 'p99|us|cpu\\|x', 'p99|us\\\\|cpu'],
+        [field['name'] for field in reply['schema']['fields']])
+
+  def testTransformMultipleValues(self):
+    reply = self._GetCompositeReply()
+
+    pivot = big_query_result_pivot.BigQueryPivotTransformer(
+        reply=reply, rows_name='machine', columns_name='zone',
+        values_name=['avg', 'p99'])
+    pivot.Transform()
+
+    self.assertListEqual(
+        ['machine', 'avg|us', 'avg|eu', 'p99|us', 'p99|eu'],
+        [field['name'] for field in reply['schema']['fields']])
+    self.assertListEqual(
+        [{'f': [{'v': 'n1-4'}, {'v': 1.0}, {'v': 3.0}, {'v': 2.0},
+                {'v': 4.0}]},
+         {'f': [{'v': 'n1-8'}, {'v': 5.0}, {'v': None}, {'v': 6.0},
+                {'v': None}]}],
+        reply['rows'])
+
+  def testTransformMultipleValuesWithAggregation(self):
+    reply = self._GetCompositeReply()
+
+    pivot = big_query_result_pivot.BigQueryPivotTransformer(
+        reply=reply, rows_name='metric', columns_name='zone',
+        values_name=['avg', 'p99'], aggregation='max')
+    pivot.Transform()
+
+    self.assertListEqual(
+        [{'f': [{'v': 'cpu'}, {'v': 5.0}, {'v': 3.0}, {'v': 6.0},
+                {'v': 4.0}]}],
+        reply['rows'])
+
+
+  def testTransformResultSet(self):
+    result = big_query_result_set.ResultSet.FromReply(
+        self._GetCompositeReply())
+
+    pivot = big_query_result_pivot.BigQueryPivotTransformer(
+        reply=result, rows_name='machine', columns_name='zone',
+        values_name=['avg', 'p99'])
+    pivot.Transform()
+
+    self.assertListEqual(
+        ['machine', 'avg|us', 'avg|eu', 'p99|us', 'p99|eu'],
+        [field['name'] for field in result.fields])
+    self.assertListEqual(
+        [('n1-4', 1.0, 3.0, 2.0, 4.0), ('n1-8', 5.0, None, 6.0, None)],
+        list(result.IterRows()))
+
 
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,208 @@
+"""Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Streaming samplers for BigQuery results.
+
+Samplers receive the rows of a query one page at a time (see
+BigQueryClient.Query), and retain only the rows that will appear in the
+sample.  This means that a large result never has to be fully materialized
+in memory to be downsampled.
+
+Two strategies are provided:
+  ReservoirSampler: A uniform random sample of max_results rows, using
+      Algorithm L (Li, 1994).  A consistent seed is used so refreshing a graph
+      doesn't change the graph.
+  StrideSampler: A deterministic sample that keeps every Nth row.  Since the
+      stride is known once totalRows is known, paging stops as soon as the
+      sample is full.
+
+In both cases, retained rows are returned in their original order.
+"""
+
+import math
+import random
+
+
+# A seed value used for doing random sampling.  We want to use a consistent
+# seed so refreshing a graph doesn't change the graph.
+RANDOM_SAMPLE_SEED = 0.8591313996314685
+
+
+class Error(Exception):
+  pass
+
+
+class SamplingError(Error):
+  pass
+
+
+class ResultSampler(object):
+  """Base class for samplers that consume query results page by page.
+
+  Subclasses implement _AddRow, and optionally override IsComplete.
+  """
+
+  def __init__(self, max_results):
+    """Initializes the sampler.
+
+    Args:
+      max_results: integer, The maximum number of rows to retain.  This should
+          be a non negative integer.
+
+    Raises:
+      SamplingError: If max_results is less than 0.
+    """
+    if max_results < 0:
+      raise SamplingError(
+          'The max_results to return from sampling must be non-negative.  '
+          'Instead it was %s.' % max_results)
+
+    self.max_results = int(max_results)
+    self.total_rows = None
+    self.rows_seen = 0
+    self._retained = []
+
+  def Begin(self, total_rows):
+    """Called once the total number of rows in the result is known.
+
+    Args:
+      total_rows: integer, The number of rows in the full result.
+    """
+    self.total_rows = int(total_rows)
+
+  def AddRows(self, rows):
+    """Adds a page of rows to the sampler.
+
+    Args:
+      rows: A list of rows, in result order.
+    """
+    for row in rows:
+      self._AddRow(self.rows_seen, row)
+      self.rows_seen += 1
+
+  def IsComplete(self):
+    """Returns True if no further rows can change the sample."""
+    return (self.total_rows is not None and
+            self.rows_seen >= self.total_rows)
+
+  def GetRows(self):
+    """Returns the retained rows, in the order they were provided."""
+    self._retained.sort(key=lambda entry: entry[0])
+    return [entry[1] for entry in self._retained]
+
+  def GetCacheKey(self):
+    """Returns a string that distinguishes this sample for caching purposes."""
+    return '%s:%s' % (self.__class__.__name__, self.max_results)
+
+  def _AddRow(self, index, row):
+    raise NotImplementedError()
+
+
+class ReservoirSampler(ResultSampler):
+  """Retains a uniform random sample of rows, using Algorithm L.
+
+  Algorithm L draws the number of rows to skip between replacements, rather
+  than a random number per row, so the cost is O(k(1 + log(n/k))) random draws
+  for a sample of k rows from n.
+  """
+
+  def __init__(self, max_results, seed=RANDOM_SAMPLE_SEED):
+    """Initializes the sampler.
+
+    Args:
+      max_results: integer, The number of rows to retain.
+      seed: The seed for the random number generator.
+    """
+    super(ReservoirSampler, self).__init__(max_results)
+    self.seed = seed
+    self._random = random.Random(seed)
+    self._weight = None
+    self._next_index = None
+
+  def _RandomUnit(self):
+    """Returns a random float in the open interval (0, 1)."""
+    value = 0.0
+    while value == 0.0:
+      value = self._random.random()
+    return value
+
+  def _AdvanceWeight(self):
+    self._weight *= math.exp(math.log(self._RandomUnit()) / self.max_results)
+
+  def _AdvanceNextIndex(self, index):
+    if self._weight >= 1.0:
+      self._next_index = index + 1
+      return
+
+    skip = math.floor(math.log(self._RandomUnit()) /
+                      math.log(1.0 - self._weight))
+    self._next_index = index + int(skip) + 1
+
+  def _AddRow(self, index, row):
+    if index < self.max_results:
+      self._retained.append((index, row))
+
+      if index == self.max_results - 1:
+        self._weight = 1.0
+        self._AdvanceWeight()
+        self._AdvanceNextIndex(index)
+      return
+
+    if index == self._next_index:
+      self._retained[self._random.randrange(self.max_results)] = (index, row)
+      self._AdvanceWeight()
+      self._AdvanceNextIndex(index)
+
+  def GetCacheKey(self):
+    return '%s:%s' % (super(ReservoirSampler, self).GetCacheKey(), self.seed)
+
+
+class StrideSampler(ResultSampler):
+  """Retains every Nth row, where N is chosen to return max_results rows.
+
+  Begin() must be called before rows are added, as the stride depends on the
+  total number of rows.
+  """
+
+  def __init__(self, max_results):
+    super(StrideSampler, self).__init__(max_results)
+    self.stride = None
+
+  def Begin(self, total_rows):
+    super(StrideSampler, self).Begin(total_rows)
+
+    if self.max_results == 0:
+      self.stride = None
+    elif self.total_rows <= self.max_results:
+      self.stride = 1.0
+    else:
+      self.stride = float(self.total_rows) / self.max_results
+
+  def _AddRow(self, index, row):
+    if self.total_rows is None:
+      raise SamplingError('Begin() must be called before adding rows.')
+
+    if self.IsComplete():
+      return
+
+    # Keep the row at each multiple of the stride, starting with the first.
+    if int(len(self._retained) * self.stride) == index:
+      self._retained.append((index, row))
+
+  def IsComplete(self):
+    if self.total_rows is None:
+      return False
+
+    return (len(self._retained) >= self.max_results or
+            super(StrideSampler, self).IsComplete())
@@ -0,0 +1,96 @@
+"""Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Tests for big_query_result_sampler.
+"""
+
+import unittest
+
+import big_query_result_sampler as sampler_lib
+
+
+def _AddPages(sampler, rows, page_size):
+  """Feeds rows to the sampler in pages, stopping when it is complete."""
+  sampler.Begin(len(rows))
+  for start in xrange(0, len(rows), page_size):
+    if sampler.IsComplete():
+      break
+    sampler.AddRows(rows[start:start + page_size])
+
+
+class ReservoirSamplerTest(unittest.TestCase):
+
+  def testNegativeMaxResults(self):
+    self.assertRaises(sampler_lib.SamplingError,
+                      sampler_lib.ReservoirSampler, -1)
+
+  def testFewerRowsThanMax(self):
+    sampler = sampler_lib.ReservoirSampler(10)
+    _AddPages(sampler, range(5), 2)
+
+    self.assertEqual(range(5), sampler.GetRows())
+
+  def testSampleSize(self):
+    sampler = sampler_lib.ReservoirSampler(10)
+    _AddPages(sampler, range(1000), 100)
+
+    rows = sampler.GetRows()
+    self.assertEqual(10, len(rows))
+    self.assertEqual(sorted(set(rows)), rows)
+
+  def testRepeatable(self):
+    first = sampler_lib.ReservoirSampler(10)
+    _AddPages(first, range(1000), 100)
+
+    second = sampler_lib.ReservoirSampler(10)
+    _AddPages(second, range(1000), 7)
+
+    self.assertEqual(first.GetRows(), second.GetRows())
+
+  def testReadsAllPages(self):
+    sampler = sampler_lib.ReservoirSampler(10)
+    _AddPages(sampler, range(1000), 100)
+
+    self.assertEqual(1000, sampler.rows_seen)
+
+
+class StrideSamplerTest(unittest.TestCase):
+
+  def testRequiresBegin(self):
+    sampler = sampler_lib.StrideSampler(10)
+    self.assertRaises(sampler_lib.SamplingError, sampler.AddRows, [1])
+
+  def testFewerRowsThanMax(self):
+    sampler = sampler_lib.StrideSampler(10)
+    _AddPages(sampler, range(5), 2)
+
+    self.assertEqual(range(5), sampler.GetRows())
+
+  def testStride(self):
+    sampler = sampler_lib.StrideSampler(4)
+    _AddPages(sampler, range(10), 3)
+
+    self.assertEqual([0, 2, 5, 7], sampler.GetRows())
+
+  def testStopsEarly(self):
+    sampler = sampler_lib.StrideSampler(4)
+    _AddPages(sampler, range(100), 10)
+
+    self.assertEqual([0, 25, 50, 75], sampler.GetRows())
+    self.assertTrue(sampler.IsComplete())
+    self.assertEqual(80, sampler.rows_seen)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,243 @@
+"""Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+A compact, column-oriented representation of query results.
+
+BigQuery replies store every cell as a dict inside a dict:
+    {'schema': {'fields': [{'name': 'col1', ...}, {'name': 'col2', ...}]},
+     'rows': [{'f': [{'v': 'foo'}, {'v': 1.5}]}]}
+
+A ResultSet holds the same data as one list per column:
+    ResultSet(fields=[{'name': 'col1', ...}, {'name': 'col2', ...}],
+              columns=[['foo'], [1.5]])
+
+which needs a fraction of the memory per row, and pickles (for memcache) to a
+fraction of the size.  Numeric columns without nulls can be further packed
+into array.array's with Compact().  The result clients produce ResultSets
+(see BigQueryClient.QueryResultSet), the pivot, statistics and formatters
+consume them, and ToReply() converts back to the BigQuery JSON format at the
+API edge.
+
+Any other entries of the reply (totalRows, jobReference, etc.) are kept in
+the metadata dict, and returned as-is by ToReply().
+
+Clients that read a result from their cache set its cache_hit to True.  It
+isn't part of the pickled state, so it only describes how the result was read
+by the current request.
+"""
+
+import array
+import itertools
+import logging
+
+from perfkit.common import big_query_result_util as result_util
+
+
+# Typecodes used by Compact() for numeric columns without nulls.
+ARRAY_TYPECODES = {
+    result_util.FieldTypes.INTEGER: 'l',
+    result_util.FieldTypes.FLOAT: 'd'}
+
+
+class ResultSet(object):
+  """Query results stored as a schema and a list of values per column."""
+
+  __slots__ = ('fields', 'columns', 'metadata', 'cache_hit')
+
+  def __init__(self, fields=None, columns=None, metadata=None):
+    """Initializes a new result set.
+
+    Args:
+      fields: A list of BigQuery field definitions.  None indicates that the
+          source reply had no schema.
+      columns: A list of value sequences, one per field.  If not provided,
+          each column is empty.
+      metadata: A dict of other reply entries, such as totalRows.
+    """
+    self.fields = fields
+    self.columns = (columns if columns is not None
+                    else [[] for _ in fields or []])
+    self.metadata = metadata if metadata is not None else {}
+    self.cache_hit = False
+
+  def __getstate__(self):
+    return (self.fields, self.columns, self.metadata)
+
+  def __setstate__(self, state):
+    self.fields, self.columns, self.metadata = state
+    self.cache_hit = False
+
+  def __len__(self):
+    return self.num_rows
+
+  @property
+  def num_rows(self):
+    """The number of rows in the result."""
+    if not self.columns:
+      return 0
+    return len(self.columns[0])
+
+  @classmethod
+  def FromReply(cls, reply, include_rows=True):
+    """Returns a ResultSet for a BigQuery reply.  Values are copied as-is.
+
+    Args:
+      reply: The BigQuery reply object.
+      include_rows: If False, only the schema and metadata are copied.
+    """
+    schema = reply.get('schema')
+    fields = schema['fields'] if schema else None
+    metadata = GetReplyMetadata(reply)
+
+    result = cls(fields=fields, metadata=metadata)
+    if include_rows:
+      result.AddReplyRows(reply.get('rows') or [], typed=False)
+
+    return result
+
+  def GetFieldIndex(self, field_name):
+    """Returns the position of field_name in the schema.
+
+    Raises:
+      ValueError: Raised if field_name cannot be found.
+    """
+    for index, field in enumerate(self.fields or []):
+      if field['name'] == field_name:
+        return index
+
+    raise ValueError('Field name "%s" not found in result.' % field_name)
+
+  def GetColumn(self, field_name):
+    """Returns the values for field_name.  See GetFieldIndex for errors."""
+    return self.columns[self.GetFieldIndex(field_name)]
+
+  def AddRows(self, rows):
+    """Appends rows, each provided as a sequence of values in schema order."""
+    for index, column in enumerate(self.columns):
+      column.extend([row[index] for row in rows])
+
+  def AddReplyRows(self, rows, timestamp_mode=None, typed=True):
+    """Appends rows in the BigQuery format ({'f': [{'v': value}]}).
+
+    Args:
+      rows: A list of BigQuery reply rows.
+      timestamp_mode: One of big_query_result_util.TimestampModes.All(),
+          used when converting TIMESTAMP values.
+      typed: If True, the string values returned by BigQuery are converted
+          to typed values (see big_query_result_util.GetTypedValue).
+    """
+    if not rows:
+      return
+
+    if self.fields is None:
+      logging.warning(
+          'schema was not defined in the reply, see bug 8854364.')
+      typed = False
+      if not self.columns:
+        self.columns = [[] for _ in rows[0]['f']]
+
+    for index, column in enumerate(self.columns):
+      if typed:
+        field_type = self.fields[index]['type']
+        column.extend([
+            result_util.GetTypedValue(field_type, row['f'][index]['v'],
+                                      timestamp_mode)
+            for row in rows])
+      else:
+        column.extend([row['f'][index]['v'] for row in rows])
+
+  def Copy(self):
+    """Returns a copy that can be transformed without changing this result.
+
+    Transforms replace columns rather than modifying them, so the column
+    values are shared with the copy.
+    """
+    result = ResultSet(fields=self.fields, columns=list(self.columns),
+                       metadata=dict(self.metadata))
+    result.cache_hit = self.cache_hit
+
+    return result
+
+  def Sort(self, field_name, descending=False):
+    """Orders the rows by the values of a field.
+
+    Nulls are ordered as the lowest values.  Rows with equal values keep
+    their relative order.
+
+    Raises:
+      ValueError: Raised if field_name cannot be found.
+    """
+    sort_column = self.GetColumn(field_name)
+    order = sorted(xrange(len(sort_column)), key=sort_column.__getitem__,
+                   reverse=descending)
+
+    self.columns = [[column[index] for index in order]
+                    for column in self.columns]
+
+  def Slice(self, offset, limit=None):
+    """Keeps only the rows in the range [offset, offset + limit).
+
+    Args:
+      offset: The index of the first row to keep.
+      limit: The maximum number of rows to keep.  If not provided, all rows
+          after offset are kept.
+    """
+    end = offset + limit if limit is not None else None
+    self.columns = [column[offset:end] for column in self.columns]
+
+  def ClearRows(self):
+    """Removes all rows, leaving the schema and metadata."""
+    self.columns = [[] for _ in self.columns]
+
+  def IterRows(self):
+    """Returns an iterator over the rows, each as a tuple of values."""
+    return itertools.izip(*self.columns)
+
+  def GetReplyRows(self):
+    """Returns the rows in the BigQuery format ({'f': [{'v': value}]})."""
+    return [{'f': [{'v': value} for value in row]}
+            for row in self.IterRows()]
+
+  def ToReply(self):
+    """Returns the result set as a BigQuery reply object."""
+    reply = dict(self.metadata)
+    if self.fields is not None:
+      reply['schema'] = {'fields': self.fields}
+    reply['rows'] = self.GetReplyRows()
+
+    return reply
+
+  def Compact(self):
+    """Packs INTEGER and FLOAT columns without nulls into array.array's.
+
+    Columns with nulls, or values that do not fit the array type, are left
+    as lists.
+    """
+    for index, field in enumerate(self.fields or []):
+      typecode = ARRAY_TYPECODES.get(field['type'])
+      column = self.columns[index]
+
+      if not typecode or isinstance(column, array.array) or None in column:
+        continue
+
+      try:
+        self.columns[index] = array.array(typecode, column)
+      except (TypeError, OverflowError):
+        pass
+
+
+def GetReplyMetadata(reply):
+  """Returns the entries of a BigQuery reply other than schema and rows."""
+  return dict((key, value) for key, value in reply.iteritems()
+              if key not in ('schema', 'rows'))
@@ -0,0 +1,131 @@
+"""Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Tests for big_query_result_set.
+"""
+
+import array
+import cPickle
+import unittest
+
+import big_query_result_set as result_set_lib
+
+
+def _GetReply():
+  return {
+      'totalRows': '2',
+      'jobReference': {'jobId': 'job1'},
+      'schema': {'fields': [
+          {'name': 'zone', 'type': 'STRING', 'mode': 'NULLABLE'},
+          {'name': 'cost', 'type': 'INTEGER', 'mode': 'NULLABLE'},
+          {'name': 'speed', 'type': 'FLOAT', 'mode': 'NULLABLE'}
+      ]},
+      'rows': [
+          {'f': [{'v': 'us-a'}, {'v': '25'}, {'v': '1.5'}]},
+          {'f': [{'v': 'eu-b'}, {'v': '27'}, {'v': None}]},
+      ]
+  }
+
+
+class ResultSetTest(unittest.TestCase):
+
+  def testFromReplyRoundTrip(self):
+    reply = _GetReply()
+    result = result_set_lib.ResultSet.FromReply(reply)
+
+    self.assertEqual(2, len(result))
+    self.assertEqual(['us-a', 'eu-b'], result.GetColumn('zone'))
+    self.assertEqual(reply, result.ToReply())
+
+  def testAddReplyRowsTyped(self):
+    reply = _GetReply()
+    result = result_set_lib.ResultSet.FromReply(reply, include_rows=False)
+    result.AddReplyRows(reply['rows'])
+
+    self.assertEqual([25, 27], result.GetColumn('cost'))
+    self.assertEqual([1.5, None], result.GetColumn('speed'))
+    self.assertEqual({'totalRows': '2', 'jobReference': {'jobId': 'job1'}},
+                     result.metadata)
+
+  def testGetColumnUnknownField(self):
+    result = result_set_lib.ResultSet.FromReply(_GetReply())
+
+    self.assertRaises(ValueError, result.GetColumn, 'unknown')
+
+  def testCompact(self):
+    reply = _GetReply()
+    result = result_set_lib.ResultSet.FromReply(reply, include_rows=False)
+    result.AddReplyRows(reply['rows'])
+    result.Compact()
+
+    self.assertIsInstance(result.GetColumn('cost'), array.array)
+    # Columns with nulls are left as lists.
+    self.assertIsInstance(result.GetColumn('speed'), list)
+    self.assertEqual([('us-a', 25, 1.5), ('eu-b', 27, None)],
+                     list(result.IterRows()))
+
+  def testPickle(self):
+    result = result_set_lib.ResultSet.FromReply(_GetReply())
+    result.ClearRows()
+    result.AddRows([('us-c', 1, 2.0)])
+
+    actual = cPickle.loads(cPickle.dumps(result, cPickle.HIGHEST_PROTOCOL))
+
+    self.assertEqual(result.fields, actual.fields)
+    self.assertEqual([['us-c'], [1], [2.0]], actual.columns)
+    self.assertEqual(result.metadata, actual.metadata)
+
+  def testCacheHitIsNotPickled(self):
+    result = result_set_lib.ResultSet.FromReply(_GetReply())
+    self.assertFalse(result.cache_hit)
+
+    result.cache_hit = True
+    self.assertTrue(result.Copy().cache_hit)
+
+    actual = cPickle.loads(cPickle.dumps(result, cPickle.HIGHEST_PROTOCOL))
+    self.assertFalse(actual.cache_hit)
+
+  def testSort(self):
+    result = result_set_lib.ResultSet.FromReply(_GetReply(), include_rows=False)
+    result.AddRows([('a', 2, None), ('b', 1, 1.0), ('c', 2, 0.5)])
+
+    result.Sort('cost')
+    self.assertEqual(['b', 'a', 'c'], result.GetColumn('zone'))
+
+    result.Sort('speed', descending=True)
+    self.assertEqual(['b', 'c', 'a'], result.GetColumn('zone'))
+
+    self.assertRaises(ValueError, result.Sort, 'unknown')
+
+  def testSlice(self):
+    result = result_set_lib.ResultSet.FromReply(_GetReply(), include_rows=False)
+    result.AddRows([('a', 1, 1.0), ('b', 2, 2.0), ('c', 3, 3.0)])
+    result.Compact()
+
+    result.Slice(1, 1)
+    self.assertEqual([('b', 2, 2.0)], list(result.IterRows()))
+
+    result.Slice(5)
+    self.assertEqual(0, len(result))
+
+  def testNoSchema(self):
+    reply = {'rows': [{'f': [{'v': 'a'}, {'v': 'b'}]}]}
+    result = result_set_lib.ResultSet.FromReply(reply)
+
+    self.assertEqual([['a'], ['b']], result.columns)
+    self.assertEqual(reply, result.ToReply())
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,173 @@
+"""Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Computes summary statistics over the numeric columns of a BigQuery reply.
+
+Statistics are calculated with NumPy over the typed values of each column
+(see big_query_result_util.ReplyFormatter.ConvertValuesToTypedData), and can
+optionally be grouped by one or more columns.  For each group and value
+column, the following are returned:
+  count: The number of non-null values.
+  mean, stddev: The mean and (population) standard deviation.
+  min, max: The smallest and largest values.
+  p50, p90, p99: The 50th, 90th and 99th percentiles.
+
+For the following 'reply':
+
+zone     machine     cost
+us-a     small       25
+us-a     large       45
+eu-b     small       27
+
+BigQueryStatisticsCalculator(reply, group_names=['zone']).Calculate() returns:
+
+[{'group': {'zone': 'us-a'},
+  'fields': {'cost': {'count': 2, 'mean': 35.0, 'min': 25.0, ...}}},
+ {'group': {'zone': 'eu-b'},
+  'fields': {'cost': {'count': 1, 'mean': 27.0, 'min': 27.0, ...}}}]
+
+Groups appear in the order they are first encountered.
+"""
+
+import numpy
+
+from perfkit.common import big_query_result_set as result_set_lib
+from perfkit.common import big_query_result_util as result_util
+
+
+NUMERIC_TYPES = [result_util.FieldTypes.INTEGER, result_util.FieldTypes.FLOAT]
+PERCENTILES = [50, 90, 99]
+
+
+class BigQueryStatisticsCalculator(object):
+  """Calculates summary statistics for a BigQuery reply."""
+
+  def __init__(self, reply, value_names=None, group_names=None):
+    """Initializes a new calculator.  See module docstring for a description.
+
+    Args:
+      reply: The BigQuery reply object, with typed values, or a
+          big_query_result_set.ResultSet.
+      value_names: A list of column names to calculate statistics for.  If not
+          provided, all INTEGER and FLOAT columns that are not grouped on are
+          used.
+      group_names: A list of column names to group the statistics by.  If not
+          provided, a single group is returned for all rows.
+    """
+    if isinstance(reply, result_set_lib.ResultSet):
+      self.result_set = reply
+    else:
+      self.result_set = result_set_lib.ResultSet.FromReply(reply)
+
+    self.reply = reply
+    self.group_names = group_names or []
+    self.value_names = value_names or self._GetNumericNames()
+
+  def _GetNumericNames(self):
+    """Returns the names of numeric columns that are not grouped on."""
+    return [field['name'] for field in self.result_set.fields
+            if field['type'] in NUMERIC_TYPES and
+            field['name'] not in self.group_names]
+
+  def _GetFieldIndex(self, field_name):
+    """Returns the position of field_name in the reply schema.
+
+    Raises:
+      ValueError: Raised if field_name cannot be found.
+    """
+    for index, field in enumerate(self.result_set.fields):
+      if field['name'] == field_name:
+        return index
+
+    raise ValueError(
+        'Field name "%s" not found in Statistics Columns.' % field_name)
+
+  def Calculate(self):
+    """Returns statistics for each group.  See module docstring for format."""
+    columns = self.result_set.columns
+    group_indexes = [self._GetFieldIndex(name) for name in self.group_names]
+
+    if group_indexes:
+      row_group_keys = zip(*[columns[index] for index in group_indexes])
+    else:
+      row_group_keys = [()] * self.result_set.num_rows
+
+    # Assign each row to a group in a single pass.
+    group_keys = []
+    group_rows = {}
+    for row_index, key in enumerate(row_group_keys):
+      if key not in group_rows:
+        group_keys.append(key)
+        group_rows[key] = []
+      group_rows[key].append(row_index)
+
+    if not group_indexes and not group_keys:
+      group_keys.append(())
+      group_rows[()] = []
+
+    value_arrays = {}
+    for name in self.value_names:
+      index = self._GetFieldIndex(name)
+      value_arrays[name] = numpy.array(
+          [_ToFloat(value) for value in columns[index]], dtype=float)
+
+    result = []
+    for key in group_keys:
+      row_indexes = numpy.array(group_rows[key], dtype=int)
+      fields = {}
+
+      for name in self.value_names:
+        values = value_arrays[name][row_indexes]
+        fields[name] = CalculateStatistics(values[~numpy.isnan(values)])
+
+      result.append({'group': dict(zip(self.group_names, key)),
+                     'fields': fields})
+
+    return result
+
+
+def CalculateStatistics(values):
+  """Returns a dict of summary statistics for a NumPy array of floats.
+
+  Args:
+    values: A 1-dimensional NumPy array, with nulls already removed.
+
+  Returns:
+    A dict with count, mean, stddev, min, max and percentile entries.  If
+    values is empty, every entry other than count is None.
+  """
+  stats = {'count': int(values.size)}
+
+  if not values.size:
+    for name in ['mean', 'stddev', 'min', 'max']:
+      stats[name] = None
+    for percentile in PERCENTILES:
+      stats['p%d' % percentile] = None
+    return stats
+
+  stats['mean'] = float(numpy.mean(values))
+  stats['stddev'] = float(numpy.std(values))
+  stats['min'] = float(numpy.min(values))
+  stats['max'] = float(numpy.max(values))
+  for percentile in PERCENTILES:
+    stats['p%d' % percentile] = float(numpy.percentile(values, percentile))
+
+  return stats
+
+
+def _ToFloat(value):
+  """Returns value as a float, with None and non-numeric values as NaN."""
+  if value is None or isinstance(value, basestring):
+    return numpy.nan
+  return float(value)
@@ -0,0 +1,92 @@
+"""Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Tests for big_query_result_stats.
+"""
+
+import unittest
+
+import big_query_result_stats
+
+
+def _GetReply():
+  return {
+      'schema': {'fields': [
+          {'name': 'zone', 'type': 'STRING', 'mode': 'NULLABLE'},
+          {'name': 'machine', 'type': 'STRING', 'mode': 'NULLABLE'},
+          {'name': 'cost', 'type': 'INTEGER', 'mode': 'NULLABLE'},
+          {'name': 'speed', 'type': 'FLOAT', 'mode': 'NULLABLE'}
+      ]},
+      'rows': [
+          {'f': [{'v': 'us-a'}, {'v': 'small'}, {'v': 25}, {'v': 1.0}]},
+          {'f': [{'v': 'us-a'}, {'v': 'large'}, {'v': 45}, {'v': None}]},
+          {'f': [{'v': 'eu-b'}, {'v': 'small'}, {'v': 27}, {'v': 3.0}]},
+      ]
+  }
+
+
+class BigQueryStatisticsCalculatorTest(unittest.TestCase):
+
+  def testCalculateUngrouped(self):
+    calculator = big_query_result_stats.BigQueryStatisticsCalculator(
+        reply=_GetReply())
+    actual = calculator.Calculate()
+
+    self.assertEqual(1, len(actual))
+    self.assertEqual({}, actual[0]['group'])
+    self.assertEqual(['cost', 'speed'], sorted(actual[0]['fields'].keys()))
+
+    cost = actual[0]['fields']['cost']
+    self.assertEqual(3, cost['count'])
+    self.assertAlmostEqual(97.0 / 3, cost['mean'])
+    self.assertEqual(25.0, cost['min'])
+    self.assertEqual(45.0, cost['max'])
+    self.assertEqual(27.0, cost['p50'])
+
+    speed = actual[0]['fields']['speed']
+    self.assertEqual(2, speed['count'])
+    self.assertEqual(2.0, speed['mean'])
+    self.assertEqual(1.0, speed['stddev'])
+
+  def testCalculateGrouped(self):
+    calculator = big_query_result_stats.BigQueryStatisticsCalculator(
+        reply=_GetReply(), value_names=['cost'], group_names=['zone'])
+    actual = calculator.Calculate()
+
+    self.assertEqual([{'zone': 'us-a'}, {'zone': 'eu-b'}],
+                     [group['group'] for group in actual])
+    self.assertEqual(35.0, actual[0]['fields']['cost']['mean'])
+    self.assertEqual(45.0, actual[0]['fields']['cost']['max'])
+    self.assertEqual(27.0, actual[1]['fields']['cost']['p99'])
+
+  def testCalculateEmpty(self):
+    reply = _GetReply()
+    reply['rows'] = []
+
+    calculator = big_query_result_stats.BigQueryStatisticsCalculator(
+        reply=reply, value_names=['cost'])
+    actual = calculator.Calculate()
+
+    self.assertEqual(0, actual[0]['fields']['cost']['count'])
+    self.assertIsNone(actual[0]['fields']['cost']['mean'])
+
+  def testCalculateUnknownField(self):
+    calculator = big_query_result_stats.BigQueryStatisticsCalculator(
+        reply=_GetReply(), value_names=['unknown'])
+
+    self.assertRaises(ValueError, calculator.Calculate)
+
+
+if __name__ == '__main__':
+  unittest.main()
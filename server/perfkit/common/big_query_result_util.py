@@ -16,6 +16,7 @@ Utility functions for dealing with BigQuery results."""
 
 __author__ = 'joemu@google.com (Joe Allan Muharsky)'
 
+import calendar
 import datetime
 import logging
 
@@ -41,6 +42,31 @@ class FieldTypes(object):
   TIMESTAMP = 'TIMESTAMP'
 
 
+class TimestampModes(object):
+  """Enumerates the supported representations of TIMESTAMP values.
+
+  ISO: A string in ISO 8601 format, with a space separator (the default).
+  EPOCH_MS: A number of milliseconds since the Unix epoch, suitable for
+      passing directly to the JavaScript Date constructor.
+  """
+
+  ISO = 'iso'
+  EPOCH_MS = 'epoch_ms'
+
+  @classmethod
+  def All(cls):
+    """Returns all known timestamp modes."""
+    return [cls.ISO, cls.EPOCH_MS]
+
+  @classmethod
+  def Validate(cls, timestamp_mode):
+    """Raises NotSupportedError if timestamp_mode is provided and unknown."""
+    if timestamp_mode and timestamp_mode not in cls.All():
+      raise NotSupportedError(
+          'Timestamp mode "{mode}" is not supported.'.format(
+              mode=timestamp_mode))
+
+
 class Formats(object):
   """Class to enumerate constants for supported result formats."""
 
@@ -131,29 +157,15 @@ class ReplyFormatter(object):
          'rows':[{'col1':'foo', 'col2':'bar'}]}
 
     Args:
-      reply: The BigQuery reply object.
+      reply: The BigQuery reply object, or a big_query_result_set.ResultSet.
 
     Returns:
       Data from the reply, refactored to a formal list of field/value dicts.
     """
-    target_rows = []
-    fields = reply['schema']['fields']
-
-    for source_row in reply['rows']:
-      target_row = {}
-      source_values = source_row['f']
-
-      for ctr in xrange(len(fields)):
-        field = fields[ctr]
-        field_values = source_values[ctr]
-        field_name = field['name']
-        field_value = field_values['v']
-
-        target_row[field_name] = field_value
-
-      target_rows.append(target_row)
+    fields, rows = _GetFieldsAndRowValues(reply)
+    field_names = [field['name'] for field in fields]
 
-    return target_rows
+    return [dict(zip(field_names, values)) for values in rows]
 
   @classmethod
   def RowsToDataTableFormat(cls, reply):
@@ -189,7 +201,7 @@ class ReplyFormatter(object):
         https://developers.google.com/chart/interactive/docs/reference#DataTable_toJSON
 
     Args:
-      reply: The BigQuery reply object.
+      reply: The BigQuery reply object, or a big_query_result_set.ResultSet.
 
     Returns:
       Data from the reply, refactored to a GViz DataTable Json object.
@@ -198,26 +210,26 @@ class ReplyFormatter(object):
     result_rows = []
     result = {'cols': result_cols, 'rows': result_rows}
 
-    fields = reply['schema']['fields']
+    fields, rows = _GetFieldsAndRowValues(reply)
 
     for field_row in fields:
       result_cols.append({'id': field_row['name'], 'label': field_row['name'],
                           'type': cls.BQTypeToGVizType(field_row['type'])})
 
-    for source_row in reply['rows']:
-      target_cells = []
-      target_row = {'c': target_cells}
-
-      for values in source_row['f']:
-        target_cells.append({'v': values['v']})
-
-      result_rows.append(target_row)
+    for values in rows:
+      result_rows.append({'c': [{'v': value} for value in values]})
 
     return result
 
   @classmethod
-  def ConvertValuesToTypedData(cls, reply):
-    """Converts non-string columns (int, etc.) to appropriately typed values."""
+  def ConvertValuesToTypedData(cls, reply, timestamp_mode=None):
+    """Converts non-string columns (int, etc.) to appropriately typed values.
+
+    Args:
+      reply: The BigQuery reply to process.  Values are converted in place.
+      timestamp_mode: One of TimestampModes.All(), which determines how
+          TIMESTAMP values are represented.  Defaults to TimestampModes.ISO.
+    """
     if 'schema' not in reply:
       logging.warning(
           'schema was not defined in the reply, see bug 8854364:\n%s', reply)
@@ -227,10 +239,10 @@ class ReplyFormatter(object):
       for ctr in xrange(len(source_row['f'])):
         field = fields[ctr]
         values = source_row['f'][ctr]
-        values['v'] = GetTypedValue(field['type'], values['v'])
+        values['v'] = GetTypedValue(field['type'], values['v'], timestamp_mode)
 
 
-def GetTypedValue(field_type, value):
+def GetTypedValue(field_type, value, timestamp_mode=None):
   """Returns a typed value based on a schema description and string value.
 
   BigQuery's Query() method returns a JSON string that has all values stored
@@ -241,6 +253,8 @@ def GetTypedValue(field_type, value):
   Args:
     field_type: The field type (as defined by BigQuery).
     value: The field value, typed as a string.
+    timestamp_mode: One of TimestampModes.All(), which determines how
+        TIMESTAMP values are represented.  Defaults to TimestampModes.ISO.
 
   Returns:
     A value of the appropriate type.
@@ -265,6 +279,8 @@ def GetTypedValue(field_type, value):
   if field_type == FieldTypes.TIMESTAMP:
     if value == 'NaN':
       return None
+    elif timestamp_mode == TimestampModes.EPOCH_MS:
+      return int(round(float(value) * 1000))
     else:
       dt = datetime.datetime.utcfromtimestamp(float(value))
       return dt.isoformat(' ')
@@ -273,3 +289,34 @@ def GetTypedValue(field_type, value):
   else:
     raise NotSupportedError(
         'Type {field_type} is not supported.'.format(field_type=field_type))
+
+
+def _GetFieldsAndRowValues(reply):
+  """Returns the fields of a reply, and an iterable of each row's values.
+
+  Args:
+    reply: The BigQuery reply object, or a big_query_result_set.ResultSet.
+  """
+  if isinstance(reply, dict):
+    return (reply['schema']['fields'],
+            ([cell['v'] for cell in row['f']] for row in reply['rows']))
+
+  return reply.fields, reply.IterRows()
+
+
+def GetEpochMilliseconds(value):
+  """Returns the milliseconds since the Unix epoch for a date or datetime.
+
+  Naive datetimes are assumed to be in UTC.
+
+  Args:
+    value: A datetime.date or datetime.datetime.
+
+  Returns:
+    An integer number of milliseconds.
+  """
+  if not isinstance(value, datetime.datetime):
+    value = datetime.datetime.fromordinal(value.toordinal())
+
+  return (calendar.timegm(value.utctimetuple()) * 1000 +
+          value.microsecond // 1000)
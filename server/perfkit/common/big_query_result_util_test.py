@@ -16,8 +16,10 @@ Unit test for big_query_client_result_util."""
 
 __author__ = 'joemu@google.com (Joe Allan Muharsky)'
 
+import datetime
 import unittest
 
+import big_query_result_set
 import big_query_result_util as util
 
 
@@ -81,6 +83,24 @@ class BigQueryClientResultUtilTest(unittest.TestCase):
 
     self.assertEqual(actual, expected_data)
 
+  def testRowsToDataTableFormatResultSet(self):
+    result = big_query_result_set.ResultSet(
+        fields=[{'name': 'col1', 'type': 'STRING'},
+                {'name': 'col2', 'type': 'FLOAT'}],
+        columns=[['foo', 'bar'], [1.5, None]])
+
+    expected = {
+        'cols': [{'id': 'col1', 'label': 'col1', 'type': 'string'},
+                 {'id': 'col2', 'label': 'col2', 'type': 'number'}],
+        'rows': [{'c': [{'v': 'foo'}, {'v': 1.5}]},
+                 {'c': [{'v': 'bar'}, {'v': None}]}]}
+
+    self.assertEqual(expected,
+                     util.ReplyFormatter.RowsToDataTableFormat(result))
+    self.assertEqual([{'col1': 'foo', 'col2': 1.5},
+                      {'col1': 'bar', 'col2': None}],
+                     util.ReplyFormatter.RowsToTemplateFormat(result))
+
   def testConvertValuesToTypedData(self):
     source_data = {
         'schema': {
@@ -118,6 +138,31 @@ class BigQueryClientResultUtilTest(unittest.TestCase):
     self.assertRaises(util.NotSupportedError,
                       util.GetTypedValue, 'UNSUPPORTED', '50')
 
+  def testGetTypedValueTimestampModes(self):
+    self.assertEqual('2013-03-03 00:48:04.500000',
+                     util.GetTypedValue('TIMESTAMP', '1.3622716845E9'))
+
+    self.assertEqual(1362271684500,
+                     util.GetTypedValue('TIMESTAMP', '1.3622716845E9',
+                                        util.TimestampModes.EPOCH_MS))
+
+    self.assertIsNone(util.GetTypedValue('TIMESTAMP', 'NaN',
+                                         util.TimestampModes.EPOCH_MS))
+
+  def testValidateTimestampMode(self):
+    util.TimestampModes.Validate(None)
+    util.TimestampModes.Validate(util.TimestampModes.EPOCH_MS)
+
+    self.assertRaises(util.NotSupportedError,
+                      util.TimestampModes.Validate, 'unknown')
+
+  def testGetEpochMilliseconds(self):
+    self.assertEqual(1362271684500, util.GetEpochMilliseconds(
+        datetime.datetime(2013, 3, 3, 0, 48, 4, 500000)))
+
+    self.assertEqual(1362268800000, util.GetEpochMilliseconds(
+        datetime.date(2013, 3, 3)))
+
 
 if __name__ == '__main__':
   unittest.main()
@@ -32,9 +32,16 @@ from oauth2client.appengine import AppAssertionCredentials
 from google.appengine.api import memcache
 
 import big_query_client
+import timing_util
 
 DEFAULT_CACHE_DURATION = 3600
 
+# Distinguishes cached ResultSets from replies cached by earlier versions.
+CACHE_KEY_PREFIX = 'result_set:'
+
+# BigQuery keeps the results of a query job for about 24 hours.
+MAX_JOB_RETENTION = 12 * 3600
+
 
 class GaeBigQueryClient(big_query_client.BigQueryClient):
   """Client for interacting with BigQuery, within app engine authentication."""
@@ -60,7 +67,16 @@ class GaeBigQueryClient(big_query_client.BigQueryClient):
     Returns:
       Cached data if found, None if not.
     """
-    return memcache.get(key)
+    with timing_util.Span('cache'):
+      return memcache.get(key)
+
+  def _GetCachedResult(self, key):
+    """Returns a cached ResultSet, marked as a cache hit, or None."""
+    data = self._GetFromCache(key)
+    if data is not None:
+      data.cache_hit = True
+
+    return data
 
   def _AddToCache(self, key, value, duration=None):
     """Adds a value to the cache.
@@ -70,34 +86,63 @@ class GaeBigQueryClient(big_query_client.BigQueryClient):
       value: The value to store.
       duration: The length of time (in seconds) to store the cached value.
     """
-    memcache.add(key, value, duration or DEFAULT_CACHE_DURATION)
+    with timing_util.Span('cache'):
+      memcache.add(key, value, duration or DEFAULT_CACHE_DURATION)
 
-  def Query(self, query, timeout=None, cache_duration=None, use_cache=True):
+  def Query(self, query, timeout=None, cache_duration=None, use_cache=True,
+            sampler=None, timestamp_mode=None):
     """Returns cached data, or issues a Big Query and returns the response.
 
     Note that multiple pages of data will be loaded returned as a single data
-    set.
+    set.  See QueryResultSet for a description of the arguments.
+
+    Returns:
+      The query results.  See big query's docs for the results format:
+      http://goto.google.com/big_query_query_results
+    """
+    return self.QueryResultSet(
+        query, timeout=timeout, cache_duration=cache_duration,
+        use_cache=use_cache, sampler=sampler,
+        timestamp_mode=timestamp_mode).ToReply()
+
+  def QueryResultSet(self, query, timeout=None, max_results_per_page=None,
+                     cache_duration=None, use_cache=True, sampler=None,
+                     timestamp_mode=None):
+    """Returns cached results, or issues a Big Query and returns the results.
+
+    The compact ResultSet is cached rather than the BigQuery JSON reply, which
+    keeps memcache entries small.
 
     Args:
       query: The query to issue.
       timeout: The length of time (in seconds) to wait before checking for job
           completion.
+      max_results_per_page: The maximum results returned per page.
       cache_duration: The length of time (in seconds) to store the result in
           the cache.
       use_cache: If false, do not use the cache.
+      sampler: If provided, a big_query_result_sampler.ResultSampler used to
+          downsample the rows as they are paged.  The sample is cached
+          separately from the full result.
+      timestamp_mode: One of big_query_result_util.TimestampModes.All(),
+          which determines how TIMESTAMP values are returned.  Each mode is
+          cached separately.
 
     Returns:
-      The query results.  See big query's docs for the results format:
-      http://goto.google.com/big_query_query_results
+      A big_query_result_set.ResultSet.
     """
     if not use_cache:
-      return super(GaeBigQueryClient, self).Query(query, timeout)
+      return super(GaeBigQueryClient, self).QueryResultSet(
+          query, timeout, max_results_per_page, sampler=sampler,
+          timestamp_mode=timestamp_mode)
 
-    query_hash = hashlib.md5(self.project_id + query).hexdigest()
-    data = self._GetFromCache(query_hash)
+    query_hash = self._GetQueryCacheKey(query, sampler, timestamp_mode)
+    data = self._GetCachedResult(query_hash)
 
     if data is None:
-      data = super(GaeBigQueryClient, self).Query(query, timeout)
+      data = super(GaeBigQueryClient, self).QueryResultSet(
+          query, timeout, max_results_per_page, sampler=sampler,
+          timestamp_mode=timestamp_mode)
       try:
         self._AddToCache(query_hash, data, cache_duration)
       except ValueError, err:
@@ -108,6 +153,145 @@ class GaeBigQueryClient(big_query_client.BigQueryClient):
 
     return data
 
+  def _GetQueryCacheKey(self, query, sampler=None, timestamp_mode=None):
+    """Returns the memcache key for the results of a query."""
+    cache_key = CACHE_KEY_PREFIX + self.project_id + query
+    if sampler:
+      cache_key += sampler.GetCacheKey()
+    if timestamp_mode:
+      cache_key += timestamp_mode
+
+    return hashlib.md5(cache_key).hexdigest()
+
+  def _GetJobCacheKey(self, job_id, timestamp_mode=None, sampler=None):
+    """Returns the memcache key for the results of a query job."""
+    cache_key = CACHE_KEY_PREFIX + 'job:' + self.project_id + job_id
+    if sampler:
+      cache_key += sampler.GetCacheKey()
+    if timestamp_mode:
+      cache_key += timestamp_mode
+
+    return hashlib.md5(cache_key).hexdigest()
+
+  def GetCachedResultSet(self, query, timestamp_mode=None, sampler=None):
+    """Returns the cached results of a query, or None if not cached.
+
+    If a sampler is provided, the cached sample of that kind is returned.
+    """
+    query_hash = self._GetQueryCacheKey(query, sampler, timestamp_mode)
+    return self._GetCachedResult(query_hash)
+
+  def GetCachedResultSets(self, queries, timestamp_mode=None):
+    """Returns a dict of cached results, keyed by query.
+
+    All of the queries are looked up in a single memcache call.  Queries that
+    are not cached are omitted.
+    """
+    queries_by_hash = dict(
+        (self._GetQueryCacheKey(query, timestamp_mode=timestamp_mode), query)
+        for query in queries)
+    with timing_util.Span('cache'):
+      cached = memcache.get_multi(queries_by_hash.keys())
+
+    for data in cached.itervalues():
+      data.cache_hit = True
+
+    return dict((queries_by_hash[query_hash], data)
+                for query_hash, data in cached.iteritems())
+
+  def GetQueryJobResultSet(self, job_id, timeout=None, timestamp_mode=None,
+                           query=None, cache_duration=None, sampler=None):
+    """Returns cached results of a query job, or gets them from Big Query.
+
+    Completed results are cached by job id.  If the query is provided, they
+    are also cached as the results of the query, so that later synchronous or
+    asynchronous requests for the same query reuse the completed job.
+    Samples are cached separately from the full results, as for
+    QueryResultSet.
+
+    Args:
+      job_id: The id of a job started by InsertQueryJob().
+      timeout: The length of time (in seconds) to wait for the job to
+          complete before returning None.
+      timestamp_mode: One of big_query_result_util.TimestampModes.All(),
+          which determines how TIMESTAMP values are returned.
+      query: The query issued by the job.
+      cache_duration: The length of time (in seconds) to store the result in
+          the cache.
+      sampler: If provided, a big_query_result_sampler.ResultSampler used to
+          downsample the rows of the completed job as they are paged.
+
+    Returns:
+      A big_query_result_set.ResultSet, or None if the job is not complete.
+    """
+    job_hash = self._GetJobCacheKey(job_id, timestamp_mode, sampler)
+    data = self._GetCachedResult(job_hash)
+
+    if data is not None:
+      logging.info('Cache hit for job %s.', job_id)
+      return data
+
+    data = super(GaeBigQueryClient, self).GetQueryJobResultSet(
+        job_id, timeout, timestamp_mode, sampler=sampler)
+
+    if data is not None:
+      try:
+        self._AddToCache(job_hash, data, cache_duration)
+        if query:
+          query_hash = self._GetQueryCacheKey(query, sampler, timestamp_mode)
+          self._AddToCache(query_hash, data, cache_duration)
+      except ValueError, err:
+        logging.error('Failed to save results to the cache: %s', err)
+
+    return data
+
+  def _GetRetainedJobCacheKey(self, query):
+    """Returns the memcache key for the id of a job that ran a query."""
+    return hashlib.md5(
+        CACHE_KEY_PREFIX + 'retained_job:' + self.project_id + query
+    ).hexdigest()
+
+  def QueryResultPage(self, query, start_index, max_results, timeout=None,
+                      timestamp_mode=None, cache_duration=None):
+    """Returns one page of the results of a query.
+
+    The page is sliced from the cached full results if available.  Otherwise
+    it is read from the retained results of an earlier job for the same
+    query, or from a new query, whose job id is retained for cache_duration.
+    See BigQueryClient.QueryResultPage for the arguments.
+    """
+    data = self.GetCachedResultSet(query, timestamp_mode)
+    if data is not None:
+      data.Slice(start_index, max_results)
+      return data
+
+    job_key = self._GetRetainedJobCacheKey(query)
+    job_id = self._GetFromCache(job_key)
+
+    if job_id:
+      try:
+        data = self.GetQueryJobPage(job_id, start_index, max_results,
+                                    timeout=timeout,
+                                    timestamp_mode=timestamp_mode)
+        if data is not None:
+          return data
+      except big_query_client.BigQueryError as err:
+        logging.warning('Retained job %s cannot be read, re-running the '
+                        'query: %s', job_id, err)
+
+    data = super(GaeBigQueryClient, self).QueryResultPage(
+        query, start_index, max_results, timeout=timeout,
+        timestamp_mode=timestamp_mode)
+
+    job_reference = (data.metadata.get('jobReference')
+                     if data is not None else None)
+    if job_reference:
+      memcache.set(job_key, job_reference['jobId'],
+                   min(cache_duration or DEFAULT_CACHE_DURATION,
+                       MAX_JOB_RETENTION))
+
+    return data
+
   @staticmethod
   def HasCache():
     """Returns true as the gae client has a cache."""
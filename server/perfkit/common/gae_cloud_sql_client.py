@@ -23,6 +23,8 @@ import logging
 import os
 
 from perfkit.common import big_query_client
+from perfkit.common import big_query_result_set as result_set_lib
+from perfkit.common import big_query_result_util as result_util
 
 # Setting up readonly user rights, assumes the 'readonly' user already exists:
 #
@@ -56,8 +58,8 @@ class CloudSqlError(big_query_client.BigQueryError):
     super(CloudSqlError, self).__init__(message, query)
 
 
-def ConvertCloudSqlToBigQuery(rows_in, schema_tuples):
-  """Converts data returned by Cloud SQL to BigQuery result format.
+def ConvertCloudSqlToResultSet(rows_in, schema_tuples, timestamp_mode=None):
+  """Converts data returned by Cloud SQL to a column-oriented ResultSet.
 
   Args:
     rows_in: Sequence of tuples, each contains data for one row. Example:
@@ -70,11 +72,13 @@ def ConvertCloudSqlToBigQuery(rows_in, schema_tuples):
          ('machine_type', 254, 14, 42, 42, 0, 1),
          ('zone', 254, 14, 66, 66, 0, 1),
          ('value', 5, 4, 22, 22, 31, 1))
+    timestamp_mode: One of big_query_result_util.TimestampModes.All(), which
+        determines how date and datetime values are returned.  Defaults to
+        ISO strings.
   Returns:
-    Dict containing rows, schema, and other metadata as used by the BigQuery
-    backend.
+    A big_query_result_set.ResultSet, with the same metadata as used by the
+    BigQuery backend.
   """
-  # TODO(klausw): refactor to use a more neutral common format.
   fields = []
   for field in schema_tuples:
     fields.append({
@@ -83,28 +87,50 @@ def ConvertCloudSqlToBigQuery(rows_in, schema_tuples):
         'mode': 'NULLABLE',
     })
 
-  rows_out = []
-  for row in rows_in:
-    row_out = []
-    for val in row:
+  epoch_ms = timestamp_mode == result_util.TimestampModes.EPOCH_MS
+
+  if rows_in:
+    columns = [list(column) for column in zip(*rows_in)]
+  else:
+    columns = [[] for _ in fields]
+
+  for column in columns:
+    for index, val in enumerate(column):
       # Convert datetime objects to isoformat strings. This assumes
       # that the server runs in UTC to create appropriate naive
       # objects and strings.
-      if isinstance(val, datetime.datetime):
-        val = val.isoformat(' ')
-      elif isinstance(val, datetime.date):
-        val = datetime.datetime.fromordinal(val.toordinal()).isoformat(' ')
-      row_out.append({'v': val})
-    rows_out.append({'f': row_out})
-
-  result = {'schema': {'fields': fields},
-            'rows': rows_out}
-  result['jobReference'] = {'jobId': '0'}
-  result['totalRows'] = len(rows_in)
+      if not isinstance(val, datetime.date):
+        continue
+      elif epoch_ms:
+        column[index] = result_util.GetEpochMilliseconds(val)
+      elif isinstance(val, datetime.datetime):
+        column[index] = val.isoformat(' ')
+      else:
+        column[index] = datetime.datetime.fromordinal(
+            val.toordinal()).isoformat(' ')
+
+  result = result_set_lib.ResultSet(
+      fields=fields, columns=columns,
+      metadata={'jobReference': {'jobId': '0'},
+                'totalRows': len(rows_in)})
+  result.Compact()
 
   return result
 
 
+def ConvertCloudSqlToBigQuery(rows_in, schema_tuples, timestamp_mode=None):
+  """Converts data returned by Cloud SQL to BigQuery result format.
+
+  See ConvertCloudSqlToResultSet for a description of the arguments.
+
+  Returns:
+    Dict containing rows, schema, and other metadata as used by the BigQuery
+    backend.
+  """
+  return ConvertCloudSqlToResultSet(
+      rows_in, schema_tuples, timestamp_mode).ToReply()
+
+
 class GaeCloudSqlClient(object):
   """Client for Cloud SQL from Appengine.
 
@@ -134,7 +160,15 @@ class GaeCloudSqlClient(object):
           host='127.0.0.1', port=3306, db=DB_NAME, user=DB_USER,
           passwd=DB_PASSWORD, charset='utf8')
 
-  def Query(self, query, timeout=None, cache_duration=None, use_cache=True):
+  def Query(self, query, timeout=None, cache_duration=None, use_cache=True,
+            timestamp_mode=None):
+    """Issues a query and returns the results in the BigQuery format."""
+    return self.QueryResultSet(query, timeout, cache_duration, use_cache,
+                               timestamp_mode).ToReply()
+
+  def QueryResultSet(self, query, timeout=None, cache_duration=None,
+                     use_cache=True, timestamp_mode=None):
+    """Issues a query and returns the results as a ResultSet."""
     # TODO(klausw): set up a per-backend connection pool to make
     # this class suitable for multithreaded use?
 
@@ -158,4 +192,4 @@ class GaeCloudSqlClient(object):
     rows_in = cursor.fetchall()
     schema_tuples = cursor.description
 
-    return ConvertCloudSqlToBigQuery(rows_in, schema_tuples)
+    return ConvertCloudSqlToResultSet(rows_in, schema_tuples, timestamp_mode)
@@ -0,0 +1,574 @@
+"""Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+A data client that runs BigQuery SQL against an embedded SQLite database.
+
+This lets dashboards be developed, benchmarked and load tested without
+BigQuery.  Tables are created from BigQuery schemas and loaded from
+newline-delimited JSON, such as the files in data/samples_mart:
+
+    client = local_sql_client.LocalSqlClient()
+    client.CreateTable('samples_mart', 'results',
+                       local_sql_client.ReadSchema(SCHEMA_FILE))
+    client.LoadJson('samples_mart', 'results', SAMPLES_FILE)
+    reply = client.Query('SELECT test, COUNT(*) AS count '
+                         'FROM [samples_mart.results] GROUP EACH BY test')
+
+Queries are translated from BigQuery (legacy) SQL before they run:
+  * Table references ([project:dataset.table], [dataset.table] and
+    dataset.table) are mapped to the tables created in the client.
+  * Double-quoted strings become SQLite strings, and 'CONTAINS', 'GROUP EACH
+    BY' and 'JOIN EACH' are rewritten.
+  * Common BigQuery functions are provided as SQLite functions.  See
+    FUNCTIONS.
+
+TIMESTAMP values are stored as ISO strings (see TIMESTAMP_FORMAT), which sort
+and compare in time order.  Columns of them are returned as TIMESTAMPs.
+
+Replies are in the same format as BigQueryClient.Query().  Unsupported SQL
+raises LocalSqlError.  Queries can only read tables: statements that write,
+ATTACH another database or run a PRAGMA are denied.
+"""
+
+__author__ = 'joemu@google.com (Joe Allan Muharsky)'
+
+import calendar
+import datetime
+import json
+import math
+import os
+import re
+import threading
+import time
+
+from perfkit.common import big_query_client
+from perfkit.common import big_query_result_set as result_set_lib
+from perfkit.common import big_query_result_util as result_util
+
+# SQLite is not available in the App Engine runtime, only in the development
+# server and tools.
+try:
+  import sqlite3  # pylint: disable=g-import-not-at-top
+except ImportError:
+  sqlite3 = None
+
+
+SAMPLES_MART_DIR = os.path.join(
+    os.path.dirname(__file__), '..', '..', '..', 'data', 'samples_mart')
+SAMPLES_MART_SCHEMA_FILE = os.path.join(SAMPLES_MART_DIR,
+                                        'results_table_schema.json')
+SAMPLES_MART_DATA_FILE = os.path.join(SAMPLES_MART_DIR, 'sample_results.json')
+SAMPLES_MART_DATASET = 'samples_mart'
+SAMPLES_MART_TABLE = 'results'
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+TIMESTAMP_PATTERN = re.compile(
+    r'^\d{4}-\d\d-\d\d \d\d:\d\d:\d\d\.\d{6}$')
+
+USEC_PER_SEC = 1000000
+EPOCH = datetime.datetime(1970, 1, 1)
+
+FIELD_TYPES_TO_SQLITE = {
+    result_util.FieldTypes.STRING: 'TEXT',
+    result_util.FieldTypes.INTEGER: 'INTEGER',
+    result_util.FieldTypes.FLOAT: 'REAL',
+    result_util.FieldTypes.BOOLEAN: 'INTEGER',
+    result_util.FieldTypes.TIMESTAMP: 'TEXT'}
+SQLITE_TO_FIELD_TYPES = {
+    'TEXT': result_util.FieldTypes.STRING,
+    'INTEGER': result_util.FieldTypes.INTEGER,
+    'REAL': result_util.FieldTypes.FLOAT}
+
+# The SQLite actions that queries are authorized to take.  The Python 2
+# sqlite3 module doesn't define the constants of functions and recursive
+# common table expressions.
+SQLITE_FUNCTION = 31
+SQLITE_RECURSIVE = 33
+QUERY_ACTIONS = frozenset([sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ,
+                           SQLITE_FUNCTION, SQLITE_RECURSIVE]
+                          if sqlite3 else [])
+
+_shared_clients = {}
+_shared_clients_lock = threading.Lock()
+
+
+class LocalSqlError(big_query_client.BigQueryError):
+  pass
+
+
+def ReadSchema(path):
+  """Returns the list of fields in a BigQuery schema file."""
+  with open(path, 'rb') as f:
+    return json.load(f)
+
+
+def GetSharedClient(database=None):
+  """Returns the process-wide client for a database, creating it if needed.
+
+  A client is kept for each database for the life of the process, so the
+  path should come from trusted configuration rather than from requests.
+
+  Args:
+    database: The path of a SQLite database file.  If not provided, the
+        client has an in-memory samples_mart.results table, loaded from
+        data/samples_mart.
+  """
+  with _shared_clients_lock:
+    client = _shared_clients.get(database)
+
+    if not client:
+      client = LocalSqlClient(database or ':memory:')
+      if not database:
+        client.CreateTable(SAMPLES_MART_DATASET, SAMPLES_MART_TABLE,
+                           ReadSchema(SAMPLES_MART_SCHEMA_FILE))
+        client.LoadJson(SAMPLES_MART_DATASET, SAMPLES_MART_TABLE,
+                        SAMPLES_MART_DATA_FILE)
+      _shared_clients[database] = client
+
+    return client
+
+
+def _ToTimestamp(value):
+  """Returns a datetime as a TIMESTAMP string."""
+  return value.strftime(TIMESTAMP_FORMAT)
+
+
+def _FromTimestamp(value):
+  """Returns the datetime of a TIMESTAMP string, or a BigQuery date string."""
+  value = value.strip()
+  if value.endswith(' UTC'):
+    value = value[:-4]
+
+  for date_format in (TIMESTAMP_FORMAT, '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M',
+                      '%Y-%m-%d', '%Y-%m-%dT%H:%M:%S'):
+    try:
+      return datetime.datetime.strptime(value, date_format)
+    except ValueError:
+      pass
+
+  raise ValueError('Unrecognized timestamp: %s' % value)
+
+
+def _UsecToTimestamp(usec):
+  return _ToTimestamp(EPOCH + datetime.timedelta(microseconds=int(usec)))
+
+
+def _TimestampToUsec(value):
+  delta = _FromTimestamp(value) - EPOCH
+  return (delta.days * 86400 + delta.seconds) * USEC_PER_SEC + (
+      delta.microseconds)
+
+
+def _NullSafe(function):
+  """Returns a function that returns NULL if any argument is NULL."""
+
+  def Wrapper(*args):
+    if any(arg is None for arg in args):
+      return None
+    return function(*args)
+
+  return Wrapper
+
+
+def _RegexpExtract(value, pattern):
+  match = re.search(pattern, value)
+  if not match:
+    return None
+  return match.group(1) if match.groups() else match.group(0)
+
+
+def _DateAdd(value, interval, unit):
+  """Implements DATE_ADD(timestamp, interval, unit)."""
+  value = _FromTimestamp(value)
+  interval = int(interval)
+  unit = unit.upper()
+
+  if unit in ('YEAR', 'MONTH'):
+    months = value.month - 1 + interval * (12 if unit == 'YEAR' else 1)
+    year = value.year + months // 12
+    month = months % 12 + 1
+    day = min(value.day, calendar.monthrange(year, month)[1])
+    return _ToTimestamp(value.replace(year=year, month=month, day=day))
+
+  units = {'DAY': 'days', 'HOUR': 'hours', 'MINUTE': 'minutes',
+           'SECOND': 'seconds'}
+  if unit not in units:
+    raise ValueError('Unsupported DATE_ADD unit: %s' % unit)
+
+  return _ToTimestamp(value + datetime.timedelta(**{units[unit]: interval}))
+
+
+def _UsecToWeek(usec, day_of_week):
+  """Implements UTC_USEC_TO_WEEK(usec, day_of_week)."""
+  day = _FromTimestamp(_UsecToTimestamp(usec)).date()
+  # datetime weekdays start on Monday, BigQuery's on Sunday.
+  offset = (day.weekday() + 1 - int(day_of_week)) % 7
+  start = day - datetime.timedelta(days=offset)
+  return _TimestampToUsec(start.strftime('%Y-%m-%d'))
+
+
+def _Truncate(template):
+  """Returns a UTC_USEC_TO_<unit> function, truncating with template."""
+
+  def Truncate(usec):
+    value = _FromTimestamp(_UsecToTimestamp(usec))
+    return _TimestampToUsec(value.strftime(template))
+
+  return Truncate
+
+
+def _CurrentTimestamp():
+  return _ToTimestamp(datetime.datetime.utcnow())
+
+
+class _StdDev(object):
+  """Implements the STDDEV aggregate (the sample standard deviation)."""
+
+  def __init__(self):
+    self.values = []
+
+  def step(self, value):
+    if value is not None:
+      self.values.append(float(value))
+
+  def finalize(self):
+    count = len(self.values)
+    if count < 2:
+      return None
+
+    mean = sum(self.values) / count
+    return math.sqrt(sum((value - mean) ** 2 for value in self.values) /
+                     (count - 1))
+
+
+# BigQuery functions, by name and number of arguments.
+FUNCTIONS = {
+    ('TIMESTAMP', 1): lambda value: _ToTimestamp(_FromTimestamp(value)),
+    ('CURRENT_TIMESTAMP', 0): _CurrentTimestamp,
+    ('NOW', 0): lambda: int(time.time() * USEC_PER_SEC),
+    ('DATE', 1): lambda value: _FromTimestamp(value).strftime('%Y-%m-%d'),
+    ('DATE_ADD', 3): _DateAdd,
+    ('SEC_TO_TIMESTAMP', 1): lambda sec: _UsecToTimestamp(sec * USEC_PER_SEC),
+    ('MSEC_TO_TIMESTAMP', 1): lambda msec: _UsecToTimestamp(msec * 1000),
+    ('USEC_TO_TIMESTAMP', 1): _UsecToTimestamp,
+    ('TIMESTAMP_TO_SEC', 1): lambda value: (
+        _TimestampToUsec(value) // USEC_PER_SEC),
+    ('TIMESTAMP_TO_MSEC', 1): lambda value: _TimestampToUsec(value) // 1000,
+    ('TIMESTAMP_TO_USEC', 1): _TimestampToUsec,
+    ('UTC_USEC_TO_HOUR', 1): _Truncate('%Y-%m-%d %H:00:00'),
+    ('UTC_USEC_TO_DAY', 1): _Truncate('%Y-%m-%d'),
+    ('UTC_USEC_TO_WEEK', 2): _UsecToWeek,
+    ('UTC_USEC_TO_MONTH', 1): _Truncate('%Y-%m-01'),
+    ('UTC_USEC_TO_YEAR', 1): _Truncate('%Y-01-01'),
+    ('REGEXP_EXTRACT', 2): _RegexpExtract,
+    ('REGEXP_MATCH', 2): lambda value, pattern: bool(re.search(pattern,
+                                                               value)),
+    ('REGEXP_REPLACE', 3): lambda value, pattern, replacement: re.sub(
+        pattern, replacement.replace('\\', '\\\\'), value),
+    ('INTEGER', 1): lambda value: int(float(value)),
+    ('FLOAT', 1): float,
+    ('STRING', 1): lambda value: (
+        value if isinstance(value, basestring) else str(value))}
+
+AGGREGATES = {
+    ('STDDEV', 1): _StdDev,
+    ('STDDEV_SAMP', 1): _StdDev}
+
+# Matches the string literals of a query, in single or double quotes, and
+# optionally raw (r'...').
+STRING_LITERAL = re.compile(
+    r'(?:(?<!\w)[rR])?(?:\'(?:[^\'\\]|\\.)*\'|"(?:[^"\\]|\\.)*")')
+# Matches an expression (after string literals are translated) that uses
+# CONTAINS.
+CONTAINS_EXPRESSION = re.compile(
+    r'([\w.]+)\s+(NOT\s+)?CONTAINS\s+(\'(?:[^\']|\'\')*\')', re.IGNORECASE)
+EACH_KEYWORD = re.compile(r'\b(GROUP|JOIN)\s+EACH\b', re.IGNORECASE)
+
+
+def _TranslateLiteral(literal):
+  """Returns a BigQuery string literal as a SQLite string literal."""
+  if literal[0] in 'rR':
+    value = literal[2:-1]
+  else:
+    value = re.sub(r'\\(.)', r'\1', literal[1:-1])
+  return "'%s'" % value.replace("'", "''")
+
+
+class LocalSqlClient(object):
+  """Runs BigQuery queries against a SQLite database.
+
+  The client can be shared by threads; queries are run one at a time.
+  """
+
+  def __init__(self, database=':memory:', project_id=None):
+    """Opens the database.
+
+    Args:
+      database: The path of the SQLite database file, or ':memory:'.
+      project_id: Accepted for compatibility with BigQueryClient.  Table
+          references ignore the project.
+    """
+    if not sqlite3:
+      raise LocalSqlError('SQLite is not available in this environment.')
+
+    self.project_id = project_id
+    self.schemas = {}
+    self._lock = threading.Lock()
+    self._querying = False
+    self._db = sqlite3.connect(database, check_same_thread=False)
+    self._db.set_authorizer(self._Authorize)
+
+    for (name, num_args), function in FUNCTIONS.iteritems():
+      self._db.create_function(name, num_args, _NullSafe(function))
+    for (name, num_args), aggregate in AGGREGATES.iteritems():
+      self._db.create_aggregate(name, num_args, aggregate)
+
+    # Tables of an existing database get a schema from their column types.
+    for (name,) in self._db.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table'").fetchall():
+      self.schemas[name] = [
+          {'name': column[1], 'type': SQLITE_TO_FIELD_TYPES.get(
+              column[2].upper(), result_util.FieldTypes.STRING),
+           'mode': 'NULLABLE'}
+          for column in self._db.execute('PRAGMA table_info("%s")' % name)]
+
+  def _Authorize(self, action, unused_arg1, unused_arg2, unused_database,
+                 unused_trigger):
+    """Denies the actions of queries that don't only read tables."""
+    if self._querying and action not in QUERY_ACTIONS:
+      return sqlite3.SQLITE_DENY
+    return sqlite3.SQLITE_OK
+
+  @staticmethod
+  def GetTableName(dataset_name, table_name):
+    """Returns the name of the SQLite table for a BigQuery table."""
+    return '%s.%s' % (dataset_name, table_name)
+
+  def TableExists(self, dataset_name, table_name):
+    return self.GetTableName(dataset_name, table_name) in self.schemas
+
+  def CreateTable(self, dataset_name, table_name, schema):
+    """Creates (or replaces) a table.
+
+    Args:
+      dataset_name: The dataset of the table.
+      table_name: The name of the table.
+      schema: A list of BigQuery field definitions.  Only NULLABLE and
+          REQUIRED fields of the types in FIELD_TYPES_TO_SQLITE are
+          supported.
+    """
+    name = self.GetTableName(dataset_name, table_name)
+    columns = []
+    for field in schema:
+      if field.get('mode') == 'REPEATED' or field['type'] == 'RECORD':
+        raise LocalSqlError('Field %s is not supported.' % field['name'])
+      columns.append('"%s" %s' % (field['name'],
+                                  FIELD_TYPES_TO_SQLITE[field['type']]))
+
+    with self._lock:
+      self._db.execute('DROP TABLE IF EXISTS "%s"' % name)
+      self._db.execute('CREATE TABLE "%s" (%s)' % (name, ', '.join(columns)))
+      self._db.commit()
+      self.schemas[name] = schema
+
+  def LoadJson(self, dataset_name, table_name, source):
+    """Appends newline-delimited JSON rows to a table.
+
+    Args:
+      dataset_name: The dataset of the table.
+      table_name: The name of the table, created by CreateTable().
+      source: The path of the file to load, or an iterable of JSON lines.
+
+    Returns:
+      The number of rows loaded.
+    """
+    if isinstance(source, basestring):
+      with open(source, 'rb') as f:
+        return self.LoadJson(dataset_name, table_name, f)
+
+    name = self.GetTableName(dataset_name, table_name)
+    fields = self.schemas[name]
+    statement = 'INSERT INTO "%s" VALUES (%s)' % (
+        name, ', '.join('?' for _ in fields))
+    converters = [self._GetLoadConverter(field['type']) for field in fields]
+
+    rows = []
+    for line in source:
+      if not line.strip():
+        continue
+      values = json.loads(line)
+      rows.append([convert(values.get(field['name']))
+                   for field, convert in zip(fields, converters)])
+
+    with self._lock:
+      self._db.executemany(statement, rows)
+      self._db.commit()
+
+    return len(rows)
+
+  def _GetLoadConverter(self, field_type):
+    """Returns a function that converts a JSON value for a field type."""
+    if field_type == result_util.FieldTypes.TIMESTAMP:
+      def ConvertTimestamp(value):
+        if value is None:
+          return None
+        if isinstance(value, (int, float)):
+          return _UsecToTimestamp(value * USEC_PER_SEC)
+        return _ToTimestamp(_FromTimestamp(value))
+      return ConvertTimestamp
+
+    if field_type == result_util.FieldTypes.BOOLEAN:
+      return lambda value: None if value is None else int(bool(value))
+
+    return lambda value: value
+
+  def TranslateQuery(self, query):
+    """Returns a BigQuery query translated to SQLite."""
+    parts = []
+    position = 0
+    for match in STRING_LITERAL.finditer(query):
+      parts.append(self._TranslateSql(query[position:match.start()]))
+      parts.append(_TranslateLiteral(match.group(0)))
+      position = match.end()
+    parts.append(self._TranslateSql(query[position:]))
+
+    return CONTAINS_EXPRESSION.sub(self._TranslateContains, ''.join(parts))
+
+  def _TranslateSql(self, sql):
+    """Translates SQL that has no string literals."""
+    sql = EACH_KEYWORD.sub(r'\1', sql)
+
+    for name in self.schemas:
+      dataset_name, table_name = name.split('.', 1)
+      pattern = (r'\[(?:[\w.:-]+:)?{dataset}\.{table}\]|'
+                 r'(?<![\w.]){dataset}\.{table}(?![\w.])').format(
+                     dataset=re.escape(dataset_name),
+                     table=re.escape(table_name))
+      sql = re.sub(pattern, '"%s"' % name, sql)
+
+    return sql
+
+  def _TranslateContains(self, match):
+    expression = 'INSTR(%s, %s) > 0' % (match.group(1), match.group(3))
+    if match.group(2):
+      expression = 'NOT ' + expression
+    return expression
+
+  def Query(self, query, timeout=None, max_results_per_page=None,
+            cache_duration=None, use_cache=True, timestamp_mode=None):
+    """Issues a query and returns the results in the BigQuery format."""
+    return self.QueryResultSet(query, timestamp_mode=timestamp_mode).ToReply()
+
+  def QueryResultSet(self, query, timeout=None, max_results_per_page=None,
+                     cache_duration=None, use_cache=True, timestamp_mode=None):
+    """Issues a query and returns the results as a ResultSet.
+
+    Args:
+      query: The BigQuery SQL to run.
+      timeout: Unused, for compatibility with BigQueryClient.
+      max_results_per_page: Unused, for compatibility with BigQueryClient.
+      cache_duration: Unused, for compatibility with BigQueryClient.
+      use_cache: Unused, for compatibility with BigQueryClient.
+      timestamp_mode: One of big_query_result_util.TimestampModes.All().
+
+    Returns:
+      A big_query_result_set.ResultSet.
+
+    Raises:
+      LocalSqlError: If the query can't be translated or run.
+    """
+    sql = self.TranslateQuery(query)
+
+    with self._lock:
+      self._querying = True
+      try:
+        cursor = self._db.execute(sql)
+        rows = cursor.fetchall()
+      except (sqlite3.Error, ValueError) as err:
+        raise LocalSqlError(str(err), query)
+      finally:
+        self._querying = False
+
+      names = [column[0] for column in cursor.description or []]
+
+    columns = [list(column) for column in zip(*rows)] if rows else [
+        [] for _ in names]
+    fields = []
+
+    for name, column in zip(names, columns):
+      field_type = self._GetFieldType(name, column)
+      fields.append({'name': name, 'type': field_type, 'mode': 'NULLABLE'})
+      column[:] = [self._GetTypedValue(field_type, value, timestamp_mode)
+                   for value in column]
+
+    result = result_set_lib.ResultSet(
+        fields=fields, columns=columns,
+        metadata={'jobReference': {'projectId': self.project_id,
+                                   'jobId': '0'},
+                  'jobComplete': True,
+                  'totalRows': len(rows)})
+    result.Compact()
+
+    return result
+
+  def _GetFieldType(self, name, column):
+    """Returns the BigQuery type of a result column.
+
+    The type is inferred from the values, and from the schema of a table
+    field with the same name (for BOOLEAN and empty columns).
+    """
+    values = [value for value in column if value is not None]
+
+    if values and all(isinstance(value, basestring) and
+                      TIMESTAMP_PATTERN.match(value) for value in values):
+      return result_util.FieldTypes.TIMESTAMP
+
+    schema_type = None
+    for schema in self.schemas.itervalues():
+      for field in schema:
+        if field['name'] == name:
+          schema_type = field['type']
+
+    if not values:
+      return schema_type or result_util.FieldTypes.STRING
+
+    if all(isinstance(value, (int, long)) for value in values):
+      if schema_type in (result_util.FieldTypes.BOOLEAN,
+                         result_util.FieldTypes.FLOAT):
+        return schema_type
+      return result_util.FieldTypes.INTEGER
+
+    if all(isinstance(value, (int, long, float)) for value in values):
+      return result_util.FieldTypes.FLOAT
+
+    return result_util.FieldTypes.STRING
+
+  def _GetTypedValue(self, field_type, value, timestamp_mode):
+    if value is None:
+      return None
+
+    if field_type == result_util.FieldTypes.TIMESTAMP:
+      value = _FromTimestamp(value)
+      if timestamp_mode == result_util.TimestampModes.EPOCH_MS:
+        return result_util.GetEpochMilliseconds(value)
+      return value.isoformat(' ')
+
+    if field_type == result_util.FieldTypes.BOOLEAN:
+      return bool(value)
+    if field_type == result_util.FieldTypes.FLOAT:
+      return float(value)
+    if field_type == result_util.FieldTypes.INTEGER:
+      return int(value)
+
+    return value
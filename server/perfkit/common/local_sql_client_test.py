@@ -0,0 +1,138 @@
+"""Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Unit tests for the SQLite-backed local data client."""
+
+__author__ = 'joemu@google.com (Joe Allan Muharsky)'
+
+import json
+import unittest
+
+from perfkit.common import big_query_result_util as result_util
+from perfkit.common import local_sql_client
+
+
+SCHEMA = [{'name': 'product_name', 'type': 'STRING', 'mode': 'NULLABLE'},
+          {'name': 'official', 'type': 'BOOLEAN', 'mode': 'NULLABLE'},
+          {'name': 'labels', 'type': 'STRING', 'mode': 'NULLABLE'},
+          {'name': 'value', 'type': 'FLOAT', 'mode': 'NULLABLE'},
+          {'name': 'timestamp', 'type': 'FLOAT', 'mode': 'NULLABLE'}]
+
+ROWS = [
+    {'product_name': 'widget-factory', 'official': True,
+     'labels': '|cloud:GCP||zone:a|', 'value': 2, 'timestamp': 1388534400},
+    {'product_name': 'widget-factory', 'official': False,
+     'labels': '|cloud:AWS|', 'value': 4.5, 'timestamp': 1388620800.5},
+    {'product_name': 'gadget-works', 'official': True,
+     'labels': '|cloud:GCP|', 'value': None, 'timestamp': 1388620800}]
+
+
+class LocalSqlClientTest(unittest.TestCase):
+
+  def setUp(self):
+    self.client = local_sql_client.LocalSqlClient()
+    self.client.CreateTable('samples_mart', 'results', SCHEMA)
+    self.client.LoadJson('samples_mart', 'results',
+                         [json.dumps(row) for row in ROWS])
+
+  def testQueryReturnsBigQueryReply(self):
+    reply = self.client.Query(
+        'SELECT product_name, COUNT(*) AS count, AVG(value) AS avg '
+        'FROM [my-project:samples_mart.results] '
+        'GROUP EACH BY product_name ORDER BY product_name')
+
+    self.assertEqual(
+        [{'name': 'product_name', 'type': 'STRING', 'mode': 'NULLABLE'},
+         {'name': 'count', 'type': 'INTEGER', 'mode': 'NULLABLE'},
+         {'name': 'avg', 'type': 'FLOAT', 'mode': 'NULLABLE'}],
+        reply['schema']['fields'])
+    self.assertEqual(
+        [{'f': [{'v': 'gadget-works'}, {'v': 1}, {'v': None}]},
+         {'f': [{'v': 'widget-factory'}, {'v': 2}, {'v': 3.25}]}],
+        reply['rows'])
+    self.assertEqual(2, reply['totalRows'])
+
+  def testQueryTypesSchemaFields(self):
+    result = self.client.QueryResultSet(
+        'SELECT official FROM samples_mart.results WHERE value IS NOT NULL')
+
+    self.assertEqual('BOOLEAN', result.fields[0]['type'])
+    self.assertEqual([True, False], result.columns[0])
+
+  def testQueryTimestampFunctions(self):
+    query = (
+        'SELECT USEC_TO_TIMESTAMP(UTC_USEC_TO_DAY(INTEGER(timestamp * '
+        '1000000))) AS day, COUNT(*) AS count '
+        'FROM [samples_mart.results] '
+        'WHERE timestamp >= TIMESTAMP_TO_SEC(TIMESTAMP("2014-01-02")) AND '
+        'timestamp < TIMESTAMP_TO_SEC(DATE_ADD(TIMESTAMP("2014-01-02"), 1, '
+        '"DAY")) '
+        'GROUP BY day')
+
+    result = self.client.QueryResultSet(query)
+    self.assertEqual('TIMESTAMP', result.fields[0]['type'])
+    self.assertEqual(['2014-01-02 00:00:00'], result.columns[0])
+    self.assertEqual([2], list(result.columns[1]))
+
+    result = self.client.QueryResultSet(
+        query, timestamp_mode=result_util.TimestampModes.EPOCH_MS)
+    self.assertEqual([1388620800000], list(result.columns[0]))
+
+  def testQueryStringFunctions(self):
+    result = self.client.QueryResultSet(
+        'SELECT REGEXP_EXTRACT(labels, r\'\\|cloud:([^|]*)\\|\') AS cloud '
+        'FROM [samples_mart.results] '
+        'WHERE labels CONTAINS "zone:" OR product_name = "gadget-works" '
+        'ORDER BY cloud')
+
+    self.assertEqual(['GCP', 'GCP'], result.columns[0])
+
+  def testQueryEmptyResult(self):
+    result = self.client.QueryResultSet(
+        'SELECT product_name, value FROM [samples_mart.results] '
+        'WHERE product_name = "none"')
+
+    self.assertEqual(['STRING', 'FLOAT'],
+                     [field['type'] for field in result.fields])
+    self.assertEqual(0, result.num_rows)
+
+  def testQueryErrors(self):
+    self.assertRaises(local_sql_client.LocalSqlError,
+                      self.client.Query, 'SELECT foo FROM [samples_mart.bar]')
+    self.assertRaises(local_sql_client.LocalSqlError,
+                      self.client.Query,
+                      'SELECT TIMESTAMP(product_name) AS t '
+                      'FROM [samples_mart.results]')
+
+  def testQueryCanOnlyReadTables(self):
+    for sql in ("ATTACH DATABASE '/tmp/other.db' AS other",
+                'PRAGMA table_info("samples_mart.results")',
+                'DELETE FROM [samples_mart.results]'):
+      self.assertRaises(local_sql_client.LocalSqlError, self.client.Query, sql)
+
+    reply = self.client.Query('SELECT COUNT(*) FROM [samples_mart.results]')
+    self.assertEqual(3, reply['rows'][0]['f'][0]['v'])
+
+  def testSharedClientLoadsSamplesMart(self):
+    client = local_sql_client.GetSharedClient()
+
+    self.assertIs(client, local_sql_client.GetSharedClient())
+    self.assertTrue(client.TableExists('samples_mart', 'results'))
+
+    reply = client.Query('SELECT COUNT(*) AS count FROM samples_mart.results')
+    self.assertEqual(3613, reply['rows'][0]['f'][0]['v'])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -22,6 +22,7 @@ __author__ = "joemu@google.com (Joe Allan Muharsky)"
 
 import big_query_client
 import credentials_lib
+import timing_util
 
 
 class MockBigQueryClient(big_query_client.BigQueryClient):
@@ -42,20 +43,24 @@ class MockBigQueryClient(big_query_client.BigQueryClient):
                                              env=env)
 
   def Query(self, query, timeout=None, max_results_per_page=None,
-            use_cache=False):
+            use_cache=False, sampler=None, timestamp_mode=None):
     if use_cache and (self.last_query == query):
       return self.last_reply
 
     self.last_query = query
 
     return super(MockBigQueryClient, self).Query(query, timeout,
-                                                 max_results_per_page)
+                                                 max_results_per_page,
+                                                 sampler=sampler,
+                                                 timestamp_mode=timestamp_mode)
 
   def _ExecuteRequestWithRetries(self, request):
-    self.last_request = request
+    # Requests are timed as for the real client.
+    with timing_util.Span('bigquery'):
+      self.last_request = request
 
-    self.last_reply = self.mock_reply
-    return self.mock_reply
+      self.last_reply = self.mock_reply
+      return self.mock_reply
 
   def HasCache(self):
     return self.use_cache
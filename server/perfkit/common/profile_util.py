@@ -0,0 +1,156 @@
+"""Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Serializes and formats cProfile results.
+
+Profiles are stored in the marshal format that pstats reads and
+Profile.dump_stats() writes, so a downloaded profile can be opened with the
+standard tools:
+
+    data = profile_util.GetStatsData(profiler)
+    ...
+    python -m pstats request.pstats
+
+They can also be formatted as text (like pstats' print_stats()) or as
+collapsed stacks, the input format of flamegraph.pl and speedscope:
+
+    stats = profile_util.LoadStats(data)
+    print profile_util.GetCollapsedStacks(stats)
+
+cProfile records the callers of each function rather than whole stacks, so
+the collapsed stacks are estimated: the time of a function is split between
+its callers in proportion to the time spent in it from each caller.
+"""
+
+__author__ = 'joemu@google.com (Joe Allan Muharsky)'
+
+import marshal
+import pstats
+import StringIO
+
+
+# Stacks deeper than this are truncated.
+MAX_STACK_DEPTH = 100
+# Stack entries estimated at less than this many microseconds are dropped.
+MIN_STACK_USEC = 1
+
+
+class _StatsData(object):
+  """Provides the stats dict of a profile in the form pstats.Stats loads."""
+
+  def __init__(self, stats):
+    self.stats = stats
+
+  def create_stats(self):
+    pass
+
+
+def GetStatsData(profiler):
+  """Returns the stats of a cProfile.Profile, in the marshal format."""
+  profiler.create_stats()
+  return marshal.dumps(profiler.stats)
+
+
+def LoadStats(data):
+  """Returns a pstats.Stats for data from GetStatsData()."""
+  return pstats.Stats(_StatsData(marshal.loads(data)),
+                      stream=StringIO.StringIO())
+
+
+def GetStatsText(stats, sort='cumulative', limit=100):
+  """Returns the stats as text, in the format of pstats' print_stats().
+
+  Args:
+    stats: A pstats.Stats.
+    sort: The pstats sort key, such as 'cumulative', 'tottime' or 'calls'.
+    limit: The maximum number of functions to include.
+  """
+  output = StringIO.StringIO()
+  stats.stream = output
+  stats.sort_stats(sort).print_stats(limit)
+  stats.print_callers(limit // 4)
+
+  return output.getvalue()
+
+
+def GetFunctionName(func):
+  """Returns a name for a pstats function key, for a stack frame.
+
+  Args:
+    func: A (filename, line number, function name) tuple.
+  """
+  filename, line, name = func
+  if filename == '~':
+    # Built-in functions, such as '<len>'.
+    label = name
+  else:
+    label = '%s (%s:%d)' % (name, filename, line)
+
+  # ';' separates frames, and ' ' separates the stack from its count.
+  return label.replace(';', ':').replace(' ', '_')
+
+
+def GetCollapsedStacks(stats):
+  """Returns the estimated stacks of a profile, in the collapsed format.
+
+  Each line is a stack of frames (root first) separated by semicolons, and the
+  microseconds spent in the last frame of the stack:
+
+      main;Dispatch;Query 1200
+
+  Args:
+    stats: A pstats.Stats.
+
+  Returns:
+    A string, with one stack per line.
+  """
+  # The (calls, primitive calls, inline time, cumulative time) of each
+  # caller -> callee edge.
+  callees = {}
+  for func, (_, _, _, _, callers) in stats.stats.iteritems():
+    for caller, caller_stats in callers.iteritems():
+      callees.setdefault(caller, []).append((func, caller_stats))
+
+  roots = [func for func, func_stats in stats.stats.iteritems()
+           if not func_stats[4]]
+  stacks = {}
+
+  def Walk(func, funcs, stack, fraction):
+    """Adds the time of func (scaled by fraction), then walks its callees."""
+    funcs = funcs + (func,)
+    stack = stack + (GetFunctionName(func),)
+
+    usec = stats.stats[func][2] * fraction * 1e6
+    if usec >= MIN_STACK_USEC:
+      stacks[stack] = stacks.get(stack, 0) + usec
+
+    if len(stack) >= MAX_STACK_DEPTH:
+      return
+
+    for callee, (_, _, _, edge_time) in callees.get(func, []):
+      callee_time = stats.stats[callee][3]
+      # Recursive calls are already included in the time of the caller.
+      if not callee_time or callee in funcs:
+        continue
+
+      # The share of the callee's time spent on this stack.
+      callee_fraction = fraction * edge_time / callee_time
+      if callee_fraction * callee_time * 1e6 >= MIN_STACK_USEC:
+        Walk(callee, funcs, stack, callee_fraction)
+
+  for root in roots:
+    Walk(root, (), (), 1.0)
+
+  return ''.join('%s %d\n' % (';'.join(stack), round(usec))
+                 for stack, usec in sorted(stacks.iteritems()))
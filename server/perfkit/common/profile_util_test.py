@@ -0,0 +1,73 @@
+"""Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Tests for the profile_util module."""
+
+__author__ = 'joemu@google.com (Joe Allan Muharsky)'
+
+import cProfile
+import unittest
+
+from perfkit.common import profile_util
+
+
+def _Inner():
+  return sum(x * x for x in xrange(20000))
+
+
+def _Outer():
+  return [_Inner() for _ in xrange(5)]
+
+
+class ProfileUtilTest(unittest.TestCase):
+
+  def setUp(self):
+    profiler = cProfile.Profile()
+    profiler.runcall(_Outer)
+    self.data = profile_util.GetStatsData(profiler)
+
+  def testLoadStats(self):
+    stats = profile_util.LoadStats(self.data)
+    names = [func[2] for func in stats.stats]
+
+    self.assertIn('_Outer', names)
+    self.assertIn('_Inner', names)
+
+  def testGetStatsText(self):
+    text = profile_util.GetStatsText(profile_util.LoadStats(self.data))
+
+    self.assertIn('function calls', text)
+    self.assertIn('_Inner', text)
+
+  def testGetCollapsedStacks(self):
+    stacks = profile_util.GetCollapsedStacks(
+        profile_util.LoadStats(self.data))
+    lines = [line.rsplit(' ', 1) for line in stacks.splitlines()]
+
+    inner_stacks = [stack for stack, _ in lines
+                    if stack.split(';')[-1].startswith('_Inner')]
+    self.assertTrue(inner_stacks)
+    for stack in inner_stacks:
+      self.assertTrue(stack.split(';')[-2].startswith('_Outer'))
+    for _, usec in lines:
+      self.assertGreaterEqual(int(usec), profile_util.MIN_STACK_USEC)
+
+  def testGetFunctionName(self):
+    self.assertEqual('<len>', profile_util.GetFunctionName(('~', 0, '<len>')))
+    self.assertEqual('Get_(a_b.py:3)',
+                     profile_util.GetFunctionName(('a b.py', 3, 'Get')))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,126 @@
+"""Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Records how long each stage of a request takes.
+
+A Timings object accumulates the elapsed time of named stages ("spans"):
+
+    timings = timing_util.Timings()
+    with timings.Span('parse'):
+      ...
+
+Code that doesn't have access to the request's Timings (such as the data
+clients) uses the module-level Span(), which records into the Timings that is
+active on the current thread, and does nothing when there is none:
+
+    with timing_util.Span('bigquery'):
+      reply = request.execute()
+
+Spans with the same name are added together, and spans can overlap (for
+example, 'bigquery' requests made while reading a page of results).  The
+stages are reported in milliseconds, as a Server-Timing header and as a dict.
+"""
+
+__author__ = 'joemu@google.com (Joe Allan Muharsky)'
+
+import collections
+import contextlib
+import json
+import logging
+import threading
+import time
+
+
+_active = threading.local()
+
+
+class Timings(object):
+  """The elapsed time of the named stages of a request."""
+
+  def __init__(self):
+    self.start_time = time.time()
+    self.context = {}
+    self._stages = collections.OrderedDict()
+
+  def __len__(self):
+    return len(self._stages)
+
+  @contextlib.contextmanager
+  def Span(self, name):
+    """Adds the time spent in the with block to the stage name."""
+    start_time = time.time()
+    try:
+      yield
+    finally:
+      self.Add(name, time.time() - start_time)
+
+  def Add(self, name, seconds):
+    """Adds a number of seconds to the stage name."""
+    self._stages[name] = self._stages.get(name, 0) + seconds
+
+  def GetTotal(self):
+    """Returns the milliseconds elapsed since the Timings was created."""
+    return round((time.time() - self.start_time) * 1000, 1)
+
+  def ToDict(self):
+    """Returns an ordered dict of stage name to elapsed milliseconds."""
+    return collections.OrderedDict(
+        (name, round(seconds * 1000, 1))
+        for name, seconds in self._stages.iteritems())
+
+  def GetServerTimingHeader(self):
+    """Returns the stages (and total) as a Server-Timing header value."""
+    stages = self.ToDict()
+    stages['total'] = self.GetTotal()
+
+    return ', '.join('%s;dur=%.1f' % (name, duration)
+                     for name, duration in stages.iteritems())
+
+  def Log(self, path):
+    """Logs the stages as a single JSON line, for aggregation.
+
+    The line is prefixed with 'timings ', and includes the path and total,
+    and any entries added to the context dict (such as the widget id).
+    """
+    entry = dict(self.context)
+    entry.update({'path': path, 'total': self.GetTotal(),
+                  'stages': self.ToDict()})
+
+    logging.info('timings %s', json.dumps(entry, sort_keys=True))
+
+  def Activate(self):
+    """Makes this the Timings that Span() records into on this thread."""
+    _active.timings = self
+
+  def Deactivate(self):
+    """Stops Span() from recording into this Timings."""
+    if GetActiveTimings() is self:
+      _active.timings = None
+
+
+def GetActiveTimings():
+  """Returns the Timings active on the current thread, or None."""
+  return getattr(_active, 'timings', None)
+
+
+@contextlib.contextmanager
+def Span(name):
+  """Records the with block as stage name of the active Timings, if any."""
+  timings = GetActiveTimings()
+
+  if timings is None:
+    yield
+  else:
+    with timings.Span(name):
+      yield
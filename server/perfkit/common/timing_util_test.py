@@ -0,0 +1,91 @@
+"""Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Tests for the timing_util module."""
+
+__author__ = 'joemu@google.com (Joe Allan Muharsky)'
+
+import json
+import unittest
+
+import mock
+
+from perfkit.common import timing_util
+
+
+class TimingsTest(unittest.TestCase):
+
+  def testAddAccumulatesStages(self):
+    timings = timing_util.Timings()
+    timings.Add('cache', 0.001)
+    timings.Add('bigquery', 0.25)
+    timings.Add('cache', 0.0005)
+
+    self.assertEqual([('cache', 1.5), ('bigquery', 250.0)],
+                     timings.ToDict().items())
+
+  def testSpan(self):
+    timings = timing_util.Timings()
+
+    with mock.patch('time.time', side_effect=[10.0, 10.125]):
+      with timings.Span('parse'):
+        pass
+
+    self.assertEqual({'parse': 125.0}, timings.ToDict())
+
+  def testModuleSpanUsesActiveTimings(self):
+    timings = timing_util.Timings()
+
+    with timing_util.Span('ignored'):
+      pass
+
+    timings.Activate()
+    try:
+      self.assertIs(timings, timing_util.GetActiveTimings())
+      with timing_util.Span('bigquery'):
+        pass
+    finally:
+      timings.Deactivate()
+
+    with timing_util.Span('ignored'):
+      pass
+
+    self.assertIsNone(timing_util.GetActiveTimings())
+    self.assertEqual(['bigquery'], timings.ToDict().keys())
+
+  def testGetServerTimingHeader(self):
+    timings = timing_util.Timings()
+    timings.Add('cache', 0.002)
+    timings.Add('bigquery', 1.5)
+
+    with mock.patch.object(timings, 'GetTotal', return_value=1510.25):
+      self.assertEqual('cache;dur=2.0, bigquery;dur=1500.0, total;dur=1510.2',
+                       timings.GetServerTimingHeader())
+
+  def testLog(self):
+    timings = timing_util.Timings()
+    timings.context['widget_id'] = '3'
+    timings.Add('bigquery', 0.5)
+
+    with mock.patch('logging.info') as log:
+      timings.Log('/data/sql')
+
+    entry = json.loads(log.call_args[0][1])
+    self.assertEqual('/data/sql', entry['path'])
+    self.assertEqual('3', entry['widget_id'])
+    self.assertEqual({'bigquery': 500.0}, entry['stages'])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,436 @@
+"""Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+End-to-end benchmarks of the Explorer server, over synthetic results.
+
+Rows are generated with samples_mart.sample_generator, and each stage of
+serving them is timed separately:
+  * generate: generating the rows.
+  * typing: converting a BigQuery reply (string values) to a ResultSet.
+  * paging: sorting the ResultSet and slicing a page of it.
+  * pivot: pivoting the values by product_name, with an average.
+  * datatable: formatting the ResultSet as a GViz DataTable.
+  * json: encoding the reply and DataTable as RenderJson() does.
+  * labels: parsing the packed labels column into a LabelManager.
+  * list_dashboards: serving /dashboard/list over --dashboards dashboards
+    (requires the App Engine SDK).
+
+Each benchmark runs in its own process, and reports the items it processed
+per second and the peak memory it used (above the memory of its inputs).  The
+results can be written to a JSON baseline, and compared to an earlier one:
+
+    python -m perfkit.explorer.explorer_benchmark --rows=100000 \\
+        --output=baseline.json
+    python -m perfkit.explorer.explorer_benchmark --rows=100000 \\
+        --baseline=baseline.json
+
+The comparison exits with status 1 if a benchmark's throughput dropped, or
+its memory grew, by more than --tolerance.
+"""
+
+__author__ = 'joemu@google.com (Joe Allan Muharsky)'
+
+import argparse
+import collections
+import contextlib
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+
+from perfkit.common import big_query_result_pivot
+from perfkit.common import big_query_result_set as result_set_lib
+from perfkit.common import big_query_result_util as result_util
+from perfkit.explorer.samples_mart import label_manager
+from perfkit.explorer.samples_mart import sample_generator
+
+
+# The fields of the benchmarked query results.
+FIELDS = [{'name': 'product_name', 'type': 'STRING', 'mode': 'NULLABLE'},
+          {'name': 'test', 'type': 'STRING', 'mode': 'NULLABLE'},
+          {'name': 'metric', 'type': 'STRING', 'mode': 'NULLABLE'},
+          {'name': 'owner', 'type': 'STRING', 'mode': 'NULLABLE'},
+          {'name': 'official', 'type': 'BOOLEAN', 'mode': 'NULLABLE'},
+          {'name': 'labels', 'type': 'STRING', 'mode': 'NULLABLE'},
+          {'name': 'value', 'type': 'FLOAT', 'mode': 'NULLABLE'},
+          {'name': 'timestamp', 'type': 'TIMESTAMP', 'mode': 'NULLABLE'}]
+
+PAGE_SIZE = 100
+
+# Memory changes smaller than this are not reported as regressions.
+MIN_MEMORY_REGRESSION_KB = 1024
+
+
+class Context(object):
+  """The inputs of a benchmark, and the measurement of its timed section."""
+
+  def __init__(self, args):
+    self.args = args
+    self.items = None
+    self.seconds = None
+    self.peak_memory_kb = None
+
+  def GetGenerator(self):
+    return sample_generator.SampleGenerator(
+        num_products=self.args.products, num_tests=self.args.tests,
+        num_metrics=self.args.metrics, label_skew=self.args.label_skew,
+        seed=self.args.seed)
+
+  def GetRows(self):
+    """Returns the generated rows, as a list of dicts."""
+    return list(self.GetGenerator().GenerateRows(self.args.rows))
+
+  def GetReplyRows(self):
+    """Returns the rows as BigQuery returns them, with string values."""
+    reply_rows = []
+    for row in self.GetRows():
+      values = []
+      for field in FIELDS:
+        value = row[field['name']]
+        if isinstance(value, bool):
+          value = str(value).lower()
+        elif not isinstance(value, basestring):
+          value = repr(value)
+        values.append({'v': value})
+      reply_rows.append({'f': values})
+
+    return reply_rows
+
+  def GetResultSet(self):
+    """Returns the rows as a typed ResultSet."""
+    result = result_set_lib.ResultSet(fields=FIELDS)
+    result.AddReplyRows(self.GetReplyRows())
+    result.metadata = {'totalRows': result.num_rows}
+    result.Compact()
+
+    return result
+
+  @contextlib.contextmanager
+  def Timed(self, items):
+    """Measures the time and memory used by the enclosed code.
+
+    Args:
+      items: The number of items (rows, dashboards) the code processes.
+    """
+    _ResetPeakMemory()
+    start_memory_kb = _GetMemoryKb('VmRSS')
+    start = time.time()
+    yield
+    self.seconds = time.time() - start
+    self.items = items
+    self.peak_memory_kb = max(0, _GetMemoryKb('VmHWM') - start_memory_kb)
+
+
+def _ResetPeakMemory():
+  """Resets the peak resident memory of the process to its current size.
+
+  This is supported by Linux 4.0 and later.  Elsewhere, the peak includes the
+  memory used to build the benchmark's inputs.
+  """
+  try:
+    with open('/proc/self/clear_refs', 'wb') as clear_refs:
+      clear_refs.write('5')
+  except IOError:
+    pass
+
+
+def _GetMemoryKb(name):
+  """Returns a memory size of the process, in KB.
+
+  Args:
+    name: 'VmRSS' for the current resident memory, or 'VmHWM' for the peak.
+  """
+  try:
+    with open('/proc/self/status') as status:
+      for line in status:
+        if line.startswith(name + ':'):
+          return int(line.split()[1])
+  except IOError:
+    pass
+
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # ru_maxrss is in bytes on Mac OS, and KB elsewhere.
+  if sys.platform == 'darwin':
+    peak //= 1024
+  return peak
+
+
+def BenchmarkGenerate(context):
+  generator = context.GetGenerator()
+
+  with context.Timed(context.args.rows):
+    for _ in generator.GenerateRows(context.args.rows):
+      pass
+
+
+def BenchmarkTyping(context):
+  reply_rows = context.GetReplyRows()
+  result = result_set_lib.ResultSet(fields=FIELDS)
+
+  with context.Timed(len(reply_rows)):
+    result.AddReplyRows(reply_rows)
+    result.Compact()
+
+
+def BenchmarkPaging(context):
+  result = context.GetResultSet()
+
+  with context.Timed(result.num_rows):
+    page = result.Copy()
+    page.Sort('value', descending=True)
+    page.Slice(result.num_rows // 2, PAGE_SIZE)
+
+
+def BenchmarkPivot(context):
+  result = context.GetResultSet()
+
+  with context.Timed(result.num_rows):
+    transformer = big_query_result_pivot.BigQueryPivotTransformer(
+        reply=result.Copy(), rows_name=['test', 'metric'],
+        columns_name='product_name', values_name='value',
+        aggregation=big_query_result_pivot.Aggregations.AVG)
+    transformer.Transform()
+
+
+def BenchmarkDataTable(context):
+  result = context.GetResultSet()
+
+  with context.Timed(result.num_rows):
+    result_util.ReplyFormatter.RowsToDataTableFormat(result)
+
+
+def BenchmarkJson(context):
+  # The handlers' encoder handles dates and other types that json doesn't.
+  # pylint: disable=g-import-not-at-top
+  from perfkit.explorer.handlers import base
+  # pylint: enable=g-import-not-at-top
+
+  result = context.GetResultSet()
+  response = result.ToReply()
+  response['results'] = result_util.ReplyFormatter.RowsToDataTableFormat(
+      result)
+
+  # pylint: disable=protected-access
+  encoder = base._JsonEncoder(sort_keys=True)
+  # pylint: enable=protected-access
+
+  with context.Timed(result.num_rows):
+    encoder.encode(response)
+
+
+def BenchmarkLabels(context):
+  labels = [row['labels'] for row in context.GetRows()]
+
+  with context.Timed(len(labels)):
+    label_manager.LabelManager().ImportColumn(labels)
+
+
+def BenchmarkListDashboards(context):
+  # pylint: disable=g-import-not-at-top
+  import webtest
+  from google.appengine.ext import testbed
+
+  from perfkit.explorer.handlers import dashboard
+  from perfkit.explorer.model import dashboard as dashboard_model
+  from perfkit.explorer.model import explorer_config
+  # pylint: enable=g-import-not-at-top
+
+  bed = testbed.Testbed()
+  bed.activate()
+  bed.init_datastore_v3_stub()
+  bed.init_memcache_stub()
+  bed.init_user_stub()
+  os.environ['USER_EMAIL'] = 'benchmark@example.com'
+  os.environ['USER_ID'] = '1'
+
+  try:
+    config = explorer_config.ExplorerConfigModel.Get()
+    config.grant_view_to_public = True
+    config.grant_save_to_public = True
+    config.put()
+
+    generator = context.GetGenerator()
+    now = datetime.datetime.now()
+    for index in xrange(context.args.dashboards):
+      owner = '%s@example.com' % generator.random.choice(generator.owners)
+      title = 'Dashboard %d' % index
+      dashboard_model.Dashboard(
+          title=title, created_date=now, modified_date=now,
+          data=json.dumps({'title': title, 'owner': owner,
+                           'children': []})).put()
+    # The dashboards have the list properties, so they are listed with a
+    # projection query.
+    dashboard_model.DashboardListState.SetUpdated()
+
+    app = webtest.TestApp(dashboard.app)
+
+    with context.Timed(context.args.dashboards):
+      cursor = None
+      while True:
+        resp = app.get('/dashboard/list', params={'cursor': cursor or ''})
+        cursor = resp.json['cursor']
+        if not cursor:
+          break
+  finally:
+    bed.deactivate()
+
+
+BENCHMARKS = collections.OrderedDict([
+    ('generate', BenchmarkGenerate),
+    ('typing', BenchmarkTyping),
+    ('paging', BenchmarkPaging),
+    ('pivot', BenchmarkPivot),
+    ('datatable', BenchmarkDataTable),
+    ('json', BenchmarkJson),
+    ('labels', BenchmarkLabels),
+    ('list_dashboards', BenchmarkListDashboards)])
+
+
+def _RunInProcess(name, args, queue):
+  """Runs a benchmark, and puts its results (or error) on the queue."""
+  context = Context(args)
+  try:
+    BENCHMARKS[name](context)
+  except Exception as err:  # pylint: disable=broad-except
+    queue.put({'error': '%s: %s' % (type(err).__name__, err)})
+    return
+
+  queue.put({'items': context.items,
+             'seconds': round(context.seconds, 4),
+             'items_per_second': round(context.items /
+                                       max(context.seconds, 1e-9), 1),
+             'peak_memory_kb': context.peak_memory_kb})
+
+
+def RunBenchmark(name, args):
+  """Runs a benchmark in a new process.
+
+  Returns:
+    A dict with 'items', 'seconds', 'items_per_second' and 'peak_memory_kb',
+    or with an 'error' if the benchmark failed.
+  """
+  queue = multiprocessing.Queue()
+  process = multiprocessing.Process(target=_RunInProcess,
+                                    args=(name, args, queue))
+  process.start()
+  process.join()
+
+  if queue.empty():
+    return {'error': 'The benchmark exited with code %s.' % process.exitcode}
+  return queue.get()
+
+
+def CompareToBaseline(results, baseline, tolerance):
+  """Returns the regressions of results against a baseline.
+
+  Args:
+    results: The 'benchmarks' dict of the current run.
+    baseline: The 'benchmarks' dict of the baseline.
+    tolerance: The fraction that throughput can drop, or memory can grow,
+        before it is reported.
+
+  Returns:
+    A list of messages describing the regressions.
+  """
+  regressions = []
+
+  for name, result in results.iteritems():
+    expected = baseline.get(name)
+    if not expected or 'error' in expected:
+      continue
+
+    if 'error' in result:
+      regressions.append('%s: %s' % (name, result['error']))
+      continue
+
+    if (result['items_per_second'] <
+        expected['items_per_second'] * (1 - tolerance)):
+      regressions.append('%s: %.1f items/s, was %.1f items/s' % (
+          name, result['items_per_second'], expected['items_per_second']))
+
+    if (result['peak_memory_kb'] >
+        expected['peak_memory_kb'] * (1 + tolerance) and
+        result['peak_memory_kb'] - expected['peak_memory_kb'] >=
+        MIN_MEMORY_REGRESSION_KB):
+      regressions.append('%s: %d KB peak memory, was %d KB' % (
+          name, result['peak_memory_kb'], expected['peak_memory_kb']))
+
+  return regressions
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+  parser.add_argument('--rows', type=int, default=100000)
+  parser.add_argument('--dashboards', type=int, default=1000)
+  parser.add_argument('--products', type=int, default=5)
+  parser.add_argument('--tests', type=int, default=20)
+  parser.add_argument('--metrics', type=int, default=8)
+  parser.add_argument('--label_skew', type=float, default=1.2)
+  parser.add_argument('--seed', type=int, default=1)
+  parser.add_argument('--benchmarks', default=','.join(BENCHMARKS),
+                      help='A comma-separated list of benchmarks to run.')
+  parser.add_argument('--output', help='The JSON file to write results to.')
+  parser.add_argument('--baseline', help='A JSON file to compare results to.')
+  parser.add_argument('--tolerance', type=float, default=0.2)
+  args = parser.parse_args()
+
+  names = [name for name in args.benchmarks.split(',') if name]
+  for name in names:
+    if name not in BENCHMARKS:
+      parser.error('Unknown benchmark: %s' % name)
+
+  results = collections.OrderedDict()
+  print '%-16s %10s %10s %14s %12s' % ('benchmark', 'items', 'seconds',
+                                       'items/s', 'peak KB')
+  for name in names:
+    result = RunBenchmark(name, args)
+    results[name] = result
+
+    if 'error' in result:
+      print '%-16s %s' % (name, result['error'])
+    else:
+      print '%-16s %10d %10.3f %14.1f %12d' % (
+          name, result['items'], result['seconds'],
+          result['items_per_second'], result['peak_memory_kb'])
+
+  if args.output:
+    with open(args.output, 'wb') as output:
+      json.dump({'created': datetime.datetime.utcnow().isoformat(),
+                 'python': platform.python_version(),
+                 'platform': platform.platform(),
+                 'args': vars(args),
+                 'benchmarks': results},
+                output, indent=2, sort_keys=True)
+      output.write('\n')
+
+  if args.baseline:
+    with open(args.baseline, 'rb') as baseline_file:
+      baseline = json.load(baseline_file)
+
+    regressions = CompareToBaseline(results, baseline['benchmarks'],
+                                    args.tolerance)
+    for regression in regressions:
+      print 'REGRESSION %s' % regression
+
+    if regressions:
+      sys.exit(1)
+
+
+if __name__ == '__main__':
+  main()
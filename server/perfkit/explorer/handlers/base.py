@@ -21,9 +21,13 @@ paths and authentication.
 
 __author__ = 'joemu@google.com (Joe Allan Muharsky)'
 
+import cProfile
 import datetime
 import json
+import logging
 import os
+import time
+import uuid
 
 import jinja2
 import webapp2
@@ -32,7 +36,10 @@ from google.appengine.api import users
 
 from perfkit.common import data_source_config
 from perfkit.common import http_util
+from perfkit.common import profile_util
+from perfkit.common import timing_util
 from perfkit.explorer.model import explorer_config
+from perfkit.explorer.model import request_profile
 
 
 _TEMPLATES_PATH = os.path.join(os.path.dirname(__file__), 'templates')
@@ -42,6 +49,7 @@ _JINJA_ENVIRONMENT = jinja2.Environment(
     variable_start_string='[[', variable_end_string=']]',
     loader=jinja2.FileSystemLoader(_TEMPLATES_PATH))
 DEFAULT_ENVIRONMENT = 'prod'
+PROFILE_ID_HEADER = 'X-Profile-Id'
 
 
 class Error(Exception):
@@ -68,11 +76,73 @@ class _JsonEncoder(json.JSONEncoder):
 
 
 class RequestHandlerBase(webapp2.RequestHandler):
-  """Provides common functions to request handler subclasses."""
+  """Provides common functions to request handler subclasses.
+
+  The time spent in each stage of a request is recorded in self.timings (see
+  timing_util).  Handlers that set REPORT_TIMINGS return the stages in a
+  Server-Timing header of their JSON responses, and log them when the
+  request is done.
+
+  Admins can profile any request by adding profile=1.  The request is run
+  under cProfile, and its stats are stored as a RequestProfile whose id is
+  returned in the X-Profile-Id header (see handlers/profiles.py).  Only the
+  request thread is profiled, so time spent in RPCs shows as waiting.
+  """
+
+  REPORT_TIMINGS = False
+
   def __init__(self, request=None, response=None):
-    self.config = explorer_config.ExplorerConfigModel.Get()
+    self.timings = timing_util.Timings()
+    with self.timings.Span('config'):
+      self.config = explorer_config.ExplorerConfigModel.Get()
     super(RequestHandlerBase, self).__init__(request, response)
 
+  def dispatch(self):
+    """Dispatches the request, recording timing_util spans into timings."""
+    self.timings.Activate()
+    try:
+      if self._IsProfiling():
+        self._DispatchProfiled()
+      else:
+        super(RequestHandlerBase, self).dispatch()
+    finally:
+      self.timings.Deactivate()
+      if self.REPORT_TIMINGS:
+        self.timings.Log(self.request.path)
+
+  def _IsProfiling(self):
+    """Returns True if the request asked to be profiled, and is allowed to."""
+    return (self.request.get('profile') == '1' and
+            users.is_current_user_admin())
+
+  def _DispatchProfiled(self):
+    """Dispatches the request under cProfile, and stores the profile."""
+    profiler = cProfile.Profile()
+    start_time = time.time()
+    profiler.enable()
+    try:
+      super(RequestHandlerBase, self).dispatch()
+    finally:
+      profiler.disable()
+      elapsed_ms = (time.time() - start_time) * 1000
+
+      # A failure to store the profile shouldn't fail the request.
+      try:
+        request_id = os.environ.get('REQUEST_LOG_ID') or uuid.uuid4().hex
+        user = users.get_current_user()
+        request_profile.RequestProfile(
+            id=request_id,
+            path=self.request.path,
+            query_string=self.request.query_string,
+            user_email=user.email() if user else None,
+            elapsed_ms=elapsed_ms,
+            status=self.response.status_int,
+            stats=profile_util.GetStatsData(profiler)).put()
+        self.response.headers[PROFILE_ID_HEADER] = request_id
+      except Exception:
+        logging.exception('Storing the profile of %s failed.',
+                          self.request.path)
+
   @property
   def env(self):
     return self.request.get('env', DEFAULT_ENVIRONMENT)
@@ -142,4 +212,11 @@ class RequestHandlerBase(webapp2.RequestHandler):
       self.response.headers["Content-Disposition"] = (
           'attachment; filename=' + filename)
 
-    self.response.out.write(_JsonEncoder(sort_keys=True).encode(data))
+    with self.timings.Span('encode'):
+      body = _JsonEncoder(sort_keys=True).encode(data)
+
+    if self.REPORT_TIMINGS:
+      self.response.headers['Server-Timing'] = (
+          self.timings.GetServerTimingHeader())
+
+    self.response.out.write(body)
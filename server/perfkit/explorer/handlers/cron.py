@@ -0,0 +1,179 @@
+"""Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Main entry module for scheduled tasks specified in app.yaml and cron.yaml.
+
+The following API is supported:
+
+GET     /cron/cubes - Refreshes the cubes of the default project and dataset.
+                      Set full=1 to rebuild them from all days.
+GET     /cron/query_log - Reads the slot time of logged queries from their
+                          BigQuery jobs.
+GET     /cron/dashboards - Copies the list properties (such as the owner) of
+                           dashboards saved before they were added.  Each
+                           request saves a batch of dashboards, and queues a
+                           task for the next batch.  Does nothing once every
+                           dashboard is updated, unless full=1 is set.
+"""
+
+__author__ = 'joemu@google.com (Joe Allan Muharsky)'
+
+import logging
+
+import base
+import data
+from perfkit.explorer.model import dashboard
+from perfkit.explorer.model import error_fields
+from perfkit.explorer.model import query_log
+from perfkit.explorer.samples_mart import cube_maintenance
+
+import webapp2
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+
+class RefreshCubesHandler(base.RequestHandlerBase):
+  """Http handler for refreshing the samples mart cubes (/cron/cubes).
+
+  Returns:
+      JSON description of the refresh.  See cube_maintenance.RefreshCubes.
+  """
+
+  def get(self):
+    """Refreshes the cubes of the default dataset."""
+    try:
+      config = self.config
+      client = data.DataHandlerUtil.GetDataClient(self.env)
+      client.project_id = config.default_project
+
+      full_rebuild = self.request.get('full') == '1'
+      result = cube_maintenance.RefreshCubes(
+          client, config.default_dataset, full_rebuild=full_rebuild)
+
+      self.RenderJson(result)
+    except Exception as err:
+      logging.exception('Refreshing the cubes failed.')
+      self.RenderJson(
+          data={error_fields.MESSAGE: str(err)}, status=500)
+
+
+# The maximum number of query log entries updated by each /cron/query_log.
+MAX_QUERY_LOG_UPDATES = 500
+
+
+def GetJobSlotMs(job):
+  """Returns the slot milliseconds used by a BigQuery job resource."""
+  statistics = job.get('statistics') or {}
+  slot_ms = (statistics.get('totalSlotMs') or
+             (statistics.get('query') or {}).get('totalSlotMs'))
+
+  return int(slot_ms or 0)
+
+
+def FillQueryLogStats(client, limit=MAX_QUERY_LOG_UPDATES):
+  """Reads the slot time of logged queries from their jobs.
+
+  BigQuery doesn't return the slot time of a query with its results, so it
+  is read from the job after the query is logged.  Entries whose job can't
+  be read get a slot_ms of 0, so they aren't read again.
+
+  Args:
+    client: A BigQueryClient.  Its project_id is set to the project of each
+        job.
+    limit: The maximum number of entries to update.
+
+  Returns:
+    A dict with the number of entries 'updated', and the number whose job
+    'failed' to be read.
+  """
+  entries = query_log.QueryLogEntry.GetPendingStats(limit)
+  failed = 0
+
+  for entry in entries:
+    try:
+      client.project_id = entry.project_id
+      entry.slot_ms = GetJobSlotMs(client.GetJobByID(entry.job_id))
+    except Exception as err:  # pylint: disable=broad-except
+      # Failures are raised as HttpError by the API client.
+      logging.warning('Reading job %s failed: %s', entry.job_id, err)
+      entry.slot_ms = 0
+      failed += 1
+
+  ndb.put_multi(entries)
+
+  return {'updated': len(entries), 'failed': failed}
+
+
+class FillQueryLogStatsHandler(base.RequestHandlerBase):
+  """Http handler for reading the slot time of logged queries.
+
+  Returns:
+      JSON with the number of entries updated, and whose job failed.
+  """
+
+  def get(self):
+    try:
+      client = data.DataHandlerUtil.GetDataClient(self.env)
+      self.RenderJson(FillQueryLogStats(client))
+    except Exception as err:
+      logging.exception('Reading the query log stats failed.')
+      self.RenderJson(
+          data={error_fields.MESSAGE: str(err)}, status=500)
+
+
+# The number of dashboards saved by each /cron/dashboards request.
+MAX_DASHBOARD_UPDATES = 200
+
+
+class UpdateDashboardsHandler(base.RequestHandlerBase):
+  """Http handler for updating the list properties of dashboards.
+
+  The dashboards are saved a batch per request, so that each request finishes
+  within the deadline.  The 'cursor' parameter is the batch to save; if there
+  are more dashboards, a task is queued to save the next batch.
+
+  Returns:
+      JSON with the number of dashboards updated, and the cursor of the next
+      batch (or null if every dashboard is updated).
+  """
+
+  def get(self):
+    try:
+      cursor = self.request.get('cursor') or None
+      full_update = self.request.get('full') == '1'
+
+      if (not cursor and not full_update and
+          dashboard.DashboardListState.IsUpdated()):
+        self.RenderJson({'updated': 0, 'cursor': None})
+        return
+
+      count, next_cursor = dashboard.Dashboard.UpdateListProperties(
+          batch_size=MAX_DASHBOARD_UPDATES, cursor=cursor)
+      if next_cursor:
+        taskqueue.add(url=self.request.path, method='GET',
+                      params={'cursor': next_cursor})
+
+      self.RenderJson({'updated': count, 'cursor': next_cursor})
+    except Exception as err:
+      logging.exception('Updating the dashboards failed.')
+      self.RenderJson(
+          data={error_fields.MESSAGE: str(err)}, status=500)
+
+
+# Main WSGI app as specified in app.yaml
+app = webapp2.WSGIApplication(
+    [('/cron/cubes', RefreshCubesHandler),
+     ('/cron/query_log', FillQueryLogStatsHandler),
+     ('/cron/dashboards', UpdateDashboardsHandler)])
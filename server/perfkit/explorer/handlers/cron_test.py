@@ -0,0 +1,117 @@
+"""Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Tests for the scheduled task handlers."""
+
+__author__ = 'joemu@google.com (Joe Allan Muharsky)'
+
+import unittest
+
+import mock
+import webtest
+
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+from perfkit.common import gae_test_util
+from perfkit.explorer.handlers import cron
+from perfkit.explorer.model import dashboard
+from perfkit.explorer.model import query_log
+
+
+class FillQueryLogStatsTest(unittest.TestCase):
+
+  def setUp(self):
+    super(FillQueryLogStatsTest, self).setUp()
+
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_datastore_v3_stub()
+    self.testbed.init_memcache_stub()
+    ndb.get_context().clear_cache()
+
+  def tearDown(self):
+    self.testbed.deactivate()
+
+  def testFillQueryLogStats(self):
+    keys = ndb.put_multi([
+        query_log.QueryLogEntry(project_id='project1', job_id='job1'),
+        query_log.QueryLogEntry(project_id='project1', job_id='missing'),
+        query_log.QueryLogEntry(slot_ms=0)])
+
+    def GetJobByID(job_id):
+      if job_id == 'missing':
+        raise ValueError('Not found.')
+      return {'statistics': {'query': {'totalSlotMs': '1500'}}}
+
+    client = mock.Mock()
+    client.GetJobByID.side_effect = GetJobByID
+
+    self.assertEqual({'updated': 2, 'failed': 1},
+                     cron.FillQueryLogStats(client))
+    self.assertEqual([1500, 0, 0], [key.get().slot_ms for key in keys])
+    self.assertEqual('project1', client.project_id)
+    self.assertEqual([], query_log.QueryLogEntry.GetPendingStats(10))
+
+
+
+class UpdateDashboardsTest(unittest.TestCase):
+
+  def setUp(self):
+    super(UpdateDashboardsTest, self).setUp()
+
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_datastore_v3_stub()
+    self.testbed.init_memcache_stub()
+    self.testbed.init_taskqueue_stub()
+    self.testbed.init_user_stub()
+    ndb.get_context().clear_cache()
+    gae_test_util.setCurrentUser(self.testbed, is_admin=True)
+
+    self.app = webtest.TestApp(cron.app)
+    self.taskqueue_stub = self.testbed.get_stub(
+        testbed.TASKQUEUE_SERVICE_NAME)
+
+  def tearDown(self):
+    self.testbed.deactivate()
+
+  def testUpdateDashboardsQueuesNextBatch(self):
+    for title in ['a', 'b', 'c']:
+      dashboard.Dashboard(title=title, data='{}').put()
+
+    with mock.patch.object(cron, 'MAX_DASHBOARD_UPDATES', 2):
+      resp = self.app.get('/cron/dashboards')
+      self.assertEqual(2, resp.json['updated'])
+
+      task, = self.taskqueue_stub.get_filtered_tasks()
+      self.assertEqual('GET', task.method)
+      self.assertEqual(
+          '/cron/dashboards?cursor=' + resp.json['cursor'], task.url)
+      self.assertFalse(dashboard.DashboardListState.IsUpdated())
+
+      resp = self.app.get(task.url)
+      self.assertEqual({'updated': 1, 'cursor': None}, resp.json)
+
+    self.assertEqual(1, len(self.taskqueue_stub.get_filtered_tasks()))
+    self.assertTrue(dashboard.DashboardListState.IsUpdated())
+
+    # Nothing is saved once every dashboard is updated, unless full=1.
+    self.assertEqual(0, self.app.get('/cron/dashboards').json['updated'])
+    self.assertEqual(
+        3, self.app.get('/cron/dashboards', {'full': '1'}).json['updated'])
+
+
+if __name__ == '__main__':
+  unittest.main()
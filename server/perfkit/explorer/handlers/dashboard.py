@@ -54,7 +54,6 @@ from perfkit.explorer.util import user_validator
 import webapp2
 
 from google.appengine.api import users
-from google.appengine.ext import ndb
 
 
 class ViewDashboardHandler(base.RequestHandlerBase):
@@ -248,7 +247,6 @@ class EditDashboardHandler(base.RequestHandlerBase):
 
       row.data = json.dumps(data)
       row.title = title
-      row.owner = new_owner
       row.put()
       self.RenderJson(data)
     except (base.InitializeError, dashboard_model.InitializeError,
@@ -409,68 +407,76 @@ class DeleteDashboardHandler(base.RequestHandlerBase):
 class ListDashboardHandler(base.RequestHandlerBase):
   """Http handler for returning a list of dashboard ID's, titles and owners.
 
+  Dashboards are listed a page at a time, ordered by title.  Only the indexed
+  list properties are read (see Dashboard.GetDashboardPage), so listing
+  doesn't depend on the size of the dashboards.
+
   Supported Modes: GET
   GET parameters:
     owner: string.  The owner, if any, to filter on.
     mine: boolean.  If true, only returns dashboards owned by the current
       user.
+    page_size: int.  The maximum number of dashboards to return, up to
+      MAX_PAGE_SIZE.  Defaults to dashboard_model.DEFAULT_PAGE_SIZE.
+    cursor: string.  The cursor returned for the previous page, if any.
+
+  Returns:
+    JSON with the 'data' of each dashboard, and the 'cursor' of the next page
+    (or null if there are no more dashboards).
   """
 
+  MAX_PAGE_SIZE = 1000
+
   def get(self):
     """Request handler for GET operations."""
 
     try:
       mine = self.request.get(fields.MINE)
       owner = self.request.get(fields.OWNER)
+      cursor = self.request.get(fields.CURSOR) or None
+      page_size = http_util.GetIntegerParam(
+          self.request, fields.PAGE_SIZE, False,
+          dashboard_model.DEFAULT_PAGE_SIZE)
 
-      query = dashboard_model.Dashboard.query()
+      if not 0 < page_size <= self.MAX_PAGE_SIZE:
+        raise http_util.ParameterError(
+            'The "{param}" parameter must be between 1 and {max}.'.format(
+                param=fields.PAGE_SIZE, max=self.MAX_PAGE_SIZE))
 
-      filter_property = ndb.GenericProperty(fields.CREATED_BY)
+      created_by = None
       if owner:
-        owner_user = user_validator.UserValidator.GetUserFromEmail(
-            owner)
+        created_by = user_validator.UserValidator.GetUserFromEmail(owner)
 
-        if owner_user:
-          query = query.filter(filter_property == owner_user)
-        else:
-          self.RenderJson({fields.DATA: []})
+        if not created_by:
+          self.RenderJson({fields.DATA: [], fields.CURSOR: None})
           return
       elif mine:
-        query = query.filter(
-            filter_property == users.get_current_user())
+        created_by = users.get_current_user()
 
-      query = query.order(dashboard_model.Dashboard.title)
-      # TODO: Add paging to the dashboard UI and limit fetches.
-      results = query.fetch(limit=2000)
+      results, next_cursor = dashboard_model.Dashboard.GetDashboardPage(
+          created_by=created_by, page_size=page_size, cursor=cursor)
 
       response = []
-      dashboard_data = None
-
       for result in results:
-        dashboard_data = json.loads(result.data)
-        created_by = None
-        modified_by = None
-
-        if result.created_by:
-          created_by = result.created_by.email()
-
-        if result.modified_by:
-          modified_by = result.modified_by.email()
+        # created_by isn't projected when it is filtered on.
+        result_created_by = created_by or result.created_by
 
         response.append({
             fields.ID: result.key.integer_id(),
-            fields.OWNER: dashboard_data.get('owner'),
+            fields.OWNER: result.owner,
             fields.TITLE: (result.title or
                            dashboard_model.DEFAULT_DASHBOARD_TITLE),
-            fields.CREATED_BY: created_by,
+            fields.CREATED_BY: (result_created_by.email()
+                                if result_created_by else None),
             fields.CREATED_DATE: result.created_date,
-            fields.MODIFIED_BY: modified_by,
+            fields.MODIFIED_BY: (result.modified_by.email()
+                                 if result.modified_by else None),
             fields.MODIFIED_DATE: result.modified_date})
 
-      self.RenderJson({fields.DATA: response})
+      self.RenderJson({fields.DATA: response, fields.CURSOR: next_cursor})
     except (base.InitializeError, dashboard_model.InitializeError,
             http_util.ParameterError) as err:
-      self.RenderJson(data={error_fields.MESSAGE: err}, status=400)
+      self.RenderJson(data={error_fields.MESSAGE: err.message}, status=400)
 
   def post(self):
     self.get()
@@ -25,7 +25,9 @@ import os
 import webtest
 import unittest
 
+from google.appengine.api import datastore
 from google.appengine.api import users
+from google.appengine.ext import ndb
 from google.appengine.ext import testbed
 
 from perfkit.explorer.handlers import dashboard
@@ -374,6 +376,67 @@ class DashboardTest(unittest.TestCase):
         [dashboard['title'] for dashboard in resp.json['data']],
         expected_titles)
 
+  def testListDashboardsPages(self):
+    dashboard_model.DashboardListState.SetUpdated()
+    for title in ['c', 'a', 'b']:
+      dashboard_model.Dashboard(
+          data=json.dumps({'title': title,
+                           'owner': DEFAULT_USERS[0]['email']}),
+          title=title).put()
+
+    resp = self.app.get(url='/dashboard/list', params={'page_size': 2})
+    self.assertEqual(['a', 'b'],
+                     [dashboard['title'] for dashboard in resp.json['data']])
+    self.assertEqual(DEFAULT_USERS[0]['email'],
+                     resp.json['data'][0]['owner'])
+    self.assertEqual(DEFAULT_USERS[0]['email'],
+                     resp.json['data'][0]['created_by'])
+
+    resp = self.app.get(url='/dashboard/list',
+                        params={'page_size': 2,
+                                'cursor': resp.json['cursor']})
+    self.assertEqual(['c'],
+                     [dashboard['title'] for dashboard in resp.json['data']])
+    self.assertIsNone(resp.json['cursor'])
+
+  def testListDashboardsMine(self):
+    dashboard_model.DashboardListState.SetUpdated()
+    dashboard_model.Dashboard(data='{"title": "mine"}', title='mine').put()
+    dashboard_model.Dashboard(
+        data='{"title": "other"}', title='other',
+        created_by=users.User(DEFAULT_USERS[1]['email'])).put()
+
+    resp = self.app.get(url='/dashboard/list', params={'mine': 'true'})
+
+    dashboard, = resp.json['data']
+    self.assertEqual('mine', dashboard['title'])
+    self.assertEqual(DEFAULT_USERS[0]['email'], dashboard['created_by'])
+
+  def testListDashboardsBeforeUpdate(self):
+    key = dashboard_model.Dashboard(
+        data=json.dumps({'title': 'legacy',
+                         'owner': DEFAULT_USERS[1]['email']}),
+        title='legacy').put()
+
+    # Dashboards saved before the owner property was added don't have it.
+    entity = datastore.Get(key.to_old_key())
+    del entity['owner']
+    datastore.Put(entity)
+    ndb.get_context().clear_cache()
+
+    for params in [{}, {'mine': 'true'}]:
+      resp = self.app.get(url='/dashboard/list', params=params)
+
+      dashboard, = resp.json['data']
+      self.assertEqual('legacy', dashboard['title'])
+      self.assertEqual(DEFAULT_USERS[1]['email'], dashboard['owner'])
+      self.assertEqual(DEFAULT_USERS[0]['email'], dashboard['created_by'])
+
+  def testListDashboardsFailsWithInvalidPage(self):
+    self.app.get(url='/dashboard/list', params={'page_size': 0}, status=400)
+    self.app.get(url='/dashboard/list', params={'cursor': 'invalid'},
+                 status=400)
+
 
 if __name__ == '__main__':
   unittest.main()
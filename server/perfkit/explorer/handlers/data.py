@@ -25,26 +25,40 @@ __author__ = 'joemu@google.com (Joe Allan Muharsky)'
 import json
 import logging
 import MySQLdb
+import os
+import Queue
+import threading
 import time
 
 from google.appengine.api import urlfetch_errors
 from google.appengine.api import users
+from google.appengine.ext import ndb
 from google.appengine.runtime import apiproxy_errors
 import google.appengine.runtime
 
 import base
 
+from perfkit.common import admission_control
 from perfkit.common import big_query_client
 from perfkit.common import big_query_result_util as result_util
 from perfkit.common import big_query_result_pivot
+from perfkit.common import big_query_result_sampler
+from perfkit.common import big_query_result_stats
 from perfkit.common import data_source_config
 from perfkit.common import gae_big_query_client
 from perfkit.common import gae_cloud_sql_client
 from perfkit.common import http_util
+from perfkit.common import local_sql_client
+from perfkit.common import timing_util
+from perfkit.explorer.model import cube_watermark
 from perfkit.explorer.model import dashboard
-from perfkit.explorer.model import explorer_config
+from perfkit.explorer.model import query_job
+from perfkit.explorer.model import query_log
+from perfkit.explorer.samples_mart import cube_maintenance
 from perfkit.explorer.samples_mart import explorer_method
+from perfkit.explorer.samples_mart import field_index
 from perfkit.explorer.samples_mart import product_labels
+from perfkit.explorer.samples_mart import query_planner
 from perfkit.ext.cloudsql.models import cloudsql_config
 import webapp2
 
@@ -52,6 +66,14 @@ from google.appengine.api import urlfetch
 
 DATASET_NAME = 'samples_mart'
 URLFETCH_TIMEOUT = 50
+# The number of seconds an async /data/sql request waits for the job to
+# finish before returning a job id, and a /data/job request waits before
+# reporting that the job is still running.
+ASYNC_SUBMIT_WAIT = 10
+ASYNC_POLL_WAIT = 30
+# The maximum number of queries run at once by /data/dashboard.
+MAX_DASHBOARD_THREADS = 10
+ERROR_UNEXPECTED = 'An unexpected error occurred.'
 ERROR_TIMEOUT = 'The request timed out.'
 
 urlfetch.set_default_fetch_deadline(URLFETCH_TIMEOUT)
@@ -65,6 +87,14 @@ class SecurityError(Error):
   pass
 
 
+# The samplers for each config.results.sampling method.  See
+# GetResultSampler.
+SAMPLERS = {
+    'stride': big_query_result_sampler.StrideSampler,
+    'random': big_query_result_sampler.ReservoirSampler}
+DEFAULT_SAMPLING = 'stride'
+
+
 class DataHandlerUtil(object):
   """Class used to allow us to replace clients with test versions."""
 
@@ -93,10 +123,15 @@ class FieldDataHandler(base.RequestHandlerBase):
 
   This handler allows start/end date, project_name, test and metric to be
   supplied as GET parameters for filtering, and field_name determines the
-  field to return.  It returns, and returns an array of dicts in the
+  field to return.  An optional prefix parameter restricts the values to
+  those starting with it (ignoring case).  It returns an array of dicts in the
   following format:
-    [{'value': 'time-to-complete'},
-     {'value': 'weight'}]
+    [{'name': 'time-to-complete'},
+     {'name': 'weight'}]
+
+  Values are served from an in-memory index of lookup_field_cube (see
+  field_index.FieldIndex), which is refreshed periodically.  Fields that are
+  not indexed are queried from BigQuery.
   """
 
   def get(self):
@@ -110,11 +145,39 @@ class FieldDataHandler(base.RequestHandlerBase):
     test = filters['test']
     metric = filters['metric']
     field_name = self.request.GET.get('field_name')
+    prefix = self.request.GET.get('prefix')
 
-    config = explorer_config.ExplorerConfigModel.Get()
+    config = self.config
     client = DataHandlerUtil.GetDataClient(self.env)
     client.project_id = config.default_project
 
+    field_filters = []
+    if product_name and field_name != 'product_name':
+      field_filters.append(('product_name', product_name))
+
+    if test and field_name not in ['test', 'product_name']:
+      field_filters.append(('test', test))
+
+    if metric and field_name not in ['metric', 'test', 'product_name']:
+      field_filters.append(('metric', metric))
+
+    if field_name in field_index.INDEXED_FIELDS:
+      try:
+        index = field_index.GetFieldIndex(client, config.default_dataset)
+        values = index.Search(
+            field_name, filters=dict(field_filters),
+            start_day=(field_index.GetDayFromFilterExpression(start_date)
+                       if start_date else None),
+            end_day=(field_index.GetDayFromFilterExpression(end_date, True)
+                     if end_date else None),
+            prefix=prefix,
+            max_results=explorer_method.DEFAULT_MAX_ROWS)
+
+        self.RenderJson({'rows': [{'name': value} for value in values]})
+        return
+      except field_index.ArgumentError as err:
+        logging.warning('Querying fields from BigQuery: %s', err)
+
     query = explorer_method.ExplorerQueryBase(
         data_client=client,
         dataset_name=config.default_dataset)
@@ -136,14 +199,12 @@ class FieldDataHandler(base.RequestHandlerBase):
            .GetTimestampFromFilterExpression(
                end_date)))
 
-    if product_name and field_name != 'product_name':
-      query.wheres.append('product_name = "%s"' % product_name)
-
-    if test and field_name not in ['test', 'product_name']:
-      query.wheres.append('test = "%s"' % test)
+    for filter_name, filter_value in field_filters:
+      query.wheres.append('%s = "%s"' % (filter_name, filter_value))
 
-    if metric and field_name not in ['metric', 'test', 'product_name']:
-      query.wheres.append('metric = "%s"' % metric)
+    if prefix:
+      query.wheres.append(
+          'LOWER(%s) LIKE "%s%%"' % (field_name, prefix.lower()))
 
     query.groups = ['name']
     query.orders = ['name']
@@ -166,7 +227,7 @@ class MetadataDataHandler(base.RequestHandlerBase):
   def get(self):
     """Request handler for GET operations."""
     urlfetch.set_default_fetch_deadline(URLFETCH_TIMEOUT)
-    config = explorer_config.ExplorerConfigModel.Get()
+    config = self.config
     client = DataHandlerUtil.GetDataClient(self.env)
     client.project_id = config.default_project
 
@@ -193,6 +254,405 @@ class MetadataDataHandler(base.RequestHandlerBase):
     self.RenderJson({'labels': response['labels']})
 
 
+def IsCloudSqlDatasource(datasource):
+  """Returns True if the datasource runs against Cloud SQL."""
+  return datasource.get('type', 'BigQuery') == 'Cloud SQL'
+
+
+def IsLocalSqlDatasource(datasource):
+  """Returns True if the datasource runs against a local SQLite database."""
+  return datasource.get('type', 'BigQuery') == 'Local SQL'
+
+
+def IsBigQueryDatasource(datasource):
+  """Returns True if the datasource runs against BigQuery.
+
+  Only BigQuery queries are cached, admitted, run asynchronously, paged from
+  their job and routed to rollups.
+  """
+  return not (IsCloudSqlDatasource(datasource) or
+              IsLocalSqlDatasource(datasource))
+
+
+def IsLocalSqlEnabled(config):
+  """Returns True if Local SQL datasources can be queried.
+
+  They are always enabled on the development server, and elsewhere only when
+  an administrator has set the config's enable_local_sql.
+  """
+  return (os.getenv('SERVER_SOFTWARE', '').startswith('Development/') or
+          bool(config.enable_local_sql))
+
+
+def GetQueryClient(datasource, env, project_id, config):
+  """Returns a new client for running the query of a datasource.
+
+  Args:
+    datasource: The datasource of a widget.  See SqlDataHandler for details.
+    env: The environment to connect to, for BigQuery datasources.
+    project_id: The BigQuery project to run queries in.
+    config: The ExplorerConfigModel.
+
+  Returns:
+    A GaeCloudSqlClient for Cloud SQL datasources, a LocalSqlClient for Local
+    SQL datasources, otherwise a BigQuery client from DataHandlerUtil.
+
+  Raises:
+    SecurityError: The datasource is Local SQL, and it isn't enabled.
+  """
+  if IsCloudSqlDatasource(datasource):
+    logging.debug('Using Cloud SQL backend')
+    cloudsql_client_config = datasource['config'].get('cloudsql')
+    if not cloudsql_client_config:
+      cloudsql_client_config = {}
+
+    cloudsql_server_config = cloudsql_config.CloudsqlConfigModel.Get()
+
+    client = gae_cloud_sql_client.GaeCloudSqlClient(
+      instance=cloudsql_client_config.get('instance'),
+      db_name=cloudsql_client_config.get('database_name'),
+      db_user=cloudsql_server_config.username,
+      db_password=cloudsql_server_config.password)
+  elif IsLocalSqlDatasource(datasource):
+    logging.debug('Using Local SQL backend')
+    if not IsLocalSqlEnabled(config):
+      raise SecurityError('Local SQL datasources are not enabled.')
+
+    client = local_sql_client.GetSharedClient(
+        config.local_sql_database or None)
+  else:
+    logging.debug('Using BigQuery backend')
+    client = DataHandlerUtil.GetDataClient(env)
+
+  client.project_id = project_id
+  return client
+
+
+def GetAdmissionController(config):
+  """Returns the instance's admission controller, with the config's limits.
+
+  Args:
+    config: The ExplorerConfigModel.
+
+  Returns:
+    An admission_control.AdmissionController.
+  """
+  return admission_control.GetController(
+      max_concurrent=config.max_concurrent_queries or 0,
+      user_rate=(config.user_queries_per_minute or 0) / 60.0,
+      user_burst=config.user_query_burst or 1,
+      project_rate=(config.project_queries_per_minute or 0) / 60.0,
+      project_burst=config.project_query_burst or 1,
+      queue_timeout=config.query_queue_timeout or 0)
+
+
+def GetAdmissionUserKey(request):
+  """Returns the key that the current user's queries are admitted under.
+
+  Anonymous users (when queries are granted to the public) are keyed by
+  their address.
+  """
+  user = users.get_current_user()
+  if user:
+    return user.email()
+
+  return 'anonymous:%s' % request.remote_addr
+
+
+def GetRollupPlan(query, project_id):
+  """Returns a query_planner.QueryPlan that reads query from a rollup, or None.
+
+  Rollups are only used once cube_maintenance has built them with the current
+  CUBE_VERSION.  They include the rows of results as of their last refresh,
+  which is reported in the plan, so only queries whose rows end at or before
+  the refresh (see QueryPlan.end_time) are routed.  Queries without an end,
+  or that end after the refresh, read results.
+
+  Args:
+    query: The SQL of a BigQuery datasource.
+    project_id: The project the query runs in, used when the query's table
+        doesn't specify one.
+  """
+  plan = query_planner.PlanQuery(query)
+  if not plan:
+    return None
+
+  watermark = cube_watermark.CubeWatermark.Get(plan.project_id or project_id,
+                                               plan.dataset_name)
+  if not watermark or watermark.version != cube_maintenance.CUBE_VERSION:
+    return None
+
+  if (plan.end_time is None or watermark.refreshed_time is None or
+      plan.end_time > watermark.refreshed_time):
+    logging.debug('Query reads rows after the refresh of rollup %s.',
+                  plan.rollup.table_name)
+    return None
+
+  plan.refreshed_time = watermark.refreshed_time
+  logging.info('Query routed to rollup %s.', plan.rollup.table_name)
+
+  return plan
+
+
+class JobStates(object):
+  """Enumerates the states reported for asynchronous query jobs."""
+
+  RUNNING = 'RUNNING'
+  DONE = 'DONE'
+  CANCELLED = 'CANCELLED'
+
+
+def CancelQueryJob(client, job_reference):
+  """Cancels a query job, records it as cancelled and frees its slot.
+
+  Args:
+    client: A BigQueryClient.
+    job_reference: A dict with the projectId and jobId of the job.
+
+  Raises:
+    big_query_client.BigQueryError: If the cancel request failed.
+  """
+  query_job.SetJobCancelled(job_reference['jobId'])
+  admission_control.ReleaseJob(job_reference['jobId'])
+  client.CancelJob(job_reference['jobId'], job_reference.get('projectId'))
+
+
+def CancelSupersededJob(client, dashboard_id, widget_id, job_reference):
+  """Cancels the job a widget was running before a new query replaced it.
+
+  A failure to cancel is logged rather than raised, so that it doesn't fail
+  the new query.
+
+  Args:
+    client: A BigQueryClient.
+    dashboard_id: The id of the dashboard that contains the widget.
+    widget_id: The id of the widget.  If not provided, nothing is cancelled.
+    job_reference: The job started for the new query, or None if its results
+        were cached.
+  """
+  if not widget_id:
+    return
+
+  previous = query_job.ReplaceWidgetJob(dashboard_id, widget_id,
+                                        job_reference)
+  if not previous:
+    return
+
+  try:
+    CancelQueryJob(client, previous)
+  except big_query_client.BigQueryError as err:
+    logging.warning('Failed to cancel superseded job %s: %s',
+                    previous['jobId'], err)
+
+
+def GetPageConfig(values):
+  """Returns the paging options of a request, or None if it isn't paged.
+
+  Args:
+    values: A dict of request values.  'offset' and 'limit' select a range of
+        rows, and 'sort_field' (with an optional 'sort_descending') orders the
+        rows before they are paged.
+
+  Returns:
+    A dict with 'offset', 'limit', 'sort_field' and 'sort_descending' entries.
+
+  Raises:
+    http_util.ParameterError: If a value is invalid.
+  """
+  offset = values.get('offset')
+  limit = values.get('limit')
+  sort_field = values.get('sort_field')
+
+  if offset is None and limit is None and not sort_field:
+    return None
+
+  page = {
+      'offset': http_util.ConvertStringToInteger(offset or 0, 'offset'),
+      'limit': (http_util.ConvertStringToInteger(limit, 'limit')
+                if limit is not None else None),
+      'sort_field': sort_field or None,
+      'sort_descending': http_util.ConvertStringToBool(
+          values.get('sort_descending'), 'sort_descending')}
+
+  if page['offset'] < 0:
+    raise http_util.ParameterError('The "offset" parameter must be >= 0.')
+
+  if page['limit'] is not None and page['limit'] <= 0:
+    raise http_util.ParameterError('The "limit" parameter must be > 0.')
+
+  return page
+
+
+def CanReadPage(query_config, page):
+  """Returns True if a page can be read without reading the full result.
+
+  This is the case for unsorted pages of queries without server-side
+  transforms, as each result row is a row of the query.
+  """
+  results_config = query_config.get('results') or {}
+  statistics_config = results_config.get('statistics') or {}
+
+  return bool(page and page['limit'] and not page['sort_field'] and
+              not results_config.get('pivot') and
+              not statistics_config.get('enabled') and
+              not results_config.get('max_rows'))
+
+
+def GetResultSampler(query_config):
+  """Returns a sampler for the rows of a datasource, or None for all rows.
+
+  If the config's results.max_rows is set, BigQuery results are downsampled
+  to at most that many rows while they are read, so a large result is never
+  fully loaded.  results.sampling is 'stride' (the default) to keep evenly
+  spaced rows, which stops reading once the sample is full, or 'random' for
+  a uniform sample, with a fixed seed so a refresh returns the same rows.
+
+  Args:
+    query_config: The datasource config.  See SqlDataHandler for details.
+
+  Returns:
+    A big_query_result_sampler.ResultSampler, or None.
+
+  Raises:
+    ValueError: If max_rows or sampling is invalid.
+  """
+  results_config = query_config.get('results') or {}
+  max_rows = results_config.get('max_rows')
+  if not max_rows:
+    return None
+
+  max_rows = int(max_rows)
+  if max_rows <= 0:
+    raise ValueError('The max_rows setting must be > 0.')
+
+  sampling = results_config.get('sampling') or DEFAULT_SAMPLING
+  if sampling not in SAMPLERS:
+    raise ValueError('The sampling setting must be one of: %s.' %
+                     ', '.join(sorted(SAMPLERS)))
+
+  return SAMPLERS[sampling](max_rows)
+
+
+def GetPageResponse(page, total_rows):
+  """Returns the 'page' entry of a paged response."""
+  return {'offset': page['offset'],
+          'limit': page['limit'],
+          'totalRows': total_rows}
+
+
+def ProcessResultSet(result, query_config, page=None):
+  """Applies the server-side transforms of a datasource config to a result.
+
+  Args:
+    result: The big_query_result_set.ResultSet returned by the query.  It is
+        modified in place.
+    query_config: The datasource config.  See SqlDataHandler for details.
+    page: If provided, the paging options from GetPageConfig().  The rows are
+        sorted and paged after the other transforms.
+
+  Returns:
+    The response for /data/sql, in the BigQuery reply format with a GViz
+    'results' entry (and 'statistics' or 'page', if enabled).
+  """
+  if query_config['results'].get('pivot'):
+    pivot_config = query_config['results']['pivot_config']
+
+    with timing_util.Span('pivot'):
+      transformer = big_query_result_pivot.BigQueryPivotTransformer(
+          reply=result,
+          rows_name=pivot_config['row_field'],
+          columns_name=pivot_config['column_field'],
+          values_name=pivot_config['value_field'],
+          aggregation=pivot_config.get('aggregation'))
+      transformer.Transform()
+
+  statistics = None
+  statistics_config = query_config['results'].get('statistics')
+  if statistics_config and statistics_config.get('enabled'):
+    with timing_util.Span('statistics'):
+      calculator = big_query_result_stats.BigQueryStatisticsCalculator(
+          reply=result,
+          value_names=statistics_config.get('value_fields'),
+          group_names=statistics_config.get('group_fields'))
+      statistics = calculator.Calculate()
+
+    if statistics_config.get('statistics_only'):
+      result.ClearRows()
+
+  if page:
+    total_rows = result.num_rows
+    with timing_util.Span('page'):
+      if page['sort_field']:
+        result.Sort(page['sort_field'], page['sort_descending'])
+      result.Slice(page['offset'], page['limit'])
+
+  # The result is only converted to the BigQuery JSON format here, once
+  # all server-side transforms are done.
+  with timing_util.Span('format'):
+    response = result.ToReply()
+    response['results'] = (
+        result_util.ReplyFormatter.RowsToDataTableFormat(result))
+
+  if statistics is not None:
+    response['statistics'] = statistics
+  if page:
+    response['page'] = GetPageResponse(page, total_rows)
+
+  return response
+
+
+def RecordQuery(query, datasource, result, rows, cache_hit, elapsed_ms,
+                timings, path, dashboard_id=None, widget_id=None,
+                response_bytes=None):
+  """Records a query that was run in the query log (see query_log).
+
+  A failure to record the query is logged rather than raised, so that it
+  doesn't fail the request.
+
+  Args:
+    query: The query that was run.
+    datasource: The datasource of the query.
+    result: The big_query_result_set.ResultSet returned by the query.  The
+        job and statistics are read from its metadata.
+    rows: The number of rows returned by the query.
+    cache_hit: True if the result was served from the Explorer cache.
+    elapsed_ms: The milliseconds spent on the query.
+    timings: A dict of the milliseconds spent in each stage of the request.
+    path: The path of the request.
+    dashboard_id: The dashboard that ran the query, if any.
+    widget_id: The widget that ran the query, if any.
+    response_bytes: The size of the response, if it is only for this query.
+  """
+  try:
+    metadata = result.metadata
+    job_reference = metadata.get('jobReference') or {}
+    job_id = None if cache_hit else job_reference.get('jobId')
+    user = users.get_current_user()
+
+    query_log.Record(query_log.QueryLogEntry(
+        fingerprint=query_log.GetQueryFingerprint(query),
+        query_text=query,
+        datasource_type=datasource.get('type', 'BigQuery'),
+        dashboard_id=str(dashboard_id) if dashboard_id else None,
+        widget_id=str(widget_id) if widget_id else None,
+        user_email=user.email() if user else None,
+        path=path,
+        cache_hit=cache_hit,
+        bigquery_cache_hit=bool(metadata.get('cacheHit')),
+        project_id=job_reference.get('projectId'),
+        job_id=job_id,
+        bytes_processed=(0 if cache_hit else
+                         int(metadata.get('totalBytesProcessed') or 0)),
+        # The slot time is read from the job later (see cron.py).
+        slot_ms=None if job_id else 0,
+        rows=rows,
+        response_bytes=response_bytes,
+        elapsed_ms=elapsed_ms,
+        timings=timings))
+  except Exception:  # pylint: disable=broad-except
+    logging.exception('Recording the query failed.')
+
+
 class SqlDataHandler(base.RequestHandlerBase):
   """Http handler for returning the results of a SQL statement (/data/sql).
 
@@ -209,31 +669,114 @@ class SqlDataHandler(base.RequestHandlerBase):
            'row_field': '',
            'column_field': '',
            'value_field': '',
-         }
+           'aggregation': null
+         },
+         'statistics': {
+           'enabled': false,
+           'value_fields': [],
+           'group_fields': [],
+           'statistics_only': false
+         },
+         'max_rows': null,
+         'sampling': 'stride'
        }
      }
   }
 
+  Each of the pivot row_field, column_field and value_field settings can be a
+  single field name, or a list of names for composite keys and multiple
+  values.  See big_query_result_pivot for more detail.
+
+  If max_rows is set, BigQuery results are downsampled to that many rows as
+  they are read, before the pivot and statistics.  See GetResultSampler.
+
+  If the top-level 'async' is true, a BigQuery query is started as a job.
+  Queries that don't finish within ASYNC_SUBMIT_WAIT seconds return
+  {'job': {'id': job_id, 'state': 'RUNNING'}}, and the results are then
+  retrieved from /data/job.  Cloud SQL queries always run synchronously.
+
+  A datasource 'type' of 'Local SQL' runs the query against a SQLite database
+  (see local_sql_client), for developing and load testing dashboards without
+  BigQuery.  They are only accepted on the development server, or when an
+  administrator sets the config's enable_local_sql.  The database file is the
+  config's local_sql_database; by default, data/samples_mart is loaded into
+  memory.  Like
+  Cloud SQL queries, Local SQL queries run synchronously, and aren't cached,
+  admitted or routed to rollups.
+
+  BigQuery queries that aren't cached are subject to admission control (see
+  GetAdmissionController): each user and project can start a limited number
+  of queries per minute, and each instance runs a limited number at once.
+  An async job still running after ASYNC_SUBMIT_WAIT keeps its slot until
+  /data/job sees it finish or it is cancelled, on any instance (or until
+  JOB_HOLD_TIMEOUT passes, if it is never polled).  Queries that can't be
+  admitted within the config's query_queue_timeout return HTTP 503 with a
+  Retry-After header.
+
+  Async jobs can be cancelled through /data/cancel with the optional top-level
+  'request_id' provided by the client.  Starting a query for a widget also
+  cancels the job still running for that widget's previous query.  Cancelled
+  jobs report {'job': {'id': job_id, 'state': 'CANCELLED'}}.
+
+  An optional top-level 'timestamp_mode' of 'epoch_ms' returns TIMESTAMP
+  values as milliseconds since the Unix epoch rather than ISO strings.  See
+  big_query_result_util.TimestampModes.
+
+  Aggregate BigQuery queries that can be answered from a rollup cube are
+  rewritten to read it (see query_planner and GetRollupPlan), and the
+  response includes {'rollup': {'table': 'samples_mart.lookup_field_cube',
+  ...}}.  A top-level 'use_rollups' of false runs the query as-is.
+
+  If statistics are enabled, a 'statistics' list is added to the response.
+  See big_query_result_stats for its format.  If statistics_only is true,
+  the rows are not returned.
+
+  The optional top-level 'offset' and 'limit' return a page of the rows, and
+  'sort_field' (with 'sort_descending') sorts the rows before paging.  Paged
+  responses include {'page': {'offset': 0, 'limit': 100, 'totalRows': 5000}},
+  where totalRows counts all the rows.  Unsorted pages of queries without a
+  pivot or statistics are read directly from the cached result, or from the
+  retained BigQuery job for the query, so only the page's rows are loaded.
+
+  The time spent in each stage of the request (config, security, cache,
+  bigquery, typing, pivot, etc.) is returned in milliseconds as a 'timings'
+  dict and a Server-Timing header, and logged with the dashboard and widget
+  ids.  See timing_util for details.
+
+  Each query that returns results is recorded in the query log, with its
+  cost and timings.  See query_log and RecordQuery.
+
   This handler returns an array of arrays in the following format:
     [['product_name', 'test', 'min', 'avg'],
      ['widget-factory', 'create-widget', 2.2, 3.1]]
   """
 
+  REPORT_TIMINGS = True
+
+  @ndb.toplevel
   def post(self):
     """Request handler for POST operations."""
     try:
       start_time = time.time()
       urlfetch.set_default_fetch_deadline(URLFETCH_TIMEOUT)
 
-      config = explorer_config.ExplorerConfigModel.Get()
+      config = self.config
+
+      with self.timings.Span('parse'):
+        request_data = json.loads(self.request.body)
 
-      request_data = json.loads(self.request.body)
+      self.timings.context.update({
+          'dashboard_id': request_data.get('dashboard_id'),
+          'widget_id': request_data.get('id')})
 
       datasource = request_data.get('datasource')
       if not datasource:
         raise KeyError('The datasource is required to run a query')
 
-      query = datasource.get('query_exec') or datasource.get('query')
+      query = GetDatasourceQuery(datasource)
+
+      timestamp_mode = request_data.get('timestamp_mode')
+      result_util.TimestampModes.Validate(timestamp_mode)
 
       if not query:
         raise KeyError('datasource.query must be provided.')
@@ -248,7 +791,11 @@ class SqlDataHandler(base.RequestHandlerBase):
         if not widget_id:
           raise KeyError('The widget id is required to run a query')
 
-        if dashboard.Dashboard.IsQueryCustom(query, dashboard_id, widget_id):
+        with self.timings.Span('security'):
+          is_query_custom = dashboard.Dashboard.IsQueryCustom(
+              query, dashboard_id, widget_id)
+
+        if is_query_custom:
           raise SecurityError('The user is not authorized to run custom queries')
         else:
           logging.error('Query is identical.')
@@ -258,51 +805,138 @@ class SqlDataHandler(base.RequestHandlerBase):
       logging.debug('Query datasource: %s', datasource)
       query_config = datasource['config']
 
-      if datasource.get('type', 'BigQuery') == 'Cloud SQL':
-        logging.debug('Using Cloud SQL backend')
-        cloudsql_client_config = query_config.get('cloudsql')
-        if not cloudsql_client_config:
-          cloudsql_client_config = {}
-
-        cloudsql_server_config = cloudsql_config.CloudsqlConfigModel.Get()
-
-        client = gae_cloud_sql_client.GaeCloudSqlClient(
-          instance=cloudsql_client_config.get('instance'),
-          db_name=cloudsql_client_config.get('database_name'),
-          db_user=cloudsql_server_config.username,
-          db_password=cloudsql_server_config.password)
+      is_big_query = IsBigQueryDatasource(datasource)
+      client = GetQueryClient(datasource, self.env, config.default_project,
+                              config)
+      page = GetPageConfig(request_data)
+      read_page = is_big_query and CanReadPage(query_config, page)
+      sampler = GetResultSampler(query_config) if is_big_query else None
+
+      rollup_plan = None
+      if is_big_query:
+        admission = GetAdmissionController(config)
+        user_key = GetAdmissionUserKey(self.request)
+
+        if request_data.get('use_rollups', True):
+          with self.timings.Span('plan'):
+            rollup_plan = GetRollupPlan(query, client.project_id)
+          if rollup_plan:
+            query = rollup_plan.query
+
+      if request_data.get('async') and is_big_query:
+        result = client.GetCachedResultSet(query, timestamp_mode, sampler)
+        job_reference = None
+
+        if result is None:
+          with admission.Admit(user_key, client.project_id):
+            job_reference = {'projectId': client.project_id,
+                             'jobId': client.InsertQueryJob(query)['jobId']}
+
+            request_id = request_data.get('request_id')
+            if request_id:
+              query_job.RegisterRequestJob(str(request_id), job_reference)
+
+            CancelSupersededJob(client, request_data.get('dashboard_id'),
+                                request_data.get('id'), job_reference)
+
+            try:
+              result = client.GetQueryJobResultSet(
+                  job_reference['jobId'], timeout=ASYNC_SUBMIT_WAIT,
+                  timestamp_mode=timestamp_mode, query=query,
+                  cache_duration=cache_duration, sampler=sampler)
+            except big_query_client.BigQueryError:
+              if not query_job.IsJobCancelled(job_reference['jobId']):
+                raise
+
+              self.RenderJson({'job': {'id': job_reference['jobId'],
+                                       'state': JobStates.CANCELLED}})
+              return
+
+            if result is None:
+              # The job keeps counting against the limit while it runs.
+              admission.HoldJob(job_reference['jobId'])
+        else:
+          CancelSupersededJob(client, request_data.get('dashboard_id'),
+                              request_data.get('id'), None)
+
+        if result is None:
+          query_job.QueryJob.Create(
+              job_id=job_reference['jobId'],
+              project_id=client.project_id,
+              query=query,
+              config=query_config,
+              timestamp_mode=timestamp_mode,
+              dashboard_id=request_data.get('dashboard_id'),
+              widget_id=request_data.get('id'))
+          self.RenderJson({'job': {'id': job_reference['jobId'],
+                                   'state': JobStates.RUNNING}})
+          return
+
+        read_page = False
+      elif read_page:
+        # Only the rows of the page are read, from the cache or BigQuery.
+        result = client.GetCachedResultSet(query, timestamp_mode)
+
+        if result is not None:
+          result.Slice(page['offset'], page['limit'])
+        else:
+          with admission.Admit(user_key, client.project_id):
+            result = client.QueryResultPage(
+                query, page['offset'], page['limit'],
+                timestamp_mode=timestamp_mode, cache_duration=cache_duration)
+        if result is None:
+          raise big_query_client.BigQueryError(
+              'The query did not complete in time.', query)
+      elif not is_big_query:
+        result = client.QueryResultSet(query, cache_duration=cache_duration,
+                                       timestamp_mode=timestamp_mode)
       else:
-        logging.debug('Using BigQuery backend')
-        client = DataHandlerUtil.GetDataClient(self.env)
-
-      client.project_id = config.default_project
-      response = client.Query(query, cache_duration=cache_duration)
-
-      if query_config['results'].get('pivot'):
-        pivot_config = query_config['results']['pivot_config']
-
-        transformer = big_query_result_pivot.BigQueryPivotTransformer(
-            reply=response,
-            rows_name=pivot_config['row_field'],
-            columns_name=pivot_config['column_field'],
-            values_name=pivot_config['value_field'])
-        transformer.Transform()
+        result = client.GetCachedResultSet(query, timestamp_mode, sampler)
+
+        if result is None:
+          with admission.Admit(user_key, client.project_id):
+            result = client.QueryResultSet(query,
+                                           cache_duration=cache_duration,
+                                           sampler=sampler,
+                                           timestamp_mode=timestamp_mode)
+
+      rows = result.num_rows
+      if read_page:
+        response = ProcessResultSet(result, query_config)
+        response['page'] = GetPageResponse(
+            page, int(result.metadata.get('totalRows') or 0))
+      else:
+        response = ProcessResultSet(result, query_config, page)
 
-      response['results'] = (
-          result_util.ReplyFormatter.RowsToDataTableFormat(response))
+      if rollup_plan:
+        response['rollup'] = rollup_plan.ToDict()
 
       elapsed_time = time.time() - start_time
       response['elapsedTime'] = elapsed_time
+      response['timings'] = self.timings.ToDict()
       self.RenderJson(response)
 
+      RecordQuery(query, datasource, result, rows,
+                  cache_hit=result.cache_hit,
+                  elapsed_ms=self.timings.GetTotal(),
+                  timings=self.timings.ToDict(),
+                  path=self.request.path,
+                  dashboard_id=request_data.get('dashboard_id'),
+                  widget_id=request_data.get('id'),
+                  response_bytes=len(self.response.body))
+
     # If 'expected' errors occur (specifically dealing with SQL problems),
     # return JSON with descriptive text so that we can give the user a
     # constructive error message.
     # TODO: Formalize error reporting/handling across the application.
     except (big_query_client.BigQueryError, big_query_result_pivot.DuplicateValueError,
+            result_util.NotSupportedError, http_util.ParameterError,
             ValueError, KeyError, SecurityError) as err:
       logging.error(str(err))
       self.RenderJson({'error': str(err)})
+    except admission_control.AdmissionError as err:
+      self.response.headers['Retry-After'] = str(err.retry_after)
+      self.RenderJson({'error': str(err)}, status=503)
     except MySQLdb.OperationalError as err:
       self.RenderJson({'error': 'MySQLdb error %s' % str(err)})
     except (google.appengine.runtime.DeadlineExceededError,
@@ -315,8 +949,442 @@ class SqlDataHandler(base.RequestHandlerBase):
     self.post()
 
 
+class JobDataHandler(base.RequestHandlerBase):
+  """Http handler for the results of an async query job (/data/job).
+
+  The 'id' parameter is the job id returned by /data/sql.  If the job is
+  still running after ASYNC_POLL_WAIT seconds, this returns:
+    {'job': {'id': job_id, 'state': 'RUNNING'}}
+
+  Otherwise, it returns the same response as /data/sql, with a 'job' entry
+  whose state is 'DONE'.  Completed results are served from the cache.  The
+  offset, limit, sort_field and sort_descending parameters page the results,
+  as for /data/sql.
+
+  If the job was cancelled, this returns:
+    {'job': {'id': job_id, 'state': 'CANCELLED'}}
+
+  Timings are reported, and completed jobs are recorded in the query log, as
+  for /data/sql.
+  """
+
+  REPORT_TIMINGS = True
+
+  @ndb.toplevel
+  def get(self):
+    """Request handler for GET operations."""
+    try:
+      start_time = time.time()
+      urlfetch.set_default_fetch_deadline(URLFETCH_TIMEOUT)
+
+      job_id = self.request.get('id')
+      if not job_id:
+        raise KeyError('The job id is required.')
+
+      self.timings.context['job_id'] = job_id
+
+      job = query_job.QueryJob.GetQueryJob(job_id)
+
+      client = DataHandlerUtil.GetDataClient(self.env)
+      client.project_id = job.project_id
+
+      cache_duration = self.config.cache_duration or None
+      try:
+        result = client.GetQueryJobResultSet(
+            job_id, timeout=ASYNC_POLL_WAIT, timestamp_mode=job.timestamp_mode,
+            query=job.query, cache_duration=cache_duration,
+            sampler=GetResultSampler(job.config))
+      except big_query_client.BigQueryError:
+        admission_control.ReleaseJob(job_id)
+        if not query_job.IsJobCancelled(job_id):
+          raise
+
+        self.RenderJson({'job': {'id': job_id, 'state': JobStates.CANCELLED}})
+        return
+
+      if result is None:
+        self.RenderJson({'job': {'id': job_id, 'state': JobStates.RUNNING}})
+        return
+
+      admission_control.ReleaseJob(job_id)
+
+      rows = result.num_rows
+      response = ProcessResultSet(result, job.config,
+                                  GetPageConfig(self.request.GET))
+      response['job'] = {'id': job_id, 'state': JobStates.DONE}
+
+      elapsed_time = time.time() - start_time
+      response['elapsedTime'] = elapsed_time
+      response['timings'] = self.timings.ToDict()
+      self.RenderJson(response)
+
+      datasource = {'config': job.config}
+      RecordQuery(job.query, datasource, result, rows,
+                  cache_hit=result.cache_hit,
+                  elapsed_ms=self.timings.GetTotal(),
+                  timings=self.timings.ToDict(),
+                  path=self.request.path,
+                  dashboard_id=job.dashboard_id,
+                  widget_id=job.widget_id,
+                  response_bytes=len(self.response.body))
+
+    except (big_query_client.BigQueryError,
+            big_query_result_pivot.DuplicateValueError,
+            query_job.Error, http_util.ParameterError, ValueError,
+            KeyError) as err:
+      logging.error(str(err))
+      self.RenderJson({'error': str(err)})
+    except (google.appengine.runtime.DeadlineExceededError,
+            apiproxy_errors.DeadlineExceededError,
+            urlfetch_errors.DeadlineExceededError):
+      self.RenderText(text=ERROR_TIMEOUT, status=408)
+
+
+class CancelDataHandler(base.RequestHandlerBase):
+  """Http handler for cancelling an async query job (/data/cancel).
+
+  The job is identified by the 'request_id' the client provided to /data/sql,
+  or by the job 'id' returned from /data/sql.  Jobs can only be cancelled by
+  the user that started them (or an administrator, by job id).  This returns:
+    {'job': {'id': job_id, 'state': 'CANCELLED'}}
+
+  If no job was started for the request (for example, because the results
+  were cached), nothing is cancelled and this returns {'job': None}.
+  """
+
+  def post(self):
+    """Request handler for POST operations."""
+    try:
+      urlfetch.set_default_fetch_deadline(URLFETCH_TIMEOUT)
+
+      request_id = self.request.get('request_id')
+      job_id = self.request.get('id')
+
+      if request_id:
+        job_reference = query_job.GetRequestJob(request_id)
+      elif job_id:
+        job = query_job.QueryJob.GetQueryJob(job_id)
+        job_reference = {'projectId': job.project_id, 'jobId': job_id}
+      else:
+        raise KeyError('The request id or job id is required.')
+
+      if not job_reference:
+        self.RenderJson({'job': None})
+        return
+
+      client = DataHandlerUtil.GetDataClient(self.env)
+      CancelQueryJob(client, job_reference)
+
+      self.RenderJson({'job': {'id': job_reference['jobId'],
+                               'state': JobStates.CANCELLED}})
+
+    except (big_query_client.BigQueryError, query_job.Error, KeyError) as err:
+      logging.error(str(err))
+      self.RenderJson({'error': str(err)})
+    except (google.appengine.runtime.DeadlineExceededError,
+            apiproxy_errors.DeadlineExceededError,
+            urlfetch_errors.DeadlineExceededError):
+      self.RenderText(text=ERROR_TIMEOUT, status=408)
+
+
+class DashboardDataHandler(base.RequestHandlerBase):
+  """Http handler for the results of every widget in a dashboard.
+
+  The dashboard (/data/dashboard?id=) is loaded and parsed once, and the saved
+  query of each widget is run with a shared config.  Cached results for all
+  widgets are looked up in a single call, and the remaining queries run
+  concurrently (up to MAX_DASHBOARD_THREADS at once), so the dashboard takes
+  about as long as its slowest query.  Widgets with identical datasources
+  share a single query.
+
+  An optional 'timestamp_mode' parameter applies to every widget.  See
+  SqlDataHandler for details.  Queries are routed to rollups as for
+  SqlDataHandler, unless 'use_rollups' is 0.
+
+  This handler returns the /data/sql response of each widget, keyed by widget
+  id, with the saved query that was run as its 'query'.  The dashboard page
+  uses it for the widgets whose query hasn't changed since the dashboard was
+  saved.  A widget that fails has a response of {'error': message}:
+    {'widgets': {'1': {'results': {...}, 'query': '...', ...},
+                 '2': {'error': '...'}},
+     'elapsedTime': 1.5, 'timings': {'queries': 1250.0, ...}}
+
+  The queries run on other threads, so their stages are reported together as
+  'queries'.  The query of each widget is recorded in the query log, with the
+  time spent on it as its 'query' stage; widgets that share a query with an
+  earlier widget are recorded as cache hits.
+  """
+
+  REPORT_TIMINGS = True
+
+  @ndb.toplevel
+  def get(self):
+    """Request handler for GET operations."""
+    try:
+      start_time = time.time()
+      urlfetch.set_default_fetch_deadline(URLFETCH_TIMEOUT)
+
+      dashboard_id = self.request.get('id')
+      if not dashboard_id:
+        raise KeyError('The dashboard id is required.')
+
+      timestamp_mode = self.request.get('timestamp_mode') or None
+      result_util.TimestampModes.Validate(timestamp_mode)
+
+      self.timings.context['dashboard_id'] = dashboard_id
+
+      with self.timings.Span('dashboard'):
+        dashboard_model = dashboard.Dashboard.GetDashboard(int(dashboard_id))
+        widgets = GetQueryWidgets(dashboard_model.GetDashboardData())
+
+      datasources = {}
+      for widget in widgets:
+        datasource = widget['datasource']
+        datasources.setdefault(_GetDatasourceKey(datasource), datasource)
+
+      # Datasources that can read a rollup run the rewritten query instead.
+      rollup_plans = {}
+      if self.request.get('use_rollups') != '0':
+        with self.timings.Span('plan'):
+          for key, datasource in datasources.items():
+            if not IsBigQueryDatasource(datasource):
+              continue
+
+            plan = GetRollupPlan(GetDatasourceQuery(datasource),
+                                 self.config.default_project)
+            if plan:
+              rollup_plans[key] = plan
+              datasources[key] = dict(datasource, query_exec=plan.query)
+
+      runner = DashboardQueryRunner(
+          env=self.env,
+          project_id=self.config.default_project,
+          config=self.config,
+          cache_duration=self.config.cache_duration or None,
+          timestamp_mode=timestamp_mode,
+          admission=GetAdmissionController(self.config),
+          user_key=GetAdmissionUserKey(self.request))
+      with self.timings.Span('queries'):
+        results = runner.Run(datasources)
+
+      response = {'widgets': {}}
+      recorded_keys = set()
+      for widget in widgets:
+        datasource = widget['datasource']
+        key = _GetDatasourceKey(datasource)
+        result, error = results[key]
+
+        if result is not None:
+          elapsed_ms = runner.elapsed_ms.get(key, 0.0)
+          RecordQuery(GetDatasourceQuery(datasource), datasource, result,
+                      result.num_rows,
+                      cache_hit=(key in runner.cached_keys or
+                                 key in recorded_keys),
+                      elapsed_ms=elapsed_ms, timings={'query': elapsed_ms},
+                      path=self.request.path, dashboard_id=dashboard_id,
+                      widget_id=widget['id'])
+          recorded_keys.add(key)
+
+        if error:
+          widget_response = {'error': error}
+        else:
+          try:
+            widget_response = ProcessResultSet(result.Copy(),
+                                               datasource['config'])
+          except (big_query_result_pivot.DuplicateValueError, ValueError,
+                  KeyError) as err:
+            logging.error(str(err))
+            widget_response = {'error': str(err)}
+
+        if 'error' not in widget_response:
+          widget_response['query'] = GetDatasourceQuery(datasource)
+          if key in rollup_plans:
+            widget_response['rollup'] = rollup_plans[key].ToDict()
+
+        response['widgets'][str(widget['id'])] = widget_response
+
+      response['elapsedTime'] = time.time() - start_time
+      response['timings'] = self.timings.ToDict()
+      self.RenderJson(response)
+
+    except (dashboard.Error, result_util.NotSupportedError, ValueError,
+            KeyError) as err:
+      logging.error(str(err))
+      self.RenderJson({'error': str(err)})
+    except (google.appengine.runtime.DeadlineExceededError,
+            apiproxy_errors.DeadlineExceededError,
+            urlfetch_errors.DeadlineExceededError):
+      self.RenderText(text=ERROR_TIMEOUT, status=408)
+
+
+class DashboardQueryRunner(object):
+  """Runs the queries of several datasources concurrently."""
+
+  def __init__(self, env, project_id, config, cache_duration=None,
+               timestamp_mode=None, admission=None, user_key=None):
+    """Initializes the runner.
+
+    Args:
+      env: The environment of the data clients.
+      project_id: The project to run BigQuery queries in.
+      config: The ExplorerConfigModel.
+      cache_duration: The number of seconds to cache results for.
+      timestamp_mode: See SqlDataHandler.
+      admission: If provided, an admission_control.AdmissionController that
+          admits each BigQuery query that isn't cached.
+      user_key: The key that queries are admitted under.
+    """
+    self.env = env
+    self.project_id = project_id
+    self.config = config
+    self.cache_duration = cache_duration
+    self.timestamp_mode = timestamp_mode
+    self.admission = admission
+    self.user_key = user_key
+
+    # The keys of the datasources served from the cache by Run(), and the
+    # milliseconds spent on the query of each other datasource.
+    self.cached_keys = set()
+    self.elapsed_ms = {}
+
+  def Run(self, datasources):
+    """Returns the results of each datasource.
+
+    Args:
+      datasources: A dict of datasources, keyed by any hashable value.
+
+    Returns:
+      A dict with the same keys, and values of (result, error).  Result is a
+      big_query_result_set.ResultSet, or None if the query failed.  Error is
+      None, or a message describing the failure.
+    """
+    results = {}
+    pending = Queue.Queue()
+
+    cached = self._GetCachedResultSets(datasources)
+    for key, datasource in datasources.iteritems():
+      query = GetDatasourceQuery(datasource)
+      # The cached results are full results, not samples.
+      if (query in cached and IsBigQueryDatasource(datasource) and
+          not _GetSamplingConfig(datasource)[0]):
+        results[key] = (cached[query], None)
+        self.cached_keys.add(key)
+      else:
+        pending.put((key, datasource))
+
+    # Each thread uses its own clients, as they are not thread safe.
+    threads = [threading.Thread(target=self._RunPending,
+                                args=(pending, results))
+               for _ in xrange(min(pending.qsize(), MAX_DASHBOARD_THREADS))]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+
+    return results
+
+  def _GetCachedResultSets(self, datasources):
+    """Returns the cached results of the BigQuery datasources, by query."""
+    queries = [GetDatasourceQuery(datasource)
+               for datasource in datasources.itervalues()
+               if IsBigQueryDatasource(datasource)]
+    if not queries:
+      return {}
+
+    client = DataHandlerUtil.GetDataClient(self.env)
+    client.project_id = self.project_id
+    return client.GetCachedResultSets(queries, self.timestamp_mode)
+
+  def _RunPending(self, pending, results):
+    """Runs datasources from the pending queue until it is empty."""
+    urlfetch.set_default_fetch_deadline(URLFETCH_TIMEOUT)
+
+    while True:
+      try:
+        key, datasource = pending.get_nowait()
+      except Queue.Empty:
+        return
+
+      start_time = time.time()
+      try:
+        client = GetQueryClient(datasource, self.env, self.project_id,
+                                self.config)
+
+        # Only BigQuery clients sample results.
+        query_args = {}
+        if IsBigQueryDatasource(datasource):
+          query_args['sampler'] = GetResultSampler(
+              datasource.get('config') or {})
+
+        admit = self.admission and IsBigQueryDatasource(datasource)
+        if admit:
+          self.admission.Acquire(self.user_key, client.project_id)
+
+        try:
+          result = client.QueryResultSet(
+              GetDatasourceQuery(datasource),
+              cache_duration=self.cache_duration,
+              timestamp_mode=self.timestamp_mode,
+              **query_args)
+        finally:
+          if admit:
+            self.admission.Release()
+
+        results[key] = (result, None)
+        self.elapsed_ms[key] = round((time.time() - start_time) * 1000, 1)
+      except (big_query_client.BigQueryError, MySQLdb.Error,
+              admission_control.AdmissionError, SecurityError,
+              ValueError) as err:
+        logging.error(str(err))
+        results[key] = (None, str(err))
+      except Exception:  # pylint: disable=broad-except
+        # Errors raised in a thread would otherwise be lost, leaving the
+        # widget without a response.
+        logging.exception('Query failed for datasource: %s', datasource)
+        results[key] = (None, ERROR_UNEXPECTED)
+
+
+def GetQueryWidgets(dashboard_data):
+  """Returns the widgets of a dashboard that have a query, in order."""
+  widgets = []
+
+  for container in dashboard_data.get('children', []):
+    for widget in container['container']['children']:
+      datasource = widget.get('datasource')
+      if datasource and GetDatasourceQuery(datasource):
+        widgets.append(widget)
+
+  return widgets
+
+
+def GetDatasourceQuery(datasource):
+  """Returns the query to run for a datasource."""
+  return datasource.get('query_exec') or datasource.get('query')
+
+
+def _GetDatasourceKey(datasource):
+  """Returns a key that is shared by datasources that run the same query."""
+  datasource_config = datasource.get('config') or {}
+  cloudsql_config = datasource_config.get('cloudsql') or {}
+
+  return ((datasource.get('type', 'BigQuery'),
+           cloudsql_config.get('instance'),
+           cloudsql_config.get('database_name')) +
+          _GetSamplingConfig(datasource) +
+          (GetDatasourceQuery(datasource),))
+
+
+def _GetSamplingConfig(datasource):
+  """Returns the (max_rows, sampling) results settings of a datasource."""
+  results_config = (datasource.get('config') or {}).get('results') or {}
+  return (results_config.get('max_rows'), results_config.get('sampling'))
+
+
 # Main WSGI app as specified in app.yaml
 app = webapp2.WSGIApplication(
     [('/data/fields', FieldDataHandler),
      ('/data/metadata', MetadataDataHandler),
-     ('/data/sql', SqlDataHandler)])
+     ('/data/sql', SqlDataHandler),
+     ('/data/job', JobDataHandler),
+     ('/data/cancel', CancelDataHandler),
+     ('/data/dashboard', DashboardDataHandler)])
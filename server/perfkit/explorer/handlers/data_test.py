@@ -19,21 +19,32 @@ __author__ = 'joemu@google.com (Joe Allan Muharsky)'
 
 import json
 import logging
+import mock
+import os
 import pytest
 import webtest
 import unittest
 
+from google.appengine.ext import ndb
 from google.appengine.ext import testbed
 
 from perfkit import test_util
+from perfkit.common import admission_control
 from perfkit.common import big_query_client
+from perfkit.common import big_query_result_set as result_set_lib
 from perfkit.common import credentials_lib
 from perfkit.common import data_source_config as config
 from perfkit.common import gae_test_util
+from perfkit.common import local_sql_client
 from perfkit.explorer.handlers import base
 from perfkit.explorer.handlers import data
+from perfkit.explorer.model import cube_watermark
 from perfkit.explorer.model import dashboard
 from perfkit.explorer.model import explorer_config
+from perfkit.explorer.model import query_job
+from perfkit.explorer.model import query_log
+from perfkit.explorer.samples_mart import cube_maintenance
+from perfkit.explorer.samples_mart import field_index
 
 
 # TODO: Change tests to verify generated SQL rather than results to remove
@@ -98,6 +109,14 @@ class DataTest(unittest.TestCase):
     self.explorer_config.grant_view_to_public = True
     self.explorer_config.put()
 
+    admission_control.ResetController()
+    query_log.ResetWriter()
+
+  def tearDown(self):
+    self.testbed.deactivate()
+    admission_control.ResetController()
+    query_log.ResetWriter()
+
   def _GetTestDataClient(self, env=None):
     return big_query_client.BigQueryClient(
         env=config.Environments.TESTING,
@@ -119,6 +138,52 @@ class DataTest(unittest.TestCase):
 
     self.assertEqual(resp.json['rows'], expected_result)
 
+  def testFieldsHandlerUsesIndex(self):
+    field_index.ClearFieldIndexes()
+    mock_client = self._UseMockDataClient({
+        'jobReference': {'jobId': 'job1'},
+        'jobComplete': True,
+        'totalRows': '3',
+        'schema': {'fields': [
+            {'name': 'product_name', 'type': 'STRING'},
+            {'name': 'test', 'type': 'STRING'},
+            {'name': 'metric', 'type': 'STRING'},
+            {'name': 'owner', 'type': 'STRING'},
+            {'name': 'day_timestamp', 'type': 'TIMESTAMP'}]},
+        'rows': [
+            {'f': [{'v': 'widget-factory'}, {'v': 'create-widgets'},
+                   {'v': 'final-weight'}, {'v': 'jdoe'},
+                   {'v': '1.3572576E9'}]},
+            {'f': [{'v': 'widget-factory'}, {'v': 'paint-widgets'},
+                   {'v': 'drying-time'}, {'v': 'jdoe'},
+                   {'v': '1.3578624E9'}]},
+            {'f': [{'v': 'gadget-works'}, {'v': 'create-gadgets'},
+                   {'v': 'final-weight'}, {'v': 'asmith'},
+                   {'v': '1.3572576E9'}]}]})
+
+    filters = {'start_date': None,
+               'end_date': {'filter_type': 'CUSTOM',
+                            'filter_value': '2013-01-10',
+                            'text': '2013-01-10'},
+               'product_name': 'widget-factory',
+               'test': None,
+               'metric': None}
+    resp = self.app.get(url='/data/fields',
+                        params=[('filters', json.dumps(filters)),
+                                ('field_name', 'test')])
+
+    self.assertEqual([{'name': 'create-widgets'}], resp.json['rows'])
+
+    # Subsequent requests are served from the index.
+    mock_client.mock_reply = None
+    resp = self.app.get(url='/data/fields',
+                        params=[('filters', json.dumps(filters)),
+                                ('field_name', 'product_name'),
+                                ('prefix', 'GAD')])
+
+    self.assertEqual([{'name': 'gadget-works'}], resp.json['rows'])
+    field_index.ClearFieldIndexes()
+
   @pytest.mark.integration
   @pytest.mark.cube
   def testAllMetdataHandler(self):
@@ -198,6 +263,18 @@ class DataTest(unittest.TestCase):
                                   'Accept': 'text/plain'})
     self.assertEqual(resp.json['error'], expected_message)
 
+  def testSqlHandlerFailsWithUnknownTimestampMode(self):
+    sql = 'SELECT foo FROM bar'
+    expected_message = 'Timestamp mode "unknown" is not supported.'
+    data = {'dashboard_id': 2, 'id': 2, 'timestamp_mode': 'unknown',
+            'datasource': {'query': sql, 'config': {'results': {}}}}
+
+    resp = self.app.post(url='/data/sql',
+                         params=json.dumps(data),
+                         headers={'Content-type': 'application/json',
+                                  'Accept': 'text/plain'})
+    self.assertEqual(resp.json['error'], expected_message)
+
   def testSqlHandlerFailsCustomQueryForPublicWithoutRights(self):
     custom_query = 'SELECT stuff FROM mysource'
 
@@ -276,5 +353,572 @@ class DataTest(unittest.TestCase):
                                   'Accept': 'text/plain'})
     self.assertEqual(resp.json['results'], self.VALID_RESULTS)
 
+  def _UseMockDataClient(self, mock_reply):
+    """Replaces the data client with a mock that returns mock_reply."""
+    self.mock_client = test_util.GetDataClient(mocked=True)
+    self.mock_client.mock_reply = mock_reply
+    data.DataHandlerUtil.GetDataClient = self._GetMockDataClient
+
+    return self.mock_client
+
+  def _GetMockDataClient(self, env=None):
+    return self.mock_client
+
+  def _GetJobReply(self, job_complete):
+    return {
+        'jobReference': {'jobId': 'job1'},
+        'jobComplete': job_complete,
+        'totalRows': '1',
+        'schema': {'fields': [
+            {'name': 'product_name', 'type': 'STRING', 'mode': 'NULLABLE'},
+            {'name': 'avg', 'type': 'FLOAT', 'mode': 'NULLABLE'}]},
+        'rows': [{'f': [{'v': 'widget-factory'}, {'v': '6.5'}]}]}
+
+  def testSqlHandlerAsyncReturnsRunningJob(self):
+    gae_test_util.setCurrentUser(self.testbed, is_admin=True)
+    self._UseMockDataClient({'jobReference': {'jobId': 'job1'},
+                             'jobComplete': False})
+
+    data = {'async': True,
+            'datasource': {'query': self.VALID_SQL,
+                           'config': {'results': {}}}}
+
+    resp = self.app.post(url='/data/sql',
+                         params=json.dumps(data),
+                         headers={'Content-type': 'application/json',
+                                  'Accept': 'text/plain'})
+
+    self.assertEqual({'job': {'id': 'job1', 'state': 'RUNNING'}}, resp.json)
+    self.assertEqual(self.VALID_SQL,
+                     query_job.QueryJob.GetQueryJob('job1').query)
+
+  def testSqlHandlerAsyncReturnsCompletedResults(self):
+    gae_test_util.setCurrentUser(self.testbed, is_admin=True)
+    self._UseMockDataClient(self._GetJobReply(job_complete=True))
+
+    data = {'async': True,
+            'datasource': {'query': self.VALID_SQL,
+                           'config': {'results': {}}}}
+
+    resp = self.app.post(url='/data/sql',
+                         params=json.dumps(data),
+                         headers={'Content-type': 'application/json',
+                                  'Accept': 'text/plain'})
+
+    self.assertEqual([{'c': [{'v': 'widget-factory'}, {'v': 6.5}]}],
+                     resp.json['results']['rows'])
+    self.assertNotIn('job', resp.json)
+
+  def _GetSampledJobReply(self):
+    reply = self._GetJobReply(job_complete=True)
+    reply['totalRows'] = '4'
+    reply['rows'] = [{'f': [{'v': name}, {'v': '1.0'}]}
+                     for name in ('a', 'b', 'c', 'd')]
+    return reply
+
+  def testSqlHandlerSamplesResultsToMaxRows(self):
+    gae_test_util.setCurrentUser(self.testbed, is_admin=True)
+    self._UseMockDataClient(self._GetSampledJobReply())
+
+    resp = self._PostSql({'datasource': {
+        'query': self.VALID_SQL,
+        'config': {'results': {'max_rows': 2}}}})
+
+    self.assertEqual(['a', 'c'], [row['c'][0]['v']
+                                  for row in resp.json['results']['rows']])
+    self.assertEqual(2, resp.json['totalRows'])
+
+  def testSqlHandlerAsyncSamplesResultsToMaxRows(self):
+    gae_test_util.setCurrentUser(self.testbed, is_admin=True)
+    self._UseMockDataClient(self._GetSampledJobReply())
+
+    resp = self._PostSql({'async': True, 'datasource': {
+        'query': self.VALID_SQL,
+        'config': {'results': {'max_rows': 3, 'sampling': 'random'}}}})
+
+    self.assertEqual(3, len(resp.json['results']['rows']))
+
+  def testSqlHandlerRejectsUnknownSampling(self):
+    gae_test_util.setCurrentUser(self.testbed, is_admin=True)
+    self._UseMockDataClient(self._GetSampledJobReply())
+
+    resp = self._PostSql({'datasource': {
+        'query': self.VALID_SQL,
+        'config': {'results': {'max_rows': 2, 'sampling': 'first'}}}})
+
+    self.assertEqual('The sampling setting must be one of: random, stride.',
+                     resp.json['error'])
+
+  def testSqlHandlerReportsTimings(self):
+    gae_test_util.setCurrentUser(self.testbed, is_admin=True)
+    self._UseMockDataClient(self._GetJobReply(job_complete=True))
+
+    resp = self._PostSql({'dashboard_id': 1, 'id': 3,
+                          'datasource': {'query': self.VALID_SQL,
+                                         'config': {'results': {}}}})
+
+    stages = resp.json['timings']
+    for stage in ('config', 'parse', 'typing', 'format'):
+      self.assertIn(stage, stages)
+
+    header = resp.headers['Server-Timing']
+    self.assertTrue(header.startswith('config;dur='))
+    self.assertIn('encode;dur=', header)
+    self.assertIn('total;dur=', header)
+
+  def _GetQueryLog(self):
+    """Writes the buffered query log, and returns its entries."""
+    ndb.Future.wait_all(query_log.Flush())
+    return query_log.QueryLogEntry.query().fetch()
+
+  def testSqlHandlerRecordsQuery(self):
+    gae_test_util.setCurrentUser(self.testbed, is_admin=True)
+    reply = self._GetJobReply(job_complete=True)
+    reply.update({'jobReference': {'projectId': 'project1', 'jobId': 'job1'},
+                  'totalBytesProcessed': '1000'})
+    self._UseMockDataClient(reply)
+
+    resp = self._PostSql({'dashboard_id': 1, 'id': 3,
+                          'datasource': {'query': self.VALID_SQL,
+                                         'config': {'results': {}}}})
+
+    entry, = self._GetQueryLog()
+    self.assertEqual(query_log.GetQueryFingerprint(self.VALID_SQL),
+                     entry.fingerprint)
+    self.assertEqual(('1', '3'), (entry.dashboard_id, entry.widget_id))
+    self.assertFalse(entry.cache_hit)
+    self.assertEqual(('project1', 'job1'), (entry.project_id, entry.job_id))
+    self.assertEqual(1000, entry.bytes_processed)
+    self.assertIsNone(entry.slot_ms)
+    self.assertEqual(1, entry.rows)
+    self.assertEqual(len(resp.body), entry.response_bytes)
+    self.assertIn('bigquery', entry.timings)
+
+  def testSqlHandlerRecordsCacheHit(self):
+    gae_test_util.setCurrentUser(self.testbed, is_admin=True)
+    reply = self._GetJobReply(job_complete=True)
+    reply.update({'jobReference': {'projectId': 'project1', 'jobId': 'job1'},
+                  'totalBytesProcessed': '1000'})
+    mock_client = self._UseMockDataClient(reply)
+    cached_result = result_set_lib.ResultSet.FromReply(reply)
+    cached_result.cache_hit = True
+    mock_client.GetCachedResultSet = mock.Mock(return_value=cached_result)
+
+    self._PostSql({'datasource': {'query': self.VALID_SQL,
+                                  'config': {'results': {}}}})
+
+    entry, = self._GetQueryLog()
+    self.assertTrue(entry.cache_hit)
+    self.assertIsNone(entry.job_id)
+    self.assertEqual(0, entry.bytes_processed)
+    self.assertEqual(0, entry.slot_ms)
+
+  def testJobHandlerRecordsWidgetQuery(self):
+    gae_test_util.setCurrentUser(self.testbed, is_admin=True)
+    query_job.QueryJob.Create(
+        job_id='job1', project_id='project1', query=self.VALID_SQL,
+        config={'results': {}}, dashboard_id=1, widget_id=3)
+    self._UseMockDataClient(self._GetJobReply(job_complete=True))
+
+    self.app.get(url='/data/job', params={'id': 'job1'})
+
+    entry, = self._GetQueryLog()
+    self.assertEqual(('1', '3'), (entry.dashboard_id, entry.widget_id))
+    self.assertEqual('job1', entry.job_id)
+    self.assertEqual('/data/job', entry.path)
+
+  def testSqlHandlerRejectsQueriesOverUserRate(self):
+    gae_test_util.setCurrentUser(self.testbed, is_admin=True)
+    self.explorer_config.user_queries_per_minute = 1
+    self.explorer_config.user_query_burst = 1
+    self.explorer_config.query_queue_timeout = 0
+    self.explorer_config.put()
+    self._UseMockDataClient(self._GetJobReply(job_complete=True))
+
+    data = {'datasource': {'query': self.VALID_SQL,
+                           'config': {'results': {}}}}
+    self.assertIn('results', self._PostSql(data).json)
+
+    resp = self.app.post(url='/data/sql', params=json.dumps(data),
+                         headers={'Content-type': 'application/json'},
+                         status=503)
+
+    self.assertIn('Too many queries', resp.json['error'])
+    self.assertEqual('60', resp.headers['Retry-After'])
+
+  def _PostRollupQuery(self, use_rollups=True, end_day='2014-01-01'):
+    """Posts an aggregate query, and returns (response, query run).
+
+    The cubes are refreshed at the start of 2014-01-01.  The query reads the
+    rows before end_day, or every row if end_day is None.
+    """
+    gae_test_util.setCurrentUser(self.testbed, is_admin=True)
+    self._UseMockDataClient(self._GetJobReply(job_complete=True))
+    cube_watermark.CubeWatermark.Set(
+        self.explorer_config.default_project, 'samples_mart_testdata',
+        1388534400000, [], version=cube_maintenance.CUBE_VERSION)
+
+    where = ''
+    if end_day:
+      where = ('WHERE timestamp < TIMESTAMP_TO_SEC(TIMESTAMP(\'%s\')) ' %
+               end_day)
+    query = ('SELECT product_name, AVG(value) AS avg '
+             'FROM [samples_mart_testdata.results] ' + where +
+             'GROUP BY product_name')
+    with mock.patch.object(self.mock_client, 'QueryResultSet',
+                           wraps=self.mock_client.QueryResultSet) as run:
+      resp = self._PostSql({'datasource': {'query': query,
+                                           'config': {'results': {}}},
+                            'use_rollups': use_rollups})
+
+    return resp, run.call_args[0][0]
+
+  def testSqlHandlerRoutesAggregatesToRollup(self):
+    resp, query = self._PostRollupQuery()
+
+    self.assertIn('FROM [samples_mart_testdata.lookup_field_cube]', query)
+    self.assertIn('SUM(value_sum) / SUM(value_count) AS avg', query)
+    self.assertEqual('samples_mart_testdata.lookup_field_cube',
+                     resp.json['rollup']['table'])
+    self.assertEqual(1388534400000, resp.json['rollup']['refreshed_time'])
+
+  def testSqlHandlerSkipsRollupForRowsAfterRefresh(self):
+    for end_day in ['2014-01-02', None]:
+      resp, query = self._PostRollupQuery(end_day=end_day)
+
+      self.assertIn('FROM [samples_mart_testdata.results]', query)
+      self.assertNotIn('rollup', resp.json)
+
+  def testSqlHandlerSkipsRollupWhenDisabled(self):
+    resp, query = self._PostRollupQuery(use_rollups=False)
+
+    self.assertIn('FROM [samples_mart_testdata.results]', query)
+    self.assertNotIn('rollup', resp.json)
+
+  def testSqlHandlerRunsLocalSqlDatasource(self):
+    gae_test_util.setCurrentUser(self.testbed, is_admin=True)
+
+    resp = self._PostSql({
+        'datasource': {
+            'type': 'Local SQL',
+            'query': ('SELECT test, COUNT(*) AS count '
+                      'FROM [samples_mart.results] '
+                      'WHERE test = "iperf" GROUP EACH BY test'),
+            'config': {'results': {}}}})
+
+    self.assertEqual([{'c': [{'v': 'iperf'}, {'v': 3613}]}],
+                     resp.json['results']['rows'])
+    self.assertNotIn('rollup', resp.json)
+
+  def _PostLocalSql(self, datasource_config=None):
+    return self._PostSql({
+        'datasource': {
+            'type': 'Local SQL',
+            'query': ('SELECT COUNT(*) AS count FROM [samples_mart.results] '
+                      'WHERE test = "iperf"'),
+            'config': datasource_config or {'results': {}}}})
+
+  @mock.patch.dict(os.environ, {'SERVER_SOFTWARE': 'Google App Engine/1.9'})
+  def testSqlHandlerRejectsLocalSqlWhenNotEnabled(self):
+    gae_test_util.setCurrentUser(self.testbed, is_admin=True)
+
+    resp = self._PostLocalSql()
+
+    self.assertEqual('Local SQL datasources are not enabled.',
+                     resp.json['error'])
+    self.assertNotIn('results', resp.json)
+
+  @mock.patch.dict(os.environ, {'SERVER_SOFTWARE': 'Google App Engine/1.9'})
+  def testSqlHandlerRunsLocalSqlWhenEnabledInConfig(self):
+    gae_test_util.setCurrentUser(self.testbed, is_admin=True)
+    self.explorer_config.enable_local_sql = True
+    self.explorer_config.put()
+
+    resp = self._PostLocalSql()
+
+    self.assertEqual([{'c': [{'v': 3613}]}], resp.json['results']['rows'])
+
+  def testSqlHandlerIgnoresLocalSqlDatabaseOfRequest(self):
+    gae_test_util.setCurrentUser(self.testbed, is_admin=True)
+
+    with mock.patch.object(local_sql_client, 'GetSharedClient',
+                           wraps=local_sql_client.GetSharedClient) as get:
+      resp = self._PostLocalSql({'results': {},
+                                 'localsql': {'database': '/tmp/other.db'}})
+
+    get.assert_called_once_with(None)
+    self.assertEqual([{'c': [{'v': 3613}]}], resp.json['results']['rows'])
+
+  def _PostSql(self, data):
+    return self.app.post(url='/data/sql',
+                         params=json.dumps(data),
+                         headers={'Content-type': 'application/json',
+                                  'Accept': 'text/plain'})
+
+  def testSqlHandlerSortsAndPagesResults(self):
+    gae_test_util.setCurrentUser(self.testbed, is_admin=True)
+    reply = self._GetJobReply(job_complete=True)
+    reply['totalRows'] = '3'
+    reply['rows'] = [{'f': [{'v': 'widget-factory'}, {'v': '6.5'}]},
+                     {'f': [{'v': 'gadget-works'}, {'v': '8.5'}]},
+                     {'f': [{'v': 'gizmo-plant'}, {'v': '7.5'}]}]
+    self._UseMockDataClient(reply)
+
+    resp = self._PostSql({'offset': 1, 'limit': 1,
+                          'sort_field': 'avg', 'sort_descending': True,
+                          'datasource': {'query': self.VALID_SQL,
+                                         'config': {'results': {}}}})
+
+    self.assertEqual([{'c': [{'v': 'gizmo-plant'}, {'v': 7.5}]}],
+                     resp.json['results']['rows'])
+    self.assertEqual({'offset': 1, 'limit': 1, 'totalRows': 3},
+                     resp.json['page'])
+
+  def testSqlHandlerReadsPageFromQueryJob(self):
+    gae_test_util.setCurrentUser(self.testbed, is_admin=True)
+    reply = self._GetJobReply(job_complete=True)
+    reply['totalRows'] = '5'
+    mock_client = self._UseMockDataClient(reply)
+
+    resp = self._PostSql({'offset': 2, 'limit': 1,
+                          'datasource': {'query': self.VALID_SQL,
+                                         'config': {'results': {}}}})
+
+    self.assertEqual([{'c': [{'v': 'widget-factory'}, {'v': 6.5}]}],
+                     resp.json['results']['rows'])
+    self.assertEqual({'offset': 2, 'limit': 1, 'totalRows': 5},
+                     resp.json['page'])
+    self.assertIn('queries/job1', mock_client.last_request.uri)
+    self.assertIn('startIndex=2', mock_client.last_request.uri)
+
+  def testSqlHandlerReadsCachedPageWithoutAdmission(self):
+    gae_test_util.setCurrentUser(self.testbed, is_admin=True)
+    self.explorer_config.user_queries_per_minute = 1
+    self.explorer_config.user_query_burst = 1
+    self.explorer_config.query_queue_timeout = 0
+    self.explorer_config.put()
+    reply = self._GetJobReply(job_complete=True)
+    reply['totalRows'] = '3'
+    reply['rows'] = [{'f': [{'v': 'widget-factory'}, {'v': '6.5'}]},
+                     {'f': [{'v': 'gadget-works'}, {'v': '8.5'}]},
+                     {'f': [{'v': 'gizmo-plant'}, {'v': '7.5'}]}]
+    mock_client = self._UseMockDataClient(reply)
+    mock_client.GetCachedResultSet = mock.Mock(
+        side_effect=lambda *args: result_set_lib.ResultSet.FromReply(reply))
+
+    for _ in range(2):
+      resp = self._PostSql({'offset': 1, 'limit': 1,
+                            'datasource': {'query': self.VALID_SQL,
+                                           'config': {'results': {}}}})
+
+      self.assertEqual([{'c': [{'v': 'gadget-works'}, {'v': '8.5'}]}],
+                       resp.json['results']['rows'])
+      self.assertEqual({'offset': 1, 'limit': 1, 'totalRows': 3},
+                       resp.json['page'])
+    self.assertIsNone(mock_client.last_request)
+
+  def testSqlHandlerFailsWithInvalidPage(self):
+    gae_test_util.setCurrentUser(self.testbed, is_admin=True)
+    self._UseMockDataClient(self._GetJobReply(job_complete=True))
+
+    resp = self._PostSql({'offset': 0, 'limit': 0,
+                          'datasource': {'query': self.VALID_SQL,
+                                         'config': {'results': {}}}})
+
+    self.assertEqual('The "limit" parameter must be > 0.',
+                     resp.json['error'])
+
+  def testJobHandlerFailsWithoutId(self):
+    resp = self.app.get(url='/data/job')
+
+    self.assertEqual('\'The job id is required.\'', resp.json['error'])
+
+  def testJobHandlerFailsForUnknownJob(self):
+    resp = self.app.get(url='/data/job', params={'id': 'unknown'})
+
+    self.assertEqual('Query job "unknown" not found.', resp.json['error'])
+
+  def testJobHandlerReportsRunningJob(self):
+    gae_test_util.setCurrentUser(self.testbed, is_admin=True)
+    query_job.QueryJob.Create(
+        job_id='job1', project_id='project1', query=self.VALID_SQL,
+        config={'results': {}})
+    self._UseMockDataClient(self._GetJobReply(job_complete=False))
+
+    resp = self.app.get(url='/data/job', params={'id': 'job1'})
+
+    self.assertEqual({'job': {'id': 'job1', 'state': 'RUNNING'}}, resp.json)
+
+  def testJobHandlerReturnsResults(self):
+    gae_test_util.setCurrentUser(self.testbed, is_admin=True)
+    query_job.QueryJob.Create(
+        job_id='job1', project_id='project1', query=self.VALID_SQL,
+        config={'results': {}}, timestamp_mode='epoch_ms')
+    mock_client = self._UseMockDataClient(self._GetJobReply(job_complete=True))
+
+    resp = self.app.get(url='/data/job', params={'id': 'job1'})
+
+    self.assertEqual({'id': 'job1', 'state': 'DONE'}, resp.json['job'])
+    self.assertEqual([{'c': [{'v': 'widget-factory'}, {'v': 6.5}]}],
+                     resp.json['results']['rows'])
+    self.assertEqual('project1', mock_client.project_id)
+
+  def testJobHandlerSamplesResultsToMaxRows(self):
+    gae_test_util.setCurrentUser(self.testbed, is_admin=True)
+    query_job.QueryJob.Create(
+        job_id='job1', project_id='project1', query=self.VALID_SQL,
+        config={'results': {'max_rows': 2}})
+    self._UseMockDataClient(self._GetSampledJobReply())
+
+    resp = self.app.get(url='/data/job', params={'id': 'job1'})
+
+    self.assertEqual(['a', 'c'], [row['c'][0]['v']
+                                  for row in resp.json['results']['rows']])
+
+  def _PostRunningJob(self, job_id, request_id=None):
+    self.mock_client.mock_reply = {'jobReference': {'jobId': job_id},
+                                   'jobComplete': False}
+
+    return self._PostSql({'async': True, 'request_id': request_id,
+                          'dashboard_id': 1, 'id': 3,
+                          'datasource': {'query': self.VALID_SQL,
+                                         'config': {'results': {}}}})
+
+  def testRunningJobHoldsAdmissionSlot(self):
+    gae_test_util.setCurrentUser(self.testbed, is_admin=True)
+    self.explorer_config.max_concurrent_queries = 1
+    self.explorer_config.query_queue_timeout = 0
+    self.explorer_config.put()
+    mock_client = self._UseMockDataClient(None)
+
+    resp = self._PostRunningJob('job1')
+    self.assertEqual({'job': {'id': 'job1', 'state': 'RUNNING'}}, resp.json)
+
+    # The running job still counts against max_concurrent_queries.
+    mock_client.mock_reply = {'jobReference': {'jobId': 'job2'},
+                              'jobComplete': False}
+    data = {'async': True, 'dashboard_id': 1, 'id': 4,
+            'datasource': {'query': self.VALID_SQL + ' ',
+                           'config': {'results': {}}}}
+    resp = self.app.post(url='/data/sql', params=json.dumps(data),
+                         headers={'Content-type': 'application/json'},
+                         status=503)
+    self.assertIn('Retry-After', resp.headers)
+
+    mock_client.mock_reply = self._GetJobReply(job_complete=True)
+    resp = self.app.get(url='/data/job', params={'id': 'job1'})
+    self.assertEqual('DONE', resp.json['job']['state'])
+
+    mock_client.mock_reply = {'jobReference': {'jobId': 'job2'},
+                              'jobComplete': False}
+    resp = self.app.post(url='/data/sql', params=json.dumps(data),
+                         headers={'Content-type': 'application/json'})
+    self.assertEqual({'job': {'id': 'job2', 'state': 'RUNNING'}}, resp.json)
+
+  def testCancelReleasesAdmissionSlot(self):
+    gae_test_util.setCurrentUser(self.testbed, is_admin=True)
+    self.explorer_config.max_concurrent_queries = 1
+    self.explorer_config.put()
+    mock_client = self._UseMockDataClient(None)
+    self._PostRunningJob('job1', request_id='request1')
+
+    controller = data.GetAdmissionController(self.explorer_config)
+    self.assertEqual(set(['job1']), controller.GetHeldJobs())
+
+    mock_client.mock_reply = {'job': {'status': {'state': 'RUNNING'}}}
+    self.app.post(url='/data/cancel', params={'request_id': 'request1'})
+
+    self.assertEqual(set(), controller.GetHeldJobs())
+    self.assertEqual(0, controller.running)
+
+  def testSqlHandlerCancelsSupersededWidgetJob(self):
+    gae_test_util.setCurrentUser(self.testbed, is_admin=True)
+    mock_client = self._UseMockDataClient(None)
+
+    with mock.patch.object(mock_client, 'CancelJob') as cancel_job:
+      self._PostRunningJob('job1')
+      self.assertFalse(cancel_job.called)
+
+      resp = self._PostRunningJob('job2')
+      cancel_job.assert_called_once_with('job1', mock_client.project_id)
+
+    self.assertEqual({'job': {'id': 'job2', 'state': 'RUNNING'}}, resp.json)
+    self.assertTrue(query_job.IsJobCancelled('job1'))
+    self.assertFalse(query_job.IsJobCancelled('job2'))
+
+  def testCancelHandlerCancelsRequestJob(self):
+    gae_test_util.setCurrentUser(self.testbed, is_admin=True)
+    mock_client = self._UseMockDataClient(None)
+    self._PostRunningJob('job1', request_id='request1')
+
+    mock_client.mock_reply = {'job': {'status': {'state': 'RUNNING'}}}
+    resp = self.app.post(url='/data/cancel',
+                         params={'request_id': 'request1'})
+
+    self.assertEqual({'job': {'id': 'job1', 'state': 'CANCELLED'}}, resp.json)
+    self.assertIn('jobs/job1/cancel', mock_client.last_request.uri)
+
+    # Polling the job reports the cancellation rather than an error.
+    with mock.patch.object(
+        mock_client, 'GetQueryJobResultSet',
+        side_effect=big_query_client.BigQueryError('Job cancelled.')):
+      resp = self.app.get(url='/data/job', params={'id': 'job1'})
+
+    self.assertEqual({'job': {'id': 'job1', 'state': 'CANCELLED'}}, resp.json)
+
+  def testCancelHandlerIgnoresRequestWithoutJob(self):
+    gae_test_util.setCurrentUser(self.testbed, is_admin=False)
+    mock_client = self._UseMockDataClient(None)
+
+    resp = self.app.post(url='/data/cancel', params={'request_id': 'cached'})
+
+    self.assertEqual({'job': None}, resp.json)
+    self.assertIsNone(mock_client.last_request)
+
+  def testCancelHandlerFailsWithoutId(self):
+    resp = self.app.post(url='/data/cancel')
+
+    self.assertEqual('\'The request id or job id is required.\'',
+                     resp.json['error'])
+
+  def testDashboardHandlerFailsWithoutId(self):
+    resp = self.app.get(url='/data/dashboard')
+
+    self.assertEqual('\'The dashboard id is required.\'', resp.json['error'])
+
+  def testDashboardHandlerRunsAllWidgets(self):
+    gae_test_util.setCurrentUser(self.testbed, is_admin=True)
+    datasource = {'query': self.VALID_SQL, 'config': {'results': {}}}
+    dashboard_data = {'children': [
+        {'container': {'children': [
+            {'id': '1', 'datasource': datasource},
+            {'id': '2'}
+        ]}},
+        {'container': {'children': [
+            {'id': '3', 'datasource': datasource},
+            {'id': '4', 'datasource': {'query': 'SELECT 1'}}
+        ]}}]}
+    dashboard_id = dashboard.Dashboard(
+        data=json.dumps(dashboard_data)).put().integer_id()
+    self._UseMockDataClient(self._GetJobReply(job_complete=True))
+
+    resp = self.app.get(url='/data/dashboard', params={'id': dashboard_id})
+
+    widgets = resp.json['widgets']
+    self.assertEqual(['1', '3', '4'], sorted(widgets.keys()))
+    self.assertEqual([{'c': [{'v': 'widget-factory'}, {'v': 6.5}]}],
+                     widgets['1']['results']['rows'])
+    self.assertEqual(self.VALID_SQL, widgets['1']['query'])
+    self.assertEqual(widgets['1'], widgets['3'])
+    # Widget 4 has no config, so its results cannot be processed.
+    self.assertEqual('\'config\'', widgets['4']['error'])
+
+    # Widget 3 shares the query of widget 1, so it is recorded as a cache hit.
+    entries = sorted(self._GetQueryLog(), key=lambda entry: entry.widget_id)
+    self.assertEqual([('1', False), ('3', True), ('4', False)],
+                     [(entry.widget_id, entry.cache_hit)
+                      for entry in entries])
+    self.assertEqual(str(dashboard_id), entries[0].dashboard_id)
+
 if __name__ == '__main__':
   unittest.main()
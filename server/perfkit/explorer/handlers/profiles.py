@@ -0,0 +1,128 @@
+"""Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Main entry module for the request profiles specified in app.yaml.
+
+Admins can profile a request by adding profile=1 to it (see
+base.RequestHandlerBase).  The profile id is returned in the X-Profile-Id
+header of the response.
+
+The following API is supported:
+
+GET     /admin/profiles - Returns the most recent profiles, without their
+                          stats.  Set limit to change the number returned.
+GET     /admin/profiles/view - Returns the profile with the provided id, in
+                               the provided format:
+                                 text: pstats' print_stats() output (default).
+                                 pstats: A file for pstats or snakeviz.
+                                 collapsed: Stacks for flamegraph.pl or
+                                            speedscope.
+"""
+
+__author__ = 'joemu@google.com (Joe Allan Muharsky)'
+
+import logging
+
+import base
+from perfkit.common import http_util
+from perfkit.common import profile_util
+from perfkit.explorer.model import error_fields
+from perfkit.explorer.model import request_profile
+
+import webapp2
+
+from google.appengine.api import users
+
+
+FORMATS = ['text', 'pstats', 'collapsed']
+
+
+class ListProfilesHandler(base.RequestHandlerBase):
+  """Http handler for listing the recent profiles (/admin/profiles)."""
+
+  def get(self):
+    if not users.is_current_user_admin():
+      self.RenderJson(
+          data={error_fields.MESSAGE: 'Only admins can view profiles.'},
+          status=403)
+      return
+
+    try:
+      limit = http_util.GetIntegerParam(
+          self.request, 'limit', False,
+          request_profile.DEFAULT_RECENT_PROFILES)
+      profiles = request_profile.RequestProfile.GetRecent(limit)
+
+      self.RenderJson({'profiles': [profile.ToDict()
+                                    for profile in profiles]})
+    except http_util.ParameterError as err:
+      self.RenderJson(
+          data={error_fields.MESSAGE: err.message}, status=400)
+
+
+class ViewProfileHandler(base.RequestHandlerBase):
+  """Http handler for downloading a profile (/admin/profiles/view)."""
+
+  def get(self):
+    if not users.is_current_user_admin():
+      self.RenderJson(
+          data={error_fields.MESSAGE: 'Only admins can view profiles.'},
+          status=403)
+      return
+
+    try:
+      profile_id = http_util.GetStringParam(self.request, 'id')
+      profile_format = http_util.GetStringParam(
+          self.request, 'format', False, 'text')
+      if profile_format not in FORMATS:
+        raise http_util.ParameterError(
+            'The format must be one of: ' + ', '.join(FORMATS))
+    except http_util.ParameterError as err:
+      self.RenderJson(
+          data={error_fields.MESSAGE: err.message}, status=400)
+      return
+
+    profile = request_profile.RequestProfile.Get(profile_id)
+    if not profile:
+      self.RenderJson(
+          data={error_fields.MESSAGE: 'Profile %s not found.' % profile_id},
+          status=404)
+      return
+
+    try:
+      if profile_format == 'pstats':
+        self.response.headers['Content-Type'] = 'application/octet-stream'
+        self.response.headers['Content-Disposition'] = (
+            'attachment; filename=%s.pstats' % profile_id)
+        self.response.out.write(profile.stats)
+        return
+
+      stats = profile_util.LoadStats(profile.stats)
+      if profile_format == 'collapsed':
+        text = profile_util.GetCollapsedStacks(stats)
+      else:
+        text = profile_util.GetStatsText(stats)
+
+      self.response.headers['Content-Type'] = 'text/plain; charset=utf-8'
+      self.response.out.write(text)
+    except Exception as err:
+      logging.exception('Formatting profile %s failed.', profile_id)
+      self.RenderJson(
+          data={error_fields.MESSAGE: str(err)}, status=500)
+
+
+# Main WSGI app as specified in app.yaml
+app = webapp2.WSGIApplication(
+    [('/admin/profiles', ListProfilesHandler),
+     ('/admin/profiles/view', ViewProfileHandler)])
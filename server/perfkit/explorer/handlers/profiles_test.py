@@ -0,0 +1,105 @@
+"""Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Tests for the request profiling hook and the profiles handlers."""
+
+__author__ = 'joemu@google.com (Joe Allan Muharsky)'
+
+import unittest
+
+import webtest
+
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+from perfkit.common import gae_test_util
+from perfkit.common import profile_util
+from perfkit.explorer.handlers import base
+from perfkit.explorer.handlers import explorer_config
+from perfkit.explorer.handlers import profiles
+from perfkit.explorer.model import request_profile
+
+
+class ProfilesTest(unittest.TestCase):
+
+  def setUp(self):
+    super(ProfilesTest, self).setUp()
+
+    self.config_app = webtest.TestApp(explorer_config.app)
+    self.app = webtest.TestApp(profiles.app)
+
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_datastore_v3_stub()
+    self.testbed.init_memcache_stub()
+    self.testbed.init_user_stub()
+    ndb.get_context().clear_cache()
+
+  def tearDown(self):
+    self.testbed.deactivate()
+
+  def testRequestIsNotProfiledByDefault(self):
+    gae_test_util.setCurrentUser(self.testbed, is_admin=True)
+    resp = self.config_app.get(url='/config')
+
+    self.assertNotIn(base.PROFILE_ID_HEADER, resp.headers)
+    self.assertEqual([], request_profile.RequestProfile.GetRecent())
+
+  def testProfileRequiresAdmin(self):
+    gae_test_util.setCurrentUser(self.testbed, is_admin=False)
+    resp = self.config_app.get(url='/config?profile=1')
+
+    self.assertNotIn(base.PROFILE_ID_HEADER, resp.headers)
+    self.assertEqual([], request_profile.RequestProfile.GetRecent())
+
+    self.app.get(url='/admin/profiles', status=403)
+
+  def testProfileRequest(self):
+    gae_test_util.setCurrentUser(self.testbed, is_admin=True)
+    resp = self.config_app.get(url='/config?profile=1')
+    profile_id = resp.headers[base.PROFILE_ID_HEADER]
+
+    resp = self.app.get(url='/admin/profiles')
+    self.assertEqual(1, len(resp.json['profiles']))
+    profile = resp.json['profiles'][0]
+    self.assertEqual(profile_id, profile['id'])
+    self.assertEqual('/config', profile['path'])
+    self.assertEqual(200, profile['status'])
+
+    resp = self.app.get(url='/admin/profiles/view',
+                        params={'id': profile_id})
+    self.assertIn('function calls', resp.body)
+
+    resp = self.app.get(url='/admin/profiles/view',
+                        params={'id': profile_id, 'format': 'collapsed'})
+    self.assertIn('get_(', resp.body)
+
+    resp = self.app.get(url='/admin/profiles/view',
+                        params={'id': profile_id, 'format': 'pstats'})
+    self.assertIn(profile_id + '.pstats',
+                  resp.headers['Content-Disposition'])
+    stats = profile_util.LoadStats(resp.body)
+    self.assertTrue(stats.stats)
+
+  def testViewProfileErrors(self):
+    gae_test_util.setCurrentUser(self.testbed, is_admin=True)
+
+    self.app.get(url='/admin/profiles/view', params={'id': 'missing'},
+                 status=404)
+    self.app.get(url='/admin/profiles/view',
+                 params={'id': 'missing', 'format': 'svg'}, status=400)
+
+
+if __name__ == '__main__':
+  unittest.main()
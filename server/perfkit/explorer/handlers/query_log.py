@@ -0,0 +1,95 @@
+"""Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Main entry module for the query log reports specified in app.yaml.
+
+The queries run by the data handlers are recorded in the query log (see
+model/query_log.py).  The following API is supported:
+
+GET     /admin/query_log/widgets - Ranks the widgets by the cost or latency of
+                                   their queries over the last 'days' (default
+                                   7).  'sort' is one of
+                                   query_log.REPORT_SORT_FIELDS (default
+                                   bytes_processed), and 'limit' is the number
+                                   of widgets returned (default 50).
+"""
+
+__author__ = 'joemu@google.com (Joe Allan Muharsky)'
+
+import datetime
+
+import base
+from perfkit.common import http_util
+from perfkit.explorer.model import error_fields
+from perfkit.explorer.model import query_log
+
+import webapp2
+
+from google.appengine.api import users
+from google.appengine.ext import ndb
+
+
+DEFAULT_REPORT_DAYS = 7
+DEFAULT_REPORT_WIDGETS = 50
+# The maximum number of entries read for a report.
+MAX_REPORT_ENTRIES = 20000
+
+
+class WidgetReportHandler(base.RequestHandlerBase):
+  """Http handler for the slowest widgets report (/admin/query_log/widgets).
+
+  Returns:
+      JSON with the 'widgets' of the report (see query_log.GetWidgetReport),
+      the number of 'entries' read, and whether the entries were 'truncated'
+      at MAX_REPORT_ENTRIES.
+  """
+
+  @ndb.toplevel
+  def get(self):
+    if not users.is_current_user_admin():
+      self.RenderJson(
+          data={error_fields.MESSAGE: 'Only admins can view the query log.'},
+          status=403)
+      return
+
+    try:
+      days = http_util.GetIntegerParam(
+          self.request, 'days', False, DEFAULT_REPORT_DAYS)
+      limit = http_util.GetIntegerParam(
+          self.request, 'limit', False, DEFAULT_REPORT_WIDGETS)
+      sort = http_util.GetStringParam(
+          self.request, 'sort', False, query_log.REPORT_SORT_FIELDS[0])
+
+      # Include the queries buffered by this instance.
+      futures = query_log.Flush()
+      if futures:
+        ndb.Future.wait_all(futures)
+
+      since = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+      with self.timings.Span('datastore'):
+        entries = query_log.QueryLogEntry.GetSince(since,
+                                                   MAX_REPORT_ENTRIES)
+
+      self.RenderJson({
+          'widgets': query_log.GetWidgetReport(entries, sort, limit),
+          'entries': len(entries),
+          'truncated': len(entries) >= MAX_REPORT_ENTRIES})
+    except (http_util.ParameterError, ValueError) as err:
+      self.RenderJson(
+          data={error_fields.MESSAGE: str(err)}, status=400)
+
+
+# Main WSGI app as specified in app.yaml
+app = webapp2.WSGIApplication(
+    [('/admin/query_log/widgets', WidgetReportHandler)])
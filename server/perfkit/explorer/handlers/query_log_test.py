@@ -0,0 +1,87 @@
+"""Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Tests for the query log report handlers."""
+
+__author__ = 'joemu@google.com (Joe Allan Muharsky)'
+
+import unittest
+
+import webtest
+
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+from perfkit.common import gae_test_util
+from perfkit.explorer.handlers import query_log
+from perfkit.explorer.model import query_log as query_log_model
+
+
+class QueryLogTest(unittest.TestCase):
+
+  def setUp(self):
+    super(QueryLogTest, self).setUp()
+
+    self.app = webtest.TestApp(query_log.app)
+
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_datastore_v3_stub()
+    self.testbed.init_memcache_stub()
+    self.testbed.init_user_stub()
+    ndb.get_context().clear_cache()
+    query_log_model.ResetWriter()
+
+  def tearDown(self):
+    self.testbed.deactivate()
+    query_log_model.ResetWriter()
+
+  def testWidgetReportRequiresAdmin(self):
+    gae_test_util.setCurrentUser(self.testbed, is_admin=False)
+
+    self.app.get(url='/admin/query_log/widgets', status=403)
+
+  def testWidgetReport(self):
+    gae_test_util.setCurrentUser(self.testbed, is_admin=True)
+    ndb.put_multi([
+        query_log_model.QueryLogEntry(dashboard_id='1', widget_id='1',
+                                      bytes_processed=10, elapsed_ms=900.0),
+        query_log_model.QueryLogEntry(dashboard_id='1', widget_id='2',
+                                      bytes_processed=500, elapsed_ms=100.0)])
+    # Entries buffered by the instance are included.
+    query_log_model.Record(query_log_model.QueryLogEntry(
+        dashboard_id='1', widget_id='1', bytes_processed=10,
+        elapsed_ms=700.0))
+
+    resp = self.app.get(url='/admin/query_log/widgets')
+    self.assertEqual(3, resp.json['entries'])
+    self.assertEqual(['2', '1'], [widget['widget_id']
+                                  for widget in resp.json['widgets']])
+
+    resp = self.app.get(url='/admin/query_log/widgets',
+                        params={'sort': 'elapsed_ms', 'limit': 1})
+    widget, = resp.json['widgets']
+    self.assertEqual('1', widget['widget_id'])
+    self.assertEqual(2, widget['queries'])
+    self.assertEqual(800.0, widget['avg_elapsed_ms'])
+
+  def testWidgetReportFailsWithUnknownSort(self):
+    gae_test_util.setCurrentUser(self.testbed, is_admin=True)
+
+    self.app.get(url='/admin/query_log/widgets', params={'sort': 'cost'},
+                 status=400)
+
+
+if __name__ == '__main__':
+  unittest.main()
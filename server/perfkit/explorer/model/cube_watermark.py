@@ -0,0 +1,67 @@
+"""Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+GAE Model for the datastore."""
+
+__author__ = 'joemu@google.com (Joe Allan Muharsky)'
+
+from google.appengine.ext import ndb
+
+
+class CubeWatermark(ndb.Model):
+  """Records how far the cubes of a dataset have been refreshed.
+
+  The entity is keyed by 'project_id:dataset_name'.  Rows appended to the
+  results table before refreshed_time are included in the cubes.
+  """
+
+  refreshed_time = ndb.IntegerProperty()  # In milliseconds since the epoch
+  refreshed_days = ndb.IntegerProperty(repeated=True, indexed=False)
+  full_rebuild = ndb.BooleanProperty(indexed=False)
+  version = ndb.IntegerProperty(indexed=False)
+  modified_date = ndb.DateTimeProperty(auto_now=True)
+
+  @staticmethod
+  def GetKeyName(project_id, dataset_name):
+    return '%s:%s' % (project_id, dataset_name)
+
+  @staticmethod
+  def Get(project_id, dataset_name):
+    """Returns the watermark of a dataset, or None if it was never refreshed."""
+    return CubeWatermark.get_by_id(
+        CubeWatermark.GetKeyName(project_id, dataset_name))
+
+  @staticmethod
+  def Set(project_id, dataset_name, refreshed_time, refreshed_days,
+          full_rebuild=False, version=None):
+    """Stores and returns the watermark of a dataset.
+
+    Args:
+      project_id: The project that contains the dataset.
+      dataset_name: The dataset that contains the cubes.
+      refreshed_time: The time (in ms since the epoch) the refresh started.
+      refreshed_days: The days (since the epoch) that were recomputed.
+      full_rebuild: True if the cubes were rebuilt from all days.
+      version: The version of the cube schemas.
+
+    Returns:
+      A CubeWatermark model instance.
+    """
+    watermark = CubeWatermark(
+        id=CubeWatermark.GetKeyName(project_id, dataset_name),
+        refreshed_time=refreshed_time, refreshed_days=refreshed_days,
+        full_rebuild=full_rebuild, version=version)
+    watermark.put()
+
+    return watermark
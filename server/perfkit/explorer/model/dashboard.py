@@ -17,10 +17,14 @@ GAE Model for the datastore."""
 __author__ = 'joemu@google.com (Joe Allan Muharsky)'
 
 import datetime
+import hashlib
 import json
 import logging
 
+from google.appengine.api import datastore_errors
+from google.appengine.api import memcache
 from google.appengine.api import users
+from google.appengine.datastore import datastore_query
 from google.appengine.ext import ndb
 
 from perfkit.explorer.util import explorer_config_util
@@ -30,6 +34,21 @@ import dashboard_fields as fields
 
 DEFAULT_DASHBOARD_TITLE = 'Untitled Dashboard'
 DEFAULT_DOMAIN = 'google.com'
+QUERY_HASHES_CACHE_PREFIX = 'dashboard_query_hashes:'
+# Cached query hashes expire after this many seconds, which bounds how long a
+# hash can outlive the query it was computed for.
+QUERY_HASHES_CACHE_DURATION = 300
+DEFAULT_PAGE_SIZE = 200
+
+# The properties read by GetDashboardPage().  They are all indexed, so the
+# dashboards can be listed with a projection query, without reading data.
+LIST_PROPERTIES = [fields.TITLE, fields.OWNER, fields.CREATED_BY,
+                   fields.CREATED_DATE, fields.MODIFIED_BY,
+                   fields.MODIFIED_DATE]
+# Increment when a property is added to LIST_PROPERTIES, so that existing
+# dashboards are listed without a projection until they are updated.
+LIST_PROPERTIES_VERSION = 1
+LIST_STATE_ID = 'dashboards'
 
 
 class Error(Exception):
@@ -59,6 +78,12 @@ class Dashboard(ndb.Model):
   title = ndb.StringProperty(default='')
   data = ndb.TextProperty(default='')
   public = ndb.BooleanProperty(default=False)
+  # A dict of widget id to the GetQueryHash() of its saved query, computed
+  # from data on put.  Used to verify queries without parsing data.
+  query_hashes = ndb.JsonProperty()
+  # The owner email of data, copied on put so that dashboards can be listed
+  # without parsing data.
+  owner = ndb.StringProperty()
 
   @staticmethod
   def GetDashboard(dashboard_id, required=True):
@@ -83,6 +108,103 @@ class Dashboard(ndb.Model):
 
     return dashboard_row
 
+  @staticmethod
+  def GetDashboardPage(created_by=None, page_size=DEFAULT_PAGE_SIZE,
+                       cursor=None):
+    """Returns a page of dashboards, ordered by title.
+
+    The dashboards are read with a projection query, so only the
+    LIST_PROPERTIES are available.  If created_by is provided, it is not
+    projected either, as properties with an equality filter cannot be.  Until
+    UpdateListProperties() has saved every dashboard, the full dashboards are
+    read instead, and the owner of those saved before it was added is read
+    from their data.
+
+    Args:
+      created_by: If provided, only dashboards created by this GAE user are
+          returned.
+      page_size: The maximum number of dashboards to return.
+      cursor: The urlsafe cursor returned for the previous page, if any.
+
+    Returns:
+      A (dashboards, cursor) tuple.  cursor is the urlsafe cursor of the next
+      page, or None if there are no more dashboards.
+
+    Raises:
+      InitializeError: If the cursor is invalid.
+    """
+    query = Dashboard.query()
+    projection = LIST_PROPERTIES
+
+    if created_by:
+      query = query.filter(Dashboard.created_by == created_by)
+      projection = [name for name in projection if name != fields.CREATED_BY]
+
+    # Projection queries skip the dashboards that lack a projected property,
+    # so the full dashboards are read until they are all updated.
+    if not DashboardListState.IsUpdated():
+      projection = None
+
+    query = query.order(Dashboard.title)
+
+    try:
+      start_cursor = (datastore_query.Cursor(urlsafe=cursor) if cursor
+                      else None)
+      dashboards, next_cursor, more = query.fetch_page(
+          page_size, projection=projection, start_cursor=start_cursor)
+    except (datastore_errors.BadValueError,
+            datastore_errors.BadRequestError) as err:
+      raise InitializeError('Invalid cursor {cursor}: {error}'.format(
+          cursor=cursor, error=err))
+
+    if not projection:
+      for dashboard in dashboards:
+        if dashboard.owner is None:
+          dashboard.owner = GetDataOwner(dashboard.data)
+
+    return dashboards, (next_cursor.urlsafe() if more and next_cursor
+                        else None)
+
+  @staticmethod
+  def UpdateListProperties(batch_size=DEFAULT_PAGE_SIZE, cursor=None):
+    """Copies the owner of a batch of dashboards from their data.
+
+    Dashboards saved before the owner property was added can't be read by
+    the projection query of GetDashboardPage().  This saves them a batch at a
+    time, without changing their modified_by and modified_date.  Once the
+    last batch is saved, GetDashboardPage() uses the projection query.
+
+    Args:
+      batch_size: The number of dashboards saved.
+      cursor: The urlsafe cursor returned for the previous batch, if any.
+
+    Returns:
+      A (count, cursor) tuple, with the number of dashboards saved, and the
+      urlsafe cursor of the next batch, or None if this was the last batch.
+
+    Raises:
+      InitializeError: If the cursor is invalid.
+    """
+    try:
+      start_cursor = (datastore_query.Cursor(urlsafe=cursor) if cursor
+                      else None)
+      dashboards, next_cursor, more = Dashboard.query().fetch_page(
+          batch_size, start_cursor=start_cursor)
+    except (datastore_errors.BadValueError,
+            datastore_errors.BadRequestError) as err:
+      raise InitializeError('Invalid cursor {cursor}: {error}'.format(
+          cursor=cursor, error=err))
+
+    for dashboard in dashboards:
+      dashboard.keep_modified = True
+    ndb.put_multi(dashboards)
+
+    if more and next_cursor:
+      return len(dashboards), next_cursor.urlsafe()
+
+    DashboardListState.SetUpdated()
+    return len(dashboards), None
+
   @staticmethod
   def CopyDashboard(dashboard_id, title=None):
     """Creates a copy of a dashboard, and optionally renames it.
@@ -318,31 +440,85 @@ class Dashboard(ndb.Model):
 
   @classmethod
   def IsQueryCustom(cls, query, dashboard_id, widget_id):
+    """Returns True unless query is the saved query for the widget.
+
+    Args:
+      query: The query to verify.
+      dashboard_id: The id of the dashboard that contains the widget.
+      widget_id: The id of the widget.
+
+    Raises:
+      SecurityError: If the current user cannot view dashboards.
+    """
     try:
-      dashboard_model = Dashboard.GetDashboard(int(dashboard_id))
+      query_hashes = cls.GetCachedQueryHashes(int(dashboard_id))
     except InitializeError:
       logging.error('Dashboard %s not found', dashboard_id)
       return True
 
-    widget_model = cls.FindWidget(dashboard_model.GetDashboardData(), widget_id)
-    if not widget_model:
+    saved_hash = query_hashes.get(str(widget_id))
+    if not saved_hash:
       return True
 
-    try:
-      datasource = widget_model.get('datasource')
+    return saved_hash != GetQueryHash(query)
 
-      if not datasource:
-        raise KeyError('Datasource not provided')
+  @classmethod
+  def GetCachedQueryHashes(cls, dashboard_id):
+    """Returns the widget query hashes of a dashboard.
 
-      saved_query = datasource.get('query_exec') or datasource.get('query')
+    The hashes are cached in memcache for QUERY_HASHES_CACHE_DURATION.
+    Saving a dashboard replaces its cached hashes, and deleting it replaces
+    them with None.  Readers only add missing entries, so a reader that
+    loaded the dashboard before it was saved can't restore the old hashes.
 
-      if saved_query:
-        if query.strip() == saved_query.strip():
-          return False
-    except KeyError:
-      return True
+    Args:
+      dashboard_id: An integer key for a dashboard.
+
+    Returns:
+      A dict of widget id to the GetQueryHash() of its saved query.
+
+    Raises:
+      InitializeError: If the dashboard is not found.
+      SecurityError: If the current user cannot view dashboards.
+    """
+    cache_key = QUERY_HASHES_CACHE_PREFIX + str(dashboard_id)
+    query_hashes = memcache.get(cache_key)
+
+    if query_hashes is not None:
+      if not explorer_config_util.ExplorerConfigUtil.CanView():
+        raise SecurityError(
+            'The current user is not authorized to view dashboards')
+      return query_hashes
+
+    dashboard_model = Dashboard.GetDashboard(dashboard_id)
+    query_hashes = dashboard_model.query_hashes
 
-    return True
+    if query_hashes is None:
+      # Dashboards saved before query_hashes was added.
+      query_hashes = cls.GetQueryHashes(dashboard_model.GetDashboardData())
+
+    memcache.add(cache_key, query_hashes, time=QUERY_HASHES_CACHE_DURATION)
+    return query_hashes
+
+  @classmethod
+  def GetQueryHashes(cls, dashboard):
+    """Returns a dict of widget id to the GetQueryHash() of its saved query.
+
+    Args:
+      dashboard: A JSON representation of the dashboard.  Widgets without a
+          saved query are omitted.
+    """
+    query_hashes = {}
+
+    for container in dashboard.get('children') or []:
+      for widget in (container.get('container') or {}).get('children') or []:
+        datasource = widget.get('datasource') or {}
+        saved_query = datasource.get('query_exec') or datasource.get('query')
+
+        if saved_query:
+          query_hashes[str(widget.get('id'))] = GetQueryHash(saved_query)
+
+    return query_hashes
 
   @classmethod
   def FindWidget(cls, dashboard, widget_id):
@@ -358,12 +534,19 @@ class Dashboard(ndb.Model):
     if not explorer_config_util.ExplorerConfigUtil.CanSave():
       raise SecurityError('The current user is not authorized to delete dashboards')
 
+  @classmethod
+  def _post_delete_hook(cls, key, future):
+    memcache.set(QUERY_HASHES_CACHE_PREFIX + str(key.id()), None,
+                 time=QUERY_HASHES_CACHE_DURATION)
+
   def _pre_put_hook(self):
     if not explorer_config_util.ExplorerConfigUtil.CanSave():
       raise SecurityError('The current user is not authorized to save dashboards')
 
-    self.modified_by = users.get_current_user()
-    self.modified_date = datetime.datetime.now()
+    # Set by UpdateListProperties(), which doesn't modify the dashboard.
+    if not getattr(self, 'keep_modified', False):
+      self.modified_by = users.get_current_user()
+      self.modified_date = datetime.datetime.now()
 
     if not self.created_by:
       self.created_by = users.get_current_user()
@@ -371,7 +554,57 @@ class Dashboard(ndb.Model):
     if not self.created_date:
       self.created_date = datetime.datetime.now()
 
+    try:
+      self.query_hashes = self.GetQueryHashes(json.loads(self.data or '{}'))
+    except (ValueError, AttributeError):
+      self.query_hashes = {}
+
+    self.owner = GetDataOwner(self.data)
+
+  def _post_put_hook(self, future):
+    if self.key:
+      memcache.set(QUERY_HASHES_CACHE_PREFIX + str(self.key.id()),
+                   self.query_hashes, time=QUERY_HASHES_CACHE_DURATION)
+
   @classmethod
   def _pre_get_hook(cls, key):
     if not explorer_config_util.ExplorerConfigUtil.CanView():
       raise SecurityError('The current user is not authorized to view dashboards')
+
+
+class DashboardListState(ndb.Model):
+  """Records the LIST_PROPERTIES_VERSION that every dashboard was updated to.
+
+  The entity is keyed by LIST_STATE_ID, and is written by
+  Dashboard.UpdateListProperties() once it has saved every dashboard.
+  """
+
+  version = ndb.IntegerProperty(indexed=False)
+  modified_date = ndb.DateTimeProperty(auto_now=True)
+
+  @staticmethod
+  def IsUpdated():
+    """Returns True if every dashboard has the current list properties."""
+    state = DashboardListState.get_by_id(LIST_STATE_ID)
+    return bool(state and state.version >= LIST_PROPERTIES_VERSION)
+
+  @staticmethod
+  def SetUpdated():
+    """Records that every dashboard has the current list properties."""
+    DashboardListState(id=LIST_STATE_ID,
+                       version=LIST_PROPERTIES_VERSION).put()
+
+
+def GetDataOwner(data):
+  """Returns the owner email of a dashboard's JSON data, or None."""
+  try:
+    owner = json.loads(data or '{}').get(fields.OWNER)
+  except (ValueError, AttributeError):
+    return None
+
+  return owner if isinstance(owner, basestring) else None
+
+
+def GetQueryHash(query):
+  """Returns a hash of a query, ignoring leading and trailing whitespace."""
+  return hashlib.sha1(query.strip().encode('utf-8')).hexdigest()
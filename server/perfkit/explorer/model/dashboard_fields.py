@@ -29,3 +29,5 @@ CREATED_DATE = 'created_date'
 MODIFIED_BY = 'modified_by'
 MODIFIED_DATE = 'modified_date'
 WRITERS = 'writers'
+CURSOR = 'cursor'
+PAGE_SIZE = 'page_size'
@@ -1,6 +1,12 @@
+import datetime
 import json
 import unittest
 
+import mock
+
+from google.appengine.api import datastore
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
 from google.appengine.ext import testbed
 
 from perfkit.common import gae_test_util
@@ -98,6 +104,59 @@ class DashboardTest(unittest.TestCase):
         'The current user is not authorized to delete dashboards',
         new_dashboard.key.delete)
 
+  def testOwnerCopiedOnPut(self):
+    new_dashboard = dashboard.Dashboard(
+        data='{"owner": "owner@mydomain.com"}')
+    new_dashboard.put()
+    self.assertEqual('owner@mydomain.com', new_dashboard.owner)
+
+    new_dashboard.data = '{}'
+    new_dashboard.put()
+    self.assertIsNone(new_dashboard.owner)
+
+  def testUpdateListProperties(self):
+    modified_date = datetime.datetime(2014, 1, 1)
+    keys = []
+    for title in ['a', 'b', 'c']:
+      key = dashboard.Dashboard(
+          title=title, data='{"owner": "owner@mydomain.com"}').put()
+      keys.append(key)
+
+      # Dashboards saved before the owner property was added don't have it.
+      entity = datastore.Get(key.to_old_key())
+      del entity['owner']
+      entity['modified_date'] = modified_date
+      datastore.Put(entity)
+    ndb.get_context().clear_cache()
+
+    # The full dashboards are listed until every dashboard is updated.
+    dashboards, _ = dashboard.Dashboard.GetDashboardPage()
+    self.assertEqual(keys, [row.key for row in dashboards])
+    self.assertEqual(['owner@mydomain.com'] * 3,
+                     [row.owner for row in dashboards])
+
+    count, cursor = dashboard.Dashboard.UpdateListProperties(batch_size=2)
+    self.assertEqual(2, count)
+    self.assertIsNotNone(cursor)
+    self.assertFalse(dashboard.DashboardListState.IsUpdated())
+
+    self.assertEqual((1, None), dashboard.Dashboard.UpdateListProperties(
+        batch_size=2, cursor=cursor))
+    self.assertTrue(dashboard.DashboardListState.IsUpdated())
+
+    dashboards, _ = dashboard.Dashboard.GetDashboardPage()
+    self.assertEqual(keys, [row.key for row in dashboards])
+    self.assertEqual('owner@mydomain.com', dashboards[0].owner)
+    self.assertEqual(modified_date, dashboards[0].modified_date)
+    # Only the list properties are read.
+    self.assertRaises(ndb.UnprojectedPropertyError, getattr, dashboards[0],
+                      'data')
+
+  def testUpdateListPropertiesFailsWithInvalidCursor(self):
+    self.assertRaises(dashboard.InitializeError,
+                      dashboard.Dashboard.UpdateListProperties,
+                      cursor='invalid')
+
 
 class DashboardIsQueryCustomTest(unittest.TestCase):
 
@@ -157,3 +216,96 @@ class DashboardIsQueryCustomTest(unittest.TestCase):
         custom_query, self.dashboard_model.key.id(), '3')
 
     self.assertTrue(actual_value)
+
+  def testIsQueryCustomIgnoresWhitespace(self):
+    actual_value = dashboard.Dashboard.IsQueryCustom(
+        '  %s\n' % self.provided_query, self.dashboard_model.key.id(), '3')
+
+    self.assertFalse(actual_value)
+
+  def testQueryHashesComputedOnPut(self):
+    self.assertEqual({'3': dashboard.GetQueryHash(self.provided_query)},
+                     self.dashboard_model.query_hashes)
+
+  def testIsQueryCustomUsesSavedQueryAfterUpdate(self):
+    custom_query = 'SELECT stuff FROM myplace'
+    dashboard_id = self.dashboard_model.key.id()
+    self.assertTrue(dashboard.Dashboard.IsQueryCustom(
+        custom_query, dashboard_id, '3'))
+
+    gae_test_util.setCurrentUser(self.testbed, is_admin=True)
+    data = self.dashboard_model.GetDashboardData()
+    data['children'][1]['container']['children'][0]['datasource'] = {
+        'query': 'SELECT foo FROM baz', 'query_exec': custom_query}
+    self.dashboard_model.data = json.dumps(data)
+    self.dashboard_model.put()
+    gae_test_util.setCurrentUser(self.testbed, is_admin=False)
+
+    self.assertFalse(dashboard.Dashboard.IsQueryCustom(
+        custom_query, dashboard_id, '3'))
+    self.assertTrue(dashboard.Dashboard.IsQueryCustom(
+        self.provided_query, dashboard_id, '3'))
+
+  def testIsQueryCustomIgnoresHashesReadBeforeUpdate(self):
+    custom_query = 'SELECT stuff FROM myplace'
+    dashboard_id = self.dashboard_model.key.id()
+    ndb.get_context().clear_cache()
+    stale_model = dashboard.Dashboard.get_by_id(dashboard_id)
+
+    def GetDashboardDuringUpdate(unused_dashboard_id):
+      # The dashboard is saved after the reader loaded it.
+      gae_test_util.setCurrentUser(self.testbed, is_admin=True)
+      data = self.dashboard_model.GetDashboardData()
+      data['children'][1]['container']['children'][0]['datasource'] = {
+          'query': custom_query}
+      self.dashboard_model.data = json.dumps(data)
+      self.dashboard_model.put()
+      gae_test_util.setCurrentUser(self.testbed, is_admin=False)
+      return stale_model
+
+    memcache.flush_all()
+    with mock.patch.object(dashboard.Dashboard, 'GetDashboard',
+                           side_effect=GetDashboardDuringUpdate):
+      self.assertFalse(dashboard.Dashboard.IsQueryCustom(
+          self.provided_query, dashboard_id, '3'))
+
+    self.assertTrue(dashboard.Dashboard.IsQueryCustom(
+        self.provided_query, dashboard_id, '3'))
+    self.assertFalse(dashboard.Dashboard.IsQueryCustom(
+        custom_query, dashboard_id, '3'))
+
+  def testIsQueryCustomTrueAfterDelete(self):
+    dashboard_id = self.dashboard_model.key.id()
+    self.assertFalse(dashboard.Dashboard.IsQueryCustom(
+        self.provided_query, dashboard_id, '3'))
+
+    gae_test_util.setCurrentUser(self.testbed, is_admin=True)
+    self.dashboard_model.key.delete()
+    gae_test_util.setCurrentUser(self.testbed, is_admin=False)
+
+    self.assertTrue(dashboard.Dashboard.IsQueryCustom(
+        self.provided_query, dashboard_id, '3'))
+
+  def testIsQueryCustomWithoutQueryHashes(self):
+    # Dashboards saved before query hashes were stored.
+    dashboard_id = self.dashboard_model.key.id()
+    legacy_model = dashboard.Dashboard(id=dashboard_id,
+                                       data=self.dashboard_model.data)
+    legacy_model._pre_put_hook = lambda: None
+    legacy_model.put()
+    self.assertIsNone(
+        dashboard.Dashboard.get_by_id(dashboard_id).query_hashes)
+
+    self.assertFalse(dashboard.Dashboard.IsQueryCustom(
+        self.provided_query, dashboard_id, '3'))
+
+  def testIsQueryCustomCachedRequiresView(self):
+    dashboard_id = self.dashboard_model.key.id()
+    dashboard.Dashboard.IsQueryCustom(self.provided_query, dashboard_id, '3')
+
+    self.config.grant_view_to_public = False
+    self.config.put()
+
+    self.assertRaises(dashboard.SecurityError,
+                      dashboard.Dashboard.IsQueryCustom,
+                      self.provided_query, dashboard_id, '3')
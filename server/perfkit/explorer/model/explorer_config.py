@@ -16,8 +16,13 @@ GAE Model for the datastore."""
 
 __author__ = 'jmuharsky@gmail.com (Joe Allan Muharsky)'
 
+import random
+import time
+
+from google.appengine.api import memcache
 from google.appengine.api import users
 from google.appengine.ext import ndb
+import webapp2
 
 
 DEFAULT_PROJECT = 'unset'
@@ -27,8 +32,26 @@ DEFAULT_ANALYTICS_KEY = ''
 DEFAULT_CACHE_DURATION = 0
 DEFAULT_MAX_PARALLEL_QUERIES = 5
 
+# Admission control for the queries run by /data handlers; see
+# perfkit.common.admission_control.  Zero disables a limit.
+DEFAULT_MAX_CONCURRENT_QUERIES = 20
+DEFAULT_USER_QUERIES_PER_MINUTE = 60
+DEFAULT_USER_QUERY_BURST = 20
+DEFAULT_PROJECT_QUERIES_PER_MINUTE = 600
+DEFAULT_PROJECT_QUERY_BURST = 100
+DEFAULT_QUERY_QUEUE_TIMEOUT = 20
+
 GLOBAL_CONFIG_KEY = 'perfkit.explorer.config'
 
+# The config is cached per request, and per instance for up to CACHE_TTL
+# seconds.  The instance cache is also discarded when the version counter in
+# memcache changes, which happens whenever the config is saved.
+CACHE_TTL = 10
+VERSION_CACHE_KEY = GLOBAL_CONFIG_KEY + ':version'
+REQUEST_REGISTRY_KEY = GLOBAL_CONFIG_KEY
+
+# A tuple of (config, version, expiration time) for the instance cache.
+_cached_config = None
 
 
 class Error(Exception):
@@ -53,11 +76,28 @@ class ExplorerConfigModel(ndb.Model):
   cache_duration = ndb.IntegerProperty(default=DEFAULT_CACHE_DURATION)
   max_parallel_queries = ndb.IntegerProperty(
       default=DEFAULT_MAX_PARALLEL_QUERIES)
+  max_concurrent_queries = ndb.IntegerProperty(
+      default=DEFAULT_MAX_CONCURRENT_QUERIES)
+  user_queries_per_minute = ndb.IntegerProperty(
+      default=DEFAULT_USER_QUERIES_PER_MINUTE)
+  user_query_burst = ndb.IntegerProperty(default=DEFAULT_USER_QUERY_BURST)
+  project_queries_per_minute = ndb.IntegerProperty(
+      default=DEFAULT_PROJECT_QUERIES_PER_MINUTE)
+  project_query_burst = ndb.IntegerProperty(
+      default=DEFAULT_PROJECT_QUERY_BURST)
+  query_queue_timeout = ndb.IntegerProperty(
+      default=DEFAULT_QUERY_QUEUE_TIMEOUT)
 
   grant_save_to_public = ndb.BooleanProperty(default=False)
   grant_view_to_public = ndb.BooleanProperty(default=False)
   grant_query_to_public = ndb.BooleanProperty(default=False)
 
+  # Local SQL datasources (see perfkit.common.local_sql_client) are always
+  # enabled on the development server.  local_sql_database is the path of
+  # their SQLite database; if empty, data/samples_mart is loaded into memory.
+  enable_local_sql = ndb.BooleanProperty(default=False)
+  local_sql_database = ndb.StringProperty(default='')
+
   def Load(self, data):
     """Sets the properties of the current config according to the provided data.
 
@@ -74,18 +114,85 @@ class ExplorerConfigModel(ndb.Model):
   def Get(cls):
     """Returns the global config, and creates it if necessary.
 
+    The config is read at most once per request, and is shared by requests on
+    the same instance for up to CACHE_TTL seconds, or until it is saved.  Each
+    request gets its own copy, so changes made by one request are not seen by
+    others; use Update() to modify the config.
+
     Returns:
       An ExplorerConfigModel instance.
     """
-    return cls.get_or_insert(GLOBAL_CONFIG_KEY)
+    request_registry = _GetRequestRegistry()
+    if request_registry is not None:
+      config = request_registry.get(REQUEST_REGISTRY_KEY)
+      if config:
+        return config
+
+    version = _GetVersion()
+    cached_config = _cached_config
+
+    if (cached_config and cached_config[1] == version and
+        cached_config[2] > time.time()):
+      config = cached_config[0]
+    else:
+      config = cls.get_or_insert(GLOBAL_CONFIG_KEY)
+      _SetCachedConfig((config, version, time.time() + CACHE_TTL))
+
+    config = cls(key=config.key, **config.to_dict())
+
+    if request_registry is not None:
+      request_registry[REQUEST_REGISTRY_KEY] = config
+
+    return config
 
   @classmethod
   def Update(cls, data):
     """Modifies the global config, and creates it if necessary.
 
+    Saving the config bumps the version counter, so the cached copies on all
+    instances are discarded.
+
     Args:
       data: A JSON object containing one or more config values.
     """
-    config_row = cls.Get()
+    config_row = cls.get_or_insert(GLOBAL_CONFIG_KEY)
 
     config_row.Load(data)
+
+  def _post_put_hook(self, future):
+    _SetCachedConfig(None)
+
+    request_registry = _GetRequestRegistry()
+    if request_registry is not None:
+      request_registry.pop(REQUEST_REGISTRY_KEY, None)
+
+    if memcache.incr(VERSION_CACHE_KEY) is None:
+      _GetVersion()
+
+
+def _SetCachedConfig(value):
+  global _cached_config
+  _cached_config = value
+
+
+def _GetRequestRegistry():
+  """Returns the registry of the current webapp2 request, or None."""
+  try:
+    return webapp2.get_request().registry
+  except AssertionError:
+    return None
+
+
+def _GetVersion():
+  """Returns the config version counter, initializing it if necessary.
+
+  The counter is initialized to a random value, so that it doesn't match a
+  version cached before memcache was flushed.
+  """
+  version = memcache.get(VERSION_CACHE_KEY)
+
+  if version is None:
+    memcache.add(VERSION_CACHE_KEY, random.getrandbits(48))
+    version = memcache.get(VERSION_CACHE_KEY)
+
+  return version
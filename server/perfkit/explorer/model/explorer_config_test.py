@@ -1,7 +1,10 @@
+import mock
 import unittest
 
+from google.appengine.api import memcache
 from google.appengine.ext import ndb
 from google.appengine.ext import testbed
+import webapp2
 
 from perfkit.common import gae_test_util
 from perfkit.explorer.model import explorer_config
@@ -17,6 +20,11 @@ class ExplorerConfigModelTest(unittest.TestCase):
     self.testbed.init_memcache_stub()
     self.testbed.init_user_stub()
 
+    # The instance and context caches outlive the testbed, and would return
+    # a config from an earlier test.
+    explorer_config._SetCachedConfig(None)
+    ndb.get_context().clear_cache()
+
   def tearDown(self):
     self.testbed.deactivate()
 
@@ -30,9 +38,23 @@ class ExplorerConfigModelTest(unittest.TestCase):
         'analytics_key': explorer_config.DEFAULT_ANALYTICS_KEY,
         'cache_duration': explorer_config.DEFAULT_CACHE_DURATION,
         'max_parallel_queries': explorer_config.DEFAULT_MAX_PARALLEL_QUERIES,
+        'max_concurrent_queries': (
+            explorer_config.DEFAULT_MAX_CONCURRENT_QUERIES),
+        'user_queries_per_minute': (
+            explorer_config.DEFAULT_USER_QUERIES_PER_MINUTE),
+        'user_query_burst': (
+            explorer_config.DEFAULT_USER_QUERY_BURST),
+        'project_queries_per_minute': (
+            explorer_config.DEFAULT_PROJECT_QUERIES_PER_MINUTE),
+        'project_query_burst': (
+            explorer_config.DEFAULT_PROJECT_QUERY_BURST),
+        'query_queue_timeout': (
+            explorer_config.DEFAULT_QUERY_QUEUE_TIMEOUT),
         'grant_save_to_public': False,
         'grant_view_to_public': False,
         'grant_query_to_public': False,
+        'enable_local_sql': False,
+        'local_sql_database': '',
     }
 
     actual_config = explorer_config.ExplorerConfigModel.Get().to_dict()
@@ -65,9 +87,23 @@ class ExplorerConfigModelTest(unittest.TestCase):
         'analytics_key': explorer_config.DEFAULT_ANALYTICS_KEY,
         'cache_duration': explorer_config.DEFAULT_CACHE_DURATION,
         'max_parallel_queries': explorer_config.DEFAULT_MAX_PARALLEL_QUERIES,
+        'max_concurrent_queries': (
+            explorer_config.DEFAULT_MAX_CONCURRENT_QUERIES),
+        'user_queries_per_minute': (
+            explorer_config.DEFAULT_USER_QUERIES_PER_MINUTE),
+        'user_query_burst': (
+            explorer_config.DEFAULT_USER_QUERY_BURST),
+        'project_queries_per_minute': (
+            explorer_config.DEFAULT_PROJECT_QUERIES_PER_MINUTE),
+        'project_query_burst': (
+            explorer_config.DEFAULT_PROJECT_QUERY_BURST),
+        'query_queue_timeout': (
+            explorer_config.DEFAULT_QUERY_QUEUE_TIMEOUT),
         'grant_save_to_public': True,
         'grant_view_to_public': False,
         'grant_query_to_public': False,
+        'enable_local_sql': False,
+        'local_sql_database': '',
     }
 
     explorer_config.ExplorerConfigModel.Update(provided_data)
@@ -93,9 +129,17 @@ class ExplorerConfigModelTest(unittest.TestCase):
         'analytics_key': initial_config.analytics_key,
         'cache_duration': initial_config.cache_duration,
         'max_parallel_queries': initial_config.max_parallel_queries,
+        'max_concurrent_queries': initial_config.max_concurrent_queries,
+        'user_queries_per_minute': initial_config.user_queries_per_minute,
+        'user_query_burst': initial_config.user_query_burst,
+        'project_queries_per_minute': initial_config.project_queries_per_minute,
+        'project_query_burst': initial_config.project_query_burst,
+        'query_queue_timeout': initial_config.query_queue_timeout,
         'grant_save_to_public': False,
         'grant_view_to_public': True,
         'grant_query_to_public': False,
+        'enable_local_sql': False,
+        'local_sql_database': '',
     }
 
     explorer_config.ExplorerConfigModel.Update(provided_data)
@@ -119,9 +163,23 @@ class ExplorerConfigModelTest(unittest.TestCase):
         'analytics_key': explorer_config.DEFAULT_ANALYTICS_KEY,
         'cache_duration': explorer_config.DEFAULT_CACHE_DURATION,
         'max_parallel_queries': explorer_config.DEFAULT_MAX_PARALLEL_QUERIES,
+        'max_concurrent_queries': (
+            explorer_config.DEFAULT_MAX_CONCURRENT_QUERIES),
+        'user_queries_per_minute': (
+            explorer_config.DEFAULT_USER_QUERIES_PER_MINUTE),
+        'user_query_burst': (
+            explorer_config.DEFAULT_USER_QUERY_BURST),
+        'project_queries_per_minute': (
+            explorer_config.DEFAULT_PROJECT_QUERIES_PER_MINUTE),
+        'project_query_burst': (
+            explorer_config.DEFAULT_PROJECT_QUERY_BURST),
+        'query_queue_timeout': (
+            explorer_config.DEFAULT_QUERY_QUEUE_TIMEOUT),
         'grant_save_to_public': False,
         'grant_view_to_public': False,
         'grant_query_to_public': True,
+        'enable_local_sql': False,
+        'local_sql_database': '',
     }
 
     initial_config_row = explorer_config.ExplorerConfigModel.Get()
@@ -134,3 +192,65 @@ class ExplorerConfigModelTest(unittest.TestCase):
 
     self.assertEquals(initial_config_row.to_dict(), actual_config)
     self.assertEquals(expected_config, actual_config)
+
+  def _PatchGetOrInsert(self):
+    """Creates the config, and counts subsequent reads from the datastore."""
+    explorer_config.ExplorerConfigModel.get_or_insert(
+        explorer_config.GLOBAL_CONFIG_KEY)
+
+    patcher = mock.patch.object(
+        explorer_config.ExplorerConfigModel, 'get_or_insert',
+        wraps=explorer_config.ExplorerConfigModel.get_or_insert)
+    self.addCleanup(patcher.stop)
+
+    return patcher.start()
+
+  def testGetCachedUntilUpdated(self):
+    gae_test_util.setCurrentUser(self.testbed, is_admin=True)
+    get_or_insert = self._PatchGetOrInsert()
+
+    explorer_config.ExplorerConfigModel.Get()
+    explorer_config.ExplorerConfigModel.Get()
+    self.assertEqual(1, get_or_insert.call_count)
+
+    explorer_config.ExplorerConfigModel.Update(
+        {'default_project': 'MODIFIED_PROJECT'})
+    get_or_insert.reset_mock()
+
+    actual_config = explorer_config.ExplorerConfigModel.Get()
+    self.assertEqual(1, get_or_insert.call_count)
+    self.assertEqual('MODIFIED_PROJECT', actual_config.default_project)
+
+  def testGetRereadsWhenVersionChanges(self):
+    get_or_insert = self._PatchGetOrInsert()
+    explorer_config.ExplorerConfigModel.Get()
+
+    # Simulates a save on another instance.
+    memcache.incr(explorer_config.VERSION_CACHE_KEY)
+    explorer_config.ExplorerConfigModel.Get()
+
+    self.assertEqual(2, get_or_insert.call_count)
+
+  def testGetMemoizedPerRequest(self):
+    get_or_insert = self._PatchGetOrInsert()
+    app = webapp2.WSGIApplication()
+    app.set_globals(app=app, request=webapp2.Request.blank('/'))
+
+    try:
+      explorer_config.ExplorerConfigModel.Get()
+      memcache.incr(explorer_config.VERSION_CACHE_KEY)
+      explorer_config.ExplorerConfigModel.Get()
+
+      self.assertEqual(1, get_or_insert.call_count)
+    finally:
+      app.clear_globals()
+
+  def testGetReturnsCopyOfCachedConfig(self):
+    config = explorer_config.ExplorerConfigModel.Get()
+    config.default_project = 'MODIFIED_PROJECT'
+
+    actual_config = explorer_config.ExplorerConfigModel.Get()
+    self.assertIsNot(config, actual_config)
+    self.assertEqual(explorer_config.DEFAULT_PROJECT,
+                     actual_config.default_project)
+    self.assertEqual(config.key, actual_config.key)
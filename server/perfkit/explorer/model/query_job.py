@@ -0,0 +1,192 @@
+"""Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+GAE Model for the datastore."""
+
+__author__ = 'joemu@google.com (Joe Allan Muharsky)'
+
+from google.appengine.api import memcache
+from google.appengine.api import users
+from google.appengine.ext import ndb
+
+
+# Running jobs are registered (in memcache) by the client request id and the
+# widget that submitted them, so they can be cancelled.  Entries expire after
+# REGISTRY_DURATION seconds, which is longer than any query is expected to run.
+REGISTRY_DURATION = 6 * 3600  # In seconds
+REQUEST_CACHE_PREFIX = 'query_job_request:'
+WIDGET_CACHE_PREFIX = 'query_job_widget:'
+CANCELLED_CACHE_PREFIX = 'query_job_cancelled:'
+
+
+class Error(Exception):
+  pass
+
+
+class InitializeError(Error):
+  pass
+
+
+class SecurityError(Error):
+  pass
+
+
+class QueryJob(ndb.Model):
+  """Models an asynchronous query submitted through /data/sql.
+
+  The entity is keyed by the BigQuery job id, and holds what is needed to
+  process the results once the job completes.
+  """
+
+  project_id = ndb.StringProperty()
+  query = ndb.TextProperty()
+  config = ndb.JsonProperty()
+  timestamp_mode = ndb.StringProperty()
+  dashboard_id = ndb.StringProperty(indexed=False)
+  widget_id = ndb.StringProperty(indexed=False)
+  created_by = ndb.UserProperty()
+  created_date = ndb.DateTimeProperty(auto_now_add=True)
+
+  @staticmethod
+  def Create(job_id, project_id, query, config, timestamp_mode=None,
+             dashboard_id=None, widget_id=None):
+    """Stores and returns a QueryJob for the current user.
+
+    Args:
+      job_id: The BigQuery job id.
+      project_id: The project the job runs in.
+      query: The query issued by the job.
+      config: The datasource config, used to process the results.
+      timestamp_mode: The timestamp mode requested for the results.
+      dashboard_id: The dashboard of the widget that started the job, if any.
+      widget_id: The widget that started the job, if any.
+
+    Returns:
+      A QueryJob model instance.
+    """
+    job = QueryJob(id=job_id, project_id=project_id, query=query,
+                   config=config, timestamp_mode=timestamp_mode,
+                   dashboard_id=str(dashboard_id) if dashboard_id else None,
+                   widget_id=str(widget_id) if widget_id else None,
+                   created_by=users.get_current_user())
+    job.put()
+
+    return job
+
+  @staticmethod
+  def GetQueryJob(job_id):
+    """Returns the QueryJob for job_id, if the current user can access it.
+
+    Args:
+      job_id: The BigQuery job id.
+
+    Returns:
+      A QueryJob model instance.
+
+    Raises:
+      InitializeError: If the job is not found.
+      SecurityError: If the job was created by a different user, or without
+          a user, and the current user is not an administrator.
+    """
+    job = QueryJob.get_by_id(job_id)
+
+    if not job:
+      raise InitializeError('Query job "%s" not found.' % job_id)
+
+    if users.is_current_user_admin():
+      return job
+
+    current_user = users.get_current_user()
+    if not (job.created_by and current_user and
+            job.created_by == current_user):
+      raise SecurityError('The user is not authorized to view this job.')
+
+    return job
+
+
+def _GetUserKey():
+  """Returns the id that scopes registry entries to the current user."""
+  user = users.get_current_user()
+  return (user.user_id() or user.email()) if user else ''
+
+
+def RegisterRequestJob(request_id, job_reference):
+  """Records the job started for a client request, so it can be cancelled.
+
+  Args:
+    request_id: The id the client provided for the request.
+    job_reference: A dict with the projectId and jobId of the job.
+  """
+  memcache.set(REQUEST_CACHE_PREFIX + _GetUserKey() + ':' + request_id,
+               job_reference, time=REGISTRY_DURATION)
+
+
+def GetRequestJob(request_id):
+  """Returns the job reference registered for a request of the current user.
+
+  Args:
+    request_id: The id the client provided for the request.
+
+  Returns:
+    A dict with the projectId and jobId of the job, or None if no job was
+    registered.
+  """
+  return memcache.get(REQUEST_CACHE_PREFIX + _GetUserKey() + ':' + request_id)
+
+
+def ReplaceWidgetJob(dashboard_id, widget_id, job_reference):
+  """Records the job running for a widget, and returns the job it replaces.
+
+  Entries are kept per user, so viewers of the same dashboard do not replace
+  each other's jobs.  Anonymous users are not tracked.
+
+  Args:
+    dashboard_id: The id of the dashboard that contains the widget.
+    widget_id: The id of the widget.
+    job_reference: A dict with the projectId and jobId of the widget's new
+        job, or None if the widget's results did not need a job.
+
+  Returns:
+    The job reference previously recorded for the widget, or None if there
+    was none or it is the same job.
+  """
+  user_key = _GetUserKey()
+  if not user_key:
+    return None
+
+  cache_key = '%s%s:%s:%s' % (WIDGET_CACHE_PREFIX, user_key, dashboard_id,
+                              widget_id)
+  previous = memcache.get(cache_key)
+
+  if job_reference:
+    memcache.set(cache_key, job_reference, time=REGISTRY_DURATION)
+  elif previous:
+    memcache.delete(cache_key)
+
+  if previous and previous != job_reference:
+    return previous
+
+
+def SetJobCancelled(job_id):
+  """Records that a job was cancelled, see IsJobCancelled."""
+  memcache.set(CANCELLED_CACHE_PREFIX + job_id, True, time=REGISTRY_DURATION)
+
+
+def IsJobCancelled(job_id):
+  """Returns True if the job was cancelled through the registry.
+
+  BigQuery reports cancelled jobs as failed, so this lets the handlers tell a
+  cancellation apart from a query error.
+  """
+  return bool(memcache.get(CANCELLED_CACHE_PREFIX + job_id))
@@ -0,0 +1,106 @@
+import unittest
+
+from google.appengine.ext import testbed
+
+from perfkit.common import gae_test_util
+from perfkit.explorer.model import query_job
+
+
+class QueryJobModelTest(unittest.TestCase):
+
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+
+    self.testbed.init_datastore_v3_stub()
+    self.testbed.init_memcache_stub()
+    self.testbed.init_user_stub()
+
+  def tearDown(self):
+    self.testbed.deactivate()
+
+  def testCreate(self):
+    gae_test_util.setCurrentUser(self.testbed, is_admin=False)
+
+    query_job.QueryJob.Create(
+        job_id='job1', project_id='project1', query='SELECT 1',
+        config={'results': {}}, timestamp_mode='epoch_ms')
+
+    actual = query_job.QueryJob.GetQueryJob('job1')
+
+    self.assertEqual('project1', actual.project_id)
+    self.assertEqual('SELECT 1', actual.query)
+    self.assertEqual({'results': {}}, actual.config)
+    self.assertEqual('epoch_ms', actual.timestamp_mode)
+    self.assertEqual(gae_test_util.NORMAL_USER_ENV['USER_EMAIL'],
+                     actual.created_by.email())
+
+  def testGetMissing(self):
+    self.assertRaises(query_job.InitializeError,
+                      query_job.QueryJob.GetQueryJob, 'unknown')
+
+  def testGetRejectForOtherUser(self):
+    gae_test_util.setCurrentUser(self.testbed, is_admin=True)
+    query_job.QueryJob.Create(
+        job_id='job1', project_id='project1', query='SELECT 1',
+        config={'results': {}})
+
+    gae_test_util.setCurrentUser(self.testbed, is_admin=False)
+
+    self.assertRaises(query_job.SecurityError,
+                      query_job.QueryJob.GetQueryJob, 'job1')
+
+  def testGetAnonymousJobRequiresAdmin(self):
+    query_job.QueryJob(id='job1', project_id='project1',
+                       query='SELECT 1').put()
+
+    gae_test_util.setCurrentUser(self.testbed, is_admin=False)
+    self.assertRaises(query_job.SecurityError,
+                      query_job.QueryJob.GetQueryJob, 'job1')
+
+    gae_test_util.setCurrentUser(self.testbed, is_admin=True)
+    self.assertEqual('SELECT 1',
+                     query_job.QueryJob.GetQueryJob('job1').query)
+
+  def testRegisterRequestJob(self):
+    gae_test_util.setCurrentUser(self.testbed, is_admin=False)
+    job_reference = {'projectId': 'project1', 'jobId': 'job1'}
+
+    query_job.RegisterRequestJob('request1', job_reference)
+
+    self.assertEqual(job_reference, query_job.GetRequestJob('request1'))
+    self.assertIsNone(query_job.GetRequestJob('request2'))
+
+    # Requests are registered per user.
+    gae_test_util.setCurrentUser(self.testbed, is_admin=True)
+    self.assertIsNone(query_job.GetRequestJob('request1'))
+
+  def testReplaceWidgetJob(self):
+    gae_test_util.setCurrentUser(self.testbed, is_admin=False)
+    job1 = {'projectId': 'project1', 'jobId': 'job1'}
+    job2 = {'projectId': 'project1', 'jobId': 'job2'}
+
+    self.assertIsNone(query_job.ReplaceWidgetJob(1, 3, job1))
+    self.assertIsNone(query_job.ReplaceWidgetJob(1, 3, job1))
+    self.assertIsNone(query_job.ReplaceWidgetJob(1, 4, job2))
+    self.assertEqual(job1, query_job.ReplaceWidgetJob(1, 3, job2))
+
+    # Cached results clear the widget's job.
+    self.assertEqual(job2, query_job.ReplaceWidgetJob(1, 3, None))
+    self.assertIsNone(query_job.ReplaceWidgetJob(1, 3, job1))
+
+    # Other users don't replace each other's jobs.
+    gae_test_util.setCurrentUser(self.testbed, is_admin=True)
+    self.assertIsNone(query_job.ReplaceWidgetJob(1, 3, job2))
+
+  def testIsJobCancelled(self):
+    self.assertFalse(query_job.IsJobCancelled('job1'))
+
+    query_job.SetJobCancelled('job1')
+
+    self.assertTrue(query_job.IsJobCancelled('job1'))
+    self.assertFalse(query_job.IsJobCancelled('job2'))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,244 @@
+"""Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+GAE Model for the datastore.
+
+Every query run by the data handlers is recorded as a QueryLogEntry.  Entries
+are buffered in memory by each instance, and written in batches with
+put_multi_async, so recording a query doesn't add a datastore write to every
+request.  Handlers that record entries must be ndb.toplevel, so that a batch
+started by the request is written before it ends.  Entries still buffered
+when an instance shuts down are lost.
+"""
+
+__author__ = 'joemu@google.com (Joe Allan Muharsky)'
+
+import collections
+import hashlib
+import logging
+import re
+import threading
+import time
+
+from google.appengine.ext import ndb
+
+
+# The number of entries written at once, and the number of seconds an entry
+# is buffered before the next Record() writes it, whichever comes first.
+BATCH_SIZE = 20
+MAX_FLUSH_DELAY = 60
+
+# The fields that the widget report can be sorted by.
+REPORT_SORT_FIELDS = ['bytes_processed', 'slot_ms', 'elapsed_ms',
+                      'p95_elapsed_ms', 'queries']
+
+_STRING_LITERAL = re.compile(r'\'(?:[^\'\\]|\\.)*\'|"(?:[^"\\]|\\.)*"')
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_LITERAL_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def GetQueryFingerprint(query):
+  """Returns an id shared by queries that only differ in their literals.
+
+  String and number literals (and lists of them) are replaced by '?', and
+  case and whitespace are normalized, so the queries of a widget over
+  different dates or filter values have the same fingerprint.
+  """
+  normalized = _STRING_LITERAL.sub('?', query)
+  normalized = _NUMBER_LITERAL.sub('?', normalized)
+  normalized = _LITERAL_LIST.sub('(?)', normalized)
+  normalized = _WHITESPACE.sub(' ', normalized).strip().lower()
+
+  return hashlib.md5(normalized.encode('utf-8')).hexdigest()
+
+
+class QueryLogEntry(ndb.Model):
+  """Models a query run for a widget or a /data/sql request.
+
+  cache_hit is True when the results were served from the Explorer cache
+  without running a query, and bigquery_cache_hit when BigQuery returned its
+  cached results.  slot_ms isn't part of BigQuery's query reply, so it is
+  None until /cron/query_log reads it from the job; entries without a job
+  have a slot_ms of 0.
+  """
+
+  fingerprint = ndb.StringProperty()
+  query_text = ndb.TextProperty()
+  datasource_type = ndb.StringProperty(indexed=False)
+  dashboard_id = ndb.StringProperty()
+  widget_id = ndb.StringProperty(indexed=False)
+  user_email = ndb.StringProperty(indexed=False)
+  path = ndb.StringProperty(indexed=False)
+  cache_hit = ndb.BooleanProperty(indexed=False)
+  bigquery_cache_hit = ndb.BooleanProperty(indexed=False)
+  project_id = ndb.StringProperty(indexed=False)
+  job_id = ndb.StringProperty(indexed=False)
+  bytes_processed = ndb.IntegerProperty(indexed=False)
+  slot_ms = ndb.IntegerProperty()
+  rows = ndb.IntegerProperty(indexed=False)
+  response_bytes = ndb.IntegerProperty(indexed=False)
+  elapsed_ms = ndb.FloatProperty(indexed=False)
+  timings = ndb.JsonProperty()
+  created_date = ndb.DateTimeProperty(auto_now_add=True)
+
+  @staticmethod
+  def GetSince(since, limit=None):
+    """Returns the entries created at or after a datetime, newest first.
+
+    If a limit is provided, the newest entries up to the limit are returned.
+    """
+    return QueryLogEntry.query(
+        QueryLogEntry.created_date >= since).order(
+            -QueryLogEntry.created_date).fetch(limit, batch_size=1000)
+
+  @staticmethod
+  def GetPendingStats(limit):
+    """Returns entries whose slot time hasn't been read from their job."""
+    return QueryLogEntry.query(QueryLogEntry.slot_ms == None).fetch(limit)
+
+
+class QueryLogWriter(object):
+  """Buffers QueryLogEntry entities, and writes them in batches."""
+
+  def __init__(self, batch_size=BATCH_SIZE, max_flush_delay=MAX_FLUSH_DELAY,
+               clock=time.time):
+    self.batch_size = batch_size
+    self.max_flush_delay = max_flush_delay
+    self.clock = clock
+
+    self._lock = threading.Lock()
+    self._entries = []
+    self._first_time = None
+
+  def Record(self, entry):
+    """Buffers an entry, and writes the buffer if it is due.
+
+    Returns:
+      The ndb futures of the write, or None if nothing was written.
+    """
+    with self._lock:
+      if not self._entries:
+        self._first_time = self.clock()
+      self._entries.append(entry)
+
+      due = (len(self._entries) >= self.batch_size or
+             self.clock() - self._first_time >= self.max_flush_delay)
+      entries = self._TakeEntries() if due else None
+
+    return self._Write(entries) if entries else None
+
+  def Flush(self):
+    """Writes the buffered entries now.
+
+    Returns:
+      The ndb futures of the write, or None if the buffer was empty.
+    """
+    with self._lock:
+      entries = self._TakeEntries()
+
+    return self._Write(entries) if entries else None
+
+  def _TakeEntries(self):
+    entries = self._entries
+    self._entries = []
+    self._first_time = None
+
+    return entries
+
+  def _Write(self, entries):
+    logging.debug('Writing %d query log entries.', len(entries))
+    return ndb.put_multi_async(entries)
+
+
+_writer = QueryLogWriter()
+
+
+def Record(entry):
+  """Records a QueryLogEntry with the instance's writer."""
+  return _writer.Record(entry)
+
+
+def Flush():
+  """Writes the entries buffered by the instance's writer."""
+  return _writer.Flush()
+
+
+def ResetWriter():
+  """Discards the entries buffered by the instance's writer."""
+  global _writer
+
+  _writer = QueryLogWriter()
+
+
+def _GetPercentile(sorted_values, percentile):
+  index = int(round(percentile / 100.0 * (len(sorted_values) - 1)))
+  return sorted_values[index]
+
+
+def GetWidgetReport(entries, sort='bytes_processed', limit=None):
+  """Returns the cost and latency of each widget's queries, costliest first.
+
+  Args:
+    entries: An iterable of QueryLogEntry.
+    sort: One of REPORT_SORT_FIELDS.  Widgets are ordered by its descending
+        value.
+    limit: If provided, the maximum number of widgets to return.
+
+  Returns:
+    A list of dicts with the dashboard_id, widget_id, the number of queries
+    and cache hits, the distinct fingerprints, and the totals of the
+    bytes_processed, slot_ms, rows, response_bytes and elapsed_ms of the
+    queries, with the average, 95th percentile and max elapsed_ms.
+  """
+  if sort not in REPORT_SORT_FIELDS:
+    raise ValueError('The sort must be one of: ' +
+                     ', '.join(REPORT_SORT_FIELDS))
+
+  widgets = collections.OrderedDict()
+  elapsed = {}
+  fingerprints = {}
+
+  for entry in entries:
+    key = (entry.dashboard_id, entry.widget_id)
+    widget = widgets.get(key)
+    if widget is None:
+      widget = widgets[key] = {
+          'dashboard_id': entry.dashboard_id, 'widget_id': entry.widget_id,
+          'queries': 0, 'cache_hits': 0, 'bytes_processed': 0, 'slot_ms': 0,
+          'rows': 0, 'response_bytes': 0, 'elapsed_ms': 0.0}
+      elapsed[key] = []
+      fingerprints[key] = set()
+
+    widget['queries'] += 1
+    widget['cache_hits'] += 1 if entry.cache_hit else 0
+    widget['bytes_processed'] += entry.bytes_processed or 0
+    widget['slot_ms'] += entry.slot_ms or 0
+    widget['rows'] += entry.rows or 0
+    widget['response_bytes'] += entry.response_bytes or 0
+    widget['elapsed_ms'] += entry.elapsed_ms or 0
+    elapsed[key].append(entry.elapsed_ms or 0)
+    fingerprints[key].add(entry.fingerprint)
+
+  for key, widget in widgets.iteritems():
+    values = sorted(elapsed[key])
+    widget['avg_elapsed_ms'] = round(widget['elapsed_ms'] / len(values), 1)
+    widget['p95_elapsed_ms'] = _GetPercentile(values, 95)
+    widget['max_elapsed_ms'] = values[-1]
+    widget['elapsed_ms'] = round(widget['elapsed_ms'], 1)
+    widget['fingerprints'] = sorted(fingerprints[key])
+
+  report = sorted(widgets.itervalues(), key=lambda widget: widget[sort],
+                  reverse=True)
+  return report[:limit] if limit else report
@@ -0,0 +1,145 @@
+"""Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Tests for the query log model."""
+
+__author__ = 'joemu@google.com (Joe Allan Muharsky)'
+
+import datetime
+import unittest
+
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+from perfkit.explorer.model import query_log
+
+
+class FakeClock(object):
+
+  def __init__(self):
+    self.time = 1000.0
+
+  def __call__(self):
+    return self.time
+
+
+class QueryLogTest(unittest.TestCase):
+
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_datastore_v3_stub()
+    self.testbed.init_memcache_stub()
+    ndb.get_context().clear_cache()
+
+  def tearDown(self):
+    self.testbed.deactivate()
+
+  def testGetQueryFingerprintIgnoresLiterals(self):
+    fingerprint = query_log.GetQueryFingerprint(
+        'SELECT test FROM t WHERE timestamp >= 1356739200 AND '
+        'product_name IN ("a", "b") AND value > 1.5')
+
+    self.assertEqual(fingerprint, query_log.GetQueryFingerprint(
+        'select test\n  from t where timestamp >= 1400000000 AND '
+        'product_name IN ("c") AND value > 2'))
+    self.assertNotEqual(fingerprint, query_log.GetQueryFingerprint(
+        'SELECT metric FROM t WHERE timestamp >= 1356739200 AND '
+        'product_name IN ("a", "b") AND value > 1.5'))
+
+  def testWriterWritesFullBatches(self):
+    writer = query_log.QueryLogWriter(batch_size=3)
+
+    self.assertIsNone(writer.Record(query_log.QueryLogEntry(query_text='1')))
+    self.assertIsNone(writer.Record(query_log.QueryLogEntry(query_text='2')))
+    self.assertEqual(0, query_log.QueryLogEntry.query().count())
+
+    ndb.Future.wait_all(writer.Record(query_log.QueryLogEntry(query_text='3')))
+    self.assertEqual(3, query_log.QueryLogEntry.query().count())
+    self.assertIsNone(writer.Flush())
+
+  def testWriterWritesDelayedEntries(self):
+    clock = FakeClock()
+    writer = query_log.QueryLogWriter(batch_size=10, max_flush_delay=60,
+                                      clock=clock)
+
+    self.assertIsNone(writer.Record(query_log.QueryLogEntry(query_text='1')))
+    clock.time += 60
+    ndb.Future.wait_all(writer.Record(query_log.QueryLogEntry(query_text='2')))
+
+    self.assertEqual(2, query_log.QueryLogEntry.query().count())
+
+  def testGetSince(self):
+    now = datetime.datetime.utcnow()
+    ndb.put_multi([
+        query_log.QueryLogEntry(query_text=str(hours),
+                                created_date=now - datetime.timedelta(
+                                    hours=hours))
+        for hours in (2, 0, 1)])
+
+    since = now - datetime.timedelta(days=1)
+    self.assertEqual(
+        ['0', '1', '2'],
+        [entry.query_text for entry in query_log.QueryLogEntry.GetSince(since)])
+    # The limit keeps the newest entries.
+    self.assertEqual(
+        ['0', '1'],
+        [entry.query_text
+         for entry in query_log.QueryLogEntry.GetSince(since, limit=2)])
+    self.assertEqual([], query_log.QueryLogEntry.GetSince(
+        datetime.datetime.utcnow() + datetime.timedelta(days=1)))
+
+  def testGetPendingStats(self):
+    ndb.put_multi([query_log.QueryLogEntry(job_id='job1', slot_ms=None),
+                   query_log.QueryLogEntry(job_id='job2', slot_ms=100),
+                   query_log.QueryLogEntry(slot_ms=0)])
+
+    self.assertEqual(
+        ['job1'],
+        [entry.job_id for entry in query_log.QueryLogEntry.GetPendingStats(
+            10)])
+
+  def testGetWidgetReport(self):
+    entries = [
+        query_log.QueryLogEntry(dashboard_id='1', widget_id='1',
+                                fingerprint='a', bytes_processed=100,
+                                slot_ms=10, elapsed_ms=500.0),
+        query_log.QueryLogEntry(dashboard_id='1', widget_id='1',
+                                fingerprint='a', cache_hit=True,
+                                bytes_processed=0, slot_ms=0,
+                                elapsed_ms=20.0),
+        query_log.QueryLogEntry(dashboard_id='1', widget_id='2',
+                                fingerprint='b', bytes_processed=50,
+                                slot_ms=None, elapsed_ms=2000.0)]
+
+    report = query_log.GetWidgetReport(entries)
+
+    self.assertEqual(['1', '2'], [widget['widget_id'] for widget in report])
+    self.assertEqual(2, report[0]['queries'])
+    self.assertEqual(1, report[0]['cache_hits'])
+    self.assertEqual(100, report[0]['bytes_processed'])
+    self.assertEqual(260.0, report[0]['avg_elapsed_ms'])
+    self.assertEqual(500.0, report[0]['max_elapsed_ms'])
+    self.assertEqual(['a'], report[0]['fingerprints'])
+
+    report = query_log.GetWidgetReport(entries, sort='p95_elapsed_ms',
+                                       limit=1)
+    self.assertEqual(['2'], [widget['widget_id'] for widget in report])
+
+    self.assertRaises(ValueError, query_log.GetWidgetReport, entries,
+                      sort='unknown')
+
+
+if __name__ == '__main__':
+  unittest.main()
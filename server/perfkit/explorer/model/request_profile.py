@@ -0,0 +1,60 @@
+"""Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+GAE Model for the datastore."""
+
+__author__ = 'joemu@google.com (Joe Allan Muharsky)'
+
+from google.appengine.ext import ndb
+
+
+# The number of profiles returned by GetRecent() by default.
+DEFAULT_RECENT_PROFILES = 50
+
+
+class RequestProfile(ndb.Model):
+  """The cProfile stats of a request that was run with profile=1.
+
+  The entity is keyed by the request id.  stats is in the marshal format of
+  profile_util.GetStatsData().
+  """
+
+  path = ndb.StringProperty(indexed=False)
+  query_string = ndb.TextProperty()
+  user_email = ndb.StringProperty(indexed=False)
+  elapsed_ms = ndb.FloatProperty(indexed=False)
+  status = ndb.IntegerProperty(indexed=False)
+  stats = ndb.BlobProperty(compressed=True)
+  created_date = ndb.DateTimeProperty(auto_now_add=True)
+
+  @staticmethod
+  def Get(request_id):
+    """Returns the profile of a request, or None if there is none."""
+    return RequestProfile.get_by_id(request_id)
+
+  @staticmethod
+  def GetRecent(limit=DEFAULT_RECENT_PROFILES):
+    """Returns the most recent profiles, newest first."""
+    return RequestProfile.query().order(
+        -RequestProfile.created_date).fetch(limit)
+
+  def ToDict(self):
+    """Returns the description of the profile, without its stats."""
+    return {'id': self.key.id(),
+            'path': self.path,
+            'query_string': self.query_string,
+            'user_email': self.user_email,
+            'elapsed_ms': self.elapsed_ms,
+            'status': self.status,
+            'created_date': self.created_date}
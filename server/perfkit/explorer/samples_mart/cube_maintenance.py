@@ -0,0 +1,298 @@
+"""Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Builds and refreshes the pre-aggregated cubes of the results table.
+
+lookup_field_cube (read by field_index) and metadata_cube (read by
+product_labels) count the rows of results per day, so picklists and label
+queries don't scan the full table.  They also summarize the values of the
+rows, so query_planner can answer aggregate widget queries from them.
+Rebuilding them from every row of results is expensive, so RefreshCubes() only
+recomputes the days that rows were appended to since the last refresh:
+
+  1. The days touched are read from the rows appended since the watermark,
+     using a table range decorator ([dataset.results@<watermark>-]).
+  2. For each cube, the rows of the untouched days are copied from the cube
+     and the touched days are recomputed from results, into a staging table.
+  3. The staging table replaces the cube with a single copy job, so readers
+     never see a partially refreshed cube.
+  4. The watermark (see model.cube_watermark) is advanced to the time the
+     refresh started, once every cube is refreshed.
+
+The cubes are rebuilt from all rows when there is no watermark, when a cube
+doesn't exist, when the cubes were built with a different CUBE_VERSION, or
+when the watermark is too old for a range decorator.
+
+    client.project_id = 'my-project'
+    cube_maintenance.RefreshCubes(client, 'samples_mart')
+"""
+
+__author__ = 'joemu@google.com (Joe Allan Muharsky)'
+
+import collections
+import logging
+import time
+
+from perfkit.explorer.model import cube_watermark
+
+
+RESULTS_TABLE = 'results'
+STAGING_SUFFIX = '_staging'
+
+MS_PER_DAY = 86400 * 1000
+USEC_PER_DAY = MS_PER_DAY * 1000
+
+# Range decorators can read the rows appended in the last 7 days; older
+# watermarks cause a full rebuild.
+MAX_INCREMENTAL_AGE = 6 * MS_PER_DAY
+# The range read is started this long before the watermark, so rows that were
+# still being appended when the last refresh started are not missed.
+# Recomputing a day is idempotent, so the overlap is harmless.
+WATERMARK_OVERLAP = 15 * 60 * 1000
+
+# The day (as microseconds since the epoch) of a results row.
+DAY_EXPRESSION = 'UTC_USEC_TO_DAY(INTEGER(timestamp * 1000000))'
+
+# Incremented when the cube schemas change, so cubes built by a previous
+# version are rebuilt rather than merged.
+CUBE_VERSION = 2
+
+# The row count and value summaries of each cube row.
+VALUE_FIELDS = ['count', 'value_count', 'value_sum', 'value_min', 'value_max']
+
+CUBE_FIELDS = collections.OrderedDict([
+    ('lookup_field_cube', ['product_name', 'test', 'metric', 'owner',
+                           'day_timestamp'] + VALUE_FIELDS),
+    ('metadata_cube', ['product_name', 'test', 'metric', 'owner',
+                       'day_timestamp', 'label', 'value'] + VALUE_FIELDS)])
+
+LOOKUP_FIELD_CUBE_QUERY = """
+SELECT
+  product_name,
+  test,
+  metric,
+  owner,
+  USEC_TO_TIMESTAMP({day}) AS day_timestamp,
+  COUNT(*) AS count,
+  COUNT(value) AS value_count,
+  SUM(value) AS value_sum,
+  MIN(value) AS value_min,
+  MAX(value) AS value_max
+FROM [{dataset}.{results}]
+{where}
+GROUP EACH BY product_name, test, metric, owner, day_timestamp
+"""
+
+METADATA_CUBE_QUERY = """
+SELECT
+  product_name,
+  test,
+  metric,
+  owner,
+  day_timestamp,
+  REGEXP_EXTRACT(label_pair, r'^([^:]*):') AS label,
+  REGEXP_EXTRACT(label_pair, r'^[^:]*:(.*)$') AS value,
+  COUNT(*) AS count,
+  COUNT(sample_value) AS value_count,
+  SUM(sample_value) AS value_sum,
+  MIN(sample_value) AS value_min,
+  MAX(sample_value) AS value_max
+FROM (
+  SELECT
+    product_name,
+    test,
+    metric,
+    owner,
+    USEC_TO_TIMESTAMP({day}) AS day_timestamp,
+    value AS sample_value,
+    SPLIT(labels, '|') AS label_pair
+  FROM [{dataset}.{results}]
+  {where})
+WHERE label_pair CONTAINS ':'
+GROUP EACH BY product_name, test, metric, owner, day_timestamp, label, value
+"""
+
+CUBE_QUERIES = {
+    'lookup_field_cube': LOOKUP_FIELD_CUBE_QUERY,
+    'metadata_cube': METADATA_CUBE_QUERY}
+
+TOUCHED_DAYS_QUERY = """
+SELECT {day} AS day
+FROM [{dataset}.{results}@{start_time}-]
+GROUP BY day
+ORDER BY day
+"""
+
+MERGE_QUERY = """
+SELECT {fields}
+FROM
+  (SELECT {fields}
+   FROM [{dataset}.{cube}]
+   WHERE UTC_USEC_TO_DAY(TIMESTAMP_TO_USEC(day_timestamp)) NOT IN ({days})),
+  ({cube_query})
+"""
+
+
+class RefreshModes(object):
+  FULL = 'full'
+  INCREMENTAL = 'incremental'
+  NONE = 'none'
+
+
+def GetCubeQuery(cube_name, dataset_name, days=None):
+  """Returns the SQL that computes a cube from the results table.
+
+  Args:
+    cube_name: The name of the cube, one of CUBE_FIELDS.
+    dataset_name: The dataset that contains the results table.
+    days: A list of days (since the epoch) to compute.  If not provided, all
+        days are computed.
+  """
+  where = ''
+  if days:
+    where = 'WHERE {day} IN ({days})'.format(
+        day=DAY_EXPRESSION, days=_FormatDays(days))
+
+  return CUBE_QUERIES[cube_name].format(
+      day=DAY_EXPRESSION, dataset=dataset_name, results=RESULTS_TABLE,
+      where=where)
+
+
+def GetMergeQuery(cube_name, dataset_name, days):
+  """Returns the SQL for a cube with the rows of the days recomputed.
+
+  The rows of the other days are read from the existing cube.
+
+  Args:
+    cube_name: The name of the cube, one of CUBE_FIELDS.
+    dataset_name: The dataset that contains the cube and results tables.
+    days: A non-empty list of days (since the epoch) to recompute.
+  """
+  return MERGE_QUERY.format(
+      fields=', '.join(CUBE_FIELDS[cube_name]), dataset=dataset_name,
+      cube=cube_name, days=_FormatDays(days),
+      cube_query=GetCubeQuery(cube_name, dataset_name, days))
+
+
+def GetTouchedDays(client, dataset_name, start_time):
+  """Returns the days of the rows appended to results since start_time.
+
+  Args:
+    client: A BigQueryClient.
+    dataset_name: The dataset that contains the results table.
+    start_time: The time (in ms since the epoch) to read appended rows from.
+        It must be within the last 7 days.
+
+  Returns:
+    A sorted list of days since the epoch.
+  """
+  query = TOUCHED_DAYS_QUERY.format(
+      day=DAY_EXPRESSION, dataset=dataset_name, results=RESULTS_TABLE,
+      start_time=int(start_time))
+  result = client.QueryResultSet(query)
+
+  return sorted(int(day) // USEC_PER_DAY
+                for day in result.GetColumn('day') if day is not None)
+
+
+def RefreshCubes(client, dataset_name, full_rebuild=False, now=None):
+  """Brings the cubes of a dataset up to date with its results table.
+
+  Args:
+    client: A BigQueryClient, with project_id set.
+    dataset_name: The dataset that contains the results table and cubes.
+    full_rebuild: If True, the cubes are rebuilt from all days.
+    now: The current time in milliseconds since the epoch, for tests.
+
+  Returns:
+    A dict describing the refresh, in the following format:
+      {'mode': 'incremental', 'days': [16400, 16401],
+       'cubes': ['lookup_field_cube', 'metadata_cube']}
+  """
+  if now is None:
+    now = int(time.time() * 1000)
+
+  watermark = cube_watermark.CubeWatermark.Get(client.project_id,
+                                               dataset_name)
+  days = None
+
+  if not full_rebuild:
+    full_rebuild = _RequiresFullRebuild(client, dataset_name, watermark, now)
+
+  if full_rebuild:
+    mode = RefreshModes.FULL
+  else:
+    days = GetTouchedDays(client, dataset_name,
+                          watermark.refreshed_time - WATERMARK_OVERLAP)
+    mode = RefreshModes.INCREMENTAL if days else RefreshModes.NONE
+
+  refreshed_cubes = []
+  if mode != RefreshModes.NONE:
+    for cube_name in CUBE_FIELDS:
+      if full_rebuild:
+        query = GetCubeQuery(cube_name, dataset_name)
+      else:
+        query = GetMergeQuery(cube_name, dataset_name, days)
+
+      _ReplaceCube(client, dataset_name, cube_name, query)
+      refreshed_cubes.append(cube_name)
+
+  cube_watermark.CubeWatermark.Set(
+      client.project_id, dataset_name, now, days or [],
+      full_rebuild=full_rebuild, version=CUBE_VERSION)
+
+  logging.info('Refreshed cubes of %s.%s (%s): %d days.',
+               client.project_id, dataset_name, mode, len(days or []))
+
+  return {'mode': mode, 'days': days or [], 'cubes': refreshed_cubes}
+
+
+def _RequiresFullRebuild(client, dataset_name, watermark, now):
+  """Returns True if the cubes can't be refreshed incrementally."""
+  if not watermark or not watermark.refreshed_time:
+    return True
+
+  if watermark.version != CUBE_VERSION:
+    logging.info('Cubes of %s were built by version %s.', dataset_name,
+                 watermark.version)
+    return True
+
+  if now - watermark.refreshed_time > MAX_INCREMENTAL_AGE:
+    logging.info('Cube watermark of %s is too old for an incremental refresh.',
+                 dataset_name)
+    return True
+
+  for cube_name in CUBE_FIELDS:
+    if not client.TableExists(dataset_name, cube_name):
+      return True
+
+  return False
+
+
+def _ReplaceCube(client, dataset_name, cube_name, query):
+  """Writes query into a staging table, and copies it over the cube."""
+  staging_table = cube_name + STAGING_SUFFIX
+
+  client.QueryInto(query, dataset_name, staging_table, 'WRITE_TRUNCATE',
+                   allow_large_results=True)
+  try:
+    client.CopyTable(staging_table, dataset_name, cube_name,
+                     write_disposition='WRITE_TRUNCATE')
+  finally:
+    client.DeleteTable(dataset_name, staging_table)
+
+
+def _FormatDays(days):
+  """Returns days (since the epoch) as a list of microsecond timestamps."""
+  return ', '.join(str(int(day) * USEC_PER_DAY) for day in days)
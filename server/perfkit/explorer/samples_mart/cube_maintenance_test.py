@@ -0,0 +1,192 @@
+"""Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Unit tests for the cube maintenance module."""
+
+__author__ = 'joemu@google.com (Joe Allan Muharsky)'
+
+import unittest
+
+import mock
+
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+from perfkit.common import big_query_result_set
+from perfkit.explorer.model import cube_watermark
+from perfkit.explorer.samples_mart import cube_maintenance
+
+
+PROJECT = 'test_project'
+DATASET = 'samples_mart'
+# 2013-01-04 is day 15709 since the epoch.
+DAY = 15709
+NOW = (DAY + 1) * cube_maintenance.MS_PER_DAY
+
+
+def _GetClient(touched_days=(), tables_exist=True):
+  client = mock.Mock()
+  client.project_id = PROJECT
+  client.TableExists.return_value = tables_exist
+  client.QueryResultSet.return_value = big_query_result_set.ResultSet(
+      fields=[{'name': 'day', 'type': 'INTEGER'}],
+      columns=[[day * cube_maintenance.USEC_PER_DAY
+                for day in touched_days]])
+
+  return client
+
+
+class CubeMaintenanceTest(unittest.TestCase):
+
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_datastore_v3_stub()
+    self.testbed.init_memcache_stub()
+    # Entities cached by ndb in earlier tests would outlive the datastore stub.
+    ndb.get_context().clear_cache()
+
+  def tearDown(self):
+    self.testbed.deactivate()
+
+  def testGetCubeQuery(self):
+    query = cube_maintenance.GetCubeQuery('lookup_field_cube', DATASET,
+                                          days=[DAY, DAY + 1])
+
+    self.assertIn('FROM [samples_mart.results]', query)
+    self.assertIn('IN (1357257600000000, 1357344000000000)', query)
+    self.assertIn('GROUP EACH BY product_name, test, metric, owner, '
+                  'day_timestamp', query)
+
+    query = cube_maintenance.GetCubeQuery('metadata_cube', DATASET)
+
+    self.assertNotIn('WHERE UTC_USEC_TO_DAY', query)
+    self.assertIn("SPLIT(labels, '|') AS label_pair", query)
+
+  def testGetMergeQuery(self):
+    query = cube_maintenance.GetMergeQuery('metadata_cube', DATASET, [DAY])
+
+    self.assertIn('FROM [samples_mart.metadata_cube]', query)
+    self.assertIn('NOT IN (1357257600000000)', query)
+    self.assertIn('FROM [samples_mart.results]', query)
+
+  def testRefreshWithoutWatermarkRebuilds(self):
+    client = _GetClient()
+
+    result = cube_maintenance.RefreshCubes(client, DATASET, now=NOW)
+
+    self.assertEqual(cube_maintenance.RefreshModes.FULL, result['mode'])
+    self.assertEqual(['lookup_field_cube', 'metadata_cube'], result['cubes'])
+    self.assertFalse(client.QueryResultSet.called)
+
+    client.QueryInto.assert_any_call(
+        mock.ANY, DATASET, 'lookup_field_cube_staging', 'WRITE_TRUNCATE',
+        allow_large_results=True)
+    client.CopyTable.assert_any_call(
+        'metadata_cube_staging', DATASET, 'metadata_cube',
+        write_disposition='WRITE_TRUNCATE')
+    client.DeleteTable.assert_any_call(DATASET, 'metadata_cube_staging')
+
+    watermark = cube_watermark.CubeWatermark.Get(PROJECT, DATASET)
+    self.assertEqual(NOW, watermark.refreshed_time)
+    self.assertTrue(watermark.full_rebuild)
+
+  def testRefreshRecomputesTouchedDays(self):
+    cube_watermark.CubeWatermark.Set(
+        PROJECT, DATASET, NOW - 3600000, [],
+        version=cube_maintenance.CUBE_VERSION)
+    client = _GetClient(touched_days=[DAY, DAY + 1])
+
+    result = cube_maintenance.RefreshCubes(client, DATASET, now=NOW)
+
+    self.assertEqual(cube_maintenance.RefreshModes.INCREMENTAL,
+                     result['mode'])
+    self.assertEqual([DAY, DAY + 1], result['days'])
+
+    touched_query = client.QueryResultSet.call_args[0][0]
+    self.assertIn('[samples_mart.results@%d-]' % (
+        NOW - 3600000 - cube_maintenance.WATERMARK_OVERLAP), touched_query)
+
+    merge_query = client.QueryInto.call_args_list[0][0][0]
+    self.assertIn('FROM [samples_mart.lookup_field_cube]', merge_query)
+    self.assertEqual(2, client.CopyTable.call_count)
+
+    watermark = cube_watermark.CubeWatermark.Get(PROJECT, DATASET)
+    self.assertEqual(NOW, watermark.refreshed_time)
+    self.assertEqual([DAY, DAY + 1], watermark.refreshed_days)
+    self.assertFalse(watermark.full_rebuild)
+
+  def testRefreshWithoutNewRowsOnlyAdvancesWatermark(self):
+    cube_watermark.CubeWatermark.Set(
+        PROJECT, DATASET, NOW - 3600000, [],
+        version=cube_maintenance.CUBE_VERSION)
+    client = _GetClient()
+
+    result = cube_maintenance.RefreshCubes(client, DATASET, now=NOW)
+
+    self.assertEqual(cube_maintenance.RefreshModes.NONE, result['mode'])
+    self.assertFalse(client.QueryInto.called)
+    self.assertEqual(
+        NOW, cube_watermark.CubeWatermark.Get(PROJECT, DATASET).refreshed_time)
+
+  def testRefreshWithOldWatermarkRebuilds(self):
+    cube_watermark.CubeWatermark.Set(
+        PROJECT, DATASET, NOW - cube_maintenance.MAX_INCREMENTAL_AGE - 1, [],
+        version=cube_maintenance.CUBE_VERSION)
+    client = _GetClient(touched_days=[DAY])
+
+    result = cube_maintenance.RefreshCubes(client, DATASET, now=NOW)
+
+    self.assertEqual(cube_maintenance.RefreshModes.FULL, result['mode'])
+
+  def testRefreshWithMissingCubeRebuilds(self):
+    cube_watermark.CubeWatermark.Set(
+        PROJECT, DATASET, NOW - 3600000, [],
+        version=cube_maintenance.CUBE_VERSION)
+    client = _GetClient(touched_days=[DAY], tables_exist=False)
+
+    result = cube_maintenance.RefreshCubes(client, DATASET, now=NOW)
+
+    self.assertEqual(cube_maintenance.RefreshModes.FULL, result['mode'])
+
+  def testRefreshWithOldCubeVersionRebuilds(self):
+    cube_watermark.CubeWatermark.Set(PROJECT, DATASET, NOW - 3600000, [],
+                                     version=1)
+    client = _GetClient(touched_days=[DAY])
+
+    result = cube_maintenance.RefreshCubes(client, DATASET, now=NOW)
+
+    self.assertEqual(cube_maintenance.RefreshModes.FULL, result['mode'])
+    self.assertEqual(cube_maintenance.CUBE_VERSION,
+                     cube_watermark.CubeWatermark.Get(PROJECT, DATASET).version)
+
+  def testFailedRefreshKeepsWatermark(self):
+    cube_watermark.CubeWatermark.Set(
+        PROJECT, DATASET, NOW - 3600000, [],
+        version=cube_maintenance.CUBE_VERSION)
+    client = _GetClient(touched_days=[DAY])
+    client.CopyTable.side_effect = Exception('copy failed')
+
+    self.assertRaises(Exception, cube_maintenance.RefreshCubes, client,
+                      DATASET, now=NOW)
+
+    client.DeleteTable.assert_called_once_with(
+        DATASET, 'lookup_field_cube_staging')
+    self.assertEqual(
+        NOW - 3600000,
+        cube_watermark.CubeWatermark.Get(PROJECT, DATASET).refreshed_time)
+
+
+if __name__ == '__main__':
+  unittest.main()
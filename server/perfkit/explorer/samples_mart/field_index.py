@@ -0,0 +1,348 @@
+"""Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+In-memory index of the distinct field values in lookup_field_cube.
+
+The query builder picklists request the distinct values of a field (product,
+test, metric, owner) for a set of filters on every keystroke.  Rather than
+issuing a BigQuery query for each request, the cube is read periodically into
+a FieldIndex, which answers the same question from memory:
+
+    index = field_index.GetFieldIndex(data_client, dataset_name)
+    index.Search('test', filters={'product_name': 'widget-factory'},
+                 prefix='create')
+
+Each distinct combination of the indexed fields is stored once, with the days
+it has data for as a list of (first_day, last_day) ranges.  Each field value
+has a posting set of the combinations it appears in, so filters are resolved
+by set intersection.
+"""
+
+__author__ = 'joemu@google.com (Joe Allan Muharsky)'
+
+import bisect
+import datetime
+import logging
+import threading
+import time
+
+from dateutil import relativedelta
+
+from perfkit.common import big_query_result_util as result_util
+from perfkit.common import datetime_util
+import explorer_method
+
+
+INDEXED_FIELDS = ('product_name', 'test', 'metric', 'owner')
+REFRESH_INTERVAL = 600  # In seconds
+SECONDS_PER_DAY = 86400
+MS_PER_DAY = SECONDS_PER_DAY * 1000
+
+# Maps a relative date filter type to the relativedelta argument it adjusts.
+RELATIVE_DATE_UNITS = {
+    'YEAR': 'years',
+    'MONTH': 'months',
+    'WEEK': 'weeks',
+    'DAY': 'days',
+    'HOUR': 'hours',
+    'MINUTE': 'minutes',
+    'SECOND': 'seconds'}
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+class Error(Exception):
+  pass
+
+
+class ArgumentError(Error):
+  pass
+
+
+class FieldIndex(object):
+  """Distinct values of the indexed fields, with the days they appear on."""
+
+  def __init__(self, fields=INDEXED_FIELDS):
+    """Initializes an empty index.
+
+    Args:
+      fields: The names of the indexed fields.
+    """
+    self.fields = tuple(fields)
+    self.created = time.time()
+
+    self._combinations = {}
+    self._day_ranges = []
+    self._postings = dict((field, {}) for field in self.fields)
+    self._sorted_values = dict((field, []) for field in self.fields)
+
+  def __len__(self):
+    return len(self._day_ranges)
+
+  def AddRows(self, rows):
+    """Adds rows to the index.  Call Finalize() when all rows are added.
+
+    Args:
+      rows: An iterable of tuples, each containing a value for each of the
+          indexed fields (in order), followed by the day number (days since
+          the epoch) the combination has data for.
+    """
+    for row in rows:
+      values = tuple(row[:-1])
+      combination_id = self._combinations.get(values)
+
+      if combination_id is None:
+        combination_id = len(self._day_ranges)
+        self._combinations[values] = combination_id
+        self._day_ranges.append([])
+
+        for field, value in zip(self.fields, values):
+          self._postings[field].setdefault(value, set()).add(combination_id)
+
+      if row[-1] is not None:
+        self._day_ranges[combination_id].append(row[-1])
+
+  def Finalize(self):
+    """Sorts the field values and collapses each day list into ranges."""
+    for field in self.fields:
+      self._sorted_values[field] = sorted(
+          (value.lower(), value) for value in self._postings[field]
+          if value is not None)
+
+    for combination_id, days in enumerate(self._day_ranges):
+      self._day_ranges[combination_id] = GetDayRanges(days)
+
+  def Search(self, field_name, filters=None, start_day=None, end_day=None,
+             prefix=None, max_results=None):
+    """Returns the sorted distinct values of a field.
+
+    Args:
+      field_name: The name of the field to return values for.
+      filters: A dict of field name to the value it must match.  Empty
+          filter values are ignored.
+      start_day: If provided, only values with data on or after this day
+          (days since the epoch) are returned.
+      end_day: If provided, only values with data on or before this day are
+          returned.
+      prefix: If provided, only values starting with this string (ignoring
+          case) are returned.
+      max_results: If provided, the maximum number of values to return.
+
+    Returns:
+      A list of field values, in ascending order.
+
+    Raises:
+      ArgumentError: Raised if field_name or a filter is not indexed.
+    """
+    self._VerifyField(field_name)
+
+    candidates = None
+    for filter_name, filter_value in sorted((filters or {}).items()):
+      if not filter_value:
+        continue
+
+      self._VerifyField(filter_name)
+      matches = self._postings[filter_name].get(filter_value, set())
+      candidates = (matches if candidates is None
+                    else candidates.intersection(matches))
+
+      if not candidates:
+        return []
+
+    if prefix:
+      values = self._GetPrefixValues(field_name, prefix)
+    else:
+      values = self._postings[field_name].keys()
+
+    results = []
+    for value in values:
+      postings = self._postings[field_name][value]
+      if candidates is not None:
+        postings = postings.intersection(candidates)
+
+      if any(self._HasDataBetween(combination_id, start_day, end_day)
+             for combination_id in postings):
+        results.append(value)
+
+    results.sort()
+    if max_results:
+      results = results[:max_results]
+
+    return results
+
+  def _VerifyField(self, field_name):
+    if field_name not in self._postings:
+      raise ArgumentError('Field "%s" is not indexed.' % field_name)
+
+  def _GetPrefixValues(self, field_name, prefix):
+    """Returns the values of a field that start with prefix (ignoring case)."""
+    sorted_values = self._sorted_values[field_name]
+    prefix = prefix.lower()
+
+    values = []
+    position = bisect.bisect_left(sorted_values, (prefix,))
+    while (position < len(sorted_values) and
+           sorted_values[position][0].startswith(prefix)):
+      values.append(sorted_values[position][1])
+      position += 1
+
+    return values
+
+  def _HasDataBetween(self, combination_id, start_day, end_day):
+    """Returns True if a combination has data between the days provided."""
+    if start_day is None and end_day is None:
+      return True
+
+    for first_day, last_day in self._day_ranges[combination_id]:
+      if ((start_day is None or last_day >= start_day) and
+          (end_day is None or first_day <= end_day)):
+        return True
+
+    return False
+
+
+class FieldIndexQuery(explorer_method.ExplorerQueryBase):
+  """Reads the distinct field combinations and days from lookup_field_cube."""
+
+  def _Initialize(self):
+    """Set up the query configuration (fields, tables, etc.)."""
+    super(FieldIndexQuery, self)._Initialize()
+
+    self.tables = ['lookup_field_cube']
+    self.fields = list(INDEXED_FIELDS) + ['day_timestamp']
+    self.groups = list(self.fields)
+    self.max_rows = None
+
+  def Execute(self):
+    """Returns a FieldIndex built from the cube."""
+    result = self.data_client.QueryResultSet(
+        query=self.GetSql(), cache_duration=REFRESH_INTERVAL,
+        timestamp_mode=result_util.TimestampModes.EPOCH_MS)
+
+    columns = [result.GetColumn(field) for field in INDEXED_FIELDS]
+    days = [timestamp // MS_PER_DAY if timestamp is not None else None
+            for timestamp in result.GetColumn('day_timestamp')]
+
+    index = FieldIndex()
+    index.AddRows(zip(*(columns + [days])))
+    index.Finalize()
+
+    logging.info('Indexed %d field combinations from %d cube rows.',
+                 len(index), len(result))
+    return index
+
+
+def GetDayRanges(days):
+  """Returns a sorted list of (first_day, last_day) runs of consecutive days.
+
+  Args:
+    days: A list of day numbers, in any order.
+  """
+  ranges = []
+  for day in sorted(set(days)):
+    if ranges and ranges[-1][1] == day - 1:
+      ranges[-1] = (ranges[-1][0], day)
+    else:
+      ranges.append((day, day))
+
+  return ranges
+
+
+def GetDayFromFilterExpression(date_filter, inclusive_end=False):
+  """Returns the day number that a date filter selects from.
+
+  This is the in-memory equivalent of comparing day_timestamp (midnight UTC)
+  to ExplorerQueryBase.GetTimestampFromFilterExpression(date_filter).
+
+  Args:
+    date_filter: A date filter clause, containing a type and value.
+    inclusive_end: If True, returns the last day that is on or before the
+        filter time, otherwise the first day on or after it.
+
+  Returns:
+    A day number (days since the epoch).
+
+  Raises:
+    ArgumentError: Raised if the filter type is not supported.
+  """
+  if date_filter['filter_type'] == 'CUSTOM':
+    if date_filter.get('specify_time'):
+      date = datetime_util.StringToDateTime(date_filter['text'])
+    else:
+      date = datetime_util.StringToFirstSecond(date_filter['text'])
+  else:
+    unit = RELATIVE_DATE_UNITS.get(date_filter['filter_type'])
+    if not unit:
+      raise ArgumentError(
+          'Date filter type "%s" is not supported.' %
+          date_filter['filter_type'])
+
+    interval = relativedelta.relativedelta(
+        **{unit: int(date_filter['filter_value'])})
+    date = datetime.datetime.utcnow() - interval
+
+  timestamp = datetime_util.DateTimeToTimestamp(date)
+  if inclusive_end:
+    return timestamp // SECONDS_PER_DAY
+  else:
+    return -(-timestamp // SECONDS_PER_DAY)
+
+
+def GetFieldIndex(data_client, dataset_name=None):
+  """Returns the FieldIndex for a dataset, refreshing it when it is stale.
+
+  Indexes are kept per project and dataset for the life of the instance.  While
+  one request refreshes a stale index, other requests use the stale copy; if
+  the refresh fails, the error is logged and the stale copy is kept for
+  another interval.
+
+  Args:
+    data_client: A BigQueryClient used to read the cube.
+    dataset_name: The name of the dataset that contains lookup_field_cube.
+
+  Returns:
+    A FieldIndex.
+  """
+  key = (data_client.project_id, dataset_name)
+  index = _indexes.get(key)
+
+  if index and time.time() - index.created < REFRESH_INTERVAL:
+    return index
+
+  if not _indexes_lock.acquire(index is None):
+    return index
+
+  try:
+    current = _indexes.get(key)
+    if current is not index and current is not None:
+      return current
+
+    _indexes[key] = FieldIndexQuery(
+        data_client=data_client, dataset_name=dataset_name).Execute()
+  except Exception:
+    if index is None:
+      raise
+    logging.exception('Failed to refresh the field index, using stale copy.')
+    index.created = time.time()
+    return index
+  finally:
+    _indexes_lock.release()
+
+  return _indexes[key]
+
+
+def ClearFieldIndexes():
+  """Discards all indexes, so they are re-read on the next request."""
+  _indexes.clear()
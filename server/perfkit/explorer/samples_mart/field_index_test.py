@@ -0,0 +1,189 @@
+"""Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Unit tests for the FieldIndex class."""
+
+__author__ = 'joemu@google.com (Joe Allan Muharsky)'
+
+import unittest
+
+from perfkit import test_util
+
+from perfkit.explorer.samples_mart import field_index
+
+
+# 2013-01-04 is day 15709 since the epoch.
+DAY = 15709
+
+
+def _GetIndex():
+  index = field_index.FieldIndex()
+  index.AddRows([
+      ('widget-factory', 'create-widgets', 'final-weight', 'jdoe', DAY),
+      ('widget-factory', 'create-widgets', 'final-weight', 'jdoe', DAY + 1),
+      ('widget-factory', 'create-widgets', 'final-weight', 'jdoe', DAY + 5),
+      ('widget-factory', 'create-widgets', 'Final-Color', 'jdoe', DAY + 5),
+      ('widget-factory', 'paint-widgets', 'drying-time', 'asmith', DAY + 2),
+      ('gadget-works', 'create-gadgets', 'final-weight', 'asmith', DAY + 9)])
+  index.Finalize()
+
+  return index
+
+
+class FieldIndexTest(unittest.TestCase):
+
+  def testSearchAll(self):
+    index = _GetIndex()
+
+    self.assertEqual(4, len(index))
+    self.assertEqual(['gadget-works', 'widget-factory'],
+                     index.Search('product_name'))
+    self.assertEqual(['Final-Color', 'drying-time', 'final-weight'],
+                     index.Search('metric'))
+
+  def testSearchFilters(self):
+    index = _GetIndex()
+
+    self.assertEqual(
+        ['create-widgets', 'paint-widgets'],
+        index.Search('test', filters={'product_name': 'widget-factory'}))
+    self.assertEqual(
+        ['widget-factory'],
+        index.Search('product_name', filters={'metric': 'final-weight',
+                                              'owner': 'jdoe'}))
+    self.assertEqual(
+        [], index.Search('test', filters={'product_name': 'gadget-works',
+                                          'owner': 'jdoe'}))
+    # Empty filters are ignored.
+    self.assertEqual(['asmith', 'jdoe'],
+                     index.Search('owner', filters={'test': None}))
+
+  def testSearchDays(self):
+    index = _GetIndex()
+
+    self.assertEqual(['drying-time'],
+                     index.Search('metric', start_day=DAY + 2,
+                                  end_day=DAY + 4))
+    self.assertEqual(['Final-Color', 'final-weight'],
+                     index.Search('metric', filters={'owner': 'jdoe'},
+                                  start_day=DAY + 3))
+    self.assertEqual(['final-weight'],
+                     index.Search('metric', end_day=DAY))
+
+  def testSearchPrefix(self):
+    index = _GetIndex()
+
+    self.assertEqual(['Final-Color', 'final-weight'],
+                     index.Search('metric', prefix='fin'))
+    self.assertEqual(['final-weight'],
+                     index.Search('metric', prefix='FINAL-W'))
+    self.assertEqual(['create-gadgets'],
+                     index.Search('test', prefix='c', max_results=1))
+    self.assertEqual([], index.Search('metric', prefix='z'))
+
+  def testSearchUnknownField(self):
+    index = _GetIndex()
+
+    self.assertRaises(field_index.ArgumentError, index.Search, 'label')
+    self.assertRaises(field_index.ArgumentError, index.Search, 'test',
+                      filters={'label': 'size'})
+
+  def testGetDayRanges(self):
+    self.assertEqual([(1, 3), (5, 5), (7, 8)],
+                     field_index.GetDayRanges([8, 2, 1, 5, 3, 7, 2]))
+    self.assertEqual([], field_index.GetDayRanges([]))
+
+  def testGetDayFromFilterExpression(self):
+    date_filter = {'filter_type': 'CUSTOM', 'filter_value': '2013-01-04',
+                   'text': '2013-01-04'}
+    self.assertEqual(DAY, field_index.GetDayFromFilterExpression(date_filter))
+    self.assertEqual(
+        DAY, field_index.GetDayFromFilterExpression(date_filter, True))
+
+    date_filter = {'filter_type': 'CUSTOM', 'specify_time': True,
+                   'text': '2013-01-04 12:00:00'}
+    self.assertEqual(DAY + 1,
+                     field_index.GetDayFromFilterExpression(date_filter))
+    self.assertEqual(
+        DAY, field_index.GetDayFromFilterExpression(date_filter, True))
+
+    self.assertRaises(field_index.ArgumentError,
+                      field_index.GetDayFromFilterExpression,
+                      {'filter_type': 'QUARTER', 'filter_value': 1})
+
+
+class FieldIndexQueryTest(unittest.TestCase):
+
+  def setUp(self):
+    test_util.SetConfigPaths()
+    field_index.ClearFieldIndexes()
+
+    self.data_client = test_util.GetDataClient(mocked=True)
+    self.data_client.mock_reply = {
+        'jobReference': {'jobId': 'job1'},
+        'jobComplete': True,
+        'totalRows': '2',
+        'schema': {'fields': [
+            {'name': 'product_name', 'type': 'STRING'},
+            {'name': 'test', 'type': 'STRING'},
+            {'name': 'metric', 'type': 'STRING'},
+            {'name': 'owner', 'type': 'STRING'},
+            {'name': 'day_timestamp', 'type': 'TIMESTAMP'}]},
+        'rows': [
+            {'f': [{'v': 'widget-factory'}, {'v': 'create-widgets'},
+                   {'v': 'final-weight'}, {'v': 'jdoe'},
+                   {'v': '1.3572576E9'}]},
+            {'f': [{'v': 'widget-factory'}, {'v': 'create-widgets'},
+                   {'v': 'final-weight'}, {'v': 'jdoe'},
+                   {'v': '1.357344E9'}]}]}
+
+  def tearDown(self):
+    field_index.ClearFieldIndexes()
+
+  def testGetSql(self):
+    query = field_index.FieldIndexQuery(data_client=self.data_client,
+                                        dataset_name='samples_mart_testdata')
+
+    expected_sql = ('SELECT\n'
+                    '\tproduct_name,\n'
+                    '\ttest,\n'
+                    '\tmetric,\n'
+                    '\towner,\n'
+                    '\tday_timestamp\n'
+                    'FROM samples_mart_testdata.lookup_field_cube\n'
+                    'GROUP BY\n'
+                    '\tproduct_name,\n'
+                    '\ttest,\n'
+                    '\tmetric,\n'
+                    '\towner,\n'
+                    '\tday_timestamp')
+
+    self.assertEqual(expected_sql, query.GetSql())
+
+  def testGetFieldIndex(self):
+    index = field_index.GetFieldIndex(self.data_client, 'samples_mart_testdata')
+
+    self.assertEqual(1, len(index))
+    self.assertEqual(['final-weight'],
+                     index.Search('metric', start_day=DAY + 1, end_day=DAY + 1))
+    self.assertEqual([], index.Search('metric', start_day=DAY + 2))
+
+    # The index is reused until it is stale.
+    self.data_client.mock_reply = None
+    self.assertIs(index, field_index.GetFieldIndex(self.data_client,
+                                                   'samples_mart_testdata'))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -22,7 +22,10 @@ and JavaScript.
 
 __author__ = 'joemu@google.com (Joe Allan Muharsky)'
 
-LABEL_BOUNDARY = '|'
+import packed_labels
+
+
+LABEL_BOUNDARY = packed_labels.LABEL_BOUNDARY
 
 
 class Error(Exception):
@@ -41,6 +44,11 @@ class LabelManager(object):
                                                {'name': 'value2', 'count': 1}]},
      {'name': 'label2', 'count': 2, 'values': [{'name': 'value3', 'count': 1}]}]
 
+  Labels and values are listed in the order they were first added.  Each label
+  and value is also indexed by name, so lookups and additions take constant
+  time regardless of the number of labels.  GetLabelsByCount() provides the
+  same structure ordered by descending count.
+
   The ImportString() methods provide deserialization of
   'packed' labels from the data tier.  Example data for the above labels:
     ['|label1:value1|,|label2:value3|',
@@ -49,7 +57,7 @@ class LabelManager(object):
   Attributes:
     labels: A list of dictionaries, where each dict describes a label and its
         associated values.  See docstring above for more detail on this
-        structure.
+        structure.  The list should only be modified through this class.
   """
 
   def __init__(self, labels=None):
@@ -60,6 +68,20 @@ class LabelManager(object):
     """
     self.labels = labels or []
 
+    self._label_index = {}
+    self._value_index = {}
+    self._labels_by_count = None
+
+    for label in self.labels:
+      self._IndexLabel(label)
+      for value in label['values']:
+        self._value_index[label['name']][value['name']] = value
+
+  def _IndexLabel(self, label):
+    """Adds a label dictionary to the name indexes."""
+    self._label_index[label['name']] = label
+    self._value_index[label['name']] = {}
+
   def GetLabel(self, label_name, create_if_none=False):
     """Returns the label specified by label_name, or optionally creates it.
 
@@ -71,11 +93,12 @@ class LabelManager(object):
     Returns:
       A dictionary representing the current label.
     """
-    label = next((item for item in self.labels
-                  if item['name'] == label_name), None)
+    label = self._label_index.get(label_name)
     if not label and create_if_none:
       label = {'name': label_name, 'count': 0, 'values': []}
       self.labels.append(label)
+      self._IndexLabel(label)
+      self._labels_by_count = None
 
     return label
 
@@ -91,12 +114,21 @@ class LabelManager(object):
     Returns:
       A dictionary representing the current value.
     """
-    value = next((item for item in label['values']
-                  if item['name'] == value_name), None)
+    if self._label_index.get(label['name']) is not label:
+      # The label isn't managed by this instance, so it isn't indexed.
+      value = next((item for item in label['values']
+                    if item['name'] == value_name), None)
+      values = None
+    else:
+      values = self._value_index[label['name']]
+      value = values.get(value_name)
 
     if not value and create_if_none:
       value = {'name': value_name, 'count': 0}
       label['values'].append(value)
+      self._labels_by_count = None
+      if values is not None:
+        values[value_name] = value
 
     return value
 
@@ -108,12 +140,53 @@ class LabelManager(object):
       value_name: The name of the value to add/increment.
       count: The amount to increase the count by.  This defaults to 1.
     """
-    label = self.GetLabel(label_name, create_if_none=True)
-    label['count'] += count
+    self.AddRows([(label_name, value_name, count)])
+
+  def AddRows(self, rows):
+    """Adds or increments many labels and values.
+
+    Args:
+      rows: An iterable of (label_name, value_name, count) tuples.  Each is
+          equivalent to a call to AddLabel(label_name, value_name, count).
+    """
+    self._labels_by_count = None
+
+    label_index = self._label_index
+    value_index = self._value_index
+
+    for label_name, value_name, count in rows:
+      label = label_index.get(label_name)
+      if not label:
+        label = self.GetLabel(label_name, create_if_none=True)
+      label['count'] += count
+
+      if value_name:
+        value = value_index[label_name].get(value_name)
+        if not value:
+          value = {'name': value_name, 'count': 0}
+          label['values'].append(value)
+          value_index[label_name][value_name] = value
+        value['count'] += count
+
+  def GetLabelsByCount(self):
+    """Returns the labels and their values, in descending order of count.
 
-    if value_name:
-      value = self.GetValue(label, value_name, create_if_none=True)
-      value['count'] += count
+    Labels and values with the same count are kept in the order they were
+    added.  The result is computed once, and reused until the labels change;
+    it should not be modified by the caller.
+
+    Returns:
+      A list of label dictionaries, in the same format as self.labels.
+    """
+    if self._labels_by_count is None:
+      self._labels_by_count = [
+          {'name': label['name'],
+           'count': label['count'],
+           'values': sorted(label['values'],
+                            key=lambda value: -value['count'])}
+          for label in sorted(self.labels, key=lambda label: -label['count'])]
+
+    return self._labels_by_count
 
   def ImportString(self, src, count=1):
     """Deserializes a packed string of label/values into the labels list.
@@ -128,19 +201,34 @@ class LabelManager(object):
       UnexpectedFormatError: Raised if the src string is not in the expected
           format.
     """
-    if src:
-      if not src.startswith(LABEL_BOUNDARY):
-        raise UnexpectedFormatError('Labels string must start with a |')
-      if not src.endswith(LABEL_BOUNDARY):
-        raise UnexpectedFormatError('Labels string must end with a |')
-
-      src = src.strip(LABEL_BOUNDARY)
-      label_strings = src.split('{boundary},{boundary}'.format(
-          boundary=LABEL_BOUNDARY))
-      label_strings.sort()
-      for label_string in label_strings:
-        label_array = label_string.split(':')
-
-        self.AddLabel(label_name=label_array[0],
-                      value_name=label_array[1],
-                      count=count)
+    try:
+      pairs = packed_labels.ParseLabels(src)
+    except packed_labels.UnexpectedFormatError as err:
+      raise UnexpectedFormatError(str(err))
+
+    pairs.sort()
+    self.AddRows([(label, value, count) for label, value in pairs])
+
+  def ImportColumn(self, srcs, counts=None, tolerant=False):
+    """Deserializes a column of packed label strings into the labels list.
+
+    Each distinct string is parsed once, so this is much faster than calling
+    ImportString() for each row of a result.
+
+    Args:
+      srcs: A sequence of packed label strings.  See ImportString.
+      counts: An optional sequence of counts, one per string.  Each string
+          counts as 1 if not provided.
+      tolerant: If True, malformed strings are parsed as well as possible
+          rather than raising an error.  See packed_labels.ParseLabels.
+
+    Raises:
+      UnexpectedFormatError: Raised if a string is not in the expected format,
+          and tolerant is False.
+    """
+    try:
+      rows = packed_labels.CountLabels(srcs, counts=counts, tolerant=tolerant)
+    except packed_labels.UnexpectedFormatError as err:
+      raise UnexpectedFormatError(str(err))
+
+    self.AddRows(rows)
@@ -0,0 +1,84 @@
+"""Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Benchmark for loading label/value counts into a LabelManager.
+
+Generates rows shaped like the ProductLabelsQuery results (one row per
+label/value pair) and times loading them with AddLabel(), AddRows() and
+ImportString().  Usage:
+
+    python label_manager_benchmark.py [--labels=100] [--values=200]
+"""
+
+__author__ = 'joemu@google.com (Joe Allan Muharsky)'
+
+import argparse
+import random
+import time
+
+import label_manager
+
+
+def GetRows(num_labels, num_values):
+  """Returns shuffled (label, value, count) rows for every label/value pair."""
+  rows = [('label%d' % label, 'value%d' % value, random.randint(1, 100))
+          for label in xrange(num_labels)
+          for value in xrange(num_values)]
+  random.shuffle(rows)
+
+  return rows
+
+
+def TimeIt(name, function, num_pairs):
+  start = time.time()
+  function()
+  elapsed = time.time() - start
+
+  print '%-14s %8.3fs %12.0f pairs/s' % (name, elapsed, num_pairs / elapsed)
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--labels', type=int, default=100)
+  parser.add_argument('--values', type=int, default=200)
+  parser.add_argument('--seed', type=int, default=1)
+  args = parser.parse_args()
+
+  random.seed(args.seed)
+  rows = GetRows(args.labels, args.values)
+  packed = ['|%s:%s|' % (label, value) for label, value, _ in rows]
+  num_pairs = len(rows)
+
+  print '%d label/value pairs (%d labels)' % (num_pairs, args.labels)
+
+  def AddLabelEach():
+    labels = label_manager.LabelManager()
+    for label, value, count in rows:
+      labels.AddLabel(label, value, count)
+
+  def AddRows():
+    label_manager.LabelManager().AddRows(rows)
+
+  def ImportString():
+    labels = label_manager.LabelManager()
+    for src in packed:
+      labels.ImportString(src)
+
+  TimeIt('AddLabel', AddLabelEach, num_pairs)
+  TimeIt('AddRows', AddRows, num_pairs)
+  TimeIt('ImportString', ImportString, num_pairs)
+
+
+if __name__ == '__main__':
+  main()
@@ -160,5 +160,57 @@ class LabelManagerTest(unittest.TestCase):
           'values': [{'name': 'value1', 'count': 3}]}])
 
 
+  def testAddRows(self):
+    expected = self._GetManager(SOURCE_RAW_DATA)
+
+    actual = label_manager.LabelManager()
+    actual.AddRows([('color', 'blue', 3), ('shape', 'circle', 3),
+                    ('size', 'large', 3), ('state', 'solid', 3),
+                    ('color', 'red', 1), ('shape', 'circle', 1),
+                    ('size', 'small', 1), ('state', 'gas', 1),
+                    ('color', 'green', 1), ('color', 'red', 1),
+                    ('shape', 'circle', 1), ('size', 'large', 1)])
+
+    self.assertEqual(expected.labels, actual.labels)
+    self.assertEqual(EXPECTED_DATA, actual.labels)
+
+  def testInitializeWithLabels(self):
+    mgr = label_manager.LabelManager(labels=[
+        {'name': 'label1', 'count': 1,
+         'values': [{'name': 'value1', 'count': 1}]}])
+
+    mgr.AddLabel('label1', 'value1')
+    mgr.AddLabel('label1', 'value2')
+
+    self.assertEqual(
+        mgr.labels,
+        [{'name': 'label1', 'count': 3,
+          'values': [{'name': 'value1', 'count': 2},
+                     {'name': 'value2', 'count': 1}]}])
+
+  def testGetLabelsByCount(self):
+    mgr = label_manager.LabelManager()
+    mgr.AddRows([('label1', 'value1', 1), ('label2', 'value2', 3),
+                 ('label1', 'value3', 2), ('label3', None, 3)])
+
+    expected = [
+        {'name': 'label1', 'count': 3,
+         'values': [{'name': 'value3', 'count': 2},
+                    {'name': 'value1', 'count': 1}]},
+        {'name': 'label2', 'count': 3,
+         'values': [{'name': 'value2', 'count': 3}]},
+        {'name': 'label3', 'count': 3, 'values': []}]
+
+    self.assertEqual(expected, mgr.GetLabelsByCount())
+    self.assertIs(mgr.GetLabelsByCount(), mgr.GetLabelsByCount())
+    # Insertion order is unchanged.
+    self.assertEqual(['value1', 'value3'],
+                     [value['name'] for value in mgr.labels[0]['values']])
+
+    mgr.AddLabel('label2', 'value2')
+    self.assertEqual(['label2', 'label1', 'label3'],
+                     [label['name'] for label in mgr.GetLabelsByCount()])
+
+
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,200 @@
+"""Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Parses the packed label strings of the results table.
+
+Each row of results stores its labels as a single string of label:value pairs,
+each enclosed in boundaries.  Pairs are separated by a comma, or not at all:
+    |cloud:GCP|,|machine_type:n1-standard-1|
+    |cloud:GCP||machine_type:n1-standard-1|
+
+ParseLabels() splits a string once on the boundary, and reads the pairs from
+alternate pieces.  Strings that don't follow the format raise
+UnexpectedFormatError, unless tolerant=True, in which case every piece that
+looks like a pair is kept and stray characters are ignored; some of the
+sample data has pairs like '|num_connections:1|[ip_type:internal|'.  Tolerant
+parsing only costs more than strict parsing for malformed strings.
+
+ParseColumn() parses a column of label strings (such as the labels column of a
+ResultSet) into one column of values per label:
+    ParseColumn(['|cloud:GCP||zone:a|', '|cloud:AWS|'])
+    => {'cloud': ['GCP', 'AWS'], 'zone': ['a', None]}
+
+Columns of results repeat the same few strings many times, so each distinct
+string is only parsed once.
+"""
+
+__author__ = 'joemu@google.com (Joe Allan Muharsky)'
+
+import collections
+
+
+LABEL_BOUNDARY = '|'
+PAIR_SEPARATORS = frozenset(['', ','])
+VALUE_SEPARATOR = ':'
+# Characters ignored around pairs in tolerant mode.
+STRAY_CHARACTERS = '[], \t'
+
+
+class Error(Exception):
+  pass
+
+
+class UnexpectedFormatError(Error):
+  """Thrown when a packed labels string is improperly formatted."""
+
+
+def ParseLabels(src, tolerant=False):
+  """Returns the label/value pairs of a packed labels string.
+
+  Args:
+    src: A string of packed label/values.  The format for packed labels is:
+        |label:value|,|label:value|
+    tolerant: If True, malformed boundaries and separators are ignored rather
+        than raising an error.
+
+  Returns:
+    A list of (label, value) tuples, in the order they appear in src.  The
+    value is None for labels without one (|label|).
+
+  Raises:
+    UnexpectedFormatError: Raised if the src string is not in the expected
+        format, and tolerant is False.
+  """
+  if not src:
+    return []
+
+  pieces = src.split(LABEL_BOUNDARY)
+
+  if not tolerant:
+    return _ParseStrict(src, pieces)
+
+  # Most strings are well-formed, so the strict parse is tried first.
+  try:
+    return _ParseStrict(src, pieces)
+  except UnexpectedFormatError:
+    return _ParseTolerant(pieces)
+
+
+def _ParseStrict(src, pieces):
+  """Returns the pairs of a string split on the boundary, or raises."""
+  if pieces[0]:
+    raise UnexpectedFormatError('Labels string must start with a |')
+  if pieces[-1]:
+    raise UnexpectedFormatError('Labels string must end with a |')
+
+  # Pairs are the odd pieces, and the separators between them the even ones.
+  if len(pieces) % 2 == 0:
+    raise UnexpectedFormatError(
+        'Labels string has an unmatched |: %s' % src)
+  if not PAIR_SEPARATORS.issuperset(pieces[2:-1:2]):
+    raise UnexpectedFormatError(
+        'Unexpected characters between labels: %s' % src)
+
+  pairs = []
+  for piece in pieces[1::2]:
+    label, has_value, value = piece.partition(VALUE_SEPARATOR)
+    if not label:
+      raise UnexpectedFormatError('Label name is missing: %s' % src)
+    pairs.append((label, value if has_value else None))
+
+  return pairs
+
+
+def _ParseTolerant(pieces):
+  """Returns the pairs of every piece that has a label, ignoring the rest."""
+  pairs = []
+
+  for piece in pieces:
+    piece = piece.strip(STRAY_CHARACTERS)
+    if not piece:
+      continue
+
+    label, has_value, value = piece.partition(VALUE_SEPARATOR)
+    label = label.strip(STRAY_CHARACTERS)
+    if label:
+      pairs.append((label, value.strip(STRAY_CHARACTERS) if has_value
+                    else None))
+
+  return pairs
+
+
+def ParseColumn(column, tolerant=False):
+  """Returns the values of each label in a column of packed labels strings.
+
+  Args:
+    column: A sequence of packed labels strings, one per row.  Empty strings
+        and None are rows without labels.
+    tolerant: See ParseLabels.
+
+  Returns:
+    An OrderedDict of label name to a list with the label's value for each
+    row of column (None if the row doesn't have the label), ordered by label
+    name.  If a row has a label more than once, the last value is kept.
+
+  Raises:
+    UnexpectedFormatError: See ParseLabels.
+  """
+  values_by_src = dict((src, dict(ParseLabels(src, tolerant=tolerant)))
+                       for src in set(column) if src)
+
+  label_names = sorted(set(
+      label for values in values_by_src.itervalues() for label in values))
+
+  # Each label's column is converted with one dict lookup per row, from the
+  # distinct strings to the label's value.
+  columns = collections.OrderedDict()
+  for label in label_names:
+    value_by_src = dict((src, values.get(label))
+                        for src, values in values_by_src.iteritems())
+    value_by_src[None] = value_by_src[''] = None
+
+    columns[label] = map(value_by_src.__getitem__, column)
+
+  return columns
+
+
+def CountLabels(column, counts=None, tolerant=False):
+  """Returns the number of rows of each label/value pair in a column.
+
+  Args:
+    column: A sequence of packed labels strings, one per row.
+    counts: An optional sequence of counts, one per row, such as the result of
+        a COUNT(*) grouped by labels.  Each row counts as 1 if not provided.
+    tolerant: See ParseLabels.
+
+  Returns:
+    A list of (label, value, count) tuples in order of first appearance,
+    suitable for LabelManager.AddRows().
+
+  Raises:
+    UnexpectedFormatError: See ParseLabels.
+  """
+  totals = {}
+  distinct_srcs = []
+  for index, src in enumerate(column):
+    if src:
+      if src not in totals:
+        totals[src] = 0
+        distinct_srcs.append(src)
+      totals[src] += counts[index] if counts is not None else 1
+
+  pair_counts = collections.OrderedDict()
+  for src in distinct_srcs:
+    count = totals[src]
+    for pair in ParseLabels(src, tolerant=tolerant):
+      pair_counts[pair] = pair_counts.get(pair, 0) + count
+
+  return [(label, value, count)
+          for (label, value), count in pair_counts.iteritems()]
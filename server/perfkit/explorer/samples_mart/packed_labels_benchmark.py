@@ -0,0 +1,122 @@
+"""Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Benchmark for parsing packed label strings.
+
+Generates a column of label strings shaped like the labels column of results
+(a few hundred distinct strings, repeated) and times parsing it:
+  * split_strip: the split/strip parsing ImportString() used to do.
+  * ParseLabels: packed_labels.ParseLabels() on each string.
+  * tolerant: packed_labels.ParseLabels(tolerant=True) on each string.
+  * ParseColumn: packed_labels.ParseColumn() on the whole column.
+  * ImportString: LabelManager.ImportString() on each string.
+  * ImportColumn: LabelManager.ImportColumn() on the whole column.
+Usage:
+
+    python packed_labels_benchmark.py [--strings=1000000] [--distinct=500]
+"""
+
+__author__ = 'joemu@google.com (Joe Allan Muharsky)'
+
+import argparse
+import random
+import time
+
+import label_manager
+import packed_labels
+
+
+LABEL_NAMES = ['cloud', 'machine_type', 'image', 'zone', 'num_connections',
+               'ip_type', 'platform', 'disk_type']
+
+
+def GetColumn(num_strings, num_distinct, pairs_per_string):
+  """Returns num_strings label strings, drawn from num_distinct strings."""
+  distinct = []
+  for _ in xrange(num_distinct):
+    names = random.sample(LABEL_NAMES, pairs_per_string)
+    distinct.append('|,|'.join(
+        '%s:value%d' % (name, random.randint(0, 20)) for name in names))
+
+  return ['|%s|' % random.choice(distinct) for _ in xrange(num_strings)]
+
+
+def ParseSplitStrip(src):
+  """Parses a label string the way ImportString() used to."""
+  src = src.strip(packed_labels.LABEL_BOUNDARY)
+  pairs = []
+  for label_string in src.split('|,|'):
+    label_array = label_string.split(':')
+    pairs.append((label_array[0], label_array[1]))
+
+  return pairs
+
+
+def TimeIt(name, function, num_strings):
+  start = time.time()
+  function()
+  elapsed = time.time() - start
+
+  print '%-14s %8.3fs %12.0f strings/s' % (name, elapsed,
+                                          num_strings / elapsed)
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--strings', type=int, default=1000000)
+  parser.add_argument('--distinct', type=int, default=500)
+  parser.add_argument('--pairs', type=int, default=6)
+  parser.add_argument('--seed', type=int, default=1)
+  args = parser.parse_args()
+
+  random.seed(args.seed)
+  column = GetColumn(args.strings, args.distinct, args.pairs)
+  num_strings = len(column)
+
+  print '%d label strings (%d distinct, %d pairs each)' % (
+      num_strings, args.distinct, args.pairs)
+
+  def SplitStrip():
+    for src in column:
+      ParseSplitStrip(src)
+
+  def ParseLabels():
+    for src in column:
+      packed_labels.ParseLabels(src)
+
+  def ParseTolerant():
+    for src in column:
+      packed_labels.ParseLabels(src, tolerant=True)
+
+  def ParseColumn():
+    packed_labels.ParseColumn(column)
+
+  def ImportString():
+    labels = label_manager.LabelManager()
+    for src in column:
+      labels.ImportString(src)
+
+  def ImportColumn():
+    label_manager.LabelManager().ImportColumn(column)
+
+  TimeIt('split_strip', SplitStrip, num_strings)
+  TimeIt('ParseLabels', ParseLabels, num_strings)
+  TimeIt('tolerant', ParseTolerant, num_strings)
+  TimeIt('ParseColumn', ParseColumn, num_strings)
+  TimeIt('ImportString', ImportString, num_strings)
+  TimeIt('ImportColumn', ImportColumn, num_strings)
+
+
+if __name__ == '__main__':
+  main()
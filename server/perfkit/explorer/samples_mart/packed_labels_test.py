@@ -0,0 +1,102 @@
+"""Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Unit tests for the packed labels parser."""
+
+__author__ = 'joemu@google.com (Joe Allan Muharsky)'
+
+import unittest
+
+import label_manager
+import packed_labels
+
+
+# A labels string from data/samples_mart/sample_results.json.
+SAMPLE_LABELS = ('|cloud:GCP||sending_zone:us-central1-b|'
+                 '|num_connections:1|[ip_type:internal|')
+
+
+class PackedLabelsTest(unittest.TestCase):
+
+  def testParseLabels(self):
+    expected = [('color', 'blue'), ('size', 'large'), ('important', None)]
+
+    self.assertEqual(
+        expected,
+        packed_labels.ParseLabels('|color:blue|,|size:large|,|important|'))
+    self.assertEqual(
+        expected,
+        packed_labels.ParseLabels('|color:blue||size:large||important|'))
+
+  def testParseLabelsKeepsSeparatorsInValue(self):
+    self.assertEqual(
+        [('uri', 'http://example.com'), ('empty', '')],
+        packed_labels.ParseLabels('|uri:http://example.com||empty:|'))
+
+  def testParseEmptyLabels(self):
+    self.assertEqual([], packed_labels.ParseLabels(''))
+    self.assertEqual([], packed_labels.ParseLabels(None))
+
+  def testParseBadLabels(self):
+    for src in ['shape:circle|,|color:blue|',
+                '|shape:circle|,|color:blue',
+                '|shape:circle|;|color:blue|',
+                '|:circle|',
+                SAMPLE_LABELS]:
+      self.assertRaises(packed_labels.UnexpectedFormatError,
+                        packed_labels.ParseLabels, src)
+
+  def testParseTolerant(self):
+    self.assertEqual(
+        [('cloud', 'GCP'), ('sending_zone', 'us-central1-b'),
+         ('num_connections', '1'), ('ip_type', 'internal')],
+        packed_labels.ParseLabels(SAMPLE_LABELS, tolerant=True))
+    self.assertEqual(
+        [('shape', 'circle'), ('color', 'blue')],
+        packed_labels.ParseLabels('shape:circle|,|:x|color:blue',
+                                  tolerant=True))
+
+  def testParseColumn(self):
+    actual = packed_labels.ParseColumn(
+        ['|cloud:GCP||zone:a|', '|cloud:AWS|', None, '|cloud:GCP||zone:a|'])
+
+    self.assertEqual(['cloud', 'zone'], actual.keys())
+    self.assertEqual(['GCP', 'AWS', None, 'GCP'], actual['cloud'])
+    self.assertEqual(['a', None, None, 'a'], actual['zone'])
+
+  def testCountLabels(self):
+    actual = packed_labels.CountLabels(
+        ['|cloud:GCP||zone:a|', '|cloud:AWS|', '', '|cloud:GCP||zone:b|'],
+        counts=[2, 1, 5, 3])
+
+    self.assertEqual(
+        [('cloud', 'GCP', 5), ('zone', 'a', 2), ('cloud', 'AWS', 1),
+         ('zone', 'b', 3)],
+        actual)
+
+  def testImportColumn(self):
+    labels = label_manager.LabelManager()
+    labels.ImportColumn([SAMPLE_LABELS, SAMPLE_LABELS], tolerant=True)
+
+    self.assertEqual(
+        {'name': 'ip_type', 'count': 2,
+         'values': [{'name': 'internal', 'count': 2}]},
+        labels.GetLabel('ip_type'))
+
+    self.assertRaises(label_manager.UnexpectedFormatError,
+                      labels.ImportColumn, [SAMPLE_LABELS])
+
+
+if __name__ == '__main__':
+  unittest.main()
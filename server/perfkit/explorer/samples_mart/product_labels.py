@@ -77,7 +77,6 @@ class ProductLabelsQuery(explorer_method.ExplorerQueryBase):
     rows = reply['rows']
 
     labels = label_manager.LabelManager()
-    for row in rows:
-      labels.AddLabel(row['label'], row['value'], row['count'])
+    labels.AddRows((row['label'], row['value'], row['count']) for row in rows)
 
     reply['labels'] = labels.labels
@@ -0,0 +1,518 @@
+"""Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Routes aggregate queries of the results table to rollup tables.
+
+Widget queries built by the query builder aggregate results by product, test,
+metric, owner and date, and BigQuery scans every row of results they read.
+The cubes built by cube_maintenance have one row per combination of those
+fields and day, with the count, sum, min and max of the values.  When a query
+can be answered from a registered rollup, PlanQuery() rewrites it to read the
+rollup instead:
+
+    SELECT product_name,                 SELECT product_name,
+      COUNT(value) AS count                SUM(value_count) AS count
+    FROM [samples_mart.results]    =>    FROM [samples_mart.lookup_field_cube]
+    WHERE test = "create-widgets"        WHERE test = "create-widgets"
+    GROUP BY product_name                GROUP BY product_name
+
+A query is only rewritten if the rollup aggregates the same rows of results.
+Its shape must be:
+  * SELECT the rollup's dimensions, dates grouped by DAY, WEEK, MONTH or YEAR
+    (as generated by the query builder), and COUNT(*) or COUNT, SUM, MIN, MAX,
+    AVG or MEAN of value.  Dates and aggregates must have an alias.
+  * FROM a single source table of the rollup.
+  * WHERE filters joined by AND, each comparing a dimension to a literal,
+    comparing timestamp to the start of a day (timestamp >= or <
+    TIMESTAMP_TO_SEC(TIMESTAMP('2014-01-01'))), or, for rollups of labels,
+    a single 'labels CONTAINS "|label:value|"' filter.
+  * GROUP BY every selected dimension and date.
+  * ORDER BY selected fields, and LIMIT.
+Other queries (relative dates, percentiles, label columns, OR, subqueries,
+etc.) return None, and should be run as-is.
+
+The rollups only include the rows of results as of their last refresh, so a
+rewritten query returns the same rows only if the rows it reads end before
+the refresh.  The plan's end_time is the earliest 'timestamp <' filter of the
+query, and data.GetRollupPlan only routes queries whose end_time is at or
+before the rollup's refresh time.  Queries without an end are never routed.
+
+Known limitations: of the date filters generated by the query builder, only a
+custom start date can be rewritten.  The builder filters end dates with <=,
+which includes the first instant of the end day, and relative dates with
+DATE_ADD(CURRENT_TIMESTAMP(), ...), which doesn't fall on a day boundary, so
+neither can be answered from daily rows.  The same applies to the
+TABLE_DATE_RANGE of tables partitioned per day.  As builder queries have no
+'timestamp <' end, widgets built with the query builder read results.
+"""
+
+__author__ = 'joemu@google.com (Joe Allan Muharsky)'
+
+import calendar
+import datetime
+import logging
+import re
+
+from perfkit.common import big_query_client
+import cube_maintenance
+
+
+DIMENSIONS = ('product_name', 'test', 'metric', 'owner')
+
+CLAUSE_PATTERN = re.compile(
+    r'\b(SELECT|FROM|WHERE|GROUP\s+(?:EACH\s+)?BY|HAVING|ORDER\s+BY|LIMIT|'
+    r'JOIN|UNION|WITHIN|OMIT)\b', re.IGNORECASE)
+UNSUPPORTED_CLAUSES = ('HAVING', 'JOIN', 'UNION', 'WITHIN', 'OMIT')
+
+ALIAS_PATTERN = re.compile(r'^(.*\S)\s+AS\s+(\w+)$', re.IGNORECASE | re.DOTALL)
+IDENTIFIER_PATTERN = re.compile(r'^\w+$')
+TABLE_PATTERN = re.compile(r'^\[(?:(.+):)?(\w+)\.(\w+)\]$|^(\w+)\.(\w+)$')
+ORDER_PATTERN = re.compile(r'^(\w+)(?:\s+(?:ASC|DESC))?$', re.IGNORECASE)
+
+# Expressions are matched with whitespace removed, and in upper case.
+DATE_PATTERN = re.compile(
+    r'^USEC_TO_TIMESTAMP\(UTC_USEC_TO_(DAY|WEEK|MONTH|YEAR)\('
+    r'INTEGER\(TIMESTAMP\*1000000\)(?:,(\d))?\)\)$')
+AGGREGATE_PATTERN = re.compile(r'^(COUNT|SUM|MIN|MAX|AVG|MEAN)\((VALUE|\*)\)$')
+
+DIMENSION_FILTER_PATTERN = re.compile(
+    r'^(\w+)\s*(=|!=|<>|<=|>=|<|>|\s+CONTAINS\s+)\s*'
+    r'("(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\')$', re.IGNORECASE)
+TIMESTAMP_FILTER_PATTERN = re.compile(
+    r'^timestamp\s*(>=|<)\s*TIMESTAMP_TO_SEC\(\s*TIMESTAMP\(\s*'
+    r'(["\'])([^"\']*)\2\s*\)\s*\)$', re.IGNORECASE)
+LABEL_FILTER_PATTERN = re.compile(
+    r'^labels\s+CONTAINS\s+(["\'])\|([^|:"\'\\]+):([^|"\'\\]*)\|\1$',
+    re.IGNORECASE)
+# A timestamp literal at the start of a day.
+DAY_START_PATTERN = re.compile(
+    r'^(\d{4}-\d{2}-\d{2})(?:[ T]00:00(?::00(?:\.0*)?)?)?'
+    r'(?:\s*(?:UTC|Z|[+-]00:?00))?$', re.IGNORECASE)
+
+# The rollup expressions that compute the aggregates of value.
+ROLLUP_AGGREGATES = {
+    ('COUNT', '*'): 'SUM(count)',
+    ('COUNT', 'VALUE'): 'SUM(value_count)',
+    ('SUM', 'VALUE'): 'SUM(value_sum)',
+    ('MIN', 'VALUE'): 'MIN(value_min)',
+    ('MAX', 'VALUE'): 'MAX(value_max)',
+    ('AVG', 'VALUE'): 'SUM(value_sum) / SUM(value_count)',
+    ('MEAN', 'VALUE'): 'SUM(value_sum) / SUM(value_count)'}
+
+_rollups = []
+
+
+class Error(Exception):
+  pass
+
+
+class NotSupportedError(Error):
+  """Raised when a query can't be answered from a rollup."""
+
+
+class Rollup(object):
+  """A table with the rows of a source table aggregated by day.
+
+  Attributes:
+    table_name: The name of the rollup table, in the source's dataset.
+    source_table: The name of the table the rollup aggregates.
+    dimensions: The fields of the source the rows are grouped by.
+    day_field: The TIMESTAMP field with the start of the day of each row.
+    label_fields: For rollups with a row per label/value pair of each source
+        row, the names of the label and value fields.  Otherwise None.
+  """
+
+  def __init__(self, table_name, source_table, dimensions=DIMENSIONS,
+               day_field='day_timestamp', label_fields=None):
+    self.table_name = table_name
+    self.source_table = source_table
+    self.dimensions = tuple(dimensions)
+    self.day_field = day_field
+    self.label_fields = label_fields
+
+
+class QueryPlan(object):
+  """A query rewritten to read a rollup.
+
+  Attributes:
+    query: The SQL to run.
+    rollup: The Rollup that the query reads.
+    project_id: The project of the table in the original query, or None if it
+        was not specified.
+    dataset_name: The dataset of the original table and rollup.
+    end_time: The time (in ms since the epoch) that the query's rows end
+        before, from its 'timestamp <' filters, or None if it has none.
+    refreshed_time: The time (in ms since the epoch) the rollup was last
+        refreshed, if known.
+  """
+
+  def __init__(self, query, rollup, project_id, dataset_name, end_time=None):
+    self.query = query
+    self.rollup = rollup
+    self.project_id = project_id
+    self.dataset_name = dataset_name
+    self.end_time = end_time
+    self.refreshed_time = None
+
+  def ToDict(self):
+    """Returns a description of the plan for responses and logs."""
+    return {
+        'table': '%s.%s' % (self.dataset_name, self.rollup.table_name),
+        'source_table': '%s.%s' % (self.dataset_name,
+                                   self.rollup.source_table),
+        'refreshed_time': self.refreshed_time}
+
+
+def RegisterRollup(rollup):
+  """Makes a rollup available to PlanQuery.
+
+  Rollups are tried in the order they are registered, so smaller rollups
+  should be registered first.
+  """
+  _rollups.append(rollup)
+
+
+def GetRollups():
+  """Returns the registered rollups."""
+  return list(_rollups)
+
+
+def PlanQuery(query):
+  """Returns a QueryPlan that reads query from a rollup, or None.
+
+  Args:
+    query: A BigQuery (legacy) SQL statement.
+
+  Returns:
+    A QueryPlan for the first registered rollup that can answer the query, or
+    None if no rollup can.  See the module docstring for the supported
+    queries.
+  """
+  try:
+    clauses = _SplitClauses(query)
+    project_id, dataset_name, table_name = _ParseTable(clauses['FROM'])
+  except NotSupportedError as err:
+    logging.debug('Query is not supported by rollups: %s', err)
+    return None
+
+  for rollup in _rollups:
+    if rollup.source_table != table_name:
+      continue
+
+    try:
+      rollup_query, end_time = _RewriteQuery(clauses, rollup, project_id,
+                                             dataset_name)
+    except NotSupportedError as err:
+      logging.debug('Query is not supported by %s: %s', rollup.table_name, err)
+      continue
+
+    return QueryPlan(rollup_query, rollup, project_id, dataset_name,
+                     end_time=end_time)
+
+  return None
+
+
+def _GetTopLevelMask(sql):
+  """Returns a list with True for each character outside quotes and brackets.
+
+  Raises:
+    NotSupportedError: If the quotes or brackets are not balanced.
+  """
+  mask = []
+  depth = 0
+  quote = None
+  index = 0
+
+  while index < len(sql):
+    char = sql[index]
+
+    if quote:
+      if char == '\\':
+        mask.extend([False] * len(sql[index:index + 2]))
+        index += 2
+        continue
+      if char == quote:
+        quote = None
+      mask.append(False)
+    elif char in '\'"':
+      quote = char
+      mask.append(False)
+    elif char in '([':
+      depth += 1
+      mask.append(False)
+    elif char in ')]':
+      depth -= 1
+      if depth < 0:
+        raise NotSupportedError('Unbalanced brackets.')
+      mask.append(False)
+    else:
+      mask.append(depth == 0)
+
+    index += 1
+
+  if quote or depth:
+    raise NotSupportedError('Unbalanced quotes or brackets.')
+
+  return mask
+
+
+def _SplitTopLevel(text, pattern):
+  """Splits text on the matches of pattern outside quotes and brackets."""
+  mask = _GetTopLevelMask(text)
+  parts = []
+  start = 0
+
+  for match in re.finditer(pattern, text, re.IGNORECASE):
+    if mask[match.start()]:
+      parts.append(text[start:match.start()].strip())
+      start = match.end()
+
+  parts.append(text[start:].strip())
+  return parts
+
+
+def _SplitClauses(query):
+  """Returns a dict of clause keyword (SELECT, FROM, etc.) to its text.
+
+  GROUP EACH BY is returned as GROUP BY.
+
+  Raises:
+    NotSupportedError: If the query isn't a single SELECT of supported
+        clauses.
+  """
+  query = query.strip().rstrip(';').strip()
+  mask = _GetTopLevelMask(query)
+
+  for comment in ('--', '#', '//'):
+    position = query.find(comment)
+    while position >= 0:
+      if mask[position]:
+        raise NotSupportedError('Queries with comments are not supported.')
+      position = query.find(comment, position + 1)
+
+  matches = [match for match in CLAUSE_PATTERN.finditer(query)
+             if mask[match.start()]]
+  if not matches or matches[0].start() != 0:
+    raise NotSupportedError('The query must start with SELECT.')
+
+  clauses = {}
+  for index, match in enumerate(matches):
+    keyword = ' '.join(match.group(1).upper().split()).replace(' EACH', '')
+    if keyword in UNSUPPORTED_CLAUSES:
+      raise NotSupportedError('%s is not supported.' % keyword)
+    if keyword in clauses:
+      raise NotSupportedError('%s appears more than once.' % keyword)
+
+    end = matches[index + 1].start() if index + 1 < len(matches) else None
+    clauses[keyword] = query[match.end():end].strip()
+
+  if 'FROM' not in clauses:
+    raise NotSupportedError('The query must have a FROM clause.')
+
+  return clauses
+
+
+def _ParseTable(from_clause):
+  """Returns the project (or None), dataset and table of a FROM clause."""
+  match = TABLE_PATTERN.match(from_clause.strip())
+  if not match:
+    raise NotSupportedError('Only a single table is supported.')
+
+  if match.group(2):
+    return match.group(1), match.group(2), match.group(3)
+  return None, match.group(4), match.group(5)
+
+
+def _RewriteQuery(clauses, rollup, project_id, dataset_name):
+  """Returns the SQL of the query clauses reading rollup, and their end time.
+
+  The end time (in ms since the epoch) is the earliest 'timestamp <' filter
+  of the query, or None if it has none.
+
+  Raises:
+    NotSupportedError: If the rollup can't answer the query.
+  """
+  select_args, outputs, groupable = _RewriteSelect(clauses['SELECT'], rollup)
+  where_args, end_time = _RewriteWhere(clauses.get('WHERE'), rollup)
+
+  group_args = []
+  if 'GROUP BY' in clauses:
+    group_args = _SplitTopLevel(clauses['GROUP BY'], ',')
+  grouped = set(arg.lower() for arg in group_args)
+
+  if not group_args and len(groupable) == len(select_args):
+    raise NotSupportedError('The query does not aggregate rows.')
+  for names in groupable:
+    if not names & grouped:
+      raise NotSupportedError('Every selected field must be grouped.')
+  for name in grouped:
+    if not any(name in names for names in groupable):
+      raise NotSupportedError('Only selected fields can be grouped by.')
+
+  order_args = []
+  if clauses.get('ORDER BY'):
+    order_args = _SplitTopLevel(clauses['ORDER BY'], ',')
+    for arg in order_args:
+      match = ORDER_PATTERN.match(arg)
+      if not match or match.group(1).lower() not in outputs:
+        raise NotSupportedError('Only selected fields can be ordered by.')
+
+  row_limit = clauses.get('LIMIT')
+  if row_limit is not None and not row_limit.isdigit():
+    raise NotSupportedError('LIMIT must be a number.')
+
+  table = '[%s%s.%s]' % (project_id + ':' if project_id else '',
+                         dataset_name, rollup.table_name)
+
+  rollup_query = big_query_client.BigQueryClient.FormatQuery(
+      select_args=select_args, from_args=[table], where_args=where_args,
+      group_args=group_args, order_args=order_args, row_limit=row_limit)
+
+  return rollup_query, end_time
+
+
+def _RewriteSelect(select_clause, rollup):
+  """Returns the rollup's select args, and the names of the selected fields.
+
+  Returns:
+    A tuple of (select_args, outputs, groupable).  outputs is the set of
+    output names, and groupable has a set of the names that each selected
+    dimension or date can be grouped by.
+  """
+  select_args = []
+  outputs = set()
+  groupable = []
+  reserved = set(rollup.label_fields or [])
+
+  for arg in _SplitTopLevel(select_clause, ','):
+    match = ALIAS_PATTERN.match(arg)
+    expression, alias = match.groups() if match else (arg, None)
+    normalized = re.sub(r'\s+', '', expression).upper()
+
+    if alias and alias.lower() in reserved:
+      raise NotSupportedError('The alias %s is a field of %s.' % (
+          alias, rollup.table_name))
+
+    if IDENTIFIER_PATTERN.match(expression) and (
+        expression.lower() in rollup.dimensions):
+      select_args.append(arg)
+      names = set([expression.lower(), (alias or expression).lower()])
+      groupable.append(names)
+      outputs.update(names)
+      continue
+
+    if not alias:
+      raise NotSupportedError('Expressions must have an alias: %s' % arg)
+
+    date_match = DATE_PATTERN.match(normalized)
+    aggregate_match = AGGREGATE_PATTERN.match(normalized)
+
+    if date_match:
+      select_args.append('%s AS %s' % (
+          _GetDateExpression(rollup, *date_match.groups()), alias))
+      groupable.append(set([alias.lower()]))
+    elif aggregate_match and aggregate_match.groups() in ROLLUP_AGGREGATES:
+      select_args.append('%s AS %s' % (
+          ROLLUP_AGGREGATES[aggregate_match.groups()], alias))
+    else:
+      raise NotSupportedError('Unsupported expression: %s' % expression)
+
+    outputs.add(alias.lower())
+
+  return select_args, outputs, groupable
+
+
+def _GetDateExpression(rollup, grain, first_day_of_week=None):
+  """Returns the rollup expression for a date grouped by grain."""
+  if grain == 'DAY':
+    return rollup.day_field
+
+  day_usec = 'TIMESTAMP_TO_USEC(%s)' % rollup.day_field
+  if grain == 'WEEK':
+    if first_day_of_week is None:
+      raise NotSupportedError('WEEK requires the first day of the week.')
+    day_usec += ', %s' % first_day_of_week
+  elif first_day_of_week is not None:
+    raise NotSupportedError('Unexpected argument for %s.' % grain)
+
+  return 'USEC_TO_TIMESTAMP(UTC_USEC_TO_%s(%s))' % (grain, day_usec)
+
+
+def _RewriteWhere(where_clause, rollup):
+  """Returns the rollup's where args for a WHERE clause (or None).
+
+  Returns:
+    A tuple of (where_args, end_time).  end_time is the earliest day (in ms
+    since the epoch) that timestamp is filtered to be before, or None.
+  """
+  if not where_clause:
+    if rollup.label_fields:
+      raise NotSupportedError('Label rollups require a label filter.')
+    return [], None
+
+  where_args = []
+  label_filters = 0
+  end_time = None
+
+  for arg in _SplitTopLevel(where_clause, r'\bAND\b'):
+    if _SplitTopLevel(arg, r'\bOR\b')[1:]:
+      raise NotSupportedError('OR is not supported.')
+
+    dimension_match = DIMENSION_FILTER_PATTERN.match(arg)
+    timestamp_match = TIMESTAMP_FILTER_PATTERN.match(arg)
+    label_match = LABEL_FILTER_PATTERN.match(arg)
+
+    if dimension_match and (
+        dimension_match.group(1).lower() in rollup.dimensions):
+      where_args.append(arg)
+    elif timestamp_match:
+      operator, quote, timestamp = timestamp_match.groups()
+      day_match = DAY_START_PATTERN.match(timestamp.strip())
+      if not day_match:
+        raise NotSupportedError(
+            'Timestamps must be compared to the start of a day.')
+      where_args.append('%s %s TIMESTAMP(%s%s%s)' % (
+          rollup.day_field, operator, quote, day_match.group(1), quote))
+      if operator == '<':
+        day_time = _GetDayTime(day_match.group(1))
+        end_time = (day_time if end_time is None
+                    else min(end_time, day_time))
+    elif label_match and rollup.label_fields:
+      quote, label, value = label_match.groups()
+      label_field, value_field = rollup.label_fields
+      where_args.append('%s = %s%s%s' % (label_field, quote, label, quote))
+      where_args.append('%s = %s%s%s' % (value_field, quote, value, quote))
+      label_filters += 1
+    else:
+      raise NotSupportedError('Unsupported filter: %s' % arg)
+
+  if rollup.label_fields and label_filters != 1:
+    raise NotSupportedError('Label rollups require a single label filter.')
+
+  return where_args, end_time
+
+
+def _GetDayTime(day):
+  """Returns the start of a 'YYYY-MM-DD' day (UTC), in ms since the epoch."""
+  try:
+    day_start = datetime.datetime.strptime(day, '%Y-%m-%d')
+  except ValueError:
+    raise NotSupportedError('Invalid day: %s' % day)
+
+  return calendar.timegm(day_start.timetuple()) * 1000
+
+
+RegisterRollup(Rollup('lookup_field_cube', cube_maintenance.RESULTS_TABLE))
+RegisterRollup(Rollup('metadata_cube', cube_maintenance.RESULTS_TABLE,
+                      label_fields=('label', 'value')))
@@ -0,0 +1,185 @@
+"""Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Unit tests for the rollup query planner."""
+
+__author__ = 'joemu@google.com (Joe Allan Muharsky)'
+
+import unittest
+
+import query_planner
+
+
+# A query in the format generated by the query builder.
+BUILDER_QUERY = """SELECT
+\tproduct_name,
+\tUSEC_TO_TIMESTAMP(UTC_USEC_TO_DAY(INTEGER(timestamp * 1000000))) AS date,
+\tCOUNT(value) AS count,
+\tAVG(value) AS avg
+FROM
+\t[my-project:samples_mart.results]
+WHERE
+\ttimestamp >= TIMESTAMP_TO_SEC(TIMESTAMP('2014-01-01')) AND
+\ttest = "create-widgets"
+GROUP BY
+\tproduct_name,
+\tdate
+ORDER BY
+\tproduct_name,
+\tdate
+LIMIT 1000;"""
+
+
+class QueryPlannerTest(unittest.TestCase):
+
+  def testPlanBuilderQuery(self):
+    plan = query_planner.PlanQuery(BUILDER_QUERY)
+
+    self.assertEqual('lookup_field_cube', plan.rollup.table_name)
+    self.assertEqual('my-project', plan.project_id)
+    self.assertEqual('samples_mart', plan.dataset_name)
+    self.assertEqual(
+        'SELECT\n'
+        '\tproduct_name,\n'
+        '\tday_timestamp AS date,\n'
+        '\tSUM(value_count) AS count,\n'
+        '\tSUM(value_sum) / SUM(value_count) AS avg\n'
+        'FROM [my-project:samples_mart.lookup_field_cube]\n'
+        'WHERE\n'
+        '\tday_timestamp >= TIMESTAMP(\'2014-01-01\') AND\n'
+        '\ttest = "create-widgets"\n'
+        'GROUP BY\n'
+        '\tproduct_name,\n'
+        '\tdate\n'
+        'ORDER BY\n'
+        '\tproduct_name,\n'
+        '\tdate\n'
+        'LIMIT 1000',
+        plan.query)
+    self.assertEqual(
+        {'table': 'samples_mart.lookup_field_cube',
+         'source_table': 'samples_mart.results',
+         'refreshed_time': None},
+        plan.ToDict())
+
+  def testPlanEndTime(self):
+    self.assertIsNone(query_planner.PlanQuery(BUILDER_QUERY).end_time)
+
+    plan = query_planner.PlanQuery(
+        'SELECT test, COUNT(*) AS c FROM [samples_mart.results] '
+        'WHERE timestamp < TIMESTAMP_TO_SEC(TIMESTAMP(\'2014-01-03\')) AND '
+        'timestamp < TIMESTAMP_TO_SEC(TIMESTAMP("2014-01-02 00:00 UTC")) AND '
+        'timestamp >= TIMESTAMP_TO_SEC(TIMESTAMP(\'2014-01-01\')) '
+        'GROUP BY test')
+
+    self.assertEqual(1388620800000, plan.end_time)
+
+  def testPlanCoarserDates(self):
+    plan = query_planner.PlanQuery(
+        'SELECT USEC_TO_TIMESTAMP(UTC_USEC_TO_WEEK('
+        'INTEGER(timestamp * 1000000), 0)) AS week, COUNT(*) AS rows '
+        'FROM samples_mart.results GROUP EACH BY week')
+
+    self.assertIn(
+        'USEC_TO_TIMESTAMP(UTC_USEC_TO_WEEK(TIMESTAMP_TO_USEC(day_timestamp), '
+        '0)) AS week', plan.query)
+    self.assertIn('SUM(count) AS rows', plan.query)
+    self.assertIn('GROUP BY\n\tweek', plan.query)
+
+  def testPlanDistinctValues(self):
+    plan = query_planner.PlanQuery(
+        'SELECT product_name AS product FROM [samples_mart.results] '
+        'GROUP BY product_name')
+
+    self.assertIn('FROM [samples_mart.lookup_field_cube]', plan.query)
+
+  def testPlanLabelFilter(self):
+    plan = query_planner.PlanQuery(
+        'SELECT metric, MAX(value) AS max FROM [samples_mart.results] '
+        'WHERE labels CONTAINS "|cloud:GCP|" GROUP BY metric')
+
+    self.assertEqual('metadata_cube', plan.rollup.table_name)
+    self.assertIn('label = "cloud" AND\n\tvalue = "GCP"', plan.query)
+    self.assertIn('MAX(value_max) AS max', plan.query)
+
+  def testUnsupportedQueries(self):
+    unsupported = [
+        # Not aggregated.
+        'SELECT product_name, value FROM [samples_mart.results]',
+        # Another table.
+        'SELECT test, COUNT(*) AS c FROM [samples_mart.other] GROUP BY test',
+        # Percentiles and unsupported fields.
+        'SELECT test, NTH(50, QUANTILES(value, 100)) AS p50 '
+        'FROM [samples_mart.results] GROUP BY test',
+        'SELECT unit, COUNT(*) AS c FROM [samples_mart.results] GROUP BY unit',
+        # Relative dates, and timestamps that don't start a day.
+        'SELECT test, COUNT(*) AS c FROM [samples_mart.results] '
+        'WHERE timestamp >= TIMESTAMP_TO_SEC(DATE_ADD(CURRENT_TIMESTAMP(), '
+        '-7, "DAY")) GROUP BY test',
+        'SELECT test, COUNT(*) AS c FROM [samples_mart.results] '
+        'WHERE timestamp >= TIMESTAMP_TO_SEC(TIMESTAMP(\'2014-01-01 12:00\')) '
+        'GROUP BY test',
+        'SELECT test, COUNT(*) AS c FROM [samples_mart.results] '
+        'WHERE timestamp <= TIMESTAMP_TO_SEC(TIMESTAMP(\'2014-01-01\')) '
+        'GROUP BY test',
+        # Selected fields that aren't grouped, and vice versa.
+        'SELECT test, metric, COUNT(*) AS c FROM [samples_mart.results] '
+        'GROUP BY test',
+        'SELECT test, COUNT(*) AS c FROM [samples_mart.results] '
+        'GROUP BY test, metric',
+        # OR, multiple label filters, and subqueries.
+        'SELECT test, COUNT(*) AS c FROM [samples_mart.results] '
+        'WHERE test = "a" OR test = "b" GROUP BY test',
+        'SELECT test, COUNT(*) AS c FROM [samples_mart.results] '
+        'WHERE labels CONTAINS "|a:1|" AND labels CONTAINS "|b:2|" '
+        'GROUP BY test',
+        'SELECT test, COUNT(*) AS c FROM (SELECT * FROM '
+        '[samples_mart.results]) GROUP BY test',
+        'SELECT test, COUNT(*) AS c FROM [samples_mart.results] '
+        'GROUP BY test HAVING c > 1',
+        # Aggregates without an alias.
+        'SELECT test, COUNT(*) FROM [samples_mart.results] GROUP BY test']
+
+    for query in unsupported:
+      self.assertIsNone(query_planner.PlanQuery(query), query)
+
+  def testBuilderDateFilters(self):
+    # Only the custom start date generated by the query builder is routed.
+    start_clause = 'timestamp >= TIMESTAMP_TO_SEC(TIMESTAMP(\'2014-01-01\'))'
+    relative_start_clause = (
+        'timestamp >= TIMESTAMP_TO_SEC(DATE_ADD(CURRENT_TIMESTAMP(), '
+        '-2, "WEEK"))')
+    end_clause = 'timestamp <= TIMESTAMP_TO_SEC(TIMESTAMP(\'2014-02-01\'))'
+
+    self.assertIsNotNone(query_planner.PlanQuery(BUILDER_QUERY))
+    self.assertIsNone(query_planner.PlanQuery(
+        BUILDER_QUERY.replace(start_clause, relative_start_clause)))
+    self.assertIsNone(query_planner.PlanQuery(
+        BUILDER_QUERY.replace(start_clause,
+                              '%s AND\n\t%s' % (start_clause, end_clause))))
+    self.assertIsNone(query_planner.PlanQuery(BUILDER_QUERY.replace(
+        '[my-project:samples_mart.results]',
+        '(TABLE_DATE_RANGE([my-project:samples_mart.results], '
+        'TIMESTAMP(\'2014-01-01\'), CURRENT_TIMESTAMP()))')))
+
+  def testQuotedKeywordsAreIgnored(self):
+    plan = query_planner.PlanQuery(
+        'SELECT test, COUNT(*) AS c FROM [samples_mart.results] '
+        'WHERE test = "a OR b GROUP BY" GROUP BY test')
+
+    self.assertIn('test = "a OR b GROUP BY"', plan.query)
+
+
+if __name__ == '__main__':
+  unittest.main()
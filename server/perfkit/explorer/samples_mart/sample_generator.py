@@ -0,0 +1,206 @@
+"""Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Generates synthetic rows for the samples_mart results table.
+
+The rows follow data/samples_mart/results_table_schema.json, and are shaped
+like the results of benchmark runs:
+  * Each run (run_uri) is of one test of one product, at one time, with one
+    set of labels, and reports a sample for each metric of the test.
+  * Products, tests, metrics, owners and label names have configurable
+    cardinalities.
+  * Label values follow a Zipf distribution (see label_skew), so a few values
+    are common and most are rare, as with zones and machine types.
+  * Timestamps are spread over [start_time, end_time).
+
+The same seed always generates the same rows.  Rows are generated lazily, so
+large tables (10M rows) can be written without holding them in memory:
+
+    python sample_generator.py --rows=1000000 --output=results.json
+"""
+
+__author__ = 'joemu@google.com (Joe Allan Muharsky)'
+
+import argparse
+import bisect
+import json
+import random
+import sys
+import uuid
+
+DEFAULT_START_TIME = 1388534400  # 2014-01-01
+DEFAULT_END_TIME = 1420070400  # 2015-01-01
+
+UNITS = ['ms', 'sec', 'MB/sec', 'Mbits/sec', 'ops/sec', 'percent']
+
+
+class SampleGenerator(object):
+  """Generates rows for the samples_mart results table."""
+
+  def __init__(self, num_products=5, num_tests=20, num_metrics=8,
+               num_owners=10, num_labels=8, num_label_values=50,
+               labels_per_run=6, label_skew=1.2,
+               start_time=DEFAULT_START_TIME, end_time=DEFAULT_END_TIME,
+               seed=1):
+    """Initializes the generator.
+
+    Args:
+      num_products: The number of distinct product_names.
+      num_tests: The number of distinct tests of each product.
+      num_metrics: The number of metrics reported by each run of a test.
+      num_owners: The number of distinct owners.
+      num_labels: The number of distinct label names.
+      num_label_values: The number of distinct values of each label.
+      labels_per_run: The number of labels of each run, up to num_labels.
+      label_skew: The exponent of the Zipf distribution of label values.
+          0 is uniform, and larger values are more skewed.
+      start_time: The earliest timestamp, in seconds since the epoch.
+      end_time: The timestamps are before this time.
+      seed: The random seed.
+    """
+    self.random = random.Random(seed)
+
+    self.products = ['product-%d' % index for index in xrange(num_products)]
+    self.tests = ['test-%d' % index for index in xrange(num_tests)]
+    self.metrics = ['metric-%d' % index for index in xrange(num_metrics)]
+    self.owners = ['owner%d' % index for index in xrange(num_owners)]
+    self.labels = ['label%d' % index for index in xrange(num_labels)]
+    self.label_values = ['value%d' % index
+                         for index in xrange(num_label_values)]
+    self.labels_per_run = min(labels_per_run, num_labels)
+    self.start_time = start_time
+    self.end_time = end_time
+
+    # The typical value and unit of each product/test/metric, picked the
+    # first time it is generated.
+    self._series = {}
+
+    # Cumulative Zipf weights, for picking a value index with bisect.
+    self._value_weights = []
+    total = 0.0
+    for rank in xrange(1, num_label_values + 1):
+      total += 1.0 / rank ** label_skew
+      self._value_weights.append(total)
+
+  def GetSeries(self, product, test, metric):
+    """Returns the (scale, unit) of the values of a product/test/metric."""
+    key = (product, test, metric)
+    if key not in self._series:
+      self._series[key] = (10 ** self.random.uniform(0, 4),
+                           self.random.choice(UNITS))
+
+    return self._series[key]
+
+  def GetLabelValue(self):
+    """Returns a label value, drawn from the skewed distribution."""
+    point = self.random.random() * self._value_weights[-1]
+    return self.label_values[bisect.bisect(self._value_weights, point)]
+
+  def GetLabels(self):
+    """Returns the packed labels string of a run."""
+    names = sorted(self.random.sample(self.labels, self.labels_per_run))
+    return ''.join('|%s:%s|' % (name, self.GetLabelValue())
+                   for name in names)
+
+  def GenerateRuns(self):
+    """Yields the rows of each run, as lists of row dicts, forever."""
+    while True:
+      product = self.random.choice(self.products)
+      test = self.random.choice(self.tests)
+      timestamp = round(self.random.uniform(self.start_time, self.end_time),
+                        3)
+      run = {'test': test,
+             'test_version': '1.%d' % self.random.randint(0, 5),
+             'official': self.random.random() < 0.8,
+             'product_name': product,
+             'product_version': '%d.0' % self.random.randint(1, 3),
+             'owner': self.random.choice(self.owners),
+             'labels': self.GetLabels(),
+             'run_uri': str(uuid.UUID(int=self.random.getrandbits(128))),
+             'log_uri': str(uuid.UUID(int=self.random.getrandbits(128)))}
+
+      rows = []
+      for metric in self.metrics:
+        scale, unit = self.GetSeries(product, test, metric)
+        row = dict(run)
+        row.update({
+            'metric': metric,
+            'value': round(scale * self.random.lognormvariate(0, 0.25), 3),
+            'unit': unit,
+            'timestamp': timestamp,
+            'sample_uri': str(uuid.UUID(int=self.random.getrandbits(128)))})
+        rows.append(row)
+
+      yield rows
+
+  def GenerateRows(self, num_rows):
+    """Yields num_rows row dicts."""
+    remaining = num_rows
+    for rows in self.GenerateRuns():
+      for row in rows[:remaining]:
+        yield row
+
+      remaining -= len(rows)
+      if remaining <= 0:
+        return
+
+
+def WriteJson(rows, output):
+  """Writes rows to a file as newline-delimited JSON.
+
+  Returns:
+    The number of rows written.
+  """
+  count = 0
+  for row in rows:
+    output.write(json.dumps(row, separators=(',', ':'), sort_keys=True))
+    output.write('\n')
+    count += 1
+
+  return count
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--rows', type=int, default=1000)
+  parser.add_argument('--products', type=int, default=5)
+  parser.add_argument('--tests', type=int, default=20)
+  parser.add_argument('--metrics', type=int, default=8)
+  parser.add_argument('--owners', type=int, default=10)
+  parser.add_argument('--labels', type=int, default=8)
+  parser.add_argument('--label_values', type=int, default=50)
+  parser.add_argument('--label_skew', type=float, default=1.2)
+  parser.add_argument('--start_time', type=int, default=DEFAULT_START_TIME)
+  parser.add_argument('--end_time', type=int, default=DEFAULT_END_TIME)
+  parser.add_argument('--seed', type=int, default=1)
+  parser.add_argument('--output', help='Defaults to stdout.')
+  args = parser.parse_args()
+
+  generator = SampleGenerator(
+      num_products=args.products, num_tests=args.tests,
+      num_metrics=args.metrics, num_owners=args.owners,
+      num_labels=args.labels, num_label_values=args.label_values,
+      label_skew=args.label_skew, start_time=args.start_time,
+      end_time=args.end_time, seed=args.seed)
+  rows = generator.GenerateRows(args.rows)
+
+  if args.output:
+    with open(args.output, 'wb') as output:
+      WriteJson(rows, output)
+  else:
+    WriteJson(rows, sys.stdout)
+
+
+if __name__ == '__main__':
+  main()
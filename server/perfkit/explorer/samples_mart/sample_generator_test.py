@@ -0,0 +1,74 @@
+"""Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Unit tests for the synthetic samples_mart generator."""
+
+__author__ = 'joemu@google.com (Joe Allan Muharsky)'
+
+import collections
+import json
+import os
+import StringIO
+import unittest
+
+import packed_labels
+import sample_generator
+
+
+SCHEMA_FILE = os.path.join(os.path.dirname(__file__), '..', '..', '..', '..',
+                           'data', 'samples_mart', 'results_table_schema.json')
+
+
+class SampleGeneratorTest(unittest.TestCase):
+
+  def testGenerateRowsMatchesSchema(self):
+    with open(SCHEMA_FILE) as f:
+      field_names = set(field['name'] for field in json.load(f))
+
+    generator = sample_generator.SampleGenerator(num_metrics=3)
+    rows = list(generator.GenerateRows(10))
+
+    self.assertEqual(10, len(rows))
+    for row in rows:
+      self.assertEqual(field_names, set(row))
+      self.assertTrue(sample_generator.DEFAULT_START_TIME <= row['timestamp'] <
+                      sample_generator.DEFAULT_END_TIME)
+      self.assertEqual(6, len(packed_labels.ParseLabels(row['labels'])))
+
+    # Each run reports every metric of its test.
+    self.assertEqual(rows[0]['run_uri'], rows[2]['run_uri'])
+    self.assertEqual(['metric-0', 'metric-1', 'metric-2'],
+                     [row['metric'] for row in rows[:3]])
+
+  def testGenerateRowsIsDeterministic(self):
+    output = StringIO.StringIO()
+    sample_generator.WriteJson(
+        sample_generator.SampleGenerator(seed=5).GenerateRows(20), output)
+
+    self.assertEqual(
+        [json.loads(line) for line in output.getvalue().splitlines()],
+        list(sample_generator.SampleGenerator(seed=5).GenerateRows(20)))
+
+  def testLabelValuesAreSkewed(self):
+    generator = sample_generator.SampleGenerator(num_label_values=20,
+                                                 label_skew=1.5)
+    counts = collections.Counter(generator.GetLabelValue()
+                                 for _ in xrange(5000))
+
+    self.assertEqual('value0', counts.most_common(1)[0][0])
+    self.assertGreater(counts['value0'], 10 * counts['value19'])
+
+
+if __name__ == '__main__':
+  unittest.main()